@@ -0,0 +1,98 @@
+"""
+reset.py — pooled sandbox container 重用前的狀態重置（sidecar 在 release 後 docker exec 一次）
+
+1. SIGKILL 除了 PID 1（tail -f /dev/null）、自己，以及 --keep-zygote 時 sidecar 常駐的 zygote
+   以外的所有 process：逾時 / 互動 session 留下的 runner、user code fork 出的 child 等
+2. 清空 /tmp（tmpfs）
+3. 印一行 JSON：{"checksum": ..., "killed": n, "removed": n}
+
+checksum = 重置後狀態（存活 process 的 cmdline + /tmp 內容）的 sha256，格式與
+sandbox_sidecar/container_pool.py 的 reset_state_checksum 相同；sidecar 比對預期的乾淨狀態，
+不符就不放回 pool。zombie（PID 1 的 tail 不會 wait）已不佔資源，不計入。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import signal
+import sys
+import time
+
+TMP_DIR = "/tmp"
+ZYGOTE_CMDLINE = "python /sandbox/zygote.py"
+KILL_WAIT_SECONDS = 1.0
+
+
+def _processes() -> dict[int, tuple[int, str]]:
+    """pid → (ppid, cmdline)，略過 zombie 與讀取期間已結束的。"""
+    procs = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        pid = int(entry)
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "replace").strip()
+        except OSError:
+            continue
+        # stat 的 comm 可能含空白 / 括號：從最後一個 ")" 之後開始切
+        fields = stat[stat.rfind(")") + 2:].split()
+        if fields[0] == "Z":
+            continue
+        procs[pid] = (int(fields[1]), cmdline)
+    return procs
+
+
+def _keep(pid: int, ppid: int, cmdline: str, keep_zygote: bool) -> bool:
+    if pid in (1, os.getpid()):
+        return True
+    # sidecar docker exec 起的 zygote 在容器的 pid namespace 裡 ppid 是 0；zygote fork 的 child 不是
+    return keep_zygote and ppid == 0 and cmdline == ZYGOTE_CMDLINE
+
+
+def _kill_strays(keep_zygote: bool) -> int:
+    strays = [pid for pid, (ppid, cmdline) in _processes().items() if not _keep(pid, ppid, cmdline, keep_zygote)]
+    for pid in strays:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    deadline = time.monotonic() + KILL_WAIT_SECONDS
+    while time.monotonic() < deadline and any(pid in _processes() for pid in strays):
+        time.sleep(0.01)
+    return len(strays)
+
+
+def _wipe_tmp() -> int:
+    removed = 0
+    for entry in os.scandir(TMP_DIR):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def state_checksum(processes: list[str], tmp_entries: list[str]) -> str:
+    state = {"processes": sorted(processes), "tmp": sorted(tmp_entries)}
+    return hashlib.sha256(json.dumps(state, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def main() -> None:
+    keep_zygote = "--keep-zygote" in sys.argv[1:]
+    killed = _kill_strays(keep_zygote)
+    removed = _wipe_tmp()
+    survivors = [cmdline for pid, (_, cmdline) in _processes().items() if pid != os.getpid()]
+    checksum = state_checksum(survivors, os.listdir(TMP_DIR))
+    sys.stdout.write(json.dumps({"checksum": checksum, "killed": killed, "removed": removed}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
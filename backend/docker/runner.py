@@ -2,9 +2,41 @@
 runner.py — Docker sandbox container 入口
 
 - 從環境變數 CODE（base64）讀取用戶程式碼
-- 循序執行 run_trace() 和 build_cfg()
+- 循序執行 run_trace() 和 build_cfg_graph_data()
 - 結果序列化為 JSON 印至 stdout
 - 例外時印 {"error": "<message>"}，不 raise
+
+Count-only 模式（COUNT_ONLY=1）：走 run_count_trace，只回傳 step_count / line_hits /
+is_truncated，不擷取變數、不建 TraceEvent / CFG、不序列化 trace。
+
+RESULT_ENCODING=zlib（僅互動/事件模式）：result payload 以 zlib 壓縮的 JSON 位元組
+base64 後放在 result event 的 payload_z，sidecar 不解析直接把位元組轉給 backend。
+
+result 另帶 profile：total_steps、每行命中次數，以及每個函式的呼叫次數與累計 wall / CPU
+時間（毫秒）。預設 head 存滿就卸下 tracer，profile 只涵蓋保留的那一段（complete=false）；
+TRACE_PROFILE=1 才持續累計到程式結束（截斷後仍以 tracing 速度執行）。
+
+TRACE_CAPTURE（JSON）：trace 擷取策略（head / ring / stride / loop / keyframe，見 tracer.CaptureSpec），
+result 的 capture 欄位回報實際採用的策略與參數。
+
+STREAM_TRACE=1（僅互動/事件模式）：執行中每 TRACE_BATCH_SIZE 個 event 送一個 trace_batch
+event（完整格式、未 delta 編碼），讓前端在執行結束前就能開始播放；最終 result 仍帶完整 trace
+（可與 RESULT_ENCODING=zlib 併用，result 照樣壓縮）。
+
+變數以 heap 快照輸出（heap_snapshot.py）：trace event 的變數是 primitive 或 {"ref": oid}，
+每個 event 帶 heap 差量，result 帶共用的 heap_objects 與 value_encoding；trace_batch 的
+預覽 event 則直接是 repr 字串。
+
+SKIP_CFG=1：不建 cfg_graph（回傳 {}），由 backend 以快取的 CFG 補上。
+
+TRACE_BACKEND（auto / settrace / monitoring，預設 auto）：tracing backend，auto 依直譯器版本選，
+3.12+ 走 sys.monitoring（PEP 669），否則 sys.settrace；兩者輸出相同。
+
+result 另帶 usage：這次執行的 wall / trace / 序列化時間、user / sys CPU 時間、max RSS，
+以及從容器 cgroup 讀到的 CPU throttle 時間（差量）與記憶體峰值（見 _usage_payload）。
+
+Batch 模式（BATCH_N_VALUES="10,50,100"）：big-O 測量用，同一個 exec 內依序對每個 n
+追加 explore_wrapper(n) 以 count-only 執行，回傳每個 n 的 step_count / timeout 旗標。
 """
 
 import ast
@@ -12,12 +44,199 @@ import base64
 import io
 import json
 import os
+import resource
+import signal
 import sys
+import time
 import traceback as _traceback
-from tracer import run_trace, LegacyInputNeededError
-from cfg_builder import build_cfg, build_module_cfg
+import zlib
+from tracer import run_trace, run_count_trace, parse_capture, select_backend, LegacyInputNeededError
+from cfg_builder import build_cfg_graph_data
+from trace_codec import encode_trace, TRACE_ENCODING_DELTA
+from heap_snapshot import HeapReader, HeapTable, HEAP_VALUE_ENCODING
 
 EVENT_PREFIX = "__CODEPULSE_EVENT__"
+RESULT_COMPRESS_LEVEL = 1  # 速度優先：level 1 已能拿到大部分壓縮率
+# 容器內的 cgroup（v2 unified；v1 的檔名放在後面當 fallback）
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+class _BatchTimeout(BaseException):
+    """單一 n 超過 PER_N_TIMEOUT。繼承 BaseException，避免被 user code 的 except Exception 吃掉。"""
+
+
+def _on_batch_alarm(_signum, _frame):
+    raise _BatchTimeout()
+
+
+def _parse_batch_n_values(raw: str) -> list[int] | None:
+    try:
+        values = [int(v) for v in raw.split(",") if v.strip()]
+    except ValueError:
+        return None
+    return values or None
+
+
+def _event_dict(ev, heap_table: HeapTable) -> dict:
+    out = {
+        "tag": ev.tag,
+        "local_vars": ev.local_vars,
+        "global_vars": ev.global_vars,
+        "dataSnapshot": ev.dataSnapshot,
+        "meta": ev.meta,
+    }
+    delta = heap_table.delta(ev.heap)
+    if delta:
+        out["heap"] = delta
+    return out
+
+
+def _preview_event_dict(ev, reader: HeapReader) -> dict:
+    """trace_batch 用：heap 值直接轉成 repr 字串，與 backend decode 後的格式相同。"""
+    meta = ev.meta
+    if "return_value" in meta:
+        meta = {**meta, "return_value": reader.render(meta["return_value"], ev.heap)}
+    return {
+        "tag": ev.tag,
+        "local_vars": {k: reader.render(v, ev.heap) for k, v in ev.local_vars.items()},
+        "global_vars": {k: reader.render(v, ev.heap) for k, v in ev.global_vars.items()},
+        "dataSnapshot": ev.dataSnapshot,
+        "meta": meta,
+    }
+
+
+def _count_payload(count_result) -> dict:
+    return {
+        "step_count": count_result.step_count,
+        "is_truncated": count_result.is_truncated,
+        # JSON object key 只能是字串
+        "line_hits": {str(lineno): hits for lineno, hits in count_result.line_hits.items()},
+    }
+
+
+def _profile_payload(profile) -> dict:
+    return {
+        "total_steps": profile.total_steps,
+        "line_hits": {str(lineno): hits for lineno, hits in profile.line_hits.items()},
+        "complete": profile.complete,
+        "functions": {
+            name: {
+                "calls": fn.calls,
+                "wall_ms": round(fn.wall_time * 1000, 3),
+                "cpu_ms": round(fn.cpu_time * 1000, 3),
+            }
+            for name, fn in profile.functions.items()
+        },
+    }
+
+
+def _read_cgroup_file(*names: str) -> str | None:
+    for name in names:
+        try:
+            with open(os.path.join(CGROUP_ROOT, name)) as f:
+                return f.read()
+        except OSError:
+            continue
+    return None
+
+
+def _cgroup_throttled() -> tuple[int, float] | None:
+    """容器 cgroup 的 (nr_throttled, 累計 throttled 毫秒)；不在容器內或讀不到時 None。"""
+    text = _read_cgroup_file("cpu.stat", "cpu,cpuacct/cpu.stat", "cpu/cpu.stat")
+    if text is None:
+        return None
+    stats = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(" ")
+        if value.strip().isdigit():
+            stats[key] = int(value)
+    if "throttled_usec" in stats:
+        throttled_ms = stats["throttled_usec"] / 1000
+    elif "throttled_time" in stats:  # v1：奈秒
+        throttled_ms = stats["throttled_time"] / 1_000_000
+    else:
+        return None
+    return stats.get("nr_throttled", 0), throttled_ms
+
+
+def _cgroup_memory_peak() -> int | None:
+    text = _read_cgroup_file("memory.peak", "memory/memory.max_usage_in_bytes")
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _usage_snapshot() -> dict:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "wall": time.perf_counter(),
+        "user": usage.ru_utime,
+        "sys": usage.ru_stime,
+        "throttled": _cgroup_throttled(),
+    }
+
+
+def _usage_payload(started: dict, traced_at: float) -> dict:
+    """
+    started（main 開頭的 _usage_snapshot）到現在的資源用量，時間單位毫秒。
+
+    trace_ms：parse + 執行 + 擷取（沒有 SKIP_CFG 時含建 CFG）；serialize_ms：之後組 output（encode_trace、heap 差量）到 JSON 編好。
+    throttled_ms / nr_throttled 是這段期間容器被 CFS quota 節流的差量。
+    memory_peak_bytes 是容器 cgroup 的峰值：容器會被 pool 重用，代表「到目前為止」所有 job 的最大值，
+    單次執行的常駐記憶體看 max_rss_kb。讀不到 cgroup（本機直接跑）時這些欄位為 None。
+    """
+    now = _usage_snapshot()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    throttled = nr_throttled = None
+    if started["throttled"] is not None and now["throttled"] is not None:
+        nr_throttled = now["throttled"][0] - started["throttled"][0]
+        throttled = round(now["throttled"][1] - started["throttled"][1], 3)
+    return {
+        "wall_ms": round((now["wall"] - started["wall"]) * 1000, 3),
+        "trace_ms": round((traced_at - started["wall"]) * 1000, 3),
+        "serialize_ms": round((now["wall"] - traced_at) * 1000, 3),
+        "user_ms": round((now["user"] - started["user"]) * 1000, 3),
+        "sys_ms": round((now["sys"] - started["sys"]) * 1000, 3),
+        "max_rss_kb": usage.ru_maxrss,
+        "throttled_ms": throttled,
+        "nr_throttled": nr_throttled,
+        "memory_peak_bytes": _cgroup_memory_peak(),
+    }
+
+
+def run_batch(code: str, n_values: list[int], per_n_timeout: float, backend: str = "settrace") -> list[dict]:
+    """
+    對每個 n 以 count-only 執行 code + explore_wrapper(n)，
+    回傳 [{n, step_count, is_truncated, line_hits, timed_out[, error]}]。
+
+    每個 n 用 SIGALRM 各自計時；n 由小到大排列，某個 n timeout 後更大的 n 必然也跑不完，
+    直接標記 timed_out 不再執行，避免整批卡滿 per_n_timeout × len(n_values)。
+    """
+    results: list[dict] = []
+    timed_out = False
+    previous_handler = signal.signal(signal.SIGALRM, _on_batch_alarm)
+    try:
+        for n in n_values:
+            entry = {"n": n, "step_count": 0, "is_truncated": False, "line_hits": {}, "timed_out": timed_out}
+            if timed_out:
+                results.append(entry)
+                continue
+            signal.setitimer(signal.ITIMER_REAL, per_n_timeout)
+            try:
+                entry.update(_count_payload(run_count_trace(code + f"\nexplore_wrapper({n})", backend=backend)))
+            except _BatchTimeout:
+                entry["timed_out"] = timed_out = True
+            except LegacyInputNeededError:
+                entry["error"] = "input_needed"
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            results.append(entry)
+    finally:
+        signal.signal(signal.SIGALRM, previous_handler)
+    return results
 
 
 def emit_event(event_type: str, **payload):
@@ -28,6 +247,7 @@ def emit_event(event_type: str, **payload):
 
 
 def main():
+    started = _usage_snapshot()
     # Redirect stdout so user print() calls don't corrupt the JSON output.
     # All JSON is written directly to the original stdout via sys.__stdout__.
     _real_stdout = sys.__stdout__
@@ -51,6 +271,21 @@ def main():
                 body["lineno"] = lineno
             _real_stdout.write(json.dumps(body) + "\n")
 
+    compress_result = os.environ.get("RESULT_ENCODING") == "zlib"
+
+    def _emit_result(output: dict, traced_at: float):
+        # usage 要把 JSON 編碼時間算進 serialize_ms：先編好 output，再把 usage 接在最後一個 key
+        text = json.dumps(output)
+        text = text[:-1] + ', "usage": ' + json.dumps(_usage_payload(started, traced_at)) + "}"
+        if interactive_enabled and compress_result:
+            compressed = zlib.compress(text.encode("utf-8"), RESULT_COMPRESS_LEVEL)
+            emit_event("result", payload_z=base64.b64encode(compressed).decode("ascii"))
+        elif interactive_enabled:
+            sys.__stdout__.write(EVENT_PREFIX + '{"type": "result", "payload": ' + text + "}\n")
+            sys.__stdout__.flush()
+        else:
+            _real_stdout.write(text + "\n")
+
     try:
         encoded = os.environ.get("CODE", "")
         if not encoded:
@@ -80,6 +315,40 @@ def main():
             _emit_error("empty code: no executable statements found")
             sys.exit(1)
 
+        try:
+            backend = select_backend(os.environ.get("TRACE_BACKEND") or "auto")
+        except ValueError as e:
+            _emit_error(f"invalid TRACE_BACKEND: {e}")
+            sys.exit(1)
+
+        batch_raw = os.environ.get("BATCH_N_VALUES", "")
+        if batch_raw:
+            n_values = _parse_batch_n_values(batch_raw)
+            if n_values is None:
+                _emit_error(f"invalid BATCH_N_VALUES: {batch_raw!r}")
+                sys.exit(1)
+            per_n_timeout = float(os.environ.get("PER_N_TIMEOUT", "5"))
+            output = {"results": run_batch(code, n_values, per_n_timeout, backend)}
+            _emit_result(output, time.perf_counter())
+            return
+
+        if os.environ.get("COUNT_ONLY") == "1":
+            try:
+                count_result = run_count_trace(code, stdin_inputs=stdin_inputs, backend=backend)
+            except LegacyInputNeededError:
+                # count-only 不支援 live input；跟非互動模式一樣回 input_needed 讓 caller 決定
+                _emit_error("input_needed")
+                sys.exit(0)
+            traced_at = time.perf_counter()
+            _emit_result(_count_payload(count_result), traced_at)
+            return
+
+        try:
+            capture = parse_capture(json.loads(os.environ.get("TRACE_CAPTURE") or "null"))
+        except ValueError as e:
+            _emit_error(f"invalid capture: {e}")
+            sys.exit(1)
+
         def _live_input(prompt: str, input_index: int, _stdout_events: list[dict]) -> str:
             emit_event("input_needed", prompt=prompt, input_index=input_index)
             line = sys.__stdin__.readline()
@@ -87,11 +356,23 @@ def main():
                 raise EOFError("stdin closed while waiting for input")
             return line.rstrip("\n")
 
+        preview_reader = HeapReader()
+
+        def _stream_batch(start: int, events: list) -> None:
+            emit_event("trace_batch", start=start, events=[_preview_event_dict(ev, preview_reader) for ev in events])
+
+        stream_enabled = interactive_enabled and os.environ.get("STREAM_TRACE") == "1"
+
         try:
             trace_result = run_trace(
                 code,
                 stdin_inputs=stdin_inputs,
                 input_provider=_live_input if interactive_enabled else None,
+                on_batch=_stream_batch if stream_enabled else None,
+                capture=capture,
+                backend=backend,
+                heap=True,
+                full_profile=os.environ.get("TRACE_PROFILE") == "1",
             )
         except LegacyInputNeededError as e:
             """
@@ -107,45 +388,31 @@ def main():
             }) + "\n")
             sys.exit(0)
 
-        try:
-            cfg_graphs = build_cfg(code)
-            module_cfg = build_module_cfg(code)
-            if module_cfg.nodes:
-                cfg_graphs["<global>"] = module_cfg
-            cfg_graph_data = {
-                name: {
-                    "nodes": [
-                        {"id": n.id, "kind": n.kind, "label": n.label, "lines": n.lines}
-                        for n in g.nodes
-                    ],
-                    "edges": [
-                        {"source": e.source, "target": e.target, "label": e.label}
-                        for e in g.edges
-                    ],
-                }
-                for name, g in cfg_graphs.items()
-            }
-        except Exception:
-            cfg_graph_data = {}
+        # SKIP_CFG=1：backend 自己建 CFG（services/cfg_cache.py，依 code hash 快取），container 不必重做
+        cfg_graph_data = {} if os.environ.get("SKIP_CFG") == "1" else build_cfg_graph_data(code)
+        traced_at = time.perf_counter()
 
+        heap_table = HeapTable()
         output = {
-            "trace": [
-                {
-                    "tag": ev.tag,
-                    "local_vars": ev.local_vars,
-                    "global_vars": ev.global_vars,
-                    "dataSnapshot": ev.dataSnapshot,
-                    "meta": ev.meta,
-                }
-                for ev in trace_result.trace
-            ],
+            # keyframe + delta 編碼，backend 用 trace_codec.decode_trace（帶 heap_objects）還原
+            "trace": encode_trace([_event_dict(ev, heap_table) for ev in trace_result.trace]),
+            "trace_encoding": TRACE_ENCODING_DELTA,
+            "heap_objects": heap_table.objects,
+            "value_encoding": HEAP_VALUE_ENCODING,
             "call_graph": {
                 "nodes": [
                     {"id": n.id, "func_name": n.func_name, "cfg": None}
                     for n in trace_result.call_graph.nodes
                 ],
                 "edges": [
-                    {"source": e.source, "target": e.target, "steps": e.steps, "return_steps": e.return_steps}
+                    {
+                        "source": e.source,
+                        "target": e.target,
+                        "steps": e.steps.tolist(),
+                        "return_steps": e.return_steps.tolist(),
+                        "calls": e.calls,
+                        "returns": e.returns,
+                    }
                     for e in trace_result.call_graph.edges
                 ],
                 "root": trace_result.call_graph.root,
@@ -154,12 +421,11 @@ def main():
             "is_truncated": trace_result.is_truncated,
             "step_count": trace_result.step_count,
             "stdout_events": trace_result.stdout_events,
+            "profile": _profile_payload(trace_result.profile),
+            "capture": trace_result.capture,
         }
 
-        if interactive_enabled:
-            emit_event("result", payload=output)
-        else:
-            _real_stdout.write(json.dumps(output) + "\n")
+        _emit_result(output, traced_at)
 
     except Exception as e:
         tb = _traceback.extract_tb(e.__traceback__)
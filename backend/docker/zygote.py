@@ -0,0 +1,71 @@
+"""
+zygote.py — pooled sandbox container 內的常駐 supervisor（zygote）
+
+sidecar 對每個 pooled container 只 docker exec 一次本程式，之後每個 job：
+- sidecar 寫一行 JSON 到 stdin：{"env": {"CODE": ..., "STDIN_INPUTS": ..., ...}}
+- zygote fork 一個 child，child 套用 env 後直接呼叫 runner.main()
+  （runner / tracer / cfg_builder / trace_codec / heap_snapshot 已在 fork 前 import，省掉直譯器冷啟動）
+- child 的 stdout / stderr / stdin 就是這個 exec 的管線，協定與單次 exec runner.py 完全相同
+  （互動 input 也由 child 直接讀 stdin）
+- child 結束後 zygote 印一行 ZYGOTE_PREFIX{"exit": <returncode>} 表示 job 結束
+
+zygote 自己不跑 user code；child 對 process 狀態的任何修改都不會影響下一個 job。
+"""
+
+import json
+import os
+import sys
+
+import runner  # noqa: F401 — 預先 import runner 及其依賴，fork 後的 child 直接共用
+
+ZYGOTE_PREFIX = "__CODEPULSE_ZYGOTE__"
+
+
+def _run_child(job: dict) -> None:
+    """fork 出的 child：跑一次 runner.main()，用 os._exit 結束，永不 return。"""
+    code = 1
+    try:
+        os.environ.update({str(k): str(v) for k, v in job.get("env", {}).items()})
+        runner.main()
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+    except BaseException:
+        code = 1
+    finally:
+        try:
+            sys.__stdout__.flush()
+            sys.__stderr__.flush()
+        finally:
+            os._exit(code)
+
+
+def serve() -> None:
+    # 用 raw（無緩衝）stdin 一次讀一行 job：不能預讀，後面的行可能是 child 的 input() 值
+    stdin = sys.stdin.buffer.raw
+    while True:
+        line = stdin.readline()
+        if not line:
+            return
+        try:
+            job = json.loads(line)
+        except ValueError:
+            job = None
+        if not isinstance(job, dict):
+            sys.__stdout__.write(ZYGOTE_PREFIX + json.dumps({"exit": 1, "error": "invalid job"}) + "\n")
+            sys.__stdout__.flush()
+            continue
+
+        pid = os.fork()
+        if pid == 0:
+            _run_child(job)
+        _, status = os.waitpid(pid, 0)
+        sys.__stdout__.write(ZYGOTE_PREFIX + json.dumps({"exit": os.waitstatus_to_exitcode(status)}) + "\n")
+        sys.__stdout__.flush()
+
+
+if __name__ == "__main__":
+    serve()
@@ -29,6 +29,8 @@ class ExploreHistory(db.Model):
     cfg_graph = db.Column(db.JSON, nullable=True)
     stdout_events = db.Column(db.JSON, nullable=True)
     top3_candidates = db.Column(db.JSON, nullable=True)
+    # 這次分析的 sandbox 資源用量（等容器 / 執行耗時、CPU、cgroup throttle、記憶體峰值）；快取命中為 {}
+    sandbox_usage = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
 
     __table_args__ = (
@@ -1,7 +1,11 @@
 import json
 import logging
+import math
 from flask import Blueprint, jsonify, request, g, Response, stream_with_context
+from flask_limiter.util import get_remote_address
 from auth_utils import login_required
+from extensions import limiter
+from services import admission as sandbox_admission
 from services.playground_history import (
     MAX_HISTORY,
     find_matching_history,
@@ -11,6 +15,9 @@ from services.playground_history import (
 
 logger = logging.getLogger(__name__)
 from services.precheck import precheck_and_wrap
+from services.sandbox import close_session, run_in_sandbox
+from services.trace_codec import decode_trace
+from services.tracer import MAX_TRACE_STEPS, parse_capture
 import services.analysis_runner  # noqa: F401 — side-effect import: executes @celery_app.task decorator to register run_analysis_task; do NOT remove
 from services.task_queue import (
     task_queue,
@@ -41,6 +48,14 @@ def submit():
     # _run_analysis / run_analysis_task 簽名沒有此參數，多傳會 TypeError
     is_retry = bool(data.get("is_retry", False))
 
+    capture = data.get("capture")
+    try:
+        parse_capture(capture)
+    except ValueError as e:
+        return jsonify({"error": "invalid_capture", "message": str(e)}), 400
+    # 前端有要播放執行中的 trace 片段才串流：每批都要經 Redis / SSE 轉送，沒人看就不送
+    stream_trace = data.get("stream_trace") is True
+
     # is_retry 為 True 時跳過 duplicate / quota 檢查：retry 是同一支 code + 漸增 stdin 的延續，
     # 第 1 次 submit 已做過完整檢查，不該再被 duplicate 攔（false positive）或被 quota 攔
     if save_history and not is_retry:
@@ -73,6 +88,8 @@ def submit():
         user_id=g.current_user_id,
         save_history=save_history,  # 不要 `and not is_retry` — 含 input() 的程式只有 retry 那次會真正完成
         stdin_inputs=stdin_inputs,
+        capture=capture,
+        stream_trace=stream_trace,
         # 不要傳 is_retry — _run_analysis / run_analysis_task 簽名沒有此參數
     )
     return jsonify({"task_id": task_id}), 202
@@ -162,3 +179,60 @@ def cancel(task_id: str):
         return jsonify({"error": "task not found"}), 404
     task_queue.cancel_task(task_id)
     return jsonify({"status": "accepted"}), 202
+
+
+def _window_rate_key() -> str:
+    """/window 以使用者為單位限流（login_required 之後才會有 current_user_id）。"""
+    user_id = g.get("current_user_id")
+    return f"user:{user_id}" if user_id is not None else get_remote_address()
+
+
+@analyze_bp.route('/window', methods=['POST'])
+@login_required
+@limiter.limit("30 per minute", key_func=_window_rate_key)
+def trace_window():
+    """
+    keyframe 擷取的 on-demand 視窗：以相同 code + stdin 重跑（使用者程式不能 import random 等，
+    重跑結果確定），回傳 [start, start + count) 的完整 trace event（meta.step 為全域 step）。
+
+    在 web process 同步跑 sandbox，不經 task queue：sidecar 沒空位或還有 task 在排隊時回 503，
+    不插隊；以使用者為 tenant 參與 sidecar 的公平排隊。
+    """
+    data = request.get_json(silent=True)
+    if not data or "code" not in data:
+        return jsonify({"error": "missing field: code"}), 400
+
+    stdin_inputs = data.get("stdin_inputs", [])
+    if not isinstance(stdin_inputs, list) or not all(isinstance(v, str) for v in stdin_inputs):
+        return jsonify({"error": "stdin_inputs must be list[str]"}), 400
+    start, count = data.get("start"), data.get("count", MAX_TRACE_STEPS)
+    capture = {"strategy": "keyframe", "every": 0, "window_start": start, "window_size": count}
+    try:
+        parse_capture(capture)
+        wrapped_code, _ = precheck_and_wrap(data["code"])
+    except (ValueError, SyntaxError) as e:
+        return jsonify({"error": "invalid_window", "message": str(e)}), 400
+
+    if sandbox_admission.sandbox_busy():
+        response = jsonify({"error": "sandbox_busy", "message": "sandbox is busy, retry later"})
+        response.headers["Retry-After"] = str(math.ceil(sandbox_admission.ADMISSION_RETRY_SECONDS))
+        return response, 503
+
+    # 視窗只回 events，不需要 CFG；tenant 與 analysis_runner 同格式，和主 trace 共用公平排隊額度
+    result = run_in_sandbox(
+        wrapped_code, stdin_inputs=stdin_inputs, capture=capture, skip_cfg=True,
+        tenant=f"user:{g.current_user_id}",
+    )
+    if result.get("status") == "input_needed" or result.get("error") == "input_needed":
+        # live 模式 sidecar 開了互動 session 在等輸入：視窗不會再餵值，立刻關掉歸還容器
+        if result.get("session_id"):
+            close_session(result["session_id"])
+        return jsonify({"error": "input_needed", "message": "stdin_inputs must cover every input() call"}), 409
+    if "error" in result:
+        return jsonify({"error": "sandbox_error", "message": result["error"]}), 502
+
+    return jsonify({
+        "start": start,
+        "events": decode_trace(result.get("trace", []), result.get("trace_encoding"), result.get("heap_objects")),
+        "capture": result.get("capture"),
+    }), 200
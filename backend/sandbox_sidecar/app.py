@@ -2,7 +2,12 @@
 sandbox_sidecar/app.py — Sandbox Sidecar
 
 唯一有 /var/run/docker.sock 存取權的服務。
-只接受一個 endpoint：POST /run，從 ContainerPool 取容器執行 user code。
+POST /run 從 ContainerPool 取容器執行 user code；POST /run_batch 在同一個容器 exec 內
+依序跑多個 n（big-O 測量用）。/run 帶 stream=true 時以 NDJSON 邊跑邊送 trace_batch。
+GET /capacity 回報目前還能直接接的 /run 數（backend admission control 用）。
+/run、/run_batch（及後續 /input）的回應帶 X-Sandbox-Timings header：等容器、啟動 runner、執行的毫秒數。
+docker 操作預設直接走 Engine API（docker_backend.py），socket 不可用或
+DOCKER_BACKEND=cli 時退回 docker CLI。
 
 安全設計：
 - 不接受任意 docker 指令，只 hardcode docker exec 參數
@@ -10,7 +15,6 @@ sandbox_sidecar/app.py — Sandbox Sidecar
 - 永遠不 raise，錯誤透過 JSON 回傳
 """
 
-import base64
 import json
 import logging
 import os
@@ -20,26 +24,54 @@ import threading
 import time
 import uuid
 from dataclasses import dataclass, field
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 from container_pool import (
     ContainerDeadError,
     ContainerPool,
     PoolExhaustedError,
 )
+from docker_backend import DockerAPIError, DockerEngineClient, engine_from_env
+from sidecar_protocol import (
+    ACQUIRE_TIMEOUT,
+    AUTOSCALE_ENABLED,
+    COMPRESSED_RESULT_MIMETYPE,
+    CONTAINER_TIMEOUT,
+    EVENT_PREFIX,
+    HEALTH_CHECK_ENABLED,
+    HEALTH_CHECK_INTERVAL,
+    MAX_POOL_SIZE,
+    MAX_REUSE,
+    MIN_POOL_SIZE,
+    NODE_POOL_LABEL,
+    POOL_EXHAUSTED_MESSAGE,
+    RESET_ENABLED,
+    STARVATION_BOUND,
+    STREAM_MIMETYPE,
+    TIMINGS_HEADER,
+    docker_exec_cmd,
+    elapsed_ms,
+    error_body,
+    event_outcome,
+    request_schedule,
+    run_batch_request_env,
+    run_request_env,
+    run_timings,
+    stream_result_line,
+)
+from zygote_client import ZygoteProcess, ZygoteUnavailableError
 
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
-CONTAINER_TIMEOUT = int(os.environ.get("CONTAINER_TIMEOUT", "10"))
-ACQUIRE_TIMEOUT = float(os.environ.get("ACQUIRE_TIMEOUT", "8"))
-MIN_POOL_SIZE = int(os.environ.get("MIN_POOL_SIZE", "10"))
-MAX_POOL_SIZE = int(os.environ.get("MAX_POOL_SIZE", "30"))
-MAX_REUSE = int(os.environ.get("MAX_REUSE", "50"))
+# 每個 pooled container 跑一個常駐 zygote（docker/zygote.py），job 由它 fork child 執行，
+# 省掉每次 docker exec + python 冷啟動；zygote 不可用時退回單次 docker exec runner.py
+ZYGOTE_ENABLED = os.environ.get("SANDBOX_ZYGOTE", "1") == "1"
 
 _pool: ContainerPool | None = None
 _pool_lock = threading.Lock()
-EVENT_PREFIX = "__CODEPULSE_EVENT__"
+# Engine API client（_get_pool 時依 DOCKER_BACKEND 決定）；None 代表走 docker CLI
+_engine: DockerEngineClient | None = None
 
 
 @dataclass
@@ -56,6 +88,9 @@ class SandboxSession:
     input_count: int = 0
     closed: bool = False
     lock: threading.Lock = field(default_factory=threading.Lock)
+    # sidecar 端計時（見 sidecar_protocol.run_timings）；started_at 即 runner 啟動完成的時間點
+    acquire_ms: float | None = None
+    exec_start_ms: float | None = None
 
 
 _sessions: dict[str, SandboxSession] = {}
@@ -64,29 +99,31 @@ _sessions_lock = threading.Lock()
 
 def _get_pool() -> ContainerPool:
     """Lazy-init ContainerPool（double-checked locking）— 第一次 /run 才開始預熱容器。"""
-    global _pool
+    global _pool, _engine
     if _pool is None:
         with _pool_lock:
             if _pool is None:
+                _engine = engine_from_env()
                 _pool = ContainerPool(
                     min_size=MIN_POOL_SIZE,
                     max_size=MAX_POOL_SIZE,
                     max_reuse=MAX_REUSE,
+                    on_spawn=_start_zygote if ZYGOTE_ENABLED else None,
+                    engine=_engine,
+                    starvation_bound=STARVATION_BOUND,
+                    label=NODE_POOL_LABEL,
+                    reset=RESET_ENABLED,
+                    warm_check=_zygote_alive if ZYGOTE_ENABLED else None,
                 )
+                if AUTOSCALE_ENABLED:
+                    _pool.start_autoscaler()
+                if HEALTH_CHECK_ENABLED:
+                    _pool.start_health_checker(HEALTH_CHECK_INTERVAL)
     return _pool
 
 
 def _error_response(message: str, *, status: int = 200, lineno: int | None = None):
-    body = {
-        "error": message,
-        "is_truncated": False,
-        "trace": [],
-        "call_graph": None,
-        "cfg_graph": {},
-    }
-    if lineno is not None:
-        body["lineno"] = lineno
-    return jsonify(body), status
+    return jsonify(error_body(message, lineno=lineno)), status
 
 
 def _reader_stdout(session: SandboxSession) -> None:
@@ -152,59 +189,154 @@ def _finish_session(session: SandboxSession, *, recycle: bool) -> None:
         except Exception:
             pass
     if recycle:
-        session.pool.mark_destroyed(session.container)
+        # 殘留 process / 互動狀態：pool 有 reset 就重置後重用，否則銷毀
+        session.pool.recycle(session.container)
     else:
         session.pool.release(session.container)
 
 
-def _wait_for_control_event(session: SandboxSession, timeout: float):
+def _iter_session_events(session: SandboxSession, timeout: float):
+    """
+    依序 yield runner 的 trace_batch event，最後 yield 一個 control event
+    （input_needed / result / error，timeout 或 runner 提早結束時合成 error）後停止。
+    """
     deadline = time.monotonic() + timeout
     while True:
         remaining = deadline - time.monotonic()
         if remaining <= 0:
-            return {"type": "error", "message": "timeout"}
+            yield {"type": "error", "message": "timeout"}
+            return
         try:
             event = session.events.get(timeout=min(remaining, 0.5))
         except queue.Empty:
             if session.process.poll() is not None:
                 stderr = "\n".join(session.stderr_lines).strip()
-                return {"type": "error", "message": stderr or "runner exited without result"}
+                yield {"type": "error", "message": stderr or "runner exited without result", "crashed": True}
+                return
             continue
 
         event_type = event.get("type")
-        if event_type in {"input_needed", "result", "error"}:
+        if event_type == "trace_batch":
+            yield event
+        elif event_type in {"input_needed", "result", "error"}:
             session.last_active_at = time.monotonic()
+            yield event
+            return
+
+
+def _wait_for_control_event(session: SandboxSession, timeout: float):
+    for event in _iter_session_events(session, timeout):
+        if event.get("type") != "trace_batch":
             return event
 
 
-def _event_to_response(session: SandboxSession, event: dict):
-    event_type = event.get("type")
-    if event_type == "input_needed":
+def _resolve_event(session: SandboxSession, event: dict) -> dict | bytes:
+    if event.get("type") == "input_needed":
         session.input_count += 1
+    finish, body = event_outcome(event, session.id, session.input_count)
+    if finish is None:
         _store_session(session)
-        return jsonify({
-            "status": "input_needed",
-            "session_id": session.id,
-            "prompt": event.get("prompt", ""),
-            "input_index": event.get("input_index", session.input_count - 1),
-        })
-    if event_type == "result":
-        result = event.get("payload", {})
-        _finish_session(session, recycle=session.input_count > 0)
-        if session.input_count > 0:
-            return jsonify({"status": "completed", "result": result})
-        return jsonify(result)
-
-    message = event.get("message", "sandbox error")
-    lineno = event.get("lineno")
-    should_recycle = session.input_count > 0 or message == "timeout"
-    _finish_session(session, recycle=should_recycle)
-    if session.input_count > 0:
-        body = {"status": "failed", "error": message}
-        if lineno is not None:
-            body["lineno"] = lineno
-        return jsonify(body)
-    return _error_response(message, lineno=lineno)
+    else:
+        _finish_session(session, recycle=finish == "recycle")
+    return body
+
+
+def _session_timings(session: SandboxSession) -> dict | None:
+    if session.acquire_ms is None:
+        return None
+    return run_timings(session.acquire_ms, session.exec_start_ms, session.started_at)
+
+
+def _event_to_response(session: SandboxSession, event: dict):
+    body = _resolve_event(session, event)
+    if isinstance(body, bytes):
+        resp = Response(body, mimetype=COMPRESSED_RESULT_MIMETYPE)
+    else:
+        resp = jsonify(body)
+    timings = _session_timings(session)
+    if timings is not None:
+        resp.headers[TIMINGS_HEADER] = json.dumps(timings, separators=(",", ":"))
+    return resp
+
+
+def _stream_session(session: SandboxSession, timeout: float):
+    """
+    /run stream=true 的 NDJSON body：每個 trace_batch 一行 {"type": "trace_batch", ...}，
+    最後一行是與非串流 /run 相同的回應 body（壓縮結果見 stream_result_line）。
+
+    client 中途斷線時 generator 被 close（GeneratorExit）：還沒結束、也沒停在 _sessions
+    等輸入的 session 在 finally 回收，否則容器與 runner 會一直佔著。
+    """
+    try:
+        for event in _iter_session_events(session, timeout):
+            if event.get("type") == "trace_batch":
+                yield json.dumps(event) + "\n"
+                continue
+            # header 早已送出，計時改放進最後一行
+            body = _resolve_event(session, event)
+            yield stream_result_line(body, _session_timings(session)) + "\n"
+    finally:
+        if _get_session(session.id) is not session:
+            _finish_session(session, recycle=True)
+
+
+def _start_zygote(container) -> ZygoteProcess | None:
+    try:
+        if _engine is not None:
+            container.zygote = ZygoteProcess.via_engine(_engine, container.id)
+        else:
+            container.zygote = ZygoteProcess.for_container(container.id)
+    except (FileNotFoundError, OSError, DockerAPIError):
+        logger.warning("failed to start zygote in container %s", container.id, exc_info=True)
+        container.zygote = None
+    return container.zygote
+
+
+def _zygote_alive(container) -> bool:
+    return container.zygote is not None and container.zygote.is_alive()
+
+
+def _submit_to_zygote(container, env: dict[str, str]):
+    zygote = container.zygote
+    if zygote is None or not zygote.is_alive():
+        zygote = _start_zygote(container)
+        if zygote is None:
+            return None
+    try:
+        return zygote.submit({**env, "CODEPULSE_INTERACTIVE": "1"})
+    except ZygoteUnavailableError:
+        logger.warning("zygote unavailable in container %s, falling back to docker exec", container.id)
+        return None
+
+
+def _exec_runner(container, env: dict[str, str]):
+    """
+    在 container 內跑一次 runner；回傳 Popen（或介面相容的 ZygoteJob）。
+
+    ZYGOTE_ENABLED 時交給容器內的 zygote fork 執行；否則 exec runner.py：
+    有 Engine API 時直接 exec（失敗才退回 CLI），CLI 的 env 以 -e KEY=VALUE 傳入（CODE 一律排第一個）。
+    """
+    if ZYGOTE_ENABLED:
+        job = _submit_to_zygote(container, env)
+        if job is not None:
+            return job
+    if _engine is not None:
+        try:
+            return _engine.exec(
+                container.id,
+                ["python", "/sandbox/runner.py"],
+                {**env, "CODEPULSE_INTERACTIVE": "1"},
+            )
+        except (OSError, DockerAPIError):
+            logger.warning("engine exec failed in container %s, falling back to docker cli", container.id, exc_info=True)
+    return subprocess.Popen(
+        docker_exec_cmd(container.id, env),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
 
 
 @app.route("/run", methods=["POST"])
@@ -213,49 +345,31 @@ def run():
     if not data or "code" not in data:
         return jsonify({"error": "missing field: code"}), 400
 
-    code = data["code"]
-    n = data.get("n")
-    per_n_timeout = data.get("per_n_timeout")
-
-    stdin_inputs = data.get("stdin_inputs", [])
-    if not isinstance(stdin_inputs, list) or not all(isinstance(v, str) for v in stdin_inputs):
-        return jsonify({"error": "stdin_inputs must be list[str]"}), 400
-
-    runnable = code if n is None else code + f"\nexplore_wrapper({n})"
-    encoded = base64.b64encode(runnable.encode("utf-8")).decode("ascii")
-    # stdin 比照 CODE 用 base64 編碼，避開 shell/env 跳脫問題；runner.py 會解碼 STDIN_INPUTS。
-    stdin_encoded = base64.b64encode(json.dumps(stdin_inputs).encode("utf-8")).decode("ascii")
-    effective_timeout = per_n_timeout if per_n_timeout is not None else CONTAINER_TIMEOUT
+    try:
+        env, effective_timeout, stream = run_request_env(data)
+        priority, tenant = request_schedule(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     pool = _get_pool()
 
+    acquire_started = time.monotonic()
     try:
-        container = pool.acquire(timeout=ACQUIRE_TIMEOUT)
+        container = pool.acquire(timeout=ACQUIRE_TIMEOUT, priority=priority, tenant=tenant)
     except PoolExhaustedError:
         return _error_response(
-            "pool_exhausted: 伺服器繁忙，請稍後再試",
+            POOL_EXHAUSTED_MESSAGE,
             status=503,
         )
+    acquire_ms = elapsed_ms(acquire_started)
 
+    exec_started = time.monotonic()
     try:
-        proc = subprocess.Popen(
-            [
-                "docker", "exec", "-i",
-                "-e", f"CODE={encoded}",
-                "-e", f"STDIN_INPUTS={stdin_encoded}",
-                "-e", "CODEPULSE_INTERACTIVE=1",
-                container.id,
-                "python", "/sandbox/runner.py",
-            ],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-        )
+        proc = _exec_runner(container, env)
     except FileNotFoundError as e:
         pool.release(container)
         return _error_response(f"docker not found: {e}")
+    exec_start_ms = elapsed_ms(exec_started)
 
     session = SandboxSession(
         id=uuid.uuid4().hex,
@@ -263,12 +377,89 @@ def run():
         container=container,
         pool=pool,
         effective_timeout=effective_timeout,
+        acquire_ms=acquire_ms,
+        exec_start_ms=exec_start_ms,
     )
     _start_readers(session)
+    if stream:
+        return Response(
+            stream_with_context(_stream_session(session, effective_timeout)),
+            mimetype=STREAM_MIMETYPE,
+        )
     event = _wait_for_control_event(session, effective_timeout)
     return _event_to_response(session, event)
 
 
+@app.route("/run_batch", methods=["POST"])
+def run_batch():
+    """
+    big-O 測量：一個容器、一次 exec 跑完所有 n（runner.py BATCH_N_VALUES 模式）。
+
+    回傳 {"results": [{"n", "step_count", "is_truncated", "timed_out"[, "error"]}]}。
+    runner 每個 n 自己計時；sidecar 只設整批上限 per_n_timeout × len(n_values)。
+    """
+    data = request.get_json(silent=True)
+    if not data or "code" not in data:
+        return jsonify({"error": "missing field: code"}), 400
+
+    try:
+        env, batch_timeout = run_batch_request_env(data)
+        priority, tenant = request_schedule(data, default="probe")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    pool = _get_pool()
+    acquire_started = time.monotonic()
+    try:
+        container = pool.acquire(timeout=ACQUIRE_TIMEOUT, priority=priority, tenant=tenant)
+    except PoolExhaustedError:
+        return _error_response(
+            POOL_EXHAUSTED_MESSAGE,
+            status=503,
+        )
+    acquire_ms = elapsed_ms(acquire_started)
+
+    exec_started = time.monotonic()
+    try:
+        proc = _exec_runner(container, env)
+    except FileNotFoundError as e:
+        pool.release(container)
+        return _error_response(f"docker not found: {e}")
+    exec_start_ms = elapsed_ms(exec_started)
+
+    session = SandboxSession(
+        id=uuid.uuid4().hex,
+        process=proc,
+        container=container,
+        pool=pool,
+        effective_timeout=batch_timeout,
+        acquire_ms=acquire_ms,
+        exec_start_ms=exec_start_ms,
+    )
+    _start_readers(session)
+    event = _wait_for_control_event(session, session.effective_timeout)
+    if event.get("type") == "input_needed":
+        # batch 模式 runner 不接 live input；保險起見仍當錯誤處理並回收容器
+        event = {"type": "error", "message": "input_needed"}
+    return _event_to_response(session, event)
+
+
+@app.route("/pool/stats", methods=["GET"])
+def pool_stats():
+    """容器池狀態與 autoscaler 統計；pool 尚未建立（還沒有任何 /run）時不觸發預熱。"""
+    if _pool is None:
+        return jsonify({"initialized": False})
+    return jsonify({"initialized": True, **_pool.stats()})
+
+
+@app.route("/capacity", methods=["GET"])
+def capacity():
+    """backend 做 admission control 用：目前還能直接接的 /run 數。pool 尚未建立時是整個 MAX_POOL_SIZE。"""
+    if _pool is None:
+        return jsonify({"initialized": False, "available": MAX_POOL_SIZE, "max_size": MAX_POOL_SIZE})
+    return jsonify({"initialized": True, **_pool.capacity()})
+
+
 @app.route("/input/<session_id>", methods=["POST"])
 def post_input(session_id: str):
     session = _get_session(session_id)
@@ -0,0 +1,631 @@
+"""
+sandbox_sidecar/asgi_app.py — asyncio 版 sidecar（ASGI）
+
+與 app.py（Flask）提供相同的 HTTP 介面（/run、/run_batch、/input、/session、/pool/stats、/capacity），
+services/sandbox.py 不需修改；以 uvicorn asgi_app:app 啟動（SIDECAR_SERVER=asgi）。
+
+差別在 session 的等待方式：
+- runner 以 asyncio subprocess 執行 docker exec，stdout / stderr 由單一 event loop 上的 task 讀取
+- 等 control event 直接 await asyncio.Queue，沒有 0.5s 輪詢；runner 結束時由 reader 送 EOF 事件
+- 等 input 的互動 session 只是一個閒置的 Queue + 兩個掛起的 task，不佔 reader thread
+
+另有 WebSocket /ws/run：worker 在 session 整段生命週期內維持一條連線，trace_batch、
+input_needed、input 與最終結果都在這條連線上多工，省掉每次 input 一個 HTTP 請求
+（訊息格式見 _websocket_run）。
+
+ContainerPool 仍是 thread 版（acquire 可能阻塞、第一次建立要等 spawn），以 asyncio.to_thread 呼叫；
+容器生命週期照樣可走 Engine API，但 runner 一律 docker exec（CLI），不經 zygote / Engine API exec
+（兩者的串流都是 thread 驅動），因此這個模式的 pool 不預熱 zygote。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from container_pool import ContainerPool, PoolExhaustedError
+from docker_backend import engine_from_env
+from sidecar_protocol import (
+    ACQUIRE_TIMEOUT,
+    AUTOSCALE_ENABLED,
+    COMPRESSED_RESULT_MIMETYPE,
+    CONTAINER_TIMEOUT,
+    EVENT_PREFIX,
+    HEALTH_CHECK_ENABLED,
+    HEALTH_CHECK_INTERVAL,
+    MAX_POOL_SIZE,
+    MAX_REUSE,
+    MIN_POOL_SIZE,
+    NODE_POOL_LABEL,
+    POOL_EXHAUSTED_MESSAGE,
+    RESET_ENABLED,
+    STARVATION_BOUND,
+    STREAM_MIMETYPE,
+    TIMINGS_HEADER,
+    docker_exec_cmd,
+    elapsed_ms,
+    error_body,
+    event_outcome,
+    request_schedule,
+    run_batch_request_env,
+    run_request_env,
+    run_timings,
+    stream_result_line,
+)
+
+logger = logging.getLogger(__name__)
+
+# runner 的 result 一行可能有數 MB；asyncio StreamReader 預設單行上限只有 64 KiB
+STREAM_LINE_LIMIT = 64 * 1024 * 1024
+_EOF = {"type": "_eof"}
+
+
+@dataclass
+class AsyncSandboxSession:
+    id: str
+    process: asyncio.subprocess.Process
+    container: object
+    pool: object
+    events: asyncio.Queue = field(default_factory=asyncio.Queue)
+    stderr_lines: list[str] = field(default_factory=list)
+    effective_timeout: float = CONTAINER_TIMEOUT
+    last_active_at: float = field(default_factory=time.monotonic)
+    input_count: int = 0
+    closed: bool = False
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    readers: list[asyncio.Task] = field(default_factory=list)
+    # sidecar 端計時（見 sidecar_protocol.run_timings）；started_at 即 runner 啟動完成的時間點
+    started_at: float = field(default_factory=time.monotonic)
+    acquire_ms: float | None = None
+    exec_start_ms: float | None = None
+
+
+_pool: ContainerPool | None = None
+_pool_lock = threading.Lock()
+# 只在 event loop thread 存取，不需要 lock
+_sessions: dict[str, AsyncSandboxSession] = {}
+# 結束後在背景收尾（等 process 退出、reader 讀完）的 task；保留參照避免被 GC
+_reapers: set[asyncio.Task] = set()
+
+
+def _get_pool() -> ContainerPool:
+    """Lazy-init ContainerPool；會阻塞到第一個容器就緒，caller 以 asyncio.to_thread 呼叫。"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ContainerPool(
+                    min_size=MIN_POOL_SIZE,
+                    max_size=MAX_POOL_SIZE,
+                    max_reuse=MAX_REUSE,
+                    engine=engine_from_env(),
+                    starvation_bound=STARVATION_BOUND,
+                    label=NODE_POOL_LABEL,
+                    reset=RESET_ENABLED,
+                )
+                if AUTOSCALE_ENABLED:
+                    _pool.start_autoscaler()
+                if HEALTH_CHECK_ENABLED:
+                    _pool.start_health_checker(HEALTH_CHECK_INTERVAL)
+    return _pool
+
+
+async def _read_stdout(session: AsyncSandboxSession) -> None:
+    try:
+        while True:
+            raw_line = await session.process.stdout.readline()
+            if not raw_line:
+                break
+            line = raw_line.decode("utf-8", "replace").rstrip("\n")
+            if not line:
+                continue
+            if line.startswith(EVENT_PREFIX):
+                try:
+                    event = json.loads(line[len(EVENT_PREFIX):])
+                except json.JSONDecodeError:
+                    session.events.put_nowait({"type": "error", "message": f"invalid protocol event: {line[:120]}"})
+                    continue
+                session.events.put_nowait(event)
+            else:
+                logger.warning("sidecar session %s: unexpected non-event stdout: %s", session.id, line[:200])
+                session.events.put_nowait({"type": "stdout", "text": line})
+    except (ValueError, asyncio.LimitOverrunError) as e:
+        session.events.put_nowait({"type": "error", "message": f"runner output too large: {e}"})
+    finally:
+        session.events.put_nowait(_EOF)
+
+
+async def _read_stderr(session: AsyncSandboxSession) -> None:
+    while True:
+        raw_line = await session.process.stderr.readline()
+        if not raw_line:
+            return
+        line = raw_line.decode("utf-8", "replace").rstrip("\n")
+        if line:
+            session.stderr_lines.append(line)
+            if len(session.stderr_lines) > 200:
+                session.stderr_lines = session.stderr_lines[-200:]
+
+
+async def _exec_runner(container, env: dict[str, str]) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        *docker_exec_cmd(container.id, env),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=STREAM_LINE_LIMIT,
+    )
+
+
+async def _start_session(
+    container, pool, env: dict[str, str], timeout: float, acquire_ms: float | None = None,
+) -> AsyncSandboxSession:
+    exec_started = time.monotonic()
+    process = await _exec_runner(container, env)
+    session = AsyncSandboxSession(
+        id=uuid.uuid4().hex,
+        process=process,
+        container=container,
+        pool=pool,
+        effective_timeout=timeout,
+        acquire_ms=acquire_ms,
+        exec_start_ms=elapsed_ms(exec_started),
+    )
+    session.readers = [
+        asyncio.create_task(_read_stdout(session)),
+        asyncio.create_task(_read_stderr(session)),
+    ]
+    return session
+
+
+async def _finish_session(session: AsyncSandboxSession, *, recycle: bool) -> None:
+    if session.closed:
+        return
+    session.closed = True
+    _sessions.pop(session.id, None)
+    if session.process.returncode is None:
+        try:
+            session.process.kill()
+        except ProcessLookupError:
+            pass
+    if recycle:
+        # 殘留 process / 互動狀態：pool 有 reset 就重置後重用，否則銷毀
+        session.pool.recycle(session.container)
+    else:
+        session.pool.release(session.container)
+    reaper = asyncio.create_task(_reap(session))
+    _reapers.add(reaper)
+    reaper.add_done_callback(_reapers.discard)
+
+
+async def _reap(session: AsyncSandboxSession) -> None:
+    try:
+        await asyncio.wait_for(session.process.wait(), 5)
+    except asyncio.TimeoutError:
+        logger.warning("sidecar session %s: runner did not exit after kill", session.id)
+    await asyncio.gather(*session.readers, return_exceptions=True)
+
+
+async def _iter_session_events(session: AsyncSandboxSession, timeout: float):
+    """同 app.py 的 _iter_session_events：yield trace_batch，最後 yield 一個 control event 後停止。"""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            event = await asyncio.wait_for(session.events.get(), remaining)
+        except asyncio.TimeoutError:
+            yield {"type": "error", "message": "timeout"}
+            return
+
+        event_type = event.get("type")
+        if event is _EOF:
+            # stdout 已關：等 stderr 讀完再回報，讓錯誤訊息完整
+            await asyncio.gather(*session.readers[1:], return_exceptions=True)
+            stderr = "\n".join(session.stderr_lines).strip()
+            yield {"type": "error", "message": stderr or "runner exited without result", "crashed": True}
+            return
+        if event_type == "trace_batch":
+            yield event
+        elif event_type in {"input_needed", "result", "error"}:
+            session.last_active_at = time.monotonic()
+            yield event
+            return
+
+
+async def _wait_for_control_event(session: AsyncSandboxSession, timeout: float) -> dict:
+    async for event in _iter_session_events(session, timeout):
+        if event.get("type") != "trace_batch":
+            return event
+    return {"type": "error", "message": "timeout"}
+
+
+async def _resolve_event(session: AsyncSandboxSession, event: dict) -> dict | bytes:
+    if event.get("type") == "input_needed":
+        session.input_count += 1
+    finish, body = event_outcome(event, session.id, session.input_count)
+    if finish is None:
+        _sessions[session.id] = session
+    else:
+        await _finish_session(session, recycle=finish == "recycle")
+    return body
+
+
+def _session_timings(session: AsyncSandboxSession) -> dict | None:
+    if session.acquire_ms is None:
+        return None
+    return run_timings(session.acquire_ms, session.exec_start_ms, session.started_at)
+
+
+def _timings_headers(session: AsyncSandboxSession) -> list[tuple[bytes, bytes]]:
+    timings = _session_timings(session)
+    if timings is None:
+        return []
+    return [(TIMINGS_HEADER.lower().encode("ascii"), json.dumps(timings, separators=(",", ":")).encode("ascii"))]
+
+
+def _with_timings(session: AsyncSandboxSession, body: dict) -> dict:
+    """串流最後一行 / WebSocket response 沒有 header 可用，計時放進 body。"""
+    timings = _session_timings(session)
+    return body if timings is None else {**body, "sandbox_timings": timings}
+
+
+# ----------------------------------------------------------------------
+# ASGI 傳輸
+# ----------------------------------------------------------------------
+
+async def _read_json(receive) -> dict | None:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(b"".join(chunks) or b"null")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _send(send, body: dict | bytes, status: int = 200, headers: list[tuple[bytes, bytes]] = ()) -> None:
+    if isinstance(body, bytes):
+        data, mimetype = body, COMPRESSED_RESULT_MIMETYPE
+    else:
+        data, mimetype = json.dumps(body).encode("utf-8"), "application/json"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", mimetype.encode("ascii")),
+            (b"content-length", str(len(data)).encode("ascii")),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _send_stream(send, session: AsyncSandboxSession, timeout: float) -> None:
+    """/run stream=true：NDJSON，trace_batch 逐行送出，最後一行是完整回應 body（見 stream_result_line）。"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", STREAM_MIMETYPE.encode("ascii"))],
+    })
+    async for event in _iter_session_events(session, timeout):
+        if event.get("type") == "trace_batch":
+            line = json.dumps(event)
+        else:
+            # header 早已送出，計時放進最後一行
+            line = stream_result_line(await _resolve_event(session, event), _session_timings(session))
+        await send({"type": "http.response.body", "body": (line + "\n").encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _acquire(pool, priority: int, tenant: str | None):
+    return await asyncio.to_thread(pool.acquire, ACQUIRE_TIMEOUT, priority, tenant)
+
+
+# ----------------------------------------------------------------------
+# endpoints
+# ----------------------------------------------------------------------
+
+async def _start_run(data: dict | None):
+    """
+    /run 與 /ws/run 共用：驗證 body、取容器、啟動 runner。
+    回傳 (session, stream, None, None)；失敗時 (None, False, 錯誤 body, HTTP status)。
+    """
+    if not data or "code" not in data:
+        return None, False, {"error": "missing field: code"}, 400
+    try:
+        env, effective_timeout, stream = run_request_env(data)
+        priority, tenant = request_schedule(data)
+    except ValueError as e:
+        return None, False, {"error": str(e)}, 400
+
+    pool = await asyncio.to_thread(_get_pool)
+    acquire_started = time.monotonic()
+    try:
+        container = await _acquire(pool, priority, tenant)
+    except PoolExhaustedError:
+        return None, False, error_body(POOL_EXHAUSTED_MESSAGE), 503
+
+    try:
+        session = await _start_session(container, pool, env, effective_timeout, elapsed_ms(acquire_started))
+    except FileNotFoundError as e:
+        pool.release(container)
+        return None, False, error_body(f"docker not found: {e}"), 200
+    return session, stream, None, None
+
+
+async def _run(receive, send) -> None:
+    session, stream, error, status = await _start_run(await _read_json(receive))
+    if session is None:
+        return await _send(send, error, status)
+    try:
+        if stream:
+            return await _send_stream(send, session, session.effective_timeout)
+        event = await _wait_for_control_event(session, session.effective_timeout)
+        body = await _resolve_event(session, event)
+        await _send(send, body, headers=_timings_headers(session))
+    finally:
+        # client 斷線（send 拋錯 / task 被 cancel）：還沒結束、也沒停在 _sessions 等輸入的 session 直接回收
+        if _sessions.get(session.id) is not session:
+            await _finish_session(session, recycle=True)
+
+
+async def _run_batch(receive, send) -> None:
+    data = await _read_json(receive)
+    if not data or "code" not in data:
+        return await _send(send, {"error": "missing field: code"}, 400)
+    try:
+        env, batch_timeout = run_batch_request_env(data)
+        priority, tenant = request_schedule(data, default="probe")
+    except ValueError as e:
+        return await _send(send, {"error": str(e)}, 400)
+
+    pool = await asyncio.to_thread(_get_pool)
+    acquire_started = time.monotonic()
+    try:
+        container = await _acquire(pool, priority, tenant)
+    except PoolExhaustedError:
+        return await _send(send, error_body(POOL_EXHAUSTED_MESSAGE), 503)
+
+    try:
+        session = await _start_session(container, pool, env, batch_timeout, elapsed_ms(acquire_started))
+    except FileNotFoundError as e:
+        pool.release(container)
+        return await _send(send, error_body(f"docker not found: {e}"))
+
+    try:
+        event = await _wait_for_control_event(session, batch_timeout)
+        if event.get("type") == "input_needed":
+            event = {"type": "error", "message": "input_needed"}
+        body = await _resolve_event(session, event)
+        await _send(send, body, headers=_timings_headers(session))
+    finally:
+        # 同 _run：批次不會停下等輸入，中途斷線一律回收（正常結束時已 closed，不會重複歸還）
+        await _finish_session(session, recycle=True)
+
+
+async def _post_input(session_id: str, receive, send) -> None:
+    session = _sessions.get(session_id)
+    if session is None or session.closed:
+        return await _send(send, {"status": "failed", "error": "session not found"}, 404)
+
+    data = await _read_json(receive) or {}
+    value = data.get("value")
+    if not isinstance(value, str):
+        return await _send(send, {"status": "failed", "error": "value must be a string"}, 400)
+
+    try:
+        async with session.lock:
+            session.process.stdin.write((value + "\n").encode("utf-8"))
+            await session.process.stdin.drain()
+            event = await _wait_for_control_event(session, session.effective_timeout)
+    except Exception as e:
+        await _finish_session(session, recycle=True)
+        return await _send(send, {"status": "failed", "error": f"failed to send input: {e}"}, 500)
+
+    body = await _resolve_event(session, event)
+    await _send(send, body, headers=_timings_headers(session))
+
+
+async def _session_alive(session_id: str, send) -> None:
+    session = _sessions.get(session_id)
+    if session is None or session.closed:
+        return await _send(send, {"status": "failed", "alive": False, "error": "session not found"}, 404)
+    alive = session.process.returncode is None
+    await _send(send, {"status": "alive" if alive else "failed", "alive": alive})
+
+
+async def _close_session(session_id: str, send) -> None:
+    session = _sessions.get(session_id)
+    if session is not None:
+        await _finish_session(session, recycle=True)
+    await _send(send, {"status": "closed"})
+
+
+async def _capacity(send) -> None:
+    if _pool is None:
+        return await _send(send, {"initialized": False, "available": MAX_POOL_SIZE, "max_size": MAX_POOL_SIZE})
+    await _send(send, {"initialized": True, **_pool.capacity()})
+
+
+async def _pool_stats(send) -> None:
+    if _pool is None:
+        return await _send(send, {"initialized": False})
+    await _send(send, {"initialized": True, **_pool.stats()})
+
+# ----------------------------------------------------------------------
+# WebSocket 通道
+# ----------------------------------------------------------------------
+
+async def _ws_receive(receive) -> dict | None:
+    """下一則 client 訊息（JSON object）；斷線回 None，格式錯誤回 {}。"""
+    while True:
+        message = await receive()
+        if message["type"] == "websocket.disconnect":
+            return None
+        if message["type"] != "websocket.receive":
+            continue
+        text = message.get("text")
+        if text is None:
+            text = (message.get("bytes") or b"").decode("utf-8", "replace")
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+
+async def _ws_send(send, message: dict) -> None:
+    await send({"type": "websocket.send", "text": json.dumps(message)})
+
+
+async def _ws_wait_input(session: AsyncSandboxSession, receive) -> dict | None:
+    """
+    等 client 的下一則訊息；期間 runner 若先結束（被 kill、crash），把該事件放回
+    queue 並回 {"type": "_runner_event"}，讓呼叫端立刻回報，不必等到使用者輸入。
+    """
+    incoming = asyncio.ensure_future(_ws_receive(receive))
+    runner_event = asyncio.ensure_future(session.events.get())
+    await asyncio.wait({incoming, runner_event}, return_when=asyncio.FIRST_COMPLETED)
+    if runner_event.done():
+        session.events.put_nowait(runner_event.result())
+        if not incoming.done():
+            incoming.cancel()
+            return {"type": "_runner_event"}
+    else:
+        runner_event.cancel()
+    return incoming.result()
+
+
+async def _websocket_run(receive, send) -> None:
+    """
+    /ws/run：一條連線對應一個 session。訊息都是 JSON text frame：
+
+    client → sidecar：{"type": "run", "body": {同 /run}}（第一則）、
+                      {"type": "input", "value": str}、{"type": "close"}
+    sidecar → client：{"type": "trace_batch", "start", "events"}（body.stream 時）、
+                      {"type": "response", "status": int, "body": {同 /run、/input 的回應}}
+
+    response.body 另帶 sandbox_timings（同 HTTP 回應的 X-Sandbox-Timings header）。
+    response.body.status == "input_needed" 時連線保持，等下一則 input；其餘 response
+    之後 sidecar 關閉連線。client 斷線視同 close，session 直接回收。
+    """
+    if (await receive())["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    first = await _ws_receive(receive)
+    if first is None:
+        return
+    data = first.get("body") if first.get("type") == "run" else None
+    if isinstance(data, dict):
+        # 結果直接以 JSON frame 回傳，不走 zlib
+        data = {**data, "compress": False}
+    session, _stream, error, status = await _start_run(data)
+    if session is None:
+        await _ws_send(send, {"type": "response", "status": status, "body": error})
+        return await send({"type": "websocket.close", "code": 1000})
+
+    disconnected = False
+    try:
+        timeout = session.effective_timeout
+        while True:
+            async for event in _iter_session_events(session, timeout):
+                if event.get("type") == "trace_batch":
+                    await _ws_send(send, event)
+                else:
+                    body = _with_timings(session, await _resolve_event(session, event))
+                    await _ws_send(send, {"type": "response", "status": 200, "body": body})
+            if session.closed:
+                break
+
+            while True:
+                message = await _ws_wait_input(session, receive)
+                if message is None:
+                    disconnected = True
+                    return
+                kind = message.get("type")
+                if kind in {"input", "close", "_runner_event"}:
+                    break
+                await _ws_send(send, {
+                    "type": "response",
+                    "status": 400,
+                    "body": {"status": "failed", "error": f"unexpected message: {kind!r}"},
+                })
+            if kind == "close":
+                break
+            if kind == "input":
+                value = message.get("value")
+                if not isinstance(value, str):
+                    await _ws_send(send, {
+                        "type": "response",
+                        "status": 400,
+                        "body": {"status": "failed", "error": "value must be a string"},
+                    })
+                    break
+                session.process.stdin.write((value + "\n").encode("utf-8"))
+                await session.process.stdin.drain()
+            timeout = session.effective_timeout
+    except (ConnectionError, OSError) as e:
+        logger.warning("sidecar session %s: websocket channel failed: %s", session.id, e)
+    finally:
+        await _finish_session(session, recycle=True)
+        if not disconnected:
+            try:
+                await send({"type": "websocket.close", "code": 1000})
+            except (ConnectionError, OSError):
+                pass
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for session in list(_sessions.values()):
+                await _finish_session(session, recycle=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "websocket":
+        if scope["path"].rstrip("/") == "/ws/run":
+            return await _websocket_run(receive, send)
+        return await send({"type": "websocket.close", "code": 1008})
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    parts = scope["path"].strip("/").split("/")
+    if method == "POST" and parts == ["run"]:
+        return await _run(receive, send)
+    if method == "POST" and parts == ["run_batch"]:
+        return await _run_batch(receive, send)
+    if method == "GET" and parts == ["pool", "stats"]:
+        return await _pool_stats(send)
+    if method == "GET" and parts == ["capacity"]:
+        return await _capacity(send)
+    if method == "POST" and len(parts) == 2 and parts[0] == "input":
+        return await _post_input(parts[1], receive, send)
+    if len(parts) == 3 and parts[0] == "session":
+        if method == "GET" and parts[2] == "alive":
+            return await _session_alive(parts[1], send)
+        if method in {"POST", "DELETE"} and parts[2] == "close":
+            return await _close_session(parts[1], send)
+    await _send(send, {"error": "not found"}, 404)
@@ -4,19 +4,91 @@ container_pool.py — Sandbox 長跑容器池
 啟動時預熱 MIN_POOL_SIZE 個 codepulse-sandbox 容器（tail -f /dev/null），
 請求到來時用 docker exec 注入 user code 執行，避免每次 docker run 的冷啟動。
 容器累計重用 MAX_REUSE 次或執行 timeout 後丟棄並背景補回。
+
+docker run 都丟到有上限的 spawn thread pool 並行執行：建構時只等第一個容器就緒
+（ready）就返回，其餘在背景補齊；丟棄的容器交給單一 replenisher thread，
+合併成一次 docker rm -f 並一次補足缺額。
+
+傳入 engine（docker_backend.DockerEngineClient）時容器生命週期改走 Engine API，
+省掉每次 fork docker CLI；未傳則維持 docker CLI。
+
+acquire 有人排隊時依優先級類別（interactive > primary > probe）、同類別內依 tenant 目前佔用的
+容器數（per-tenant fair queuing）決定下一個拿到容器的人；等超過 starvation_bound 的請求不再被插隊。
+
+autoscaler（start_autoscaler）背景依最近的到達率、acquire 等待時間與使用中比例
+預先把容器數拉到 target，閒置過多時等 cooldown 後才逐一縮回（hysteresis，避免上下抖動）。
+
+health checker（start_health_checker）定期以一次 docker ps / Engine API 列表查閒置容器的狀態：
+已退出或被外部移除的（OOM kill、docker rm）在分給請求前就移出 pool 並補回；暫時異常的
+（paused / restarting）記一次失敗，連續 HEALTH_MAX_FAILURES 次才移除，acquire 優先給最近檢查正常的容器。
+傳入 warm_check 時，正常的閒置容器若預熱狀態已失效（例如 zygote 死了）就先借出、重跑 on_spawn 再放回，
+不讓下一個請求付重新預熱的延遲。
+
+reset=True 時 recycle() 的容器（互動 session 結束、timeout、錯誤，可能留有殘留 process）先在
+背景 exec 一次 /sandbox/reset.py（殺掉殘留 process、清空 /tmp），回報的狀態 checksum 與預期的
+乾淨狀態（reset_state_checksum）相符才放回 pool，否則銷毀；不必每次 docker run 新的。
+正常跑完的 release() 不重置：runner 已結束、沙箱 builtins 碰不到檔案系統，直接放回，
+不為每個請求付一次 docker exec。MAX_REUSE 仍保留作為上限（kernel 層的狀態無法在容器內重置）。
 """
 
 from __future__ import annotations
 
+import hashlib
+import itertools
+import json
+import logging
+import math
 import subprocess
 import threading
 import uuid
 import time
+from collections import Counter, deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 
+logger = logging.getLogger(__name__)
+
 POOL_LABEL = "codepulse-pool=1"
 IMAGE_NAME = "codepulse-sandbox"
 SPAWN_RETRIES = 3
+SPAWN_WORKERS = 4                # 同時進行的 docker run 上限
+
+AUTOSCALE_INTERVAL = 1.0         # 秒：autoscaler 檢查週期
+AUTOSCALE_WINDOW = 30.0          # 秒：到達率 / 等待時間的統計視窗
+SCALE_UP_HEADROOM = 2            # target 額外保留的閒置容器數
+SCALE_UP_WAIT_P95 = 0.5          # 秒：視窗內 acquire 等待 p95 超過此值再多補一個
+SCALE_DOWN_BAND = 2              # 超過 target 這麼多個才考慮縮
+SCALE_DOWN_COOLDOWN = 120.0      # 秒：最近一次擴張 / 滿載後多久才開始縮
+DEFAULT_SPAWN_SECONDS = 2.0      # 還沒量到 docker run 耗時前的估計值
+
+# acquire 的優先級類別：數字小的先拿到容器
+PRIORITY_INTERACTIVE = 0         # 使用者正在等輸入 / 互動 session
+PRIORITY_PRIMARY = 1             # 使用者看得到的主 trace
+PRIORITY_PROBE = 2               # 背景 big-O 測量
+PRIORITY_CLASSES = {
+    "interactive": PRIORITY_INTERACTIVE,
+    "primary": PRIORITY_PRIMARY,
+    "probe": PRIORITY_PROBE,
+}
+STARVATION_SECONDS = 2.0         # 排隊超過這麼久就不再被高優先級 / 其他 tenant 插隊
+
+HEALTH_CHECK_SECONDS = 5.0       # 秒：閒置容器的狀態檢查週期
+HEALTH_MAX_FAILURES = 3          # 連續幾次狀態異常（非 running）才移除
+DEAD_STATES = frozenset({"exited", "dead", "removing", "created"})   # 一看到就移除
+
+RESET_CMD = ["python", "/sandbox/reset.py"]
+RESET_TIMEOUT = 5.0              # 秒：reset exec 逾時視為失敗
+RESET_WORKERS = 4                # 同時進行的 reset exec 上限
+# reset 後應存活的 process（cmdline）：PID 1，以及保留預熱時的 zygote（與 docker/reset.py 一致）
+BASE_PROCESSES = ("tail -f /dev/null",)
+ZYGOTE_CMDLINE = "python /sandbox/zygote.py"
+
+
+def reset_state_checksum(processes: list[str] | tuple[str, ...], tmp_entries: list[str] | tuple[str, ...] = ()) -> str:
+    """容器狀態的 checksum；格式必須與 docker/reset.py 的 state_checksum 相同。"""
+    state = {"processes": sorted(processes), "tmp": sorted(tmp_entries)}
+    return hashlib.sha256(json.dumps(state, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
 
 
 class PoolExhaustedError(Exception):
@@ -32,147 +104,669 @@ class PooledContainer:
     id: str
     in_use: bool = False
     reuse_count: int = 0
+    zygote: object | None = None  # 容器內常駐的 zygote 連線（見 zygote_client.py），由 app.py 管理
+    tenant: str | None = None     # 目前使用者（acquire 時設定），fair queuing 依此計算各 tenant 佔用數
+    health_checks: int = 0        # health checker 檢查次數
+    health_failures: int = 0      # 其中狀態不是 running 的次數
+    consecutive_failures: int = 0
+
+    @property
+    def failure_rate(self) -> float:
+        return self.health_failures / self.health_checks if self.health_checks else 0.0
+
+
+@dataclass
+class _Waiter:
+    priority: int
+    tenant: str | None
+    seq: int
+    arrived_at: float
 
 class ContainerPool:
-    def __init__(self, min_size: int, max_size: int, max_reuse: int = 50):
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        max_reuse: int = 50,
+        on_spawn: Callable[[PooledContainer], None] | None = None,
+        spawn_workers: int = SPAWN_WORKERS,
+        engine=None,
+        starvation_bound: float = STARVATION_SECONDS,
+        label: str = POOL_LABEL,
+        warm_check: Callable[[PooledContainer], bool] | None = None,
+        reset: bool = False,
+    ):
         self.min_size = min_size
         self.max_size = max_size
         self.max_reuse = max_reuse
+        # 新容器啟動後呼叫（例如先起 zygote 預熱），失敗不影響容器本身
+        self.on_spawn = on_spawn
+        # docker_backend.DockerEngineClient；None 時走 docker CLI
+        self.engine = engine
+        self.starvation_bound = starvation_bound
+        # 容器 label；同一個 docker daemon 上跑多個 sidecar 時各用各的，互不清掉對方的容器
+        self.label = label
+        # health check 時判斷 on_spawn 的預熱是否仍有效；False 就重跑 on_spawn
+        self.warm_check = warm_check
+        # recycle 時先在容器內重置後重用（見 _reset_container）
+        self.reset = reset
 
         self._lock = threading.Lock()
         self._cond = threading.Condition(self._lock)
         self.containers: list[PooledContainer] = []
 
+        # autoscaler 用的統計（皆在 _lock 內存取）
+        self._clock = time.monotonic
+        self._arrivals: deque[float] = deque()
+        self._waits: deque[tuple[float, float, int]] = deque()   # (時間, 等待秒數, 優先級)
+        self._spawn_seconds = DEFAULT_SPAWN_SECONDS          # docker run 耗時 EWMA
+        self._spawning = 0
+        self._target = min_size
+        self._last_pressure_at = float("-inf")               # 最近一次擴張或滿載
+        self._exhausted_count = 0
+        self._autoscaler: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._health_checker: threading.Thread | None = None
+        self._health_stop = threading.Event()
+        self._health_checks = 0
+        self._health_failures = 0
+        self._health_evicted = 0
+        self._health_rewarmed = 0
+        self._resetting = 0
+        self._resets = 0
+        self._reset_failures = 0
+        self._reset_seconds = 0.0                            # reset exec 耗時 EWMA
+        self._reset_executor = (
+            ThreadPoolExecutor(max_workers=RESET_WORKERS, thread_name_prefix="pool-reset") if reset else None
+        )
+
+        # 並行 spawn 與 replenish
+        self._executor = ThreadPoolExecutor(max_workers=spawn_workers, thread_name_prefix="pool-spawn")
+        self._waiters: list[_Waiter] = []                    # acquire 中尚未拿到容器的請求
+        self._seq = itertools.count()
+        self._last_spawn_error: Exception | None = None
+        self._retired: list[str] = []                        # 待 docker rm 的容器 id
+        self._replenish_wakeup = threading.Event()
+        self._replenisher: threading.Thread | None = None
+        self.ready = threading.Event()                       # 至少有一個容器可用
+
         self._cleanup_zombies()
-        for _ in range(min_size):
-            self.containers.append(self._spawn())
+        with self._cond:
+            if min_size <= 0:
+                self.ready.set()
+            self._spawn_async(min_size)
+            # 等第一個容器起來就返回；全部失敗才拋（與序列版行為一致）
+            self._cond.wait_for(lambda: self.containers or self._spawning == 0)
+            if min_size > 0 and not self.containers:
+                raise RuntimeError(
+                    f"failed to spawn container after {SPAWN_RETRIES} retries: {self._last_spawn_error}"
+                )
 
     def _cleanup_zombies(self) -> None:
         """sidecar 重啟時清掉前一代留下的孤兒容器。"""
-        try:
-            out = subprocess.check_output(
-                ["docker", "ps", "-aq", "--filter", f"label={POOL_LABEL}"],
-                text=True, timeout=10,
-            )
-        except subprocess.SubprocessError:
-            return
-        ids = [line for line in out.strip().splitlines() if line]
+        if self.engine is not None:
+            try:
+                ids = self.engine.list_containers(self.label)
+            except (RuntimeError, OSError):
+                return
+        else:
+            try:
+                out = subprocess.check_output(
+                    ["docker", "ps", "-aq", "--filter", f"label={self.label}"],
+                    text=True, timeout=10,
+                )
+            except subprocess.SubprocessError:
+                return
+            ids = [line for line in out.strip().splitlines() if line]
         if ids:
+            self._remove_containers(ids)
+
+    def _remove_containers(self, ids: list[str]) -> None:
+        """強制移除容器（docker rm -f），失敗忽略。"""
+        if self.engine is not None:
+            for cid in ids:
+                try:
+                    self.engine.remove_container(cid)
+                except (RuntimeError, OSError):
+                    pass
+            return
+        try:
             subprocess.run(["docker", "rm", "-f", *ids], capture_output=True, timeout=15)
+        except subprocess.SubprocessError:
+            pass
+
+    def _run_container(self) -> str:
+        """docker run -d 一個長跑容器，回傳 id。"""
+        name = f"sandbox-{uuid.uuid4().hex[:8]}"
+        if self.engine is not None:
+            label_key, label_value = self.label.split("=", 1)
+            return self.engine.run_container({
+                "Image": IMAGE_NAME,
+                "Entrypoint": ["tail"],
+                "Cmd": ["-f", "/dev/null"],
+                "User": "nobody",
+                "Labels": {label_key: label_value},
+                "HostConfig": {
+                    "NetworkMode": "none",
+                    "ReadonlyRootfs": True,
+                    "Tmpfs": {"/tmp": "rw,exec,size=64m"},
+                    "Memory": 128 * 1024 * 1024,
+                    "NanoCpus": 500_000_000,
+                },
+            }, name)
+        return subprocess.check_output(
+            [
+                "docker", "run", "-d",
+                "--label", self.label,
+                "--network", "none",
+                "--read-only", "--tmpfs", "/tmp:rw,exec,size=64m",
+                "--user", "nobody",
+                "--memory", "128m", "--cpus", "0.5",
+                "--name", name,
+                "--entrypoint", "tail",
+                IMAGE_NAME,
+                "-f", "/dev/null",
+            ],
+            text=True, timeout=15,
+        ).strip()
 
     def _spawn(self) -> PooledContainer:
         """啟動一個新的長跑容器，回傳 PooledContainer。失敗 retry SPAWN_RETRIES 次。"""
         last_err: Exception | None = None
         for _ in range(SPAWN_RETRIES):
+            started = time.monotonic()
             try:
-                cid = subprocess.check_output(
-                    [
-                        "docker", "run", "-d",
-                        "--label", POOL_LABEL,
-                        "--network", "none",
-                        "--read-only", "--tmpfs", "/tmp:rw,exec,size=64m",
-                        "--user", "nobody",
-                        "--memory", "128m", "--cpus", "0.5",
-                        "--name", f"sandbox-{uuid.uuid4().hex[:8]}",
-                        "--entrypoint", "tail",
-                        IMAGE_NAME,
-                        "-f", "/dev/null",
-                    ],
-                    text=True, timeout=15,
-                ).strip()
-                return PooledContainer(id=cid)
+                cid = self._run_container()
+            except (RuntimeError, OSError) as e:
+                # Engine API 錯誤（DockerAPIError 繼承 RuntimeError）或 socket 問題
+                last_err = e
+                continue
             except subprocess.CalledProcessError as e:
                 last_err = e
+                continue
+            self._spawn_seconds = 0.8 * self._spawn_seconds + 0.2 * (time.monotonic() - started)
+            container = PooledContainer(id=cid)
+            if self.on_spawn is not None:
+                try:
+                    self.on_spawn(container)
+                except Exception:
+                    pass
+            return container
         raise RuntimeError(f"failed to spawn container after {SPAWN_RETRIES} retries: {last_err}")
 
-    def acquire(self, timeout: float = 8.0) -> PooledContainer:
-        """取得一個 idle 容器並標記為 in_use。Pool 滿載且超時 → PoolExhaustedError。"""
+    def _spawn_async(self, n: int) -> list[Future]:
+        """
+        （須持有 _lock）送出 n 個背景 spawn，先計入 _spawning 讓 acquire / autoscaler
+        不會重複補；完成後加入 pool 並 notify 等待中的 acquire。
+        """
+        self._spawning += n
+        return [self._executor.submit(self._spawn_into_pool) for _ in range(n)]
+
+    def _spawn_into_pool(self) -> None:
+        try:
+            new_c = self._spawn()
+        except Exception as e:
+            new_c = None
+            err = e
+        with self._cond:
+            self._spawning -= 1
+            if new_c is not None:
+                self.containers.append(new_c)
+                self.ready.set()
+            else:
+                self._last_spawn_error = err
+            self._cond.notify_all()
+
+    def wait_spawns(self, timeout: float | None = None) -> bool:
+        """等所有進行中的 spawn 完成；逾時回 False。"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._spawning == 0, timeout)
+
+    def acquire(
+        self,
+        timeout: float = 8.0,
+        priority: int = PRIORITY_PRIMARY,
+        tenant: str | None = None,
+    ) -> PooledContainer:
+        """
+        取得一個 idle 容器並標記為 in_use。Pool 滿載且超時 → PoolExhaustedError。
+
+        同時有多個請求在等時，空出來的容器給 _next_waiter() 選出的那一個，而不是先醒的 thread。
+        """
         with self._cond:
-            deadline = None
-            while True:
-                for c in self.containers:
-                    if not c.in_use:
-                        c.in_use = True
-                        return c
-
-                if len(self.containers) < self.max_size:
-                    # Release lock before slow docker run (up to 15s) so other threads can proceed.
-                    self._cond.release()
-                    try:
-                        new_c = self._spawn()
-                    except Exception:
-                        new_c = None
-                    finally:
-                        self._cond.acquire()
-                    if new_c is not None:
-                        if len(self.containers) < self.max_size:
-                            new_c.in_use = True
-                            self.containers.append(new_c)
-                            return new_c
-                        else:
-                            subprocess.run(["docker", "rm", "-f", new_c.id], capture_output=True)
-                    # Spawn failed or pool filled while lock was released — fall through to wait/timeout path
-
-                if deadline is None:
-                    deadline = time.monotonic() + timeout
-
-                remaining = deadline - time.monotonic()
-                if remaining <= 0 or not self._cond.wait(timeout=remaining):
-                    raise PoolExhaustedError(
-                        f"pool exhausted: all {self.max_size} containers busy, waited {timeout}s"
+            started = self._clock()
+            self._trim_stats(started)
+            self._arrivals.append(started)
+            deadline = time.monotonic() + timeout
+            waiter = _Waiter(priority, tenant, next(self._seq), started)
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    # 同樣閒置時先給最近一次檢查正常的（min 取第一個最小值，正常情況仍是原本的順序）
+                    idle = min(
+                        (c for c in self.containers if not c.in_use),
+                        key=lambda c: c.consecutive_failures,
+                        default=None,
                     )
+                    if idle is not None:
+                        if self._next_waiter() is waiter:
+                            idle.in_use = True
+                            idle.tenant = tenant
+                            self._waits.append((started, self._clock() - started, priority))
+                            return idle
+                        # 輪到的人可能在上次 notify 之後才變成隊首（例如剛過 starvation_bound），叫醒它
+                        self._cond.notify_all()
+
+                    # 進行中的 spawn 與 reset 不夠分給所有等待者才再補；兩者完成都會 notify
+                    if (
+                        self._spawning + self._resetting < len(self._waiters)
+                        and len(self.containers) + self._spawning < self.max_size
+                    ):
+                        self._spawn_async(1)
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(timeout=remaining):
+                        if any(not c.in_use for c in self.containers) and self._next_waiter() is waiter:
+                            continue
+                        now = self._clock()
+                        self._waits.append((started, now - started, priority))
+                        self._exhausted_count += 1
+                        self._last_pressure_at = now
+                        raise PoolExhaustedError(
+                            f"pool exhausted: all {self.max_size} containers busy, waited {timeout}s"
+                        )
+            finally:
+                self._waiters.remove(waiter)
+                if self._waiters:
+                    # 隊首換人了：讓其餘等待者重新判斷
+                    self._cond.notify_all()
+
+    def _next_waiter(self) -> _Waiter | None:
+        """
+        （須持有 _lock）下一個該拿到容器的等待者，依序比較：
+        1. 已等超過 starvation_bound 的優先（彼此 FIFO）：低優先級最多被插隊這麼久
+        2. 優先級類別（PRIORITY_INTERACTIVE < PRIORITY_PRIMARY < PRIORITY_PROBE）
+        3. 同類別內目前佔用容器最少的 tenant：同一個使用者的多個 probe 不會擠掉別人的
+        4. 先到先拿
+        """
+        if not self._waiters:
+            return None
+        now = self._clock()
+        held = Counter(c.tenant for c in self.containers if c.in_use)
+
+        def rank(w: _Waiter) -> tuple:
+            if now - w.arrived_at >= self.starvation_bound:
+                return (0, 0, 0, w.seq)
+            return (1, w.priority, held[w.tenant], w.seq)
+
+        return min(self._waiters, key=rank)
 
     def release(self, container: PooledContainer) -> None:
-        """歸還容器；reuse 達上限就改走銷毀流程。"""
+        """歸還正常跑完的容器，直接放回；reuse 達上限就改走銷毀流程。"""
+        self._return(container, reset=False)
+
+    def recycle(self, container: PooledContainer) -> None:
+        """
+        狀態不乾淨的容器（互動 session 結束、timeout 後可能有殘留 process）：
+        有 reset 就在背景重置後放回（完成前仍算使用中），否則與 mark_destroyed 相同。
+        """
+        if self.reset:
+            self._return(container, reset=True)
+        else:
+            self.mark_destroyed(container)
+
+    def _return(self, container: PooledContainer, *, reset: bool) -> None:
         with self._cond:
             container.reuse_count += 1
             if container.reuse_count >= self.max_reuse:
                 if container in self.containers:
                     self.containers.remove(container)
-                self._cond.notify_all()
-                should_destroy = True
+                self._retire(container.id)
+            elif reset:
+                self._resetting += 1
+                self._reset_executor.submit(self._reset_and_return, container)
             else:
                 container.in_use = False
-                self._cond.notify_all()
-                should_destroy = False
+                container.tenant = None
+            self._cond.notify_all()
 
-        if should_destroy:
-            threading.Thread(
-                target=self._destroy_and_replenish,
-                args=(container.id,),
-                daemon=True,
-            ).start()
+    def _reset_and_return(self, container: PooledContainer) -> None:
+        started = time.monotonic()
+        try:
+            clean = self._reset_container(container)
+        except Exception:
+            clean = False
+        with self._cond:
+            self._resetting -= 1
+            self._resets += 1
+            self._reset_seconds = 0.8 * self._reset_seconds + 0.2 * (time.monotonic() - started)
+            if clean:
+                container.in_use = False
+                container.tenant = None
+            else:
+                self._reset_failures += 1
+                if container in self.containers:
+                    self.containers.remove(container)
+                self._retire(container.id)
+            self._cond.notify_all()
+
+    def _reset_container(self, container: PooledContainer) -> bool:
+        """
+        容器內 exec reset.py，回報的 checksum 等於預期的乾淨狀態才算成功。
+        預熱（warm_check）仍有效時保留 zygote，否則一併清掉，之後由 health checker / 下一次 submit 重新預熱。
+        """
+        keep_zygote = self.warm_check is not None and self._warm(container)
+        cmd = RESET_CMD + (["--keep-zygote"] if keep_zygote else [])
+        expected = reset_state_checksum(BASE_PROCESSES + ((ZYGOTE_CMDLINE,) if keep_zygote else ()))
+        if self.engine is not None:
+            proc = self.engine.exec(container.id, cmd)
+            try:
+                returncode = proc.wait(RESET_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                return False
+            lines = []
+            while (line := proc.stdout.readline()) != "":
+                lines.append(line)
+            output = "".join(lines)
+        else:
+            try:
+                done = subprocess.run(
+                    ["docker", "exec", container.id, *cmd],
+                    capture_output=True, text=True, timeout=RESET_TIMEOUT,
+                )
+            except (subprocess.SubprocessError, OSError):
+                return False
+            returncode, output = done.returncode, done.stdout
+        if returncode != 0:
+            return False
+        try:
+            report = json.loads(output.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return False
+        return isinstance(report, dict) and report.get("checksum") == expected
+
+    def _warm(self, container: PooledContainer) -> bool:
+        try:
+            return bool(self.warm_check(container))
+        except Exception:
+            return False
 
     def mark_destroyed(self, container: PooledContainer) -> None:
         """容器死亡（timeout / OOM / 外部移除）→ 立刻從 pool 移除，不算 reuse。"""
         with self._cond:
             if container in self.containers:
                 self.containers.remove(container)
+            self._retire(container.id)
             self._cond.notify_all()
-        threading.Thread(
-            target=self._destroy_and_replenish,
-            args=(container.id,),
-            daemon=True,
-        ).start()
-
-    def _destroy_and_replenish(self, container_id: str) -> None:
-        """背景 thread：強制移除舊容器，並補新容器到 min_size。"""
+
+    def _retire(self, container_id: str) -> None:
+        """（須持有 _lock）排入待銷毀清單並喚醒 replenisher（只有一個 thread）。"""
+        self._retired.append(container_id)
+        if self._replenisher is None:
+            self._replenisher = threading.Thread(target=self._replenish_loop, daemon=True)
+            self._replenisher.start()
+        self._replenish_wakeup.set()
+
+    def _replenish_loop(self) -> None:
+        """背景 thread：累積的舊容器一次 docker rm -f，並行補新容器到 min_size。"""
+        while True:
+            self._replenish_wakeup.wait()
+            self._replenish_wakeup.clear()
+            # thread 不能死：_replenisher 不會被清掉，死了之後就再也不補容器
+            try:
+                with self._cond:
+                    ids, self._retired = self._retired, []
+                    need = max(0, self.min_size - len(self.containers) - self._spawning)
+                    futures = self._spawn_async(need)
+                if ids:
+                    self._remove_containers(ids)
+                wait(futures)
+            except Exception:
+                logger.exception("pool replenish round failed")
+
+    # ------------------------------------------------------------------
+    # health checker
+    # ------------------------------------------------------------------
+
+    def start_health_checker(self, interval: float = HEALTH_CHECK_SECONDS) -> None:
+        """啟動背景 health check thread（重複呼叫無作用）。"""
+        if self._health_checker is not None:
+            return
+
+        def loop():
+            while not self._health_stop.wait(interval):
+                try:
+                    self._health_tick()
+                except Exception:
+                    logger.exception("pool health check failed")
+
+        self._health_checker = threading.Thread(target=loop, daemon=True)
+        self._health_checker.start()
+
+    def stop_health_checker(self) -> None:
+        self._health_stop.set()
+
+    def _container_states(self) -> dict[str, str] | None:
+        """pool label 下所有容器的 id → State；docker 不可用時回 None（這一輪不判斷）。"""
+        if self.engine is not None:
+            try:
+                return self.engine.container_states(self.label)
+            except (RuntimeError, OSError):
+                return None
         try:
-            subprocess.run(
-                ["docker", "rm", "-f", container_id],
-                capture_output=True, timeout=15,
+            out = subprocess.check_output(
+                ["docker", "ps", "-a", "--no-trunc", "--filter", f"label={self.label}",
+                 "--format", "{{.ID}} {{.State}}"],
+                text=True, timeout=10,
             )
-        except subprocess.SubprocessError:
-            pass
+        except (subprocess.SubprocessError, OSError):
+            return None
+        states = {}
+        for line in out.strip().splitlines():
+            cid, _, state = line.partition(" ")
+            if cid:
+                states[cid] = state.strip()
+        return states
 
+    def _health_tick(self) -> int:
+        """
+        檢查一輪閒置容器，回傳移除數。使用中的容器不管（exec 失敗時由呼叫端 mark_destroyed）；
+        列表裡找不到的視為已被移除。
+        """
         with self._cond:
-            need = max(0, self.min_size - len(self.containers))
-        for _ in range(need):
+            idle = [c for c in self.containers if not c.in_use]
+        if not idle:
+            return 0
+        states = self._container_states()
+        if states is None:
+            return 0
+
+        evicted = 0
+        rewarm: list[PooledContainer] = []
+        with self._cond:
+            for container in idle:
+                if container.in_use or container not in self.containers:
+                    continue   # 查詢期間被借走或已移除
+                state = states.get(container.id, "missing")
+                container.health_checks += 1
+                self._health_checks += 1
+                if state == "running":
+                    container.consecutive_failures = 0
+                    if self._needs_rewarm(container):
+                        # 先借出（in_use），重新預熱期間不會被分給請求
+                        container.in_use = True
+                        rewarm.append(container)
+                    continue
+                container.health_failures += 1
+                container.consecutive_failures += 1
+                self._health_failures += 1
+                if state in DEAD_STATES or state == "missing" or container.consecutive_failures >= HEALTH_MAX_FAILURES:
+                    self.containers.remove(container)
+                    self._retire(container.id)
+                    evicted += 1
+            if evicted:
+                self._health_evicted += evicted
+                self._cond.notify_all()
+
+        for container in rewarm:
             try:
-                new_c = self._spawn()
-            except RuntimeError:
-                break
+                self.on_spawn(container)
+            except Exception:
+                pass
+        if rewarm:
             with self._cond:
-                if len(self.containers) < self.min_size:
-                    self.containers.append(new_c)
-                    self._cond.notify_all()
+                for container in rewarm:
+                    container.in_use = False
+                self._health_rewarmed += len(rewarm)
+                self._cond.notify_all()
+        return evicted
+
+    def _needs_rewarm(self, container: PooledContainer) -> bool:
+        if self.warm_check is None or self.on_spawn is None:
+            return False
+        return not self._warm(container)
+
+    # ------------------------------------------------------------------
+    # autoscaler
+    # ------------------------------------------------------------------
+
+    def start_autoscaler(self, interval: float = AUTOSCALE_INTERVAL) -> None:
+        """啟動背景 autoscaler thread（重複呼叫無作用）。"""
+        if self._autoscaler is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self._autoscale_tick()
+                except Exception:
+                    pass
+
+        self._autoscaler = threading.Thread(target=loop, daemon=True)
+        self._autoscaler.start()
+
+    def stop_autoscaler(self) -> None:
+        self._stop.set()
+
+    def _trim_stats(self, now: float) -> None:
+        cutoff = now - AUTOSCALE_WINDOW
+        while self._arrivals and self._arrivals[0] < cutoff:
+            self._arrivals.popleft()
+        while self._waits and self._waits[0][0] < cutoff:
+            self._waits.popleft()
+
+    def _wait_percentile(self, q: float) -> float:
+        if not self._waits:
+            return 0.0
+        ordered = sorted(w for _, w, _ in self._waits)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _class_wait_percentile(self, priority: int, q: float) -> float:
+        ordered = sorted(w for _, w, p in self._waits if p == priority)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _compute_target(self) -> int:
+        """
+        預期需求 = 使用中 + 下一批容器 spawn 完成前會到達的請求數 + headroom；
+        最近等待 p95 偏高再多補一個。結果夾在 [min_size, max_size]。
+        """
+        in_use = sum(1 for c in self.containers if c.in_use)
+        arrival_rate = len(self._arrivals) / AUTOSCALE_WINDOW
+        expected = in_use + math.ceil(arrival_rate * self._spawn_seconds) + SCALE_UP_HEADROOM
+        if self._wait_percentile(0.95) > SCALE_UP_WAIT_P95:
+            expected += 1
+        return max(self.min_size, min(self.max_size, expected))
+
+    def _autoscale_tick(self) -> None:
+        """擴張：目前 + spawn 中 < target 時並行補滿（等本批完成才返回）；縮減：超出 band 且過了 cooldown，一次移除一個閒置容器。"""
+        with self._cond:
+            now = self._clock()
+            self._trim_stats(now)
+            target = self._compute_target()
+            self._target = target
+            current = len(self.containers) + self._spawning
+            to_spawn = max(0, min(target, self.max_size) - current)
+            futures = self._spawn_async(to_spawn)
+            if to_spawn:
+                self._last_pressure_at = now
+
+            victim = None
+            if (
+                not to_spawn
+                and len(self.containers) - target >= SCALE_DOWN_BAND
+                and len(self.containers) > self.min_size
+                and now - self._last_pressure_at >= SCALE_DOWN_COOLDOWN
+            ):
+                victim = next((c for c in reversed(self.containers) if not c.in_use), None)
+                if victim is not None:
+                    self.containers.remove(victim)
+
+        if victim is not None:
+            self._remove_containers([victim.id])
+
+        wait(futures)
+
+    def capacity(self) -> dict:
+        """
+        /capacity 用的精簡版 stats（不整理統計視窗）：available = max_size 扣掉使用中與排隊中的請求，
+        即現在送一個 /run 進來不必排隊就能拿到（或馬上 spawn 出）容器的名額。
+        """
+        with self._cond:
+            in_use = sum(1 for c in self.containers if c.in_use)
+            waiting = len(self._waiters)
+            return {
+                "available": max(0, self.max_size - in_use - waiting),
+                "idle": len(self.containers) - in_use,
+                "in_use": in_use,
+                "spawning": self._spawning,
+                "waiting": waiting,
+                "max_size": self.max_size,
+            }
+
+    def stats(self) -> dict:
+        """目前 pool 狀態與 autoscaler 統計（/pool/stats 用）。"""
+        with self._cond:
+            now = self._clock()
+            self._trim_stats(now)
+            in_use = sum(1 for c in self.containers if c.in_use)
+            size = len(self.containers)
+            return {
+                "size": size,
+                "in_use": in_use,
+                "idle": size - in_use,
+                "spawning": self._spawning,
+                "ready": self.ready.is_set(),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "target": self._target,
+                "in_use_ratio": in_use / size if size else 0.0,
+                "arrival_rate": len(self._arrivals) / AUTOSCALE_WINDOW,
+                "wait_p50": self._wait_percentile(0.5),
+                "wait_p95": self._wait_percentile(0.95),
+                "spawn_seconds": self._spawn_seconds,
+                "exhausted_total": self._exhausted_count,
+                "waiting": len(self._waiters),
+                "waiting_by_priority": {
+                    name: sum(1 for w in self._waiters if w.priority == level)
+                    for name, level in PRIORITY_CLASSES.items()
+                },
+                "wait_p95_by_priority": {
+                    name: self._class_wait_percentile(level, 0.95)
+                    for name, level in PRIORITY_CLASSES.items()
+                },
+                "health_checks": self._health_checks,
+                "health_failures": self._health_failures,
+                "health_evicted": self._health_evicted,
+                "health_rewarmed": self._health_rewarmed,
+                "resetting": self._resetting,
+                "resets": self._resets,
+                "reset_failures": self._reset_failures,
+                "reset_seconds": self._reset_seconds,
+                # 曾檢查異常、仍留在 pool 的容器（暫時性狀態，尚未達移除門檻）
+                "unhealthy_containers": {
+                    c.id[:12]: round(c.failure_rate, 3) for c in self.containers if c.health_failures
+                },
+            }
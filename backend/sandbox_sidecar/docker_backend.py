@@ -0,0 +1,368 @@
+"""
+docker_backend.py — 直接走 Docker Engine API（/var/run/docker.sock）的 client
+
+container_pool.py / app.py 原本每個操作都 fork 一次 docker CLI（Go runtime 冷啟動，
+每次數十 ms）。DockerEngineClient 以 HTTP over unix socket 直接呼叫 Engine API：
+- 一般請求（create / start / rm / ps / exec create）每個 thread 共用一條持久連線
+- exec start 走 hijacked stream（Upgrade: tcp），用獨立 socket，回傳與 subprocess.Popen
+  介面相容的 EngineExec（stdin / stdout / stderr / poll / wait / kill），app.py 不必分辨
+
+engine_from_env() 依 DOCKER_BACKEND（auto / api / cli）決定是否使用；
+socket 不存在或 ping 失敗時回 None，呼叫端退回 docker CLI。
+"""
+
+from __future__ import annotations
+
+import codecs
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import subprocess
+import threading
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+DOCKER_API_VERSION = "v1.41"
+API_TIMEOUT = 15.0               # 秒：一般 API 請求
+_STREAM_STDOUT = 1
+_STREAM_STDERR = 2
+
+
+class DockerAPIError(RuntimeError):
+    """Engine API 回傳 4xx / 5xx。"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"docker api {status}: {message}")
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = API_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class _LineStream:
+    """行佇列，readline() 行為同文字檔：串流結束後回 ""。"""
+
+    def __init__(self):
+        self._lines: queue.SimpleQueue = queue.SimpleQueue()
+
+    def put(self, line: str) -> None:
+        self._lines.put(line)
+
+    def close(self) -> None:
+        self._lines.put("")
+
+    def readline(self) -> str:
+        line = self._lines.get()
+        if line == "":
+            self._lines.put("")
+        return line
+
+
+class _SocketWriter:
+    """EngineExec.stdin：文字寫入 hijacked socket；close() 半關閉讓容器內讀到 EOF。"""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+
+    def write(self, text: str) -> int:
+        self._sock.sendall(text.encode("utf-8"))
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class EngineExec:
+    """
+    一次 exec 的 Popen 相容包裝。背景 thread 解多工 Engine 的 stream frame
+    （8 bytes header：stream type + 3 bytes 0 + uint32 big-endian 長度），
+    依 stdout / stderr 切行；串流結束後向 API 查 ExitCode。
+    """
+
+    pid = None  # 沒有本機 process；ZygoteProcess.kill 據此略過 killpg
+
+    def __init__(self, client: DockerEngineClient, exec_id: str, sock: socket.socket, initial: bytes = b""):
+        self._client = client
+        self.exec_id = exec_id
+        self._sock = sock
+        self.stdin = _SocketWriter(sock)
+        self.stdout = _LineStream()
+        self.stderr = _LineStream()
+        self.returncode: int | None = None
+        self._killed = False
+        self._done = threading.Event()
+        threading.Thread(target=self._demux, args=(initial,), daemon=True).start()
+
+    def _demux(self, buf: bytes) -> None:
+        decoders = {
+            _STREAM_STDOUT: codecs.getincrementaldecoder("utf-8")("replace"),
+            _STREAM_STDERR: codecs.getincrementaldecoder("utf-8")("replace"),
+        }
+        partial = {_STREAM_STDOUT: "", _STREAM_STDERR: ""}
+        targets = {_STREAM_STDOUT: self.stdout, _STREAM_STDERR: self.stderr}
+
+        def feed(stream: int, data: bytes, final: bool = False) -> None:
+            text = partial[stream] + decoders[stream].decode(data, final)
+            *lines, partial[stream] = text.split("\n")
+            for line in lines:
+                targets[stream].put(line + "\n")
+
+        self._sock.settimeout(None)
+        try:
+            while True:
+                while len(buf) >= 8:
+                    stream, size = buf[0], struct.unpack(">I", buf[4:8])[0]
+                    if len(buf) < 8 + size:
+                        break
+                    if stream in targets:
+                        feed(stream, buf[8:8 + size])
+                    buf = buf[8 + size:]
+                chunk = self._sock.recv(65536)
+                if not chunk:
+                    break
+                buf += chunk
+        except OSError:
+            pass
+        for stream, target in targets.items():
+            feed(stream, b"", final=True)
+            if partial[stream]:
+                target.put(partial[stream])
+
+        returncode = -9
+        if not self._killed:
+            try:
+                code = self._client.exec_exit_code(self.exec_id)
+                returncode = code if code is not None else -9
+            except (OSError, DockerAPIError, http.client.HTTPException):
+                pass
+        self.returncode = returncode
+        self.stdout.close()
+        self.stderr.close()
+        self._done.set()
+        self._close_socket()
+
+    def _close_socket(self) -> None:
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired("docker exec", timeout)
+        return self.returncode
+
+    def kill(self) -> None:
+        """
+        斷開 attach 連線。Engine API 無法對 exec 送 signal，容器內殘留的 process
+        與 docker CLI 模式相同，由 caller 重置（ContainerPool.recycle）或回收容器處理。
+        """
+        if self._done.is_set():
+            return
+        self._killed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class DockerEngineClient:
+    def __init__(self, socket_path: str = DOCKER_SOCKET, timeout: float = API_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()  # http.client 連線非 thread-safe：每個 thread 一條
+
+    def _path(self, path: str, params: dict | None = None) -> str:
+        url = f"/{DOCKER_API_VERSION}{path}"
+        if params:
+            url += "?" + urlencode(params)
+        return url
+
+    def _connection(self) -> _UnixHTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _UnixHTTPConnection(self.socket_path, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method: str, path: str, body: dict | None = None, params: dict | None = None):
+        """
+        送出請求並回傳解析後的 JSON（無 body 回 None）；持久連線斷掉時重連一次。
+        任何 I/O 錯誤（含 timeout）都丟棄這條連線，否則 http.client 停在 Request-sent 狀態，
+        同 thread 之後每次呼叫都是 CannotSendRequest。HTTPException 轉成 ConnectionError，
+        呼叫端照常以 OSError 處理。
+        """
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, self._path(path, params), body=payload, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (OSError, http.client.HTTPException) as exc:
+                conn.close()
+                self._local.conn = None
+                reconnect = isinstance(exc, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))
+                if reconnect and not attempt:
+                    continue
+                if isinstance(exc, OSError):
+                    raise
+                raise ConnectionError(f"docker api connection error: {exc!r}") from exc
+        if resp.status >= 400:
+            try:
+                message = json.loads(data).get("message", "")
+            except (ValueError, AttributeError):
+                message = data.decode("utf-8", "replace")
+            raise DockerAPIError(resp.status, message)
+        if not data:
+            return None
+        return json.loads(data)
+
+    def ping(self) -> bool:
+        if not os.path.exists(self.socket_path):
+            return False
+        conn = self._connection()
+        try:
+            conn.request("GET", "/_ping")
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            return False
+
+    # ------------------------------------------------------------------
+    # container lifecycle
+    # ------------------------------------------------------------------
+
+    def list_containers(self, label: str) -> list[str]:
+        """含已停止的容器（同 docker ps -aq --filter label=...）。"""
+        items = self._request(
+            "GET", "/containers/json",
+            params={"all": "1", "filters": json.dumps({"label": [label]})},
+        )
+        return [item["Id"] for item in items or []]
+
+    def container_states(self, label: str) -> dict[str, str]:
+        """label 下所有容器的 id → State（running / exited / paused…），一次 API 呼叫（pool health check 用）。"""
+        items = self._request(
+            "GET", "/containers/json",
+            params={"all": "1", "filters": json.dumps({"label": [label]})},
+        )
+        return {item["Id"]: item.get("State", "") for item in items or []}
+
+    def run_container(self, config: dict, name: str) -> str:
+        """create + start（同 docker run -d），回傳容器 id。"""
+        created = self._request("POST", "/containers/create", body=config, params={"name": name})
+        container_id = created["Id"]
+        self._request("POST", f"/containers/{quote(container_id)}/start")
+        return container_id
+
+    def remove_container(self, container_id: str) -> None:
+        """同 docker rm -f；容器已不存在視為成功。"""
+        try:
+            self._request("DELETE", f"/containers/{quote(container_id)}", params={"force": "1"})
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+
+    # ------------------------------------------------------------------
+    # exec
+    # ------------------------------------------------------------------
+
+    def exec(self, container_id: str, cmd: list[str], env: dict[str, str] | None = None) -> EngineExec:
+        """同 docker exec -i：建立 exec、hijack attach，回傳 Popen 相容的 EngineExec。"""
+        created = self._request("POST", f"/containers/{quote(container_id)}/exec", body={
+            "AttachStdin": True,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "Cmd": cmd,
+            "Env": [f"{k}={v}" for k, v in (env or {}).items()],
+        })
+        exec_id = created["Id"]
+        sock, initial = self._hijack(f"/exec/{quote(exec_id)}/start", {"Detach": False, "Tty": False})
+        return EngineExec(self, exec_id, sock, initial)
+
+    def exec_exit_code(self, exec_id: str) -> int | None:
+        info = self._request("GET", f"/exec/{quote(exec_id)}/json")
+        return info.get("ExitCode") if info else None
+
+    def _hijack(self, path: str, body: dict) -> tuple[socket.socket, bytes]:
+        """送出 Upgrade: tcp 請求，讀完 response header 後把 socket 交給呼叫端當原始串流。"""
+        payload = json.dumps(body).encode("utf-8")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(
+                (
+                    f"POST {self._path(path)} HTTP/1.1\r\n"
+                    "Host: localhost\r\n"
+                    "Content-Type: application/json\r\n"
+                    "Connection: Upgrade\r\n"
+                    "Upgrade: tcp\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n"
+                ).encode("ascii") + payload
+            )
+            buf = b""
+            while b"\r\n\r\n" not in buf:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("docker closed connection during exec attach")
+                buf += chunk
+            head, rest = buf.split(b"\r\n\r\n", 1)
+            status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            try:
+                status = int(status_line.split()[1])
+            except (IndexError, ValueError):
+                raise ConnectionError(f"invalid attach response: {status_line!r}") from None
+            if status not in (101, 200):
+                raise DockerAPIError(status, rest.decode("utf-8", "replace").strip())
+        except BaseException:
+            sock.close()
+            raise
+        return sock, rest
+
+
+def engine_from_env() -> DockerEngineClient | None:
+    """
+    DOCKER_BACKEND=cli → None（一律 docker CLI）；api / auto → socket 可用時回 client。
+    api 模式下不可用會記 warning，仍退回 CLI 而不讓 sidecar 起不來。
+    """
+    mode = os.environ.get("DOCKER_BACKEND", "auto")
+    if mode == "cli":
+        return None
+    client = DockerEngineClient(os.environ.get("DOCKER_SOCKET", DOCKER_SOCKET))
+    if client.ping():
+        return client
+    if mode == "api":
+        logger.warning("docker engine api unavailable at %s, falling back to docker cli", client.socket_path)
+    return None
@@ -0,0 +1,216 @@
+"""
+sandbox_sidecar/sidecar_protocol.py — Flask（app.py）與 ASGI（asgi_app.py）兩種 sidecar 共用的部分
+
+不依賴任何 web framework：設定、runner 事件協定常數、request body → runner env 的解析，
+以及 runner control event → 回應 body 的對應。
+"""
+
+import base64
+import binascii
+import json
+import os
+import time
+import zlib
+
+from container_pool import HEALTH_CHECK_SECONDS, POOL_LABEL, PRIORITY_CLASSES, STARVATION_SECONDS
+
+CONTAINER_TIMEOUT = int(os.environ.get("CONTAINER_TIMEOUT", "10"))
+ACQUIRE_TIMEOUT = float(os.environ.get("ACQUIRE_TIMEOUT", "8"))
+MIN_POOL_SIZE = int(os.environ.get("MIN_POOL_SIZE", "10"))
+MAX_POOL_SIZE = int(os.environ.get("MAX_POOL_SIZE", "30"))
+MAX_REUSE = int(os.environ.get("MAX_REUSE", "50"))
+# 背景 autoscaler：依負載預先擴張 / 閒置時縮回（見 ContainerPool.start_autoscaler）
+AUTOSCALE_ENABLED = os.environ.get("POOL_AUTOSCALE", "1") == "1"
+# 背景檢查閒置容器狀態，死掉的在分出去之前移除（見 ContainerPool.start_health_checker）
+HEALTH_CHECK_ENABLED = os.environ.get("POOL_HEALTH_CHECK", "1") == "1"
+HEALTH_CHECK_INTERVAL = float(os.environ.get("POOL_HEALTH_INTERVAL", str(HEALTH_CHECK_SECONDS)))
+# recycle 的容器（互動 session、timeout、runner 異常結束）先在容器內重置（殺殘留 process、清 /tmp）再重用（見 ContainerPool.recycle）
+RESET_ENABLED = os.environ.get("POOL_RESET", "1") == "1"
+# acquire 排隊時低優先級請求最多被插隊的秒數（見 ContainerPool._next_waiter）
+STARVATION_BOUND = float(os.environ.get("POOL_STARVATION_SECONDS", str(STARVATION_SECONDS)))
+# 同一台 host 跑多個 sidecar（多節點）時各設不同的 SIDECAR_NODE_ID，容器 label 與孤兒清理才不互相干擾
+NODE_POOL_LABEL = f"codepulse-pool={os.environ['SIDECAR_NODE_ID']}" if os.environ.get("SIDECAR_NODE_ID") else POOL_LABEL
+
+EVENT_PREFIX = "__CODEPULSE_EVENT__"
+# /run 帶 compress=true 時，runner 回傳 zlib 壓縮的 JSON；sidecar 原封不動以此 mimetype 轉出
+COMPRESSED_RESULT_MIMETYPE = "application/vnd.codepulse.result+zlib"
+# /run 帶 stream=true 時回 NDJSON：trace_batch 逐行送出，最後一行是完整回應
+# （同時帶 compress=true 時最後一行是 {"type": "result_z", "payload_z": base64(zlib JSON)}）
+STREAM_MIMETYPE = "application/x-ndjson"
+POOL_EXHAUSTED_MESSAGE = "pool_exhausted: 伺服器繁忙，請稍後再試"
+# /run、/run_batch 回應的 sidecar 端計時（JSON，見 run_timings）。壓縮結果的 body 不能改，
+# 所以一律放 header；串流的最後一行與 WebSocket 的 response 則放在 body 的 sandbox_timings
+TIMINGS_HEADER = "X-Sandbox-Timings"
+
+
+def error_body(message: str, *, lineno: int | None = None) -> dict:
+    body = {
+        "error": message,
+        "is_truncated": False,
+        "trace": [],
+        "call_graph": None,
+        "cfg_graph": {},
+    }
+    if lineno is not None:
+        body["lineno"] = lineno
+    return body
+
+
+def elapsed_ms(since: float) -> float:
+    return round((time.monotonic() - since) * 1000, 3)
+
+
+def run_timings(acquire_ms: float, exec_start_ms: float, exec_started_at: float) -> dict:
+    """
+    一次 /run 在 sidecar 端的時間分解（毫秒）：acquire_ms = 等 pool 給容器，
+    exec_start_ms = 啟動 runner（zygote fork / docker exec），run_ms = 啟動後到這個回應為止。
+    runner 自己量的 CPU / 序列化 / throttle 在結果的 usage 欄位。
+    """
+    return {
+        "acquire_ms": acquire_ms,
+        "exec_start_ms": exec_start_ms,
+        "run_ms": elapsed_ms(exec_started_at),
+    }
+
+
+def request_schedule(data: dict, default: str = "primary") -> tuple[int, str | None]:
+    """
+    body 的 priority（"interactive" / "primary" / "probe"，沒帶用 default）與 tenant
+    → ContainerPool.acquire 的 (priority, tenant)；不合法拋 ValueError（回 400）。
+    """
+    name = data.get("priority") or default
+    if name not in PRIORITY_CLASSES:
+        raise ValueError(f"priority must be one of {sorted(PRIORITY_CLASSES)}")
+    tenant = data.get("tenant")
+    if tenant is not None and not isinstance(tenant, str):
+        raise ValueError("tenant must be a string")
+    return PRIORITY_CLASSES[name], tenant
+
+
+def run_request_env(data: dict) -> tuple[dict[str, str], float, bool]:
+    """/run 的 body → (runner env, timeout, 是否串流)；參數不合法拋 ValueError（回 400）。"""
+    code = data["code"]
+    n = data.get("n")
+    per_n_timeout = data.get("per_n_timeout")
+
+    stdin_inputs = data.get("stdin_inputs", [])
+    if not isinstance(stdin_inputs, list) or not all(isinstance(v, str) for v in stdin_inputs):
+        raise ValueError("stdin_inputs must be list[str]")
+
+    runnable = code if n is None else code + f"\nexplore_wrapper({n})"
+    encoded = base64.b64encode(runnable.encode("utf-8")).decode("ascii")
+    # stdin 比照 CODE 用 base64 編碼，避開 shell/env 跳脫問題；runner.py 會解碼 STDIN_INPUTS。
+    stdin_encoded = base64.b64encode(json.dumps(stdin_inputs).encode("utf-8")).decode("ascii")
+    effective_timeout = per_n_timeout if per_n_timeout is not None else CONTAINER_TIMEOUT
+
+    env = {"CODE": encoded, "STDIN_INPUTS": stdin_encoded}
+    if data.get("count_only"):
+        # 只要步數（big-O / 統計用）：runner 走 run_count_trace，不回傳 trace / cfg_graph
+        env["COUNT_ONLY"] = "1"
+    capture = data.get("capture")
+    if capture is not None:
+        # 細部驗證在 runner（tracer.parse_capture），這裡只擋掉型別不對的
+        if not isinstance(capture, dict):
+            raise ValueError("capture must be an object")
+        env["TRACE_CAPTURE"] = json.dumps(capture, separators=(",", ":"))
+    if data.get("profile"):
+        # 截斷後仍要完整 profile（熱度圖）：runner 不卸下 tracer，執行時間跟著變長
+        env["TRACE_PROFILE"] = "1"
+    if data.get("skip_cfg"):
+        # backend 自己有 CFG 快取（services/cfg_cache.py）：runner 不建 cfg_graph
+        env["SKIP_CFG"] = "1"
+    stream = bool(data.get("stream"))
+    if stream:
+        env["STREAM_TRACE"] = "1"
+    if data.get("compress"):
+        # 串流時 trace_batch 仍是明文，最後的完整結果照樣壓縮（見 stream_result_line）
+        env["RESULT_ENCODING"] = "zlib"
+    return env, effective_timeout, stream
+
+
+def stream_result_line(body: dict | bytes, timings: dict | None) -> str:
+    """
+    串流 /run 的最後一行：dict 照原樣（計時放進 sandbox_timings）；壓縮結果的位元組
+    base64 後包成 {"type": "result_z", "payload_z", "sandbox_timings"}，由 backend 解壓。
+    """
+    if isinstance(body, bytes):
+        line = {"type": "result_z", "payload_z": base64.b64encode(body).decode("ascii")}
+        if timings is not None:
+            line["sandbox_timings"] = timings
+        return json.dumps(line)
+    return json.dumps(body if timings is None else {**body, "sandbox_timings": timings})
+
+
+def run_batch_request_env(data: dict) -> tuple[dict[str, str], float]:
+    """/run_batch 的 body → (runner env, 整批 timeout)；參數不合法拋 ValueError（回 400）。"""
+    n_values = data.get("n_values")
+    if (
+        not isinstance(n_values, list)
+        or not n_values
+        or not all(isinstance(v, int) and not isinstance(v, bool) for v in n_values)
+    ):
+        raise ValueError("n_values must be non-empty list[int]")
+
+    per_n_timeout = data.get("per_n_timeout") or CONTAINER_TIMEOUT
+    encoded = base64.b64encode(data["code"].encode("utf-8")).decode("ascii")
+    env = {
+        "CODE": encoded,
+        "BATCH_N_VALUES": ",".join(str(v) for v in n_values),
+        "PER_N_TIMEOUT": str(per_n_timeout),
+    }
+    return env, per_n_timeout * len(n_values)
+
+
+def docker_exec_cmd(container_id: str, env: dict[str, str]) -> list[str]:
+    cmd = ["docker", "exec", "-i"]
+    for key, value in env.items():
+        cmd += ["-e", f"{key}={value}"]
+    return cmd + ["-e", "CODEPULSE_INTERACTIVE=1", container_id, "python", "/sandbox/runner.py"]
+
+
+def event_outcome(event: dict, session_id: str, input_count: int) -> tuple[str | None, dict | bytes]:
+    """
+    control event → (收尾方式, body)。
+    收尾方式：None = 保留 session 等下一個 input；"release" / "recycle" = 歸還 / 回收容器。
+    body 為 bytes 時是非互動的壓縮結果，以 COMPRESSED_RESULT_MIMETYPE 原封轉出。
+    input_count 需已包含這次的 input_needed。
+    """
+    event_type = event.get("type")
+    if event_type == "input_needed":
+        return None, {
+            "status": "input_needed",
+            "session_id": session_id,
+            "prompt": event.get("prompt", ""),
+            "input_index": event.get("input_index", input_count - 1),
+        }
+    if event_type == "result":
+        finish = "recycle" if input_count > 0 else "release"
+        if "payload_z" in event:
+            try:
+                compressed = base64.b64decode(event["payload_z"])
+            except (binascii.Error, TypeError):
+                return finish, error_body("invalid compressed result payload")
+            if input_count == 0:
+                # 非互動：壓縮位元組直接轉給 backend，不 decompress / json.loads / jsonify
+                return finish, compressed
+            try:
+                result = json.loads(zlib.decompress(compressed))
+            except (zlib.error, ValueError):
+                return finish, {"status": "failed", "error": "invalid compressed result payload"}
+        else:
+            result = event.get("payload", {})
+        if input_count > 0:
+            return finish, {"status": "completed", "result": result}
+        return finish, result
+
+    message = event.get("message", "sandbox error")
+    lineno = event.get("lineno")
+    # timeout / runner 異常結束（crashed，sidecar 合成）可能留下殘留 process，要重置；
+    # 使用者程式自己的例外是 runner 正常回報的，容器乾淨，直接歸還
+    finish = "recycle" if input_count > 0 or message == "timeout" or event.get("crashed") else "release"
+    if input_count > 0:
+        body = {"status": "failed", "error": message}
+        if lineno is not None:
+            body["lineno"] = lineno
+        return finish, body
+    return finish, error_body(message, lineno=lineno)
@@ -0,0 +1,177 @@
+"""
+zygote_client.py — sidecar 端的 zygote 連線
+
+每個 pooled container 持有一個 ZygoteProcess（docker exec -i ... python /sandbox/zygote.py
+的長駐 Popen）。submit(env) 回傳 ZygoteJob，介面與 subprocess.Popen 相容
+（stdin / stdout / stderr / poll / kill），app.py 的 SandboxSession 不必分辨兩種模式：
+- stdout / stderr：只含這個 job 的行，job 結束（zygote 印出 exit 標記）時讀到 ""（EOF）
+- stdin：直接寫到 zygote 的 stdin，由 child 的 input() 讀取
+- kill()：正常結束時 child 馬上就會退出，稍等 exit 標記；等不到才殺掉整個 zygote
+
+同一時間只會有一個 job（container 被 acquire 時才 submit）。
+via_engine() 改用 Engine API 的 exec（docker_backend.EngineExec，同樣是 Popen 相容介面）。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import signal
+import subprocess
+import threading
+
+ZYGOTE_PREFIX = "__CODEPULSE_ZYGOTE__"
+ZYGOTE_EXIT_GRACE = 0.5  # 秒：result 之後等 child 退出的寬限
+
+
+class ZygoteUnavailableError(Exception):
+    """zygote 已死或正忙，無法接新 job。"""
+
+
+class _JobStream:
+    """per-job 的行佇列，readline() 行為同檔案：job 結束後回 ""。"""
+
+    def __init__(self):
+        self._lines: queue.SimpleQueue = queue.SimpleQueue()
+
+    def put(self, line: str) -> None:
+        self._lines.put(line)
+
+    def close(self) -> None:
+        self._lines.put("")
+
+    def readline(self) -> str:
+        line = self._lines.get()
+        if line == "":
+            # 讓之後的 readline 也拿到 EOF
+            self._lines.put("")
+        return line
+
+
+class ZygoteJob:
+    def __init__(self, zygote: ZygoteProcess):
+        self._zygote = zygote
+        self.stdin = zygote.process.stdin
+        self.stdout = _JobStream()
+        self.stderr = _JobStream()
+        self.returncode: int | None = None
+        self._done = threading.Event()
+
+    def _finish(self, returncode: int) -> None:
+        if self._done.is_set():
+            return
+        self.returncode = returncode
+        self.stdout.close()
+        self.stderr.close()
+        self._done.set()
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired("zygote job", timeout)
+        return self.returncode
+
+    def kill(self) -> None:
+        if not self._done.wait(ZYGOTE_EXIT_GRACE):
+            # child 卡住（timeout / 無窮迴圈）：殺掉整個 zygote，container 由 caller 回收
+            self._zygote.kill()
+
+
+class ZygoteProcess:
+    def __init__(self, argv: list[str] | None = None, env: dict[str, str] | None = None, *, process=None):
+        if process is None:
+            process = subprocess.Popen(
+                argv,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+                env=env,
+                start_new_session=True,  # kill() 用 killpg 連同 fork 出的 child 一起收掉
+            )
+        self.process = process
+        self._lock = threading.Lock()
+        self._job: ZygoteJob | None = None
+        threading.Thread(target=self._pump_stdout, daemon=True).start()
+        threading.Thread(target=self._pump_stderr, daemon=True).start()
+
+    @classmethod
+    def for_container(cls, container_id: str) -> ZygoteProcess:
+        return cls(["docker", "exec", "-i", container_id, "python", "/sandbox/zygote.py"])
+
+    @classmethod
+    def via_engine(cls, engine, container_id: str) -> ZygoteProcess:
+        return cls(process=engine.exec(container_id, ["python", "/sandbox/zygote.py"]))
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def submit(self, env: dict[str, str]) -> ZygoteJob:
+        with self._lock:
+            if not self.is_alive():
+                raise ZygoteUnavailableError("zygote is not running")
+            if self._job is not None:
+                raise ZygoteUnavailableError("zygote is busy")
+            job = ZygoteJob(self)
+            self._job = job
+        try:
+            self.process.stdin.write(json.dumps({"env": env}) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            with self._lock:
+                self._job = None
+            raise ZygoteUnavailableError(f"failed to submit job: {e}") from e
+        return job
+
+    def kill(self) -> None:
+        """
+        殺掉 zygote（本機直接跑時連 child 一起）並結束進行中的 job。
+        docker exec 模式下只殺得到 exec client，容器內殘留的 child 由 caller 回收容器處理。
+        """
+        if self.process.pid is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+        self._end_job(-signal.SIGKILL)
+
+    def _current_job(self) -> ZygoteJob | None:
+        with self._lock:
+            return self._job
+
+    def _end_job(self, returncode: int) -> None:
+        with self._lock:
+            job, self._job = self._job, None
+        if job is not None:
+            job._finish(returncode)
+
+    def _pump_stdout(self) -> None:
+        for line in iter(self.process.stdout.readline, ""):
+            if line.startswith(ZYGOTE_PREFIX):
+                try:
+                    returncode = int(json.loads(line[len(ZYGOTE_PREFIX):]).get("exit", 1))
+                except (ValueError, TypeError, AttributeError):
+                    returncode = 1
+                self._end_job(returncode)
+                continue
+            job = self._current_job()
+            if job is not None:
+                job.stdout.put(line)
+        # zygote 結束（container 被移除 / 被 kill）：進行中的 job 一併結束
+        self.process.wait()
+        self._end_job(self.process.returncode if self.process.returncode is not None else -9)
+
+    def _pump_stderr(self) -> None:
+        for line in iter(self.process.stderr.readline, ""):
+            job = self._current_job()
+            if job is not None:
+                job.stderr.put(line)
@@ -0,0 +1,144 @@
+"""
+admission.py — sandbox 滿載時的 admission control（Celery 模式）
+
+sidecar 的 pool 滿了之後，/run 要在 ContainerPool.acquire 等滿 ACQUIRE_TIMEOUT 才回 503，
+期間一直佔著 Celery worker。改成 task 開跑前先問 sidecar /capacity：
+- 有空位且排在前面 → 放行（從等候佇列移除）
+- 否則 task 以 Celery retry 退回 broker（不佔 worker），並透過 SSE 回報排隊位置
+
+等候佇列是 Redis sorted set（score = 第一次被擋下的時間），只放被 check 擋下、正在等 retry 的
+task（cache hit、被取消、還沒輪到 worker 的都不佔位置），位置即 ZRANK；放行、取消或等超過
+ADMISSION_MAX_WAIT 後移除。big-O probe 只在還有 PROBE_SHED_BELOW 個以上空位、且沒人在排隊時
+才送（should_shed_probes）。
+
+全部 fail-open：Redis 或 sidecar /capacity 不可用時一律放行，不讓 admission 本身變成故障點。
+"""
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+
+import redis as redis_lib
+
+from services.sandbox import sidecar_capacity
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("SANDBOX_ADMISSION", "1") == "1"
+ADMISSION_RETRY_SECONDS = float(os.getenv("SANDBOX_ADMISSION_RETRY_SECONDS", "1"))
+# 排超過這麼久就直接放行（交給 sidecar 自己的 acquire 排隊 / 503）
+ADMISSION_MAX_WAIT = float(os.getenv("SANDBOX_ADMISSION_MAX_WAIT", "60"))
+# Celery retry 上限：check 等滿 ADMISSION_MAX_WAIT 必放行，多留幾次給 Redis / 時鐘誤差
+ADMISSION_MAX_RETRIES = math.ceil(ADMISSION_MAX_WAIT / max(ADMISSION_RETRY_SECONDS, 0.1)) + 5
+# 空位少於這個數就不送 big-O probe，留給使用者看得到的 trace
+PROBE_SHED_BELOW = int(os.getenv("SANDBOX_PROBE_SHED_BELOW", "2"))
+
+QUEUE_KEY = "sandbox:admission:queue"
+
+_client: redis_lib.Redis | None = None
+
+
+@dataclass
+class Admission:
+    admitted: bool
+    position: int = 0              # 未放行時：前面還有幾個（1 = 下一個）
+    capacity: dict | None = None   # 這次查到的 sidecar /capacity；None = 查不到
+
+
+class AdmissionDeferred(Exception):
+    """
+    哨兵例外：sandbox 沒空位，task 應退回 queue 稍後重試（run_analysis_task 轉成 Celery retry）。
+    與 LegacyInputNeededSignal 一樣不是錯誤。
+    """
+    def __init__(self, position: int):
+        super().__init__(f"admission deferred: position {position}")
+        self.position = position
+
+
+def _redis():
+    global _client
+    if _client is None:
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        _client = redis_lib.from_url(
+            redis_url,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _client
+
+
+def release(task_id: str) -> None:
+    """離開等候佇列（放行、取消、task 結束時）；不在佇列中則無作用。"""
+    if not ADMISSION_ENABLED:
+        return
+    try:
+        _redis().zrem(QUEUE_KEY, task_id)
+    except redis_lib.RedisError:
+        logger.debug("admission release failed for %s", task_id, exc_info=True)
+
+
+def check(task_id: str) -> Admission:
+    """
+    task 開跑前呼叫：排在前 available 名內就放行並離開佇列，否則留在（或排進）佇列並回報位置。
+    佇列裡超過 ADMISSION_MAX_WAIT 的項目（worker 掛掉、task 被 revoke 沒清掉的）順便清掉。
+    """
+    if not ADMISSION_ENABLED:
+        return Admission(admitted=True)
+    capacity = sidecar_capacity()
+    if capacity is None:
+        release(task_id)
+        return Admission(admitted=True)
+
+    now = time.time()
+    try:
+        client = _redis()
+        client.zremrangebyscore(QUEUE_KEY, "-inf", now - ADMISSION_MAX_WAIT - 60)
+        client.zadd(QUEUE_KEY, {task_id: now}, nx=True)
+        rank = client.zrank(QUEUE_KEY, task_id)
+        enqueued_at = client.zscore(QUEUE_KEY, task_id)
+    except redis_lib.RedisError:
+        logger.debug("admission check failed for %s", task_id, exc_info=True)
+        return Admission(admitted=True, capacity=capacity)
+
+    waited = now - (enqueued_at if enqueued_at is not None else now)
+    if rank is None or rank < capacity["available"] or waited >= ADMISSION_MAX_WAIT:
+        release(task_id)
+        return Admission(admitted=True, capacity=capacity)
+    return Admission(admitted=False, position=rank - capacity["available"] + 1, capacity=capacity)
+
+
+def sandbox_busy(capacity: dict | None = None) -> bool:
+    """
+    同步跑 sandbox 的 route（/api/analyze/window）用：沒有空位，或還有 task 在等候佇列裡
+    就該回 503 讓 client 稍後重試，不插隊到排隊中的 task 前面。
+    """
+    if not ADMISSION_ENABLED:
+        return False
+    if capacity is None:
+        capacity = sidecar_capacity()
+        if capacity is None:
+            return False
+    if capacity["available"] < 1:
+        return True
+    try:
+        return _redis().zcard(QUEUE_KEY) > 0
+    except redis_lib.RedisError:
+        return False
+
+
+def should_shed_probes(capacity: dict | None = None) -> bool:
+    """big-O probe 該不該省略：空位少於 PROBE_SHED_BELOW，或還有 task 在等候佇列裡。"""
+    if not ADMISSION_ENABLED:
+        return False
+    if capacity is None:
+        capacity = sidecar_capacity()
+        if capacity is None:
+            return False
+    if capacity["available"] < PROBE_SHED_BELOW:
+        return True
+    try:
+        return _redis().zcard(QUEUE_KEY) > 0
+    except redis_lib.RedisError:
+        return False
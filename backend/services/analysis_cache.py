@@ -0,0 +1,117 @@
+"""
+analysis_cache.py — 跨使用者的分析結果快取（Redis）
+
+兩層 key：
+- 完整結果：sha256(實際執行的 code + stdin_inputs)。trace / CFG / call graph 都帶行號，
+  只差註解或空行的 code 行號就不同，不能共用，所以這層以原始 code 為準。
+- 各階段結果（AST 複雜度、big-O、algo 辨識）：sha256(normalize_code(code))。
+  這些結果與行號、stdin 無關，格式不同、stdin 不同也能共用。
+
+淘汰策略：每個 key 都有 TTL，命中時重設 TTL（常用的留著，冷門的自然過期，近似 LRU）。
+Redis 與 Celery broker 共用，不能改 maxmemory-policy，所以另外用
+MAX_CACHED_RESULT_BYTES 擋掉過大的結果。
+
+全部 best-effort：Redis 不可用時 get 回 None、set 什麼都不做，永遠不 raise。
+"""
+import hashlib
+import json
+import logging
+import os
+
+import redis as redis_lib
+
+from services.code_normalizer import normalize_code
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "86400"))            # 1 天
+STAGE_CACHE_TTL = int(os.getenv("ANALYSIS_STAGE_CACHE_TTL", "604800"))      # 7 天
+MAX_CACHED_RESULT_BYTES = 2 * 1024 * 1024
+
+STAGE_AST = "ast"
+STAGE_BIGO = "bigO"
+STAGE_IDENTIFY = "identify"
+
+_KEY_PREFIX = "analysis:cache"
+
+_client: redis_lib.Redis | None = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        _client = redis_lib.from_url(
+            redis_url,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _client
+
+
+def result_key(code: str, stdin_inputs: list[str] | None, capture: dict | None = None) -> str:
+    key_parts: list = [code, list(stdin_inputs or [])]
+    if capture is not None:
+        # 預設擷取（head）沿用原本的 key；其他策略的 trace 內容不同，另存
+        key_parts.append(capture)
+    payload = json.dumps(key_parts, sort_keys=True)
+    return f"{_KEY_PREFIX}:result:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def code_fingerprint(code: str) -> str | None:
+    """normalize_code 後的 sha256；空 code 或快取關閉時回 None（不快取）。"""
+    if not CACHE_ENABLED:
+        return None
+    normalized = normalize_code(code)
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _get(key: str, ttl: int):
+    if not CACHE_ENABLED:
+        return None
+    try:
+        client = _redis()
+        raw = client.get(key)
+        if raw is None:
+            return None
+        client.expire(key, ttl)
+        return json.loads(raw)
+    except (redis_lib.RedisError, ValueError):
+        logger.debug("analysis cache read failed for %s", key, exc_info=True)
+        return None
+
+
+def _set(key: str, value, ttl: int) -> None:
+    if not CACHE_ENABLED:
+        return
+    try:
+        raw = json.dumps(value)
+        if len(raw) > MAX_CACHED_RESULT_BYTES:
+            return
+        _redis().setex(key, ttl, raw)
+    except (redis_lib.RedisError, TypeError, ValueError):
+        logger.debug("analysis cache write failed for %s", key, exc_info=True)
+
+
+def get_result(code: str, stdin_inputs: list[str] | None, capture: dict | None = None) -> dict | None:
+    return _get(result_key(code, stdin_inputs, capture), RESULT_CACHE_TTL)
+
+
+def set_result(code: str, stdin_inputs: list[str] | None, result: dict, capture: dict | None = None) -> None:
+    _set(result_key(code, stdin_inputs, capture), result, RESULT_CACHE_TTL)
+
+
+def get_stage(stage: str, fingerprint: str | None):
+    if fingerprint is None:
+        return None
+    return _get(f"{_KEY_PREFIX}:{stage}:{fingerprint}", STAGE_CACHE_TTL)
+
+
+def set_stage(stage: str, fingerprint: str | None, value) -> None:
+    if fingerprint is None:
+        return
+    _set(f"{_KEY_PREFIX}:{stage}:{fingerprint}", value, STAGE_CACHE_TTL)
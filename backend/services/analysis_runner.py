@@ -1,23 +1,32 @@
+import ast
 import logging
-import ast as _ast
 import concurrent.futures as _cf
 import os
 import time
+from collections.abc import Callable
 import redis as redis_lib
 from database import db
 from models.explorer import ExploreHistory, AnalysisSource
 
 from celery.exceptions import Ignore
 from celery_app import celery_app
+from services import admission as sandbox_admission
+from services import analysis_cache
 from services.sandbox import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PRIMARY,
     check_session_alive,
     close_session,
     run_in_sandbox,
     send_input,
 )
+from services.sandbox_channel import SandboxChannel, open_channel
+from services.cfg_cache import cfg_graph_for
 from services.ast_complexity import analyze_complexity
 from services.complexity_analyzer import measure_step_counts, generate_bigo_wrapper
 from services.tracer import TraceEvent
+from services.trace_codec import TRACE_ENCODING_DELTA, decode_trace, encode_trace, pack_trace
+from services.heap_snapshot import heap_local_values, resolve_heap
 from services.template_tracer import build_level1_trace, SUPPORTED_ALGORITHMS
 from services.algo_identification import identify as algo_identify, IdentifyResult
 from services.algo_identification.divergence_log import log_divergence
@@ -79,7 +88,11 @@ def _input_key(task_id: str) -> str:
     return f"analyze:input:{task_id}"
 
 
-def _wait_for_user_input(task_id: str, session_id: str) -> str:
+def _wait_for_user_input(
+    task_id: str,
+    session_id: str,
+    is_alive: Callable[[], bool] | None = None,
+) -> str:
     # live interactive input 僅 Celery 模式支援：此函式用 Redis BLPOP 等使用者輸入值
     # 由 /api/analyze/input 經 CeleryTaskQueue.submit_input() rpush 進 analyze:input:{task_id}
     # in-memory queue（USE_CELERY=0）沒有對應的 Redis push，不支援 live input（見 task_queue_memory.submit_input 註解）
@@ -102,12 +115,21 @@ def _wait_for_user_input(task_id: str, session_id: str) -> str:
                 raise InteractiveInputCancelled("cancelled")
             return value
 
-        if not check_session_alive(session_id):
+        # 走 WebSocket 通道時以通道的 ping 當 heartbeat，不另發 HTTP
+        alive = is_alive() if is_alive is not None else check_session_alive(session_id)
+        if not alive:
             raise RuntimeError("sandbox session lost")
 
 
-def _cleanup_interactive_session(task_id: str, session_id: str | None) -> None:
-    if session_id:
+def _cleanup_interactive_session(
+    task_id: str,
+    session_id: str | None,
+    channel: SandboxChannel | None = None,
+) -> None:
+    if channel is not None:
+        # 關閉通道即由 sidecar 回收 session
+        channel.close()
+    elif session_id:
         try:
             close_session(session_id)
         except Exception:
@@ -119,7 +141,11 @@ def _cleanup_interactive_session(task_id: str, session_id: str | None) -> None:
         logger.warning("failed to cleanup interactive redis keys for %s", task_id, exc_info=True)
 
 
-def _resolve_interactive_sandbox(task_id: str, sandbox_result: dict) -> dict:
+def _resolve_interactive_sandbox(
+    task_id: str,
+    sandbox_result: dict,
+    channel: SandboxChannel | None = None,
+) -> dict:
     session_id = sandbox_result.get("session_id")
     if not session_id:
         raise RuntimeError("input_needed response missing session_id")
@@ -136,15 +162,22 @@ def _resolve_interactive_sandbox(task_id: str, sandbox_result: dict) -> dict:
                 "input_index": sandbox_result.get("input_index", 0),
             })
             try:
-                value = _wait_for_user_input(task_id, session_id)
+                value = _wait_for_user_input(task_id, session_id, channel.is_alive if channel else None)
             except InteractiveInputTimeout:
                 return {"error": "timeout", "is_truncated": True, "trace": [], "call_graph": None, "cfg_graph": {}}
             except InteractiveInputCancelled:
                 return {"error": "cancelled", "is_truncated": False, "trace": [], "call_graph": None, "cfg_graph": {}}
-            sandbox_result = send_input(session_id, value)
+            if channel is not None:
+                sandbox_result = channel.send_input(value)
+            else:
+                sandbox_result = send_input(session_id, value)
 
         if sandbox_result.get("status") == "completed":
-            return sandbox_result.get("result", {})
+            result = sandbox_result.get("result", {})
+            if "sandbox_timings" in sandbox_result:
+                # sidecar 計時在外層回應上（acquire / exec 是整個 session 開頭量的）
+                result.setdefault("sandbox_timings", sandbox_result["sandbox_timings"])
+            return result
         if sandbox_result.get("status") == "failed":
             error_msg = sandbox_result.get("error", "sandbox failed")
             # lineno:N:msg 與非互動 error 路徑（下方 _run_analysis）同格式，讓前端能標出錯誤行
@@ -152,7 +185,7 @@ def _resolve_interactive_sandbox(task_id: str, sandbox_result: dict) -> dict:
             raise RuntimeError(f"lineno:{lineno}:{error_msg}" if lineno else error_msg)
         return sandbox_result
     finally:
-        _cleanup_interactive_session(task_id, session_id)
+        _cleanup_interactive_session(task_id, session_id, channel)
 
 
 EXPECTED_STRUCTURE: dict[str, str] = {
@@ -166,16 +199,41 @@ EXPECTED_STRUCTURE: dict[str, str] = {
 }
 
 
-def _extract_input_data(trace_events: list) -> list | None:
-    for ev in trace_events:
+def _reads_input(code: str) -> bool:
+    """
+    程式有沒有用到內建 input（呼叫或把它當值傳出去，例如 f = input）；字串、註解、
+    變數名裡的 "input" 不算。語法錯誤時保守地以字面比對判斷。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return "input" in code
+    return any(
+        isinstance(node, ast.Name) and node.id == "input" and isinstance(node.ctx, ast.Load)
+        for node in ast.walk(tree)
+    )
+
+
+def _sandbox_tenant(user_id, task_id: str) -> str:
+    """sidecar 公平排隊的 tenant：登入使用者以 user 為單位，匿名的以 task 為單位。"""
+    return f"user:{user_id}" if user_id is not None else f"task:{task_id}"
+
+
+def _sandbox_usage(sandbox_result: dict) -> dict:
+    """
+    sidecar 計時（sandbox_timings：等容器 / 啟動 runner / 執行）與 runner 量的 usage
+    （CPU、序列化、cgroup throttle、記憶體峰值）合成一個扁平 dict；兩者都沒有時回 {}。
+    """
+    return {**(sandbox_result.get("sandbox_timings") or {}), **(sandbox_result.get("usage") or {})}
+
+
+def _extract_input_data(trace_events: list, local_values: list[dict]) -> list | None:
+    """第一個 CALL event 的第一個 list 型別 local（local_values 為 heap_local_values 還原的值）。"""
+    for ev, values in zip(trace_events, local_values):
         if ev.get("tag") == "CALL":
-            for val_str in ev.get("local_vars", {}).values():
-                try:
-                    val = _ast.literal_eval(val_str)
-                    if isinstance(val, list):
-                        return val
-                except (ValueError, SyntaxError):
-                    continue
+            for val in values.values():
+                if isinstance(val, list):
+                    return list(val)
     return None
 
 
@@ -211,13 +269,14 @@ def _save_history(
     complexity_source: str,
     gemini_summary: dict | None,
     have_level1: bool,
-    execution_trace: list,
+    execution_trace: list | dict,
     is_truncated: bool,
-    raw_trace: list,
+    raw_trace: list | dict,
     raw_index_map: list,
     call_graph: dict | None,
     cfg_graph: dict,
     stdout_events: list,
+    sandbox_usage: dict | None = None,
 ) -> None:
     if find_matching_history(code, user_id) is not None:
         logger.info("Explore history duplicate found for user %s; skipping persistence", user_id)
@@ -256,11 +315,43 @@ def _save_history(
         cfg_graph=cfg_graph,
         stdout_events=stdout_events,
         top3_candidates=top3_candidates,
+        sandbox_usage=sandbox_usage,
     )
     db.session.add(record)
     db.session.commit()
 
 
+def _save_cached_history(task_id: str, user_id: int, code: str, cached: dict) -> None:
+    """完整結果快取命中時，照一般路徑幫這位使用者存一筆 history（best-effort）。"""
+    identify_result = IdentifyResult(
+        algo_name=cached.get("detected_algorithm"),
+        score=cached.get("confidence_score") or 0.0,
+        top_raw="",
+        top3=[(c["name"], c["score"]) for c in cached.get("top3_candidates", [])],
+    )
+    packed_raw_trace = pack_trace(encode_trace(cached.get("raw_trace", [])), TRACE_ENCODING_DELTA)
+    have_level1 = cached.get("have_level1", False)
+    try:
+        _save_history(
+            user_id, code, identify_result,
+            cached.get("time_complexity") or "unknown",
+            cached.get("analysis_source", "ast"),
+            cached.get("gemini_summary"),
+            have_level1=have_level1,
+            execution_trace=cached.get("execution_trace", []) if have_level1 else packed_raw_trace,
+            is_truncated=cached.get("is_truncated", False),
+            raw_trace=packed_raw_trace,
+            raw_index_map=cached.get("raw_index_map", []),
+            call_graph=cached.get("call_graph"),
+            cfg_graph=cached.get("cfg_graph", {}),
+            stdout_events=cached.get("stdout_events", []),
+            # 快取命中沒有跑 sandbox
+            sandbox_usage={},
+        )
+    except Exception:
+        logger.warning("Failed to save explore history for task %s", task_id, exc_info=True)
+
+
 @celery_app.task(bind=True, name="analysis_runner.run_analysis", max_retries=1)
 def run_analysis_task(
     self,
@@ -269,6 +360,8 @@ def run_analysis_task(
     user_id: int | None = None,
     save_history: bool | None = None,
     stdin_inputs: list[str] | None = None,
+    capture: dict | None = None,
+    stream_trace: bool = False,
 ) -> dict:
     """Celery task: analysis main flow. task_id = self.request.id."""
     from app import app as flask_app
@@ -276,6 +369,8 @@ def run_analysis_task(
     if save_history is None:
         headers = getattr(self.request, "headers", None) or {}
         save_history = headers.get("save_history", True) is not False
+    admission = not celery_app.conf.task_always_eager
+    requeued = False
     with flask_app.app_context():
         try:
             return _run_analysis(
@@ -285,6 +380,17 @@ def run_analysis_task(
                 user_id=user_id,
                 save_history=save_history,
                 stdin_inputs=stdin_inputs,
+                capture=capture,
+                stream_trace=stream_trace,
+                admission=admission,
+            )
+        except sandbox_admission.AdmissionDeferred:
+            # sandbox 滿載：退回 broker 稍後再排，不讓 worker 卡在 /run 的 acquire 等待上。
+            # 同一個 task id 重排，SSE 訂閱不受影響；check 超過 ADMISSION_MAX_WAIT 必放行，重試次數有上限
+            requeued = True
+            raise self.retry(
+                countdown=sandbox_admission.ADMISSION_RETRY_SECONDS,
+                max_retries=sandbox_admission.ADMISSION_MAX_RETRIES,
             )
         except LegacyInputNeededSignal as sig:
             # [LEGACY] input_needed 用自訂 state，不讓 Celery 標記成 SUCCESS/FAILURE。
@@ -297,6 +403,10 @@ def run_analysis_task(
                 },
             )
             raise Ignore()
+        finally:
+            # 除了等 retry 的，結束（含失敗、retry 次數用完）就離開等候佇列，不拖住後面的排隊位置
+            if admission and not requeued:
+                sandbox_admission.release(task_id)
 
 
 def _run_analysis(
@@ -306,13 +416,78 @@ def _run_analysis(
     user_id: int | None = None,
     save_history: bool = True,
     stdin_inputs: list[str] | None = None,
+    capture: dict | None = None,
+    stream_trace: bool = False,
+    admission: bool = False,
 ) -> dict:
     logger.info("_run_analysis called with user_id=%s task_id=%s", user_id, task_id)
+
+    cached_result = analysis_cache.get_result(wrapped_code, stdin_inputs, capture)
+    if cached_result is not None:
+        # 同一份 code + stdin 已完整分析過（可能是別的使用者）：跳過 sandbox 與所有分析
+        logger.info("analysis cache hit for task_id=%s", task_id)
+        if user_id is not None and save_history:
+            _save_cached_history(task_id, user_id, code, cached_result)
+        task_queue.update_progress(task_id, STAGE_DONE, "Done")
+        return {**cached_result, "sandbox_usage": {}}
+
+    # admission control（只在 Celery worker 上）：sandbox 沒空位就回報排隊位置並退回 queue
+    capacity = None
+    if admission:
+        decision = sandbox_admission.check(task_id)
+        if not decision.admitted:
+            task_queue.publish_event(task_id, {
+                "stage": STAGE_SANDBOX,
+                "status": "running",
+                "type": "queued",
+                "position": decision.position,
+                "message": f"排隊中：前面還有 {decision.position} 個",
+            })
+            raise sandbox_admission.AdmissionDeferred(decision.position)
+        capacity = decision.capacity
+
     task_queue.update_progress(task_id, STAGE_SANDBOX, "正在模擬執行並計算複雜度…")
-    sandbox_result = run_in_sandbox(wrapped_code, stdin_inputs=stdin_inputs or [])
 
-    if sandbox_result.get("status") == "input_needed":
-        sandbox_result = _resolve_interactive_sandbox(task_id, sandbox_result)
+    def _publish_trace_batch(start: int, events: list[dict]) -> None:
+        # 執行中先把 trace 片段推到 SSE，前端不必等整段 trace 跑完才開始播放
+        task_queue.publish_event(task_id, {
+            "stage": STAGE_SANDBOX,
+            "status": "running",
+            "type": "trace_batch",
+            "start": start,
+            "events": events,
+        })
+
+    # 可能讀 input() 的程式改走常駐 WebSocket 通道：之後每次輸入都在同一條連線上往返
+    interactive = _reads_input(wrapped_code)
+    channel = open_channel() if interactive else None
+    sandbox_runner = channel.run if channel is not None else run_in_sandbox
+    tenant = _sandbox_tenant(user_id, task_id)
+    sandbox_result = sandbox_runner(
+        wrapped_code,
+        stdin_inputs=stdin_inputs or [],
+        on_trace_batch=_publish_trace_batch if stream_trace else None,
+        capture=capture,
+        skip_cfg=True,
+        priority=PRIORITY_INTERACTIVE if interactive else PRIORITY_PRIMARY,
+        tenant=tenant,
+    )
+
+    # live input 的值不在 cache key 裡，這類結果不能進完整結果快取
+    used_live_input = sandbox_result.get("status") == "input_needed"
+    if used_live_input:
+        sandbox_result = _resolve_interactive_sandbox(task_id, sandbox_result, channel)
+    elif channel is not None:
+        channel.close()
+
+    # 逾時 / 錯誤時也記：timeout 是等容器、CPU 被節流還是 user code 本身慢，要靠這行分辨
+    sandbox_usage = _sandbox_usage(sandbox_result)
+    if sandbox_usage:
+        logger.info(
+            "sandbox usage task_id=%s %s",
+            task_id,
+            " ".join(f"{key}={value}" for key, value in sandbox_usage.items()),
+        )
 
     # [LEGACY — re-submit fallback only] input_needed short-circuit (D10)：
     # runner JSON 帶 error == "input_needed"（runner 已退出）時必須在進入 big-O / Gemini /
@@ -333,42 +508,84 @@ def _run_analysis(
         lineno = sandbox_result.get("lineno")
         raise RuntimeError(f"lineno:{lineno}:{error_msg}" if lineno else error_msg)
     else:
-        execution_trace = sandbox_result.get("trace", [])
+        encoded_trace = sandbox_result.get("trace", [])
+        trace_encoding = sandbox_result.get("trace_encoding")
+        heap_objects = sandbox_result.get("heap_objects")
+        # 先只解 delta：變數仍是 heap 值，Level 1 要的 Python 值直接從 heap 還原
+        heap_trace = decode_trace(encoded_trace, trace_encoding)
+        execution_trace = resolve_heap(heap_trace, heap_objects) if heap_objects is not None else heap_trace
         call_graph = sandbox_result.get("call_graph")
-        cfg_graph = sandbox_result.get("cfg_graph", {})
+        # container 不建 CFG（skip_cfg）：依 code hash 從 backend 的 LRU 快取取
+        cfg_graph = cfg_graph_for(wrapped_code)
         is_truncated = sandbox_result.get("is_truncated", False)
         stdout_events = sandbox_result.get("stdout_events", [])
+        profile = sandbox_result.get("profile")
+        capture_info = sandbox_result.get("capture")
 
     task_queue.update_progress(task_id, STAGE_ANALYSIS, "正在分析時間複雜度…")
     ast_complexity = "unknown"
     bigo_complexity = "unknown"
 
-    bigo_code = generate_bigo_wrapper(code)
+    # AST / big-O / algo 辨識只看程式內容，以 normalize 後的 code 做跨使用者、跨 stdin 快取
+    fingerprint = analysis_cache.code_fingerprint(code)
+    cached_ast = analysis_cache.get_stage(analysis_cache.STAGE_AST, fingerprint)
+    cached_bigo = analysis_cache.get_stage(analysis_cache.STAGE_BIGO, fingerprint)
+    cached_identify = analysis_cache.get_stage(analysis_cache.STAGE_IDENTIFY, fingerprint)
+
+    bigo_code = generate_bigo_wrapper(code) if cached_bigo is None else None
+    # 滿載時先捨棄 big-O probe（一次佔 5 輪 sandbox），bigo 記 unknown，讓出空位給主要執行
+    probes_shed = bigo_code is not None and admission and sandbox_admission.should_shed_probes(capacity)
+    if probes_shed:
+        logger.info("sandbox busy, shedding big-O probe for task_id=%s", task_id)
+        bigo_code = None
 
     with _cf.ThreadPoolExecutor(max_workers=4) as _pool:
-        _ast_fut = _pool.submit(analyze_complexity, code)
+        _ast_fut = _pool.submit(analyze_complexity, code) if cached_ast is None else None
         _bigo_fut = (
-            _pool.submit(measure_step_counts, bigo_code)
+            _pool.submit(measure_step_counts, bigo_code, tenant)
             if bigo_code is not None
             else None
         )
-        _minilm_fut = _pool.submit(algo_identify, code)
+        _minilm_fut = _pool.submit(algo_identify, code) if cached_identify is None else None
         _gemini_fut = _pool.submit(gemini_analyze, code)
 
-        try:
-            ast_complexity = _ast_fut.result(timeout=60)
-        except Exception:
-            ast_complexity = "unknown"
+        if _ast_fut is not None:
+            try:
+                ast_complexity = _ast_fut.result(timeout=60)
+            except Exception:
+                ast_complexity = "unknown"
+            if ast_complexity != "unknown":
+                analysis_cache.set_stage(analysis_cache.STAGE_AST, fingerprint, ast_complexity)
+        else:
+            ast_complexity = cached_ast
         if _bigo_fut is not None:
             try:
                 bigo_complexity = _bigo_fut.result(timeout=60)
             except Exception:
                 bigo_complexity = "unknown"
-        try:
-            identify_result = _minilm_fut.result(timeout=60)
-        except Exception:
-            logger.warning("algo_identify failed, falling back to unknown", exc_info=True)
-            identify_result = IdentifyResult(algo_name=None, score=0.0, top_raw="", top3=[])
+            if bigo_complexity != "unknown":
+                analysis_cache.set_stage(analysis_cache.STAGE_BIGO, fingerprint, bigo_complexity)
+        elif cached_bigo is not None:
+            bigo_complexity = cached_bigo
+        if _minilm_fut is not None:
+            try:
+                identify_result = _minilm_fut.result(timeout=60)
+                analysis_cache.set_stage(analysis_cache.STAGE_IDENTIFY, fingerprint, {
+                    "algo_name": identify_result.algo_name,
+                    "score": identify_result.score,
+                    "top_raw": identify_result.top_raw,
+                    "top3": identify_result.top3,
+                })
+            except Exception:
+                logger.warning("algo_identify failed, falling back to unknown", exc_info=True)
+                identify_result = IdentifyResult(algo_name=None, score=0.0, top_raw="", top3=[])
+        else:
+            identify_result = IdentifyResult(
+                algo_name=cached_identify["algo_name"],
+                score=cached_identify["score"],
+                top_raw=cached_identify["top_raw"],
+                top3=[tuple(c) for c in cached_identify["top3"]],
+            )
         try:
             gemini_result = _gemini_fut.result(timeout=60)
         except Exception:
@@ -449,19 +666,23 @@ def _run_analysis(
         )
 
     have_level1 = False
-    raw_trace_objects = [
-        TraceEvent(
-            tag=ev["tag"],
-            local_vars=ev.get("local_vars", {}),
-            global_vars=ev.get("global_vars", {}),
-            dataSnapshot=ev.get("dataSnapshot", []),
-            meta=ev.get("meta", {}),
-        )
-        for ev in execution_trace
-    ]
-    input_data = _extract_input_data(execution_trace)
-    level1_result = build_level1_trace(algo_for_level1, raw_trace_objects, input_data, code=code) \
-        if algo_for_level1 is not None else None
+    level1_result = None
+    if algo_for_level1 is not None:
+        # 舊版 runner 沒有 heap_objects：拿不到結構化的值，對齊失敗後走 Level 2
+        local_values = heap_local_values(heap_trace, heap_objects) if heap_objects is not None \
+            else [{} for _ in execution_trace]
+        raw_trace_objects = [
+            TraceEvent(
+                tag=ev["tag"],
+                local_vars=values,
+                global_vars=ev.get("global_vars", {}),
+                dataSnapshot=ev.get("dataSnapshot", []),
+                meta=ev.get("meta", {}),
+            )
+            for ev, values in zip(execution_trace, local_values)
+        ]
+        input_data = _extract_input_data(execution_trace, local_values)
+        level1_result = build_level1_trace(algo_for_level1, raw_trace_objects, input_data, code=code)
     raw_trace = execution_trace
     raw_index_map: list = []
     if level1_result is not None:
@@ -479,18 +700,22 @@ def _run_analysis(
         have_level1 = True
 
     # Persist history (best-effort, never raises)
+    # raw_trace 直接存 runner 的 delta + heap 編碼（serialize_history 讀取時再 unpack_trace 還原）；
+    # 沒有 Level 1 時 execution_trace 就是 raw_trace，也一併存編碼版本
     if user_id is not None and save_history:
+        packed_raw_trace = pack_trace(encoded_trace, trace_encoding, heap_objects)
         try:
             _save_history(
                 user_id, code, identify_result, final_complexity, complexity_source, gemini_summary,
                 have_level1=have_level1,
-                execution_trace=execution_trace,
+                execution_trace=execution_trace if have_level1 else packed_raw_trace,
                 is_truncated=is_truncated,
-                raw_trace=raw_trace,
+                raw_trace=packed_raw_trace,
                 raw_index_map=raw_index_map,
                 call_graph=call_graph,
                 cfg_graph=cfg_graph,
                 stdout_events=stdout_events,
+                sandbox_usage=sandbox_usage,
             )
         except Exception:
             logger.warning("Failed to save explore history for task %s", task_id, exc_info=True)
@@ -500,7 +725,7 @@ def _run_analysis(
     level1_eligible = algo_for_level1 is not None and identify_result.score >= 0.45
     top3_candidates = [{"name": name, "score": score} for name, score in identify_result.top3]
 
-    return {
+    result = {
         "detected_algorithm": identify_result.algo_name,
         "confidence_score":   identify_result.score,
         "level1_eligible":    level1_eligible,
@@ -516,5 +741,15 @@ def _run_analysis(
         "cfg_graph": cfg_graph,
         "is_truncated": is_truncated,
         "stdout_events": stdout_events,
+        # 行命中 / 函式耗時，供熱度圖使用；trace 截斷時只涵蓋保留的那一段（complete=false）
+        "profile": profile,
+        # 實際採用的 trace 擷取策略（ring / stride / loop / keyframe…）與保留 / 總步數
+        "capture": capture_info,
         "top3_candidates": top3_candidates,
     }
+    # Gemini fallback（限流 / API 失敗）與滿載時省略 big-O 都是暫時性的，不把缺欄位的結果快取一整天
+    if not used_live_input and not gemini_result.is_fallback and not probes_shed:
+        analysis_cache.set_result(wrapped_code, stdin_inputs, result, capture)
+    # 這次執行的資源用量只屬於這個 task，不進快取（快取命中時沒有跑 sandbox，也就沒有這欄）
+    result["sandbox_usage"] = sandbox_usage
+    return result
@@ -281,3 +281,29 @@ def build_module_cfg(source: str) -> CfgGraph:
 
     return cfg
 
+
+def build_cfg_graph_data(source: str) -> dict:
+    """
+    runner / backend 共用的 cfg_graph 序列化格式：{ func_name | "<global>": {nodes, edges} }。
+    任何建構失敗都回 {}（CFG 只是輔助視覺化，不影響 trace）。
+    """
+    try:
+        graphs = build_cfg(source)
+        module_cfg = build_module_cfg(source)
+        if module_cfg.nodes:
+            graphs["<global>"] = module_cfg
+        return {
+            name: {
+                "nodes": [
+                    {"id": n.id, "kind": n.kind, "label": n.label, "lines": n.lines}
+                    for n in g.nodes
+                ],
+                "edges": [
+                    {"source": e.source, "target": e.target, "label": e.label}
+                    for e in g.edges
+                ],
+            }
+            for name, g in graphs.items()
+        }
+    except Exception:
+        return {}
@@ -0,0 +1,54 @@
+"""
+cfg_cache.py — backend 端的 CFG 建構與 LRU 快取
+
+runner 原本每次 /run 都在 container 內 build_cfg + build_module_cfg（重新 parse、ast.walk、
+ast.unparse），同一份 code 重跑（互動重送、trace 視窗、不同 stdin）都重做一次。
+改由 backend 依 sha256(code) 快取序列化好的 cfg_graph dict，/run 帶 skip_cfg 讓 container 略過。
+
+CFG 帶行號，key 用實際執行的原始 code（不 normalize）。
+per-process 快取（Celery prefork 每個 worker 各一份），thread-safe；回傳的 dict 會被多次共用，呼叫端不可修改。
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from services.cfg_builder import build_cfg_graph_data
+
+CFG_CACHE_SIZE = int(os.environ.get("CFG_CACHE_SIZE", "256"))
+
+_cache: OrderedDict[str, dict] = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def cfg_graph_for(code: str) -> dict:
+    """code 的 cfg_graph（與 runner 原本輸出的格式相同）；命中時直接回快取的 dict。"""
+    key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return cached
+        _stats["misses"] += 1
+
+    # 建構不持鎖：同一份 code 併發 miss 頂多各建一次
+    data = build_cfg_graph_data(code)
+    with _cache_lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > CFG_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return data
+
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        return {**_stats, "size": len(_cache), "max_size": CFG_CACHE_SIZE}
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+        _stats["hits"] = _stats["misses"] = 0
@@ -2,17 +2,16 @@
 complexity_analyzer.py — big-O 步驟計數 + 曲線擬合
 
 measure_step_counts(wrapped_code) -> str
-  對多個 n 值執行 wrapped_code，收集 step_count，曲線擬合回傳複雜度標籤。
+  一次 /run_batch 對多個 n 值執行 wrapped_code，收集 step_count，曲線擬合回傳複雜度標籤。
   可用資料點 < 2 時回傳 "unknown"。
 """
 from __future__ import annotations
 
 import ast as _ast
-import concurrent.futures
 import numpy as np
 from scipy.optimize import curve_fit
 
-from services.sandbox import run_in_sandbox
+from services.sandbox import run_batch_in_sandbox
 from services.complexity_labels import normalize_complexity
 
 _INT_PARAMS = {"n", "k", "x", "num", "target", "val", "value", "count"}
@@ -99,29 +98,23 @@ N_VALUES = [10, 50, 100, 200, 500]
 PER_N_TIMEOUT = 5  # 秒，每個 n 值的獨立 timeout
 
 
-def measure_step_counts(wrapped_code: str) -> str:
+def measure_step_counts(wrapped_code: str, tenant: str | None = None) -> str:
     """
-    對 N_VALUES 中每個 n 平行執行 wrapped_code（呼叫 explore_wrapper(n)），
-    收集 step_count，曲線擬合後回傳複雜度標籤。
+    把 N_VALUES 一次送進 sidecar /run_batch（同一個容器依序呼叫 explore_wrapper(n)），
+    收集 step_count，曲線擬合後回傳複雜度標籤。timeout / error 的 n 不列入擬合。
+    tenant 給 sidecar 做 per-tenant 公平排隊（probe 優先級最低）。
     """
-    def _run_one(n: int) -> tuple[int, dict]:
-        return n, run_in_sandbox(wrapped_code, n=n, per_n_timeout=PER_N_TIMEOUT)
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(N_VALUES)) as pool:
-        futures = {pool.submit(_run_one, n): n for n in N_VALUES}
-        results: dict[int, dict] = {}
-        for fut in concurrent.futures.as_completed(futures):
-            n, result = fut.result()
-            results[n] = result
+    batch = run_batch_in_sandbox(wrapped_code, N_VALUES, per_n_timeout=PER_N_TIMEOUT, tenant=tenant)
+    if "error" in batch:
+        return "unknown"
 
     counts: list[int] = []
     valid_ns: list[int] = []
-    for n in N_VALUES:
-        result = results[n]
-        if "error" in result:
+    for result in batch.get("results", []):
+        if result.get("error") or result.get("timed_out"):
             continue
         counts.append(result.get("step_count", 0))
-        valid_ns.append(n)
+        valid_ns.append(result["n"])
 
     if len(valid_ns) < 2:
         return "unknown"
@@ -0,0 +1,379 @@
+"""
+heap_snapshot.py — 變數的結構化 heap 快照（copy-on-write）
+
+tracer 原本把每個變數 repr() 成字串，backend 再 ast.literal_eval 回 Python 值：兩端都花 CPU、
+看不出 aliasing，list 每改一格就整串重送。這裡改成 heap 模型：
+
+- HeapRecorder（runner 端，tracer 擷取 event 時呼叫）：每個容器物件配一個 object id（oid），
+  變數值是 primitive（int / str / bool / None / 有限 float）或 {"ref": oid}。物件內容以
+  不可變的 node（[kind, payload]）表示，內容改變才換新 node；每個 event 的 view（oid → node）
+  是 copy-on-write dict，沒有物件改變的 event 直接共用上一個 view。
+- HeapTable（runner 端，輸出時）：把保留下來的 event 的 view 攤平成共用的 object table
+  （每個 node 版本只出現一次）＋每個 event 的 [[oid, version], ...] 差量；list 的新版本若只
+  改了少數幾格，以 ["patch", base, length, [[i, value], ...]] 相對上一版存。
+- resolve_heap() / heap_local_values()（backend 端）：依差量還原每個 event 的 view，
+  分別產生前端 trace.ts 用的 repr 字串，與 template_tracer 用的 Python 值（不經 literal_eval）。
+
+wire 格式：event["heap"] = [[oid, version], ...]，result["heap_objects"] = object table，
+result["value_encoding"] = HEAP_VALUE_ENCODING。
+
+同時在 sandbox container（flat import）與 backend（services.heap_snapshot）使用，
+不可依賴 services 套件內其他模組。
+"""
+from __future__ import annotations
+
+from operator import is_
+
+HEAP_VALUE_ENCODING = "heap"
+HEAP_OBJECTS_MAX = 4096  # recorder 追蹤的物件數上限，超過就重新配 oid（同 tracer 的 repr 快取）
+
+_INLINE_TYPES = frozenset({int, str, bool, type(None)})
+_CONTAINER_KINDS = {list: "list", tuple: "tuple", dict: "dict", set: "set", frozenset: "frozenset"}
+_RECURSIVE_TEXT = {"list": "[...]", "dict": "{...}", "tuple": "(...)", "set": "{...}", "frozenset": "frozenset(...)"}
+
+
+def _is_ref(value) -> bool:
+    # payload 裡的 dict 只可能是 ref：真正的 dict 一律是 heap 物件
+    return type(value) is dict
+
+
+def _same_items(value, shallow) -> bool:
+    """容器的淺層檢查：長度相同且每個元素（dict 含 key）仍是同一物件。"""
+    if len(value) != len(shallow):
+        return False
+    if type(value) is dict:
+        return all(map(is_, value, shallow)) and all(map(is_, value.values(), shallow.values()))
+    return all(map(is_, value, shallow))
+
+
+def _same_payload(kind: str, a: list, b: list) -> bool:
+    """payload 逐項比較；型別也要相同（1 == True == 1.0，但 repr 不同）。"""
+    if len(a) != len(b):
+        return False
+    if kind != "dict":
+        # 元素只有 primitive 與 ref dict，== 與型別比對都在 C 層完成
+        return a == b and all(map(is_, map(type, a), map(type, b)))
+    for x, y in zip(a, b):
+        if type(x) is not type(y):
+            return False
+        if type(x) is list:  # dict payload 的 [key, value]
+            if not _same_payload("pair", x, y):
+                return False
+        elif x != y:
+            return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# runner 端：擷取
+# ---------------------------------------------------------------------------
+
+class _Entry:
+    __slots__ = ("obj", "ref", "node", "shallow", "nested")
+
+    def __init__(self, obj, ref: dict):
+        self.obj = obj        # 持有參照，避免 id 被回收重用
+        self.ref = ref        # 同一物件永遠回傳同一個 ref dict，trace_codec 的 diff 走 identity
+        self.node = None
+        self.shallow = None
+        self.nested = False
+
+
+class HeapRecorder:
+    """
+    tracer 每個 event：begin() → 對每個變數呼叫 recorder(value) → end() 取得該 event 的 view。
+    同一 event 內同一物件只走訪一次（aliasing 與循環參照都回同一個 ref）。
+    """
+
+    def __init__(self):
+        self._entries: dict[int, _Entry] = {}
+        self._next_oid = 1
+        self._seen: dict[int, dict] = {}
+        self._changed: dict[int, list] = {}
+        self.view: dict[int, list] = {}
+
+    def begin(self) -> None:
+        if len(self._entries) >= HEAP_OBJECTS_MAX:
+            self._entries.clear()
+            self.view = {}
+        self._seen = {}
+
+    def end(self) -> dict[int, list]:
+        if self._changed:
+            self.view = {**self.view, **self._changed}
+            self._changed = {}
+        return self.view
+
+    def __call__(self, value):
+        value_type = type(value)
+        if value_type in _INLINE_TYPES:
+            return value
+        if value_type is float and value - value == 0:  # inf / nan 不是合法 JSON，當成物件
+            return value
+        return self._record(value, value_type)
+
+    def _record(self, value, value_type):
+        key = id(value)
+        ref = self._seen.get(key)
+        if ref is not None:
+            return ref
+        entry = self._entries.get(key)
+        if entry is None or entry.obj is not value:
+            entry = _Entry(value, {"ref": self._next_oid})
+            self._next_oid += 1
+            self._entries[key] = entry
+        self._seen[key] = entry.ref
+
+        kind = _CONTAINER_KINDS.get(value_type)
+        if kind is None:
+            # 函式 / 類別的 repr 不會變，記過一次就不再 repr
+            if entry.node is None or not callable(value):
+                text = repr(value)
+                if entry.node is None or entry.node[1] != text:
+                    self._set(entry, ["repr", text])
+            return entry.ref
+
+        if entry.shallow is not None and _same_items(value, entry.shallow):
+            # 這一層沒變；巢狀的子容器仍要走訪，它們自己可能換版本
+            if entry.nested:
+                for item in (value.values() if kind == "dict" else value):
+                    self(item)
+            return entry.ref
+
+        if kind == "dict":
+            payload = [[self(k), self(v)] for k, v in value.items()]
+            nested = any(_is_ref(k) or _is_ref(v) for k, v in payload)
+        elif _INLINE_TYPES.issuperset(map(type, value)):
+            # 最常見的 list[int] / list[str]：元素直接放進 payload，不逐一呼叫 recorder
+            # （float 要先檢查是否有限，不走這條）
+            payload = list(value)
+            nested = False
+        else:
+            payload = [self(item) for item in value]
+            nested = any(map(_is_ref, payload))
+        # tuple / frozenset 不可變，自己就是淺層快照
+        entry.shallow = value.copy() if kind in ("list", "dict", "set") else value
+        entry.nested = nested
+        node = entry.node
+        if node is None or node[0] != kind or not _same_payload(kind, node[1], payload):
+            self._set(entry, [kind, payload])
+        return entry.ref
+
+    def _set(self, entry: _Entry, node: list) -> None:
+        entry.node = node
+        self._changed[entry.ref["ref"]] = node
+
+
+def _list_patch(old: list, new: list) -> list | None:
+    """new 相對 old 改了哪幾格；超過一半就不值得 patch。"""
+    sets = [
+        [i, v] for i, v in enumerate(new)
+        if i >= len(old) or type(old[i]) is not type(v) or old[i] != v
+    ]
+    return sets if len(sets) * 2 < len(new) else None
+
+
+class HeapTable:
+    """per-event view → 共用 object table（每個 node 版本一筆）＋每個 event 的差量。"""
+
+    def __init__(self):
+        self.objects: list[list] = []
+        self._versions: dict[int, int] = {}        # id(node) → version
+        self._latest: dict[int, tuple[int, list]] = {}  # oid → 最後一次輸出的 (version, node)
+        self._nodes: list[list] = []               # 持有 node，id() 才不會重用
+        self._prev_view: dict | None = None
+
+    def delta(self, view: dict | None) -> list[list[int]]:
+        if view is None or view is self._prev_view:
+            return []
+        prev = self._prev_view or {}
+        out = [
+            [oid, self._version(oid, node)]
+            for oid, node in view.items()
+            if prev.get(oid) is not node
+        ]
+        self._prev_view = view
+        return out
+
+    def _version(self, oid: int, node: list) -> int:
+        version = self._versions.get(id(node))
+        if version is not None:
+            return version
+        entry = node
+        latest = self._latest.get(oid)
+        if latest is not None and node[0] == "list" and latest[1][0] == "list":
+            patch = _list_patch(latest[1][1], node[1])
+            if patch is not None:
+                entry = ["patch", latest[0], len(node[1]), patch]
+        version = len(self.objects)
+        self.objects.append(entry)
+        self._versions[id(node)] = version
+        self._nodes.append(node)
+        self._latest[oid] = (version, node)
+        return version
+
+
+# ---------------------------------------------------------------------------
+# 讀取：heap 值 → repr 字串 / Python 值
+# ---------------------------------------------------------------------------
+
+class OpaqueValue:
+    """heap 裡的非容器物件（函式、自訂類別實例…）：只保留 repr。"""
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self) -> str:
+        return self.text
+
+
+class HeapReader:
+    """
+    在某個 view 下把 heap 值轉成 repr 字串（與 tracer 的 repr() 相同）或 Python 值。
+    沒有子物件的 node 結果只跟 node 本身有關，跨 event 快取；materialize 的結果可能被多個
+    event 共用，呼叫端不可修改。
+    """
+
+    def __init__(self):
+        self._texts: dict[int, tuple[list, str]] = {}
+        self._values: dict[int, tuple[list, object]] = {}
+
+    def render(self, value, view: dict) -> str:
+        if not _is_ref(value):
+            return repr(value)
+        return self._render(value["ref"], view, set())[0]
+
+    def materialize(self, value, view: dict):
+        if not _is_ref(value):
+            return value
+        return self._materialize(value["ref"], view, {})
+
+    def _render(self, oid: int, view: dict, active: set) -> tuple[str, bool]:
+        node = view[oid]
+        cached = self._texts.get(id(node))
+        if cached is not None and cached[0] is node:
+            return cached[1], True
+        kind, payload = node
+        if kind == "repr":
+            return payload, True
+        if oid in active:
+            return _RECURSIVE_TEXT[kind], False
+
+        active.add(oid)
+        flat = True
+
+        def part(item) -> str:
+            nonlocal flat
+            if not _is_ref(item):
+                return repr(item)
+            flat = False
+            return self._render(item["ref"], view, active)[0]
+
+        if kind == "dict":
+            text = "{" + ", ".join(f"{part(k)}: {part(v)}" for k, v in payload) + "}"
+        else:
+            inner = ", ".join(map(part, payload))
+            if kind == "list":
+                text = f"[{inner}]"
+            elif kind == "tuple":
+                text = f"({inner},)" if len(payload) == 1 else f"({inner})"
+            elif kind == "set":
+                text = f"{{{inner}}}" if payload else "set()"
+            else:
+                text = f"frozenset({{{inner}}})" if payload else "frozenset()"
+        active.discard(oid)
+        if flat:
+            self._texts[id(node)] = (node, text)
+        return text, flat
+
+    def _materialize(self, oid: int, view: dict, memo: dict):
+        if oid in memo:
+            return memo[oid]
+        node = view[oid]
+        cached = self._values.get(id(node))
+        if cached is not None and cached[0] is node:
+            return cached[1]
+        kind, payload = node
+        if kind == "repr":
+            out = OpaqueValue(payload)
+            memo[oid] = out
+            return out
+
+        def item(value):
+            return self._materialize(value["ref"], view, memo) if _is_ref(value) else value
+
+        # list / dict 先登記再填內容，循環參照才會指回同一個物件
+        if kind == "list":
+            out = memo[oid] = []
+            out.extend(map(item, payload))
+        elif kind == "dict":
+            out = memo[oid] = {}
+            for k, v in payload:
+                out[item(k)] = item(v)
+        elif kind == "tuple":
+            out = memo[oid] = tuple(map(item, payload))
+        elif kind == "set":
+            out = memo[oid] = set(map(item, payload))
+        else:
+            out = memo[oid] = frozenset(map(item, payload))
+        flat = not any(_is_ref(k) or _is_ref(v) for k, v in payload) if kind == "dict" \
+            else not any(map(_is_ref, payload))
+        if flat:
+            self._values[id(node)] = (node, out)
+        return out
+
+
+def _expand_objects(objects: list[list]) -> list[list]:
+    """object table → 完整 node（patch 套回 base 版本）。"""
+    nodes: list[list] = []
+    for entry in objects:
+        if entry[0] == "patch":
+            _, base, length, sets = entry
+            base_kind, base_items = nodes[base]
+            items = base_items[:length]
+            items.extend([None] * (length - len(items)))
+            for i, value in sets:
+                items[i] = value
+            nodes.append([base_kind, items])
+        else:
+            nodes.append(entry)
+    return nodes
+
+
+def _views(events: list[dict], objects: list[list]):
+    """依序套用每個 event 的 heap 差量，yield (event, view)。"""
+    nodes = _expand_objects(objects)
+    view: dict[int, list] = {}
+    for ev in events:
+        delta = ev.get("heap")
+        if delta:
+            view = {**view, **{oid: nodes[version] for oid, version in delta}}
+        yield ev, view
+
+
+def resolve_heap(events: list[dict], objects: list[list]) -> list[dict]:
+    """heap 值的完整 trace（已經 trace_codec 解完 delta）→ 前端 trace.ts 格式（repr 字串）。"""
+    reader = HeapReader()
+    resolved: list[dict] = []
+    for ev, view in _views(events, objects):
+        meta = ev.get("meta", {})
+        if "return_value" in meta:
+            meta = {**meta, "return_value": reader.render(meta["return_value"], view)}
+        resolved.append({
+            "tag": ev["tag"],
+            "local_vars": {k: reader.render(v, view) for k, v in ev.get("local_vars", {}).items()},
+            "global_vars": {k: reader.render(v, view) for k, v in ev.get("global_vars", {}).items()},
+            "dataSnapshot": ev.get("dataSnapshot", []),
+            "meta": meta,
+        })
+    return resolved
+
+
+def heap_local_values(events: list[dict], objects: list[list]) -> list[dict]:
+    """每個 event 的 local_vars 還原成 Python 值（list / dict / tuple…，其他物件為 OpaqueValue）。"""
+    reader = HeapReader()
+    return [
+        {k: reader.materialize(v, view) for k, v in ev.get("local_vars", {}).items()}
+        for ev, view in _views(events, objects)
+    ]
@@ -3,6 +3,7 @@ import hashlib
 from database import db
 from models.explorer import ExploreHistory
 from services.code_normalizer import normalize_code
+from services.trace_codec import unpack_trace
 
 MAX_HISTORY = 5
 
@@ -83,8 +84,8 @@ def serialize_history(record: ExploreHistory) -> dict:
         'created_at': record.created_at.isoformat(),
         'have_level1': record.have_level1,
         'is_truncated': record.is_truncated,
-        'execution_trace': record.execution_trace or [],
-        'raw_trace': record.raw_trace or [],
+        'execution_trace': unpack_trace(record.execution_trace),
+        'raw_trace': unpack_trace(record.raw_trace),
         'raw_index_map': record.raw_index_map or [],
         'call_graph': record.call_graph,
         'cfg_graph': record.cfg_graph or {},
@@ -6,66 +6,507 @@ sandbox-sidecar 執行，回傳結構化的 TraceResult dict。
 
 n: 若不為 None，sidecar 會在 code 末尾追加 explore_wrapper(n)（big-O 測量用）
 per_n_timeout: 覆蓋預設 CONTAINER_TIMEOUT（秒）
+count_only: True 時 runner 只計步數，回傳 step_count / line_hits / is_truncated（無 trace）
+on_trace_batch: 給定時走 sidecar 串流模式，執行中每收到一批 trace 就呼叫
+                on_trace_batch(start, events)；回傳值與非串流相同
+capture: trace 擷取策略（ring / stride / loop / keyframe…），結果的 capture 欄位回報實際採用的策略
+skip_cfg: True 時 container 不建 cfg_graph（回傳 {}），呼叫端改用 services/cfg_cache.py
+full_profile: True 時 trace 截斷後 runner 仍累計 profile 到程式結束（預設截斷即卸下 tracer，
+              profile.complete 為 false），截斷的程式會跑得慢很多
+priority / tenant: sidecar 容器池排隊用的優先級類別（PRIORITY_*）與使用者，
+                   忙碌時 interactive > primary > probe，同類別內各 tenant 輪流
+
+sidecar_capacity() 查 sidecar 目前還能直接接的 /run 數（services/admission.py 用）。
+
+多個 sidecar（SANDBOX_SIDECAR_URLS，逗號分隔）時在 client 端分流：
+- 每次挑 outstanding 請求最少的健康節點；連不上的節點暫停 NODE_DOWN_SECONDS，
+  之後以 GET /capacity 探測成功才放回
+- /run、/run_batch 在連線失敗或該節點 pool 滿載（503）時改送下一個節點
+- 互動 session 綁在建立它的節點：回傳的 session_id 編成 "<節點序號>:<sidecar session id>"，
+  send_input / check_session_alive / close_session 依此送回同一台，不做 failover
+
+run_batch_in_sandbox(code, n_values, per_n_timeout) 一次送出多個 n，sidecar 在同一個
+容器 exec 內依序執行（big-O 測量用），回傳每個 n 的 step_count / timed_out。
+
+互動 session 可改走 services/sandbox_channel.py 的 WebSocket 通道（回傳格式相同）。
+
+所有呼叫共用一個 per-process 的 requests.Session（keep-alive 連線池、連線失敗重試、
+(connect, read) 分開的 timeout）；connection_stats() 回報連線重用情形。
 
 永遠不 raise，錯誤透過回傳 {"error": "..."} 傳遞。
 """
 
+import base64
+import json
+import logging
 import os
+import threading
+import time
+import zlib
+from collections.abc import Callable
+from dataclasses import dataclass
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 SIDECAR_URL = os.environ.get("SANDBOX_SIDECAR_URL", "http://sandbox-sidecar:8080")
+# 多節點：逗號分隔的 sidecar 清單，沒設時只用 SIDECAR_URL。所有 backend / worker 的順序必須一致（session_id 帶節點序號）
+SIDECAR_URLS = [url.strip() for url in os.environ.get("SANDBOX_SIDECAR_URLS", "").split(",") if url.strip()]
+NODE_DOWN_SECONDS = float(os.environ.get("SANDBOX_NODE_DOWN_SECONDS", "5"))
+SESSION_NODE_SEP = ":"
 CONTAINER_TIMEOUT = 15  # 秒（比 sidecar 內部 10s 多一點，留網路開銷）
+# sidecar 對 compress=true 的 /run 以此 mimetype 回傳 zlib 壓縮的 JSON（見 sandbox_sidecar/app.py）
+COMPRESSED_RESULT_MIMETYPE = "application/vnd.codepulse.result+zlib"
+STREAM_MIMETYPE = "application/x-ndjson"
+# sidecar 端計時（等容器 / 啟動 runner / 執行的毫秒數），_decode_response 併入結果的 sandbox_timings
+TIMINGS_HEADER = "X-Sandbox-Timings"
 
+# sidecar 容器池的優先級類別（見 sandbox_sidecar/container_pool.py PRIORITY_CLASSES）
+PRIORITY_INTERACTIVE = "interactive"   # 互動 session（使用者正在輸入）
+PRIORITY_PRIMARY = "primary"           # 使用者看得到的主 trace
+PRIORITY_PROBE = "probe"               # 背景 big-O 測量
 
-def run_in_sandbox(
+# 每個節點保留的連線數（超過時照樣連線，只是用完不留）。Celery prefork 每個 process 一次一個
+# task，同時只有一條（主 trace 的 /run 與互動 input / heartbeat 之後，measure_step_counts 只送
+# 一個 /run_batch）；上限由 gunicorn gthread 決定（--threads 10 各打一個 /run），16 留點餘裕
+HTTP_POOL_SIZE = int(os.environ.get("SANDBOX_HTTP_POOL_SIZE", "16"))
+CONNECT_TIMEOUT = 2.0   # 秒：建立 TCP 連線；read timeout 依各呼叫的執行時間上限
+CONNECT_RETRIES = 2     # 只重試連線階段（request 尚未送出，POST 也安全）
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+
+def _http() -> requests.Session:
+    """
+    per-process 共用的 Session（thread-safe：底層 urllib3 連線池自帶 lock）。
+    fork 之後（Celery prefork worker）第一次呼叫會重建，不沿用父行程的 socket。
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                retry = Retry(
+                    total=CONNECT_RETRIES,
+                    connect=CONNECT_RETRIES,
+                    read=0,
+                    status=0,
+                    redirect=0,
+                    other=0,
+                    backoff_factor=0.1,
+                )
+                # 每個 sidecar 節點一個 urllib3 pool：只留 1 個時多節點會互相擠掉，連線無法重用
+                adapter = HTTPAdapter(
+                    pool_connections=max(1, len(SIDECAR_URLS)), pool_maxsize=HTTP_POOL_SIZE, max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session, _session_pid = session, pid
+    return _session
+
+
+def connection_stats() -> dict:
+    """
+    連線重用統計（本 process）：requests = 送出的請求數，connections_opened = 新建的 TCP 連線數，
+    reuse_ratio = 走既有 keep-alive 連線的比例。
+    """
+    session = _session if _session_pid == os.getpid() else None
+    requests_sent = opened = 0
+    if session is not None:
+        for adapter in set(session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[key]
+                requests_sent += pool.num_requests
+                opened += pool.num_connections
+    reused = max(0, requests_sent - opened)
+    return {
+        "requests": requests_sent,
+        "connections_opened": opened,
+        "reused": reused,
+        "reuse_ratio": reused / requests_sent if requests_sent else 0.0,
+        "pool_size": HTTP_POOL_SIZE,
+    }
+
+
+@dataclass
+class SidecarNode:
+    index: int
+    url: str
+    outstanding: int = 0       # 本 process 送出、還沒收完回應的請求 / 開著的通道
+    handed_out: int = 0        # 累計分配次數，outstanding 相同時輪流
+    down: bool = False
+    down_until: float = 0.0
+    probing: bool = False
+    failures: int = 0
+
+
+_nodes: list[SidecarNode] = []
+_nodes_key: tuple[str, ...] = ()
+_nodes_lock = threading.Lock()
+
+
+def _sidecar_nodes() -> list[SidecarNode]:
+    """目前設定的節點（SIDECAR_URLS / SIDECAR_URL 改變時重建，計數歸零）。"""
+    global _nodes, _nodes_key
+    key = tuple(url.rstrip("/") for url in (SIDECAR_URLS or [SIDECAR_URL]))
+    with _nodes_lock:
+        if key != _nodes_key:
+            _nodes = [SidecarNode(index, url) for index, url in enumerate(key)]
+            _nodes_key = key
+        return _nodes
+
+
+def node_count() -> int:
+    return len(_sidecar_nodes())
+
+
+def _probe_node(node: SidecarNode) -> bool:
+    try:
+        return _http().get(f"{node.url}/capacity", timeout=(CONNECT_TIMEOUT, 1)).status_code < 500
+    except Exception:
+        return False
+
+
+def _revive_due_nodes(nodes: list[SidecarNode]) -> None:
+    """暫停期滿的節點探測一次（同一節點同時只有一個 thread 探測），成功才放回。"""
+    now = time.monotonic()
+    for node in nodes:
+        with _nodes_lock:
+            due = node.down and not node.probing and node.down_until <= now
+            if due:
+                node.probing = True
+        if not due:
+            continue
+        healthy = _probe_node(node)
+        with _nodes_lock:
+            node.probing = False
+            if healthy:
+                node.down, node.failures = False, 0
+                logger.info("sandbox sidecar %s is back", node.url)
+            else:
+                node.down_until = time.monotonic() + NODE_DOWN_SECONDS
+
+
+def acquire_node(exclude: tuple[SidecarNode, ...] = ()) -> SidecarNode | None:
+    """
+    挑 outstanding 最少的健康節點並佔一個名額（用完呼叫 release_node）。
+    全部都不健康時仍挑一個（可能已恢復，失敗也會照常回錯誤）；exclude 排除後沒有節點回 None。
+    """
+    nodes = _sidecar_nodes()
+    if len(nodes) > 1:
+        _revive_due_nodes(nodes)
+    with _nodes_lock:
+        candidates = [node for node in nodes if node not in exclude]
+        if not candidates:
+            return None
+        healthy = [node for node in candidates if not node.down]
+        node = min(healthy or candidates, key=lambda n: (n.outstanding, n.handed_out))
+        node.outstanding += 1
+        node.handed_out += 1
+        return node
+
+
+def release_node(node: SidecarNode, failed: bool = False) -> None:
+    """歸還 acquire_node 的名額；failed = 連不上，節點暫停 NODE_DOWN_SECONDS。"""
+    with _nodes_lock:
+        node.outstanding = max(0, node.outstanding - 1)
+        if not failed:
+            # 有回應就代表節點活著（全部節點都暫停時仍會被挑中）
+            node.down = False
+            return
+        node.failures += 1
+        if not node.down:
+            logger.warning("sandbox sidecar %s unreachable, pausing for %.0fs", node.url, NODE_DOWN_SECONDS)
+        node.down = True
+        node.down_until = time.monotonic() + NODE_DOWN_SECONDS
+
+
+def node_stats() -> list[dict]:
+    with _nodes_lock:
+        return [
+            {"url": n.url, "outstanding": n.outstanding, "handed_out": n.handed_out,
+             "down": n.down, "failures": n.failures}
+            for n in _nodes
+        ]
+
+
+def pin_session(node: SidecarNode, result: dict) -> dict:
+    """回應裡的 session_id 加上節點序號，之後的 /input、/session 呼叫才送得回同一台。"""
+    session_id = result.get("session_id") if isinstance(result, dict) else None
+    if session_id:
+        return {**result, "session_id": f"{node.index}{SESSION_NODE_SEP}{session_id}"}
+    return result
+
+
+def _session_node(session_id: str) -> tuple[SidecarNode, str]:
+    """pin_session 的反向；沒有節點前綴（單節點時代的 id）或序號超出範圍時視為第一台。"""
+    nodes = _sidecar_nodes()
+    prefix, sep, raw = session_id.partition(SESSION_NODE_SEP)
+    if sep and prefix.isdigit() and int(prefix) < len(nodes):
+        return nodes[int(prefix)], raw
+    return nodes[0], session_id
+
+
+def _post_with_failover(path: str, **kwargs) -> tuple[SidecarNode, requests.Response]:
+    """
+    POST 到 acquire_node 挑的節點；連不上或該節點 pool 滿載（503）時換下一個節點重送。
+    回傳的節點仍佔著名額，呼叫端收完回應後 release_node。逾時不換（code 可能已經跑完一輪）。
+    """
+    tried: tuple[SidecarNode, ...] = ()
+    while True:
+        node = acquire_node(exclude=tried)
+        if node is None:
+            raise requests.ConnectionError("no sandbox sidecar available")
+        tried += (node,)
+        has_next = len(tried) < len(_sidecar_nodes())
+        try:
+            resp = _http().post(f"{node.url}{path}", **kwargs)
+        except requests.ConnectionError:
+            release_node(node, failed=True)
+            if has_next:
+                continue
+            raise
+        except BaseException:
+            release_node(node)
+            raise
+        if resp.status_code == 503 and has_next:
+            logger.info("sandbox sidecar %s pool exhausted, trying next node", node.url)
+            resp.close()
+            release_node(node)
+            continue
+        return node, resp
+
+
+def _decode_response(resp) -> dict:
+    """
+    sidecar 回應 → dict。壓縮結果只在這裡 decompress + json.loads 一次；
+    X-Sandbox-Timings header 併入 body 的 sandbox_timings（串流 / WebSocket 的 body 本來就帶）。
+    """
+    if resp.headers.get("Content-Type", "").startswith(COMPRESSED_RESULT_MIMETYPE):
+        body = json.loads(zlib.decompress(resp.content))
+    else:
+        body = resp.json()
+    timings = resp.headers.get(TIMINGS_HEADER)
+    if timings and isinstance(body, dict):
+        try:
+            body["sandbox_timings"] = json.loads(timings)
+        except ValueError:
+            logger.warning("invalid %s header: %.200s", TIMINGS_HEADER, timings)
+    return body
+
+
+def _consume_stream(resp, on_trace_batch: Callable[[int, list[dict]], None]) -> dict:
+    """逐行讀 sidecar 的 NDJSON：trace_batch 交給 callback，其餘那一行就是最終回應。"""
+    if not resp.headers.get("Content-Type", "").startswith(STREAM_MIMETYPE):
+        # 舊版 sidecar 不認得 stream 旗標，回的是一般 JSON
+        return _decode_response(resp)
+    result: dict = {"error": "sandbox stream ended without result", "is_truncated": False,
+                    "trace": [], "call_graph": None, "cfg_graph": {}}
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        message = json.loads(line)
+        if message.get("type") == "result_z":
+            # 壓縮的最終結果（帶 compress 的串流）：解壓後併回 sidecar 計時
+            result = json.loads(zlib.decompress(base64.b64decode(message["payload_z"])))
+            if "sandbox_timings" in message and isinstance(result, dict):
+                result["sandbox_timings"] = message["sandbox_timings"]
+            continue
+        if message.get("type") != "trace_batch":
+            result = message
+            continue
+        try:
+            on_trace_batch(message.get("start", 0), message.get("events", []))
+        except Exception:
+            # 串流只是提早預覽，callback 失敗不影響最終結果
+            logger.warning("on_trace_batch callback failed", exc_info=True)
+    return result
+
+
+def build_run_body(
     code: str,
     n: int | None = None,
     per_n_timeout: int | None = None,
     stdin_inputs: list[str] | None = None,
+    count_only: bool = False,
+    stream: bool = False,
+    capture: dict | None = None,
+    skip_cfg: bool = False,
+    priority: str | None = None,
+    tenant: str | None = None,
+    full_profile: bool = False,
 ) -> dict:
     """
-    透過 sandbox-sidecar HTTP API 執行 code。
-
-    Returns:
-        成功：{"trace": [...], "call_graph": {...}, "cfg_graph": {...},
-               "is_truncated": bool, "step_count": int}
-        需要輸入：{"error": "input_needed", "prompt": "...", "input_index": int}
-        失敗：{"error": "<message>", "is_truncated": bool, "trace": []}
+    /run 的 request body（services/sandbox_channel.py 的 WebSocket 通道共用同一格式）。
+    priority 沒給時：帶 n / count_only 的是 big-O 測量（probe），其餘是主 trace（primary）。
     """
-    body: dict = {"code": code}
+    if priority is None:
+        priority = PRIORITY_PROBE if n is not None or count_only else PRIORITY_PRIMARY
+    body: dict = {"code": code, "compress": True, "priority": priority}
     if n is not None:
         body["n"] = n
     if per_n_timeout is not None:
         body["per_n_timeout"] = per_n_timeout
     if stdin_inputs is not None:
         body["stdin_inputs"] = stdin_inputs
+    if count_only:
+        body["count_only"] = True
+    if stream:
+        body["stream"] = True
+    if capture is not None:
+        body["capture"] = capture
+    if skip_cfg:
+        body["skip_cfg"] = True
+    if full_profile:
+        body["profile"] = True
+    if tenant is not None:
+        body["tenant"] = tenant
+    return body
+
 
+def run_in_sandbox(
+    code: str,
+    n: int | None = None,
+    per_n_timeout: int | None = None,
+    stdin_inputs: list[str] | None = None,
+    count_only: bool = False,
+    on_trace_batch: Callable[[int, list[dict]], None] | None = None,
+    capture: dict | None = None,
+    skip_cfg: bool = False,
+    priority: str | None = None,
+    tenant: str | None = None,
+    full_profile: bool = False,
+) -> dict:
+    """
+    透過 sandbox-sidecar HTTP API 執行 code。
+
+    capture：trace 擷取策略（services.tracer.parse_capture 的格式），None 為預設的前 N 步。
+    skip_cfg：不在 container 內建 CFG，結果的 cfg_graph 為 {}。
+    full_profile：trace 截斷後仍累計完整 profile（見模組 docstring）。
+    priority / tenant：容器池排隊的類別與使用者（見 build_run_body）。
+
+    Returns:
+        成功：{"trace": [...], "call_graph": {...}, "cfg_graph": {...},
+               "is_truncated": bool, "step_count": int,
+               "usage": {runner 量的 CPU / 序列化 / cgroup throttle 與記憶體},
+               "sandbox_timings": {"acquire_ms", "exec_start_ms", "run_ms"}}
+        count_only：{"step_count": int, "is_truncated": bool, "line_hits": {"<lineno>": int}}
+        需要輸入：{"error": "input_needed", "prompt": "...", "input_index": int}
+        失敗：{"error": "<message>", "is_truncated": bool, "trace": []}
+    """
+    body = build_run_body(
+        code, n, per_n_timeout, stdin_inputs, count_only,
+        stream=on_trace_batch is not None, capture=capture, skip_cfg=skip_cfg,
+        priority=priority, tenant=tenant, full_profile=full_profile,
+    )
     effective_timeout = per_n_timeout if per_n_timeout is not None else CONTAINER_TIMEOUT
     http_timeout = effective_timeout + 5  # buffer for container startup + network overhead
 
+    node = None
     try:
-        resp = requests.post(
-            f"{SIDECAR_URL}/run",
+        node, resp = _post_with_failover(
+            "/run",
             json=body,
-            timeout=http_timeout,
+            timeout=(CONNECT_TIMEOUT, http_timeout),
+            stream=on_trace_batch is not None,
         )
-        return resp.json()
+        if on_trace_batch is not None:
+            return pin_session(node, _consume_stream(resp, on_trace_batch))
+        return pin_session(node, _decode_response(resp))
     except requests.Timeout:
         return {"error": "timeout", "is_truncated": True, "trace": [], "call_graph": None, "cfg_graph": {}}
     except requests.ConnectionError as e:
         return {"error": f"sandbox sidecar unavailable: {e}", "is_truncated": False, "trace": [], "call_graph": None, "cfg_graph": {}}
     except Exception as e:
         return {"error": f"sandbox error: {e}", "is_truncated": False, "trace": [], "call_graph": None, "cfg_graph": {}}
+    finally:
+        if node is not None:
+            release_node(node)
+
+
+def run_batch_in_sandbox(
+    code: str,
+    n_values: list[int],
+    per_n_timeout: int,
+    tenant: str | None = None,
+) -> dict:
+    """
+    透過 sandbox-sidecar /run_batch 對多個 n 執行 code（code 需定義 explore_wrapper(n)）。
+
+    Returns:
+        成功：{"results": [{"n": int, "step_count": int, "is_truncated": bool,
+                            "timed_out": bool, "error"?: str}, ...]}
+        失敗：{"error": "<message>", ...}
+    """
+    body = {"code": code, "n_values": list(n_values), "per_n_timeout": per_n_timeout, "priority": PRIORITY_PROBE}
+    if tenant is not None:
+        body["tenant"] = tenant
+    http_timeout = per_n_timeout * len(n_values) + 5
+
+    node = None
+    try:
+        node, resp = _post_with_failover(
+            "/run_batch",
+            json=body,
+            timeout=(CONNECT_TIMEOUT, http_timeout),
+        )
+        return _decode_response(resp)
+    except requests.Timeout:
+        return {"error": "timeout", "results": []}
+    except requests.ConnectionError as e:
+        return {"error": f"sandbox sidecar unavailable: {e}", "results": []}
+    except Exception as e:
+        return {"error": f"sandbox error: {e}", "results": []}
+    finally:
+        if node is not None:
+            release_node(node)
+
+
+def _node_capacity(node: SidecarNode) -> dict | None:
+    try:
+        resp = _http().get(f"{node.url}/capacity", timeout=(CONNECT_TIMEOUT, 1))
+        if resp.status_code != 200:
+            return None
+        body = resp.json()
+    except Exception:
+        return None
+    return body if isinstance(body, dict) and isinstance(body.get("available"), int) else None
+
+
+def sidecar_capacity() -> dict | None:
+    """
+    sidecar /capacity（{"available": int, ...}，見 ContainerPool.capacity）；多節點時加總健康節點的
+    available / max_size，並帶 nodes = 有回應的節點數。
+    全部連不上、逾時或舊版 sidecar 沒有這個 endpoint 時回 None，呼叫端應視為「不限制」。
+    """
+    nodes = [node for node in _sidecar_nodes() if not node.down]
+    if len(nodes) <= 1:
+        return _node_capacity(nodes[0] if nodes else _sidecar_nodes()[0])
+    reports = [report for report in map(_node_capacity, nodes) if report is not None]
+    if not reports:
+        return None
+    return {
+        "available": sum(report["available"] for report in reports),
+        "max_size": sum(report.get("max_size", 0) for report in reports),
+        "nodes": len(reports),
+    }
 
 
 def send_input(session_id: str, value: str) -> dict:
+    node, raw_id = _session_node(session_id)
     try:
-        resp = requests.post(
-            f"{SIDECAR_URL}/input/{session_id}",
+        resp = _http().post(
+            f"{node.url}/input/{raw_id}",
             json={"value": value},
-            timeout=CONTAINER_TIMEOUT + 5,
+            timeout=(CONNECT_TIMEOUT, CONTAINER_TIMEOUT + 5),
         )
-        return resp.json()
+        return pin_session(node, _decode_response(resp))
     except requests.Timeout:
         return {"status": "failed", "error": "timeout"}
     except requests.ConnectionError as e:
@@ -75,10 +516,11 @@ def send_input(session_id: str, value: str) -> dict:
 
 
 def check_session_alive(session_id: str) -> bool:
+    node, raw_id = _session_node(session_id)
     try:
-        resp = requests.get(
-            f"{SIDECAR_URL}/session/{session_id}/alive",
-            timeout=5,
+        resp = _http().get(
+            f"{node.url}/session/{raw_id}/alive",
+            timeout=(CONNECT_TIMEOUT, 5),
         )
         if resp.status_code != 200:
             return False
@@ -89,10 +531,11 @@ def check_session_alive(session_id: str) -> bool:
 
 
 def close_session(session_id: str) -> dict:
+    node, raw_id = _session_node(session_id)
     try:
-        resp = requests.post(
-            f"{SIDECAR_URL}/session/{session_id}/close",
-            timeout=5,
+        resp = _http().post(
+            f"{node.url}/session/{raw_id}/close",
+            timeout=(CONNECT_TIMEOUT, 5),
         )
         return resp.json()
     except requests.ConnectionError as e:
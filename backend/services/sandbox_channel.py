@@ -0,0 +1,183 @@
+"""
+sandbox_channel.py — worker ↔ sandbox-sidecar 的常駐 WebSocket 通道（互動 session 用）
+
+HTTP 模式下每次 input() 都要一個 POST /input/<session_id>，等待期間再以
+GET /session/<id>/alive 做 heartbeat。SandboxChannel 在 session 整段生命週期內
+維持一條 WebSocket（sidecar 的 /ws/run，僅 SIDECAR_SERVER=asgi 提供）：
+run 請求、trace_batch、input_needed、input 與最終結果都在同一條連線上多工。
+
+open_channel() 在通道不可用時回 None（未安裝 websockets、SANDBOX_CHANNEL=0、
+sidecar 是不支援 WebSocket 的 Flask 版），呼叫端退回 services.sandbox 的 HTTP 路徑。
+握手被拒後 CHANNEL_RETRY_SECONDS 內不再嘗試，避免每次分析都多一次失敗的連線。
+多個 sidecar 時通道連到 services.sandbox.acquire_node 挑的節點，開著期間算該節點的一個 outstanding。
+
+run() / send_input() 的回傳值與 run_in_sandbox() / send_input() 相同，永遠不 raise。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+
+from services.sandbox import (
+    CONNECT_TIMEOUT,
+    CONTAINER_TIMEOUT,
+    SidecarNode,
+    acquire_node,
+    build_run_body,
+    node_count,
+    pin_session,
+    release_node,
+)
+
+try:
+    from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidURI
+    from websockets.sync.client import connect as ws_connect
+except ImportError:  # pragma: no cover - websockets 未安裝時一律走 HTTP
+    ws_connect = None
+
+logger = logging.getLogger(__name__)
+
+# auto：sidecar 支援就用；0：一律 HTTP
+CHANNEL_MODE = os.environ.get("SANDBOX_CHANNEL", "auto")
+CHANNEL_RETRY_SECONDS = 60.0
+PING_INTERVAL = 10.0  # 秒：等使用者輸入期間由 websockets 背景 thread 自動 ping
+
+_unavailable_until = 0.0
+_unavailable_lock = threading.Lock()
+
+
+def _channel_url(base: str) -> str:
+    base = base.rstrip("/")
+    if base.startswith("https://"):
+        return "wss://" + base[len("https://"):] + "/ws/run"
+    return "ws://" + base.removeprefix("http://") + "/ws/run"
+
+
+def _failed_run(error: str, *, is_truncated: bool = False) -> dict:
+    return {"error": error, "is_truncated": is_truncated, "trace": [], "call_graph": None, "cfg_graph": {}}
+
+
+class SandboxChannel:
+    """一條 /ws/run 連線 = 一個 sandbox session。非 thread-safe，由單一 worker thread 使用。"""
+
+    def __init__(self, connection, node: SidecarNode | None = None):
+        self._ws = connection
+        self._node = node
+        self._timeout: float = CONTAINER_TIMEOUT + 5
+
+    def run(
+        self,
+        code: str,
+        n: int | None = None,
+        per_n_timeout: int | None = None,
+        stdin_inputs: list[str] | None = None,
+        count_only: bool = False,
+        on_trace_batch: Callable[[int, list[dict]], None] | None = None,
+        capture: dict | None = None,
+        skip_cfg: bool = False,
+        priority: str | None = None,
+        tenant: str | None = None,
+    ) -> dict:
+        """同 run_in_sandbox()；需要輸入時回 {"status": "input_needed", "session_id", ...}，連線保持。"""
+        body = build_run_body(
+            code, n, per_n_timeout, stdin_inputs, count_only,
+            stream=on_trace_batch is not None, capture=capture, skip_cfg=skip_cfg,
+            priority=priority, tenant=tenant,
+        )
+        body.pop("compress", None)
+        effective_timeout = per_n_timeout if per_n_timeout is not None else CONTAINER_TIMEOUT
+        self._timeout = effective_timeout + 5
+        try:
+            self._ws.send(json.dumps({"type": "run", "body": body}))
+            return self._read_response(on_trace_batch)
+        except TimeoutError:
+            return _failed_run("timeout", is_truncated=True)
+        except (ConnectionClosed, OSError) as e:
+            return _failed_run(f"sandbox channel closed: {e}")
+        except Exception as e:
+            return _failed_run(f"sandbox error: {e}")
+
+    def send_input(self, value: str, on_trace_batch: Callable[[int, list[dict]], None] | None = None) -> dict:
+        """同 services.sandbox.send_input()，但不必另開 HTTP 請求。"""
+        try:
+            self._ws.send(json.dumps({"type": "input", "value": value}))
+            return self._read_response(on_trace_batch)
+        except TimeoutError:
+            return {"status": "failed", "error": "timeout"}
+        except (ConnectionClosed, OSError) as e:
+            return {"status": "failed", "error": f"sandbox channel closed: {e}"}
+        except Exception as e:
+            return {"status": "failed", "error": f"sandbox error: {e}"}
+
+    def is_alive(self) -> bool:
+        """連線仍開著即 session 仍在：runner 中途結束時 sidecar 會送出結果並關閉連線。"""
+        try:
+            return self._ws.ping().wait(CONNECT_TIMEOUT)
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        """關閉連線；sidecar 端據此回收 session 與容器。"""
+        try:
+            self._ws.send(json.dumps({"type": "close"}))
+        except Exception:
+            pass
+        try:
+            self._ws.close()
+        except Exception:
+            logger.warning("failed to close sandbox channel", exc_info=True)
+        if self._node is not None:
+            release_node(self._node)
+            self._node = None
+
+    def _read_response(self, on_trace_batch) -> dict:
+        deadline = time.monotonic() + self._timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            message = json.loads(self._ws.recv(timeout=remaining))
+            if message.get("type") == "response":
+                body = message.get("body") or {}
+                # session 只活在這條連線上，id 仍帶節點，與 HTTP 路徑的格式一致
+                return pin_session(self._node, body) if self._node is not None else body
+            if message.get("type") != "trace_batch" or on_trace_batch is None:
+                continue
+            try:
+                on_trace_batch(message.get("start", 0), message.get("events", []))
+            except Exception:
+                # 串流只是提早預覽，callback 失敗不影響最終結果
+                logger.warning("on_trace_batch callback failed", exc_info=True)
+
+
+def open_channel() -> SandboxChannel | None:
+    """連上 sidecar 的 /ws/run；不可用時回 None（呼叫端改走 HTTP）。"""
+    global _unavailable_until
+    if ws_connect is None or CHANNEL_MODE == "0":
+        return None
+    if time.monotonic() < _unavailable_until:
+        return None
+    node = acquire_node()
+    if node is None:
+        return None
+    try:
+        connection = ws_connect(
+            _channel_url(node.url),
+            open_timeout=CONNECT_TIMEOUT,
+            ping_interval=PING_INTERVAL,
+            max_size=None,  # 完整結果（trace）可能數 MB
+            compression=None,
+        )
+    except (InvalidHandshake, InvalidURI, OSError, TimeoutError) as e:
+        unreachable = isinstance(e, (OSError, TimeoutError))
+        release_node(node, failed=unreachable)
+        # 連不上只暫停該節點（多節點時 HTTP 路徑會 failover）；握手被拒代表 sidecar 不支援通道
+        if not unreachable or node_count() == 1:
+            with _unavailable_lock:
+                _unavailable_until = time.monotonic() + CHANNEL_RETRY_SECONDS
+        logger.info("sandbox channel unavailable on %s, using http: %s", node.url, e)
+        return None
+    return SandboxChannel(connection, node)
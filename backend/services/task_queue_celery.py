@@ -6,6 +6,7 @@ import redis as redis_lib
 from celery.result import AsyncResult
 
 from celery_app import celery_app  # noqa: F401 - ensures celery_app is configured
+from services import admission
 from services.task_queue import STAGE_DONE, CANCEL_INPUT_VALUE
 
 PROGRESS_TTL = 300  # seconds, aligned with result_expires in celery_app.py
@@ -109,6 +110,8 @@ class CeleryTaskQueue:
         key = f"analyze:input:{task_id}"
         self._redis.rpush(key, CANCEL_INPUT_VALUE)
         self._redis.expire(key, PROGRESS_TTL)
+        # 還在等 sandbox 空位的 task 不再佔排隊位置（見 services.admission）
+        admission.release(task_id)
 
     def mark_waiting_for_input(self, task_id: str, session_id: str) -> None:
         key = f"analyze:session:{task_id}"
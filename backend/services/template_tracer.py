@@ -111,21 +111,18 @@ def _extract_user_snapshots(user_raw_trace) -> list:
     從用戶 raw trace 提取 list 型別變數的快照序列。
     只保留狀態有變化的快照點（去除連續重複）。
     回傳 list of (snapshot, raw_index)。
+
+    local_vars 的值是 heap_snapshot 還原的 Python 值（不是 repr 字串），直接判斷型別。
     """
-    import ast
     snapshots: list = []
     last_snapshot = None
 
     for raw_idx, event in enumerate(user_raw_trace):
-        for val_str in event.local_vars.values():
-            try:
-                val = ast.literal_eval(val_str)
-                if isinstance(val, list) and val != last_snapshot:
-                    snapshots.append((val, raw_idx))
-                    last_snapshot = val
-                    break  # 每個 event 只取第一個 list 變數
-            except (ValueError, SyntaxError):
-                continue
+        for val in event.local_vars.values():
+            if isinstance(val, list) and val != last_snapshot:
+                snapshots.append((val, raw_idx))
+                last_snapshot = val
+                break  # 每個 event 只取第一個 list 變數
 
     return snapshots
 
@@ -0,0 +1,124 @@
+"""
+trace_codec.py — trace 差量編碼（keyframe + delta）
+
+runner 每個 event 都帶完整 local_vars / global_vars，但相鄰 event 通常只改一兩個變數。
+encode_trace() 每 KEYFRAME_INTERVAL 個 event 存一次完整快照（keyframe），其餘只存
+有變化的 key（local_vars / global_vars）與被刪除的 key（local_del / global_del）。
+decode_trace() 還原成前端 trace.ts 的完整格式。
+
+runner 以 heap 值輸出變數時（heap_snapshot.py），每個 event 的 heap 差量原樣帶過；
+decode_trace() 給了 heap_objects 就順便還原成 repr 字串。
+
+同時在 sandbox container（runner.py，flat import）與 backend（services.trace_codec）使用，
+除了同樣 flat 部署的 heap_snapshot，不可依賴 services 套件內其他模組。
+"""
+from __future__ import annotations
+
+try:
+    from services.heap_snapshot import resolve_heap
+except ImportError:
+    from heap_snapshot import resolve_heap
+
+TRACE_ENCODING_DELTA = "delta"
+KEYFRAME_INTERVAL = 50
+
+_MISSING = object()
+
+
+def _diff(prev: dict, cur: dict) -> tuple[dict, list]:
+    # 值是 repr 字串或 heap 值；tracer 的快取讓未變的值是同一個物件，!= 走 identity 捷徑
+    changed = {k: v for k, v in cur.items() if prev.get(k, _MISSING) != v}
+    removed = [k for k in prev if k not in cur]
+    return changed, removed
+
+
+def encode_trace(events: list[dict], keyframe_interval: int = KEYFRAME_INTERVAL) -> list[dict]:
+    """完整 trace（list of event dict）→ delta 編碼。第 0 個 event 一定是 keyframe。"""
+    encoded: list[dict] = []
+    prev_locals: dict = {}
+    prev_globals: dict = {}
+
+    for i, ev in enumerate(events):
+        local_vars = ev.get("local_vars", {})
+        global_vars = ev.get("global_vars", {})
+        out = {
+            "tag": ev["tag"],
+            "dataSnapshot": ev.get("dataSnapshot", []),
+            "meta": ev.get("meta", {}),
+        }
+        if "heap" in ev:
+            out["heap"] = ev["heap"]
+        if i % keyframe_interval == 0:
+            out["keyframe"] = True
+            out["local_vars"] = local_vars
+            out["global_vars"] = global_vars
+        else:
+            out["local_vars"], local_del = _diff(prev_locals, local_vars)
+            out["global_vars"], global_del = _diff(prev_globals, global_vars)
+            if local_del:
+                out["local_del"] = local_del
+            if global_del:
+                out["global_del"] = global_del
+        encoded.append(out)
+        prev_locals = local_vars
+        prev_globals = global_vars
+
+    return encoded
+
+
+def decode_trace(events: list[dict], encoding: str | None, heap_objects: list | None = None) -> list[dict]:
+    """
+    delta 編碼 → 完整 trace。encoding 為 None（舊 runner / 舊資料）時原樣回傳。
+    heap_objects（runner 的 heap_objects）給定時，變數的 heap 值還原成 repr 字串。
+    """
+    if encoding != TRACE_ENCODING_DELTA:
+        return resolve_heap(events, heap_objects) if heap_objects is not None else events
+
+    decoded: list[dict] = []
+    local_vars: dict = {}
+    global_vars: dict = {}
+
+    for ev in events:
+        if ev.get("keyframe"):
+            local_vars = dict(ev.get("local_vars", {}))
+            global_vars = dict(ev.get("global_vars", {}))
+        else:
+            local_vars = {**local_vars, **ev.get("local_vars", {})}
+            for k in ev.get("local_del", ()):
+                local_vars.pop(k, None)
+            global_vars = {**global_vars, **ev.get("global_vars", {})}
+            for k in ev.get("global_del", ()):
+                global_vars.pop(k, None)
+        out = {
+            "tag": ev["tag"],
+            "local_vars": local_vars,
+            "global_vars": global_vars,
+            "dataSnapshot": ev.get("dataSnapshot", []),
+            "meta": ev.get("meta", {}),
+        }
+        if "heap" in ev:
+            out["heap"] = ev["heap"]
+        decoded.append(out)
+
+    if heap_objects is not None:
+        return resolve_heap(decoded, heap_objects)
+    return decoded
+
+
+def pack_trace(events: list[dict], encoding: str | None, heap_objects: list | None = None) -> list | dict:
+    """存進 DB JSON 欄位用：已編碼的 trace 連同 encoding（與 heap object table）一起存，未編碼就存原本的 list。"""
+    if encoding is None and heap_objects is None:
+        return events
+    packed = {"encoding": encoding, "events": events}
+    if heap_objects is not None:
+        packed["heap_objects"] = heap_objects
+    return packed
+
+
+def unpack_trace(stored) -> list[dict]:
+    """pack_trace 的反向；也接受舊資料（純 list）與 None。"""
+    if not stored:
+        return []
+    if isinstance(stored, dict):
+        return decode_trace(stored.get("events", []), stored.get("encoding"), stored.get("heap_objects"))
+    return stored
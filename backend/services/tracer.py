@@ -6,14 +6,30 @@ tracer.py — sys.settrace PoC
 2. call/return events 建構 CallGraph
 3. MAX_TRACE_STEPS 硬限制
 4. 執行緒安全（閉包封裝，不用 module-level globals）
+5. ExecutionProfile：整段執行的行命中 / 函式呼叫彙總，不受 MAX_TRACE_STEPS 截斷
+6. backend：3.12+ 可改用 sys.monitoring（PEP 669），輸出與 settrace 相同、開銷較低
+7. heap=True：變數記成結構化 heap 值（見 heap_snapshot.py），不 repr
 """
 from __future__ import annotations
 
 import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
 from collections.abc import Callable
+from operator import is_
 from dataclasses import dataclass, field
 from typing import TYPE_CHECKING
+
+try:
+    from services.heap_snapshot import HeapRecorder
+except ImportError:
+    from heap_snapshot import HeapRecorder  # sandbox container 內 flat import
+
 if TYPE_CHECKING:
+    from types import FrameType
+
     from services.cfg_builder import CfgGraph
 
 
@@ -41,6 +57,9 @@ class LegacyInputNeededError(Exception):
 
 
 MAX_TRACE_STEPS = 2000
+TRACE_BATCH_SIZE = 100  # run_trace(on_batch=...) 每累積這麼多 event 回呼一次
+KEYFRAME_EVERY = 50     # capture strategy keyframe 的預設間隔
+EDGE_STEPS_LIMIT = 256  # 每條 call edge 預設最多記幾個 CALL / RETURN 的 trace index
 
 RESTRICTED_BUILTINS = {
     "range", "len", "print", "int", "float", "str", "bool",
@@ -66,6 +85,57 @@ def _is_internal_symbol(func_name: str) -> bool:
     return func_name.startswith("_") or ("<" in func_name and func_name != "<module>")
 
 
+# repr 只由自身 identity 決定的型別：同一物件 → 同一 repr
+_ATOMIC_TYPES = frozenset({int, float, complex, str, bytes, bool, type(None)})
+_REPR_CACHE_MAX = 4096
+
+
+def _flat_unchanged(value, snapshot) -> bool:
+    """list / dict 的廉價版本檢查：長度相同且每個元素（dict 含 key）仍是同一物件。"""
+    if len(value) != len(snapshot):
+        return False
+    if type(value) is dict:
+        return all(map(is_, value, snapshot)) and all(map(is_, value.values(), snapshot.values()))
+    return all(map(is_, value, snapshot))
+
+
+class _ReprCache:
+    """
+    每個 event 都對所有變數 repr() 是 O(steps × vars × value size)。這裡以 id 快取上次的
+    repr 字串，命中條件：
+    - atomic 型別（int/str/...）：同一物件即可重用
+    - 元素全為 atomic 的 list / dict：另存一份淺拷貝，元素 identity 都沒變才重用
+    其他型別（巢狀容器、tuple、set…）一律重新 repr。
+    快取持有物件參照，避免 id 被回收重用；超過 _REPR_CACHE_MAX 筆就整個清空。
+    """
+
+    def __init__(self):
+        self._entries: dict[int, tuple] = {}
+
+    def __call__(self, value) -> str:
+        key = id(value)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is value:
+            snapshot = entry[1]
+            if type(value) in _ATOMIC_TYPES:
+                return entry[2]
+            if snapshot is not None and _flat_unchanged(value, snapshot):
+                return entry[2]
+
+        text = repr(value)
+        value_type = type(value)
+        snapshot = None
+        if value_type is list and _ATOMIC_TYPES.issuperset(map(type, value)):
+            snapshot = value.copy()
+        elif value_type is dict and _ATOMIC_TYPES.issuperset(map(type, value.values())):
+            snapshot = value.copy()
+
+        if len(self._entries) >= _REPR_CACHE_MAX:
+            self._entries.clear()
+        self._entries[key] = (value, snapshot, text)
+        return text
+
+
 @dataclass
 class TraceEvent:
     tag: str           # "LINE" | "CALL" | "RETURN"
@@ -73,6 +143,8 @@ class TraceEvent:
     global_vars: dict
     dataSnapshot: list
     meta: dict         # { lineno, func_name }
+    # heap=True 時：local_vars / global_vars / return_value 是 heap 值，heap 為該 event 的 view
+    heap: dict | None = None
 
 
 @dataclass
@@ -82,12 +154,20 @@ class CallNode:
     cfg: CfgGraph | None = None   # PoC 階段由外部注入；正式版由 cfg_builder 提供
 
 
+def _step_array() -> array:
+    return array("I")
+
+
 @dataclass
 class CallEdge:
     source: str        # caller CallNode.id
     target: str        # callee CallNode.id
-    steps: list[int] = field(default_factory=list)
-    return_steps: list[int] = field(default_factory=list)  # RETURN event step indices
+    # CALL / RETURN event 在 trace 中的 index，每條 edge 最多 CaptureSpec.edge_steps 個
+    steps: array = field(default_factory=_step_array)
+    return_steps: array = field(default_factory=_step_array)
+    # 經過這條 edge 的呼叫 / 返回次數（head 算到截斷為止，其餘策略涵蓋整段執行）
+    calls: int = 0
+    returns: int = 0
 
 
 @dataclass
@@ -97,6 +177,30 @@ class CallGraph:
     root: str = ""
 
 
+@dataclass
+class FunctionProfile:
+    calls: int = 0
+    # 秒；只計最外層那一次呼叫（遞迴不重複累加），含 tracing 本身的開銷，適合相對比較
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+
+
+@dataclass
+class ExecutionProfile:
+    """
+    整段執行的彙總，大小只和行數 / 函式數有關。total_steps 與 step_count 的計法相同
+    （LINE/CALL/RETURN，過濾內部 symbol），未截斷時兩者相等。wall_time 不含等待使用者
+    input 的時間。
+
+    head 策略存滿後預設卸下 tracer，profile 只涵蓋 trace 保留的那一段（complete=False）；
+    run_trace(full_profile=True) 才會持續累計到程式結束。
+    """
+    total_steps: int = 0
+    line_hits: dict[int, int] = field(default_factory=dict)
+    functions: dict[str, FunctionProfile] = field(default_factory=dict)
+    complete: bool = True
+
+
 @dataclass
 class TraceResult:
     trace: list[TraceEvent]
@@ -104,12 +208,380 @@ class TraceResult:
     is_truncated: bool
     step_count: int
     stdout_events: list[dict] = field(default_factory=list)
+    profile: ExecutionProfile = field(default_factory=ExecutionProfile)
+    capture: dict = field(default_factory=lambda: {"strategy": "head"})
+
+
+@dataclass
+class CountResult:
+    """count-only 模式的結果：只有步數、行命中次數與截斷資訊，沒有 TraceEvent。"""
+    step_count: int
+    is_truncated: bool
+    line_hits: dict[int, int] = field(default_factory=dict)
+
+
+# ---------------------------------------------------------------------------
+# 擷取策略（MAX_TRACE_STEPS 之外的取樣 / 視窗）
+# ---------------------------------------------------------------------------
+
+CAPTURE_STRATEGIES = ("head", "ring", "stride", "loop", "keyframe")
+
+
+@dataclass
+class CaptureSpec:
+    """
+    trace 要保留哪些 step。不論策略，程式都跑到結束，保留的 event 數以 max_steps 為上限：
+    - head：前 max_steps 步（預設，原本的行為）
+    - ring：最後 max_steps 步
+    - stride：每 every 步取一步；存滿就把間隔加倍並丟掉不在新間隔上的 event
+    - loop：loop_line 那個迴圈只保留每 every 次迭代（迴圈外的 step 照常保留），存滿即停
+    - keyframe：每 every 步一個 keyframe（存滿同 stride 加倍），另外完整保留
+      [window_start, window_start + window_size)；every=0 只取視窗（on-demand 取片段用）
+    head / loop 以外的策略，event 的 meta["step"] 是它在整段執行中的 step 編號。
+
+    edge_steps：每條 call edge 保留幾個 step index（CallEdge.steps / return_steps），
+    呼叫次數另有 CallEdge.calls / returns；要完整清單就設成 max_steps。
+    """
+    strategy: str = "head"
+    max_steps: int = MAX_TRACE_STEPS
+    every: int = 1
+    loop_line: int | None = None
+    window_start: int = 0
+    window_size: int = 0
+    edge_steps: int = EDGE_STEPS_LIMIT
+
+
+def _int_field(spec: dict, key: str, default: int, minimum: int, maximum: int | None = None) -> int:
+    value = spec.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        raise ValueError(f"capture.{key} must be an integer >= {minimum}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"capture.{key} must be <= {maximum}")
+    return value
+
+
+def parse_capture(spec: dict | None) -> CaptureSpec:
+    """request / env 的 capture 設定 → CaptureSpec；不合法拋 ValueError。max_steps 不可超過 MAX_TRACE_STEPS。"""
+    if spec is None:
+        return CaptureSpec()
+    if not isinstance(spec, dict):
+        raise ValueError("capture must be an object")
+    strategy = spec.get("strategy", "head")
+    if strategy not in CAPTURE_STRATEGIES:
+        raise ValueError(f"capture.strategy must be one of {', '.join(CAPTURE_STRATEGIES)}")
+    capture = CaptureSpec(
+        strategy=strategy,
+        max_steps=_int_field(spec, "max_steps", MAX_TRACE_STEPS, 1, MAX_TRACE_STEPS),
+        edge_steps=_int_field(spec, "edge_steps", EDGE_STEPS_LIMIT, 0, MAX_TRACE_STEPS),
+    )
+    if strategy == "stride":
+        capture.every = _int_field(spec, "every", 1, 1)
+    elif strategy == "loop":
+        if "loop_line" not in spec:
+            raise ValueError("capture.loop_line is required for strategy loop")
+        capture.loop_line = _int_field(spec, "loop_line", 0, 1)
+        capture.every = _int_field(spec, "every", 1, 1)
+    elif strategy == "keyframe":
+        capture.every = _int_field(spec, "every", KEYFRAME_EVERY, 0)
+        capture.window_start = _int_field(spec, "window_start", 0, 0)
+        capture.window_size = _int_field(spec, "window_size", 0, 0, MAX_TRACE_STEPS)
+        if capture.every == 0 and capture.window_size == 0:
+            raise ValueError("capture.window_size is required when capture.every is 0")
+    return capture
+
+
+def _loop_line_range(user_code: str, loop_line: int) -> range | None:
+    """loop_line 上的 for / while 迴圈涵蓋的行號範圍；該行不是迴圈標頭回 None。"""
+    import ast
+    try:
+        tree = ast.parse(user_code)
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.For, ast.While, ast.AsyncFor)) and node.lineno == loop_line:
+            return range(node.lineno, (node.end_lineno or node.lineno) + 1)
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Tracing backend：settrace（所有版本）/ sys.monitoring（3.12+，PEP 669）
+# ---------------------------------------------------------------------------
+
+TRACE_BACKENDS = ("settrace", "monitoring")
+USER_CODE_FILENAME = "<string>"  # exec(str) 編譯出的 co_filename
+MONITORING_TOOL_NAME = "codepulse"
+
+# handler(frame, event, arg) -> bool：event 為 settrace 的 "call" / "line" / "return"；
+# 回 False 表示這個 frame（monitoring：這個 code 位置）之後不必再送 event
+EventHandler = Callable[["FrameType", str, object], bool]
+
+
+def select_backend(name: str = "auto") -> str:
+    """auto：直譯器有 sys.monitoring（3.12+）就用 monitoring，否則 settrace；不支援時指定 monitoring 也退回 settrace。"""
+    if name != "auto" and name not in TRACE_BACKENDS:
+        raise ValueError(f"trace backend must be one of auto, {', '.join(TRACE_BACKENDS)}")
+    if name == "settrace" or not hasattr(sys, "monitoring"):
+        return "settrace"
+    return "monitoring"
+
+
+class _SettraceBackend:
+    """sys.settrace：每個 frame 的每個 event 都呼叫 Python trace function，直譯器 fast path 全關。"""
+
+    def __init__(self, handler: EventHandler):
+        def tracer(frame, event, arg):
+            # 只追使用者程式碼：backend 自己的 stop / pause 等 frame 不進 trace
+            if event == "call" and frame.f_code.co_filename != USER_CODE_FILENAME:
+                return None
+            return tracer if handler(frame, event, arg) else None
+
+        self._tracer = tracer
+        self._detached = False
+
+    def start(self) -> None:
+        sys.settrace(self._tracer)
+
+    def stop(self) -> None:
+        sys.settrace(None)
+
+    pause = stop
+
+    def resume(self) -> None:
+        if not self._detached:
+            sys.settrace(self._tracer)
+
+    def detach(self) -> None:
+        """之後整段 run 都不再追蹤（resume 也不會重新掛上）；可在 handler 內呼叫。"""
+        self._detached = True
+        sys.settrace(None)
+
+    def lighten(self, light) -> None:
+        """settrace 每個 event 本來就帶 frame，省不了什麼：維持原 handler。"""
+
+
+class _MonitoringBackend:
+    """
+    sys.monitoring：只訂 LINE 與函式進出（PY_START / PY_RETURN，generator 另需 RESUME / YIELD，
+    例外離開為 UNWIND / THROW），callback 只在使用者程式碼上呼叫 handler。非使用者程式碼、
+    內部 symbol 與 handler 回 False 的位置回傳 DISABLE，直譯器之後不再為該位置觸發 event。
+    JUMP 只為了對齊 settrace：往回跳且起訖同一行時補一個 line event，其餘 jump 一律 DISABLE。
+
+    lighten(light) 之後換成不取 frame 的 callback，只把 (code, event, lineno) 交給 light；
+    detach() 則直接關掉所有 event（handler 當下那個位置同時回 DISABLE），直譯器不再呼叫任何
+    callback，之後的程式以原生速度執行。
+
+    事件是 process-wide（不分 thread），同一時間只能有一個 run 佔用 tool id；
+    start() 在 tool id 已被佔用時拋 RuntimeError。
+    """
+
+    def __init__(self, handler: EventHandler):
+        events = sys.monitoring.events
+        self._tool = sys.monitoring.PROFILER_ID
+        self._jump_lines: dict[tuple[int, int], int] = {}
+        self._callbacks = self._frame_callbacks(handler)
+        self._detached = False
+        self._events = (
+            events.PY_START | events.PY_RESUME | events.PY_THROW
+            | events.PY_RETURN | events.PY_YIELD | events.PY_UNWIND
+            | events.LINE | events.JUMP
+        )
+
+    def _same_line_jump(self, code, src: int, dest: int) -> int:
+        """往回跳且起訖同一行 → 該行號，否則 0（legacy settrace 只為這種 jump 發 line event）。"""
+        key = (id(code), src)
+        line = self._jump_lines.get(key)
+        if line is None:
+            src_line = dest_line = None
+            if dest <= src:
+                for start, end, lineno in code.co_lines():
+                    if start <= src < end:
+                        src_line = lineno
+                    if start <= dest < end:
+                        dest_line = lineno
+            line = self._jump_lines[key] = src_line if src_line is not None and src_line == dest_line else 0
+        return line
+
+    def _frame_callbacks(self, handler: EventHandler) -> dict:
+        events = sys.monitoring.events
+        disable = sys.monitoring.DISABLE
+        getframe = sys._getframe
+        same_line_jump = self._same_line_jump
+
+        def skip(code) -> bool:
+            return code.co_filename != USER_CODE_FILENAME or _is_internal_symbol(code.co_name)
+
+        def on_start(code, _offset):
+            if skip(code) or not handler(getframe(1), "call", None):
+                return disable
+            return None
+
+        def on_return(code, _offset, retval):
+            if skip(code) or not handler(getframe(1), "return", retval):
+                return disable
+            return None
+
+        def on_line(code, _line):
+            if skip(code) or not handler(getframe(1), "line", None):
+                return disable
+            return None
+
+        def on_jump(code, src, dest):
+            if skip(code) or not same_line_jump(code, src, dest) or not handler(getframe(1), "line", None):
+                return disable
+            return None
+
+        # UNWIND / THROW 不能 DISABLE；settrace 對例外離開的 return event 也是 arg=None
+        def on_unwind(code, _offset, _exc):
+            if not skip(code):
+                handler(getframe(1), "return", None)
+
+        def on_throw(code, _offset, _exc):
+            if not skip(code):
+                handler(getframe(1), "call", None)
+
+        return {
+            events.PY_START: on_start,
+            events.PY_RESUME: on_start,
+            events.PY_THROW: on_throw,
+            events.PY_RETURN: on_return,
+            events.PY_YIELD: on_return,
+            events.PY_UNWIND: on_unwind,
+            events.LINE: on_line,
+            events.JUMP: on_jump,
+        }
+
+    def _light_callbacks(self, light: Callable[[object, str, int], None]) -> dict:
+        events = sys.monitoring.events
+        disable = sys.monitoring.DISABLE
+        same_line_jump = self._same_line_jump
+
+        def skip(code) -> bool:
+            return code.co_filename != USER_CODE_FILENAME or _is_internal_symbol(code.co_name)
+
+        def on_start(code, _offset):
+            if skip(code):
+                return disable
+            light(code, "call", 0)
+            return None
+
+        def on_return(code, _offset, _retval):
+            if skip(code):
+                return disable
+            light(code, "return", 0)
+            return None
+
+        def on_line(code, line):
+            if skip(code):
+                return disable
+            light(code, "line", line)
+            return None
+
+        def on_jump(code, src, dest):
+            line = 0 if skip(code) else same_line_jump(code, src, dest)
+            if not line:
+                return disable
+            light(code, "line", line)
+            return None
+
+        def on_unwind(code, _offset, _exc):
+            if not skip(code):
+                light(code, "return", 0)
+
+        def on_throw(code, _offset, _exc):
+            if not skip(code):
+                light(code, "call", 0)
+
+        return {
+            events.PY_START: on_start,
+            events.PY_RESUME: on_start,
+            events.PY_THROW: on_throw,
+            events.PY_RETURN: on_return,
+            events.PY_YIELD: on_return,
+            events.PY_UNWIND: on_unwind,
+            events.LINE: on_line,
+            events.JUMP: on_jump,
+        }
+
+    def _register(self) -> None:
+        for event, callback in self._callbacks.items():
+            sys.monitoring.register_callback(self._tool, event, callback)
+
+    def start(self) -> None:
+        mon = sys.monitoring
+        try:
+            mon.use_tool_id(self._tool, MONITORING_TOOL_NAME)
+        except ValueError as e:
+            raise RuntimeError(f"sys.monitoring tool id in use: {e}") from e
+        # DISABLE 會留在 code 物件上：清掉前一次 run（同 process 的 batch / 測試）留下的
+        mon.restart_events()
+        self._register()
+        mon.set_events(self._tool, self._events)
+
+    def stop(self) -> None:
+        mon = sys.monitoring
+        mon.set_events(self._tool, 0)
+        for event in self._callbacks:
+            mon.register_callback(self._tool, event, None)
+        mon.free_tool_id(self._tool)
+
+    def pause(self) -> None:
+        sys.monitoring.set_events(self._tool, 0)
+
+    def resume(self) -> None:
+        if not self._detached:
+            sys.monitoring.set_events(self._tool, self._events)
+
+    def detach(self) -> None:
+        self._detached = True
+        sys.monitoring.set_events(self._tool, 0)
+
+    def lighten(self, light: Callable[[object, str, int], None]) -> None:
+        self._callbacks = self._light_callbacks(light)
+        self._register()
+
+
+def _start_backend(name: str, handler: EventHandler) -> _SettraceBackend | _MonitoringBackend:
+    if name == "monitoring" and hasattr(sys, "monitoring"):
+        backend = _MonitoringBackend(handler)
+        try:
+            backend.start()
+            return backend
+        except RuntimeError:
+            pass  # 另一個 tool（或同 process 的另一個 run）佔著 tool id
+    backend = _SettraceBackend(handler)
+    backend.start()
+    return backend
 
 
 # ---------------------------------------------------------------------------
 # 核心 tracer
 # ---------------------------------------------------------------------------
 
+def _require_sandbox() -> None:
+    import os
+    if os.environ.get("SANDBOX_CONTAINER") != "1":
+        raise RuntimeError(
+            "run_trace() 只能在 sandbox container 內呼叫。"
+            "請透過 sandbox_sidecar 執行用戶程式碼。"
+        )
+
+
+def _build_sandboxed_globals(print_fn: Callable, input_fn: Callable) -> dict:
+    import builtins as _builtins_module
+    return {
+        "__builtins__": {
+            **{
+                k: getattr(_builtins_module, k)
+                for k in RESTRICTED_BUILTINS
+                if hasattr(_builtins_module, k)
+            },
+            "print": print_fn,
+            "input": input_fn,
+        },
+        "__name__": "__main__",
+    }
+
+
 InputProvider = Callable[[str, int, list[dict]], str]
 
 
@@ -117,26 +589,74 @@ def run_trace(
     user_code: str,
     stdin_inputs: list[str] | None = None,
     input_provider: InputProvider | None = None,
+    on_batch: Callable[[int, list[TraceEvent]], None] | None = None,
+    batch_size: int = TRACE_BATCH_SIZE,
+    capture: CaptureSpec | None = None,
+    backend: str = "settrace",
+    heap: bool = False,
+    full_profile: bool = False,
 ) -> TraceResult:
     """
     執行 user_code，收集 TraceEvent[] 並建構 CallGraph。
     執行緒安全：所有狀態以閉包封裝。
 
+    on_batch(start, events)：每累積 batch_size 個 event 回呼一次（執行結束時補送剩餘的），
+    讓 runner 邊跑邊串流 trace；start 為該批第一個 event 在 trace 中的 index。
+    只有 append-only 的擷取策略（head / loop）會回呼；ring / stride / keyframe 會回頭丟掉
+    已保留的 event，不串流。
+
+    capture：保留哪些 step（見 CaptureSpec），預設 head。實際採用的策略與參數放在
+    TraceResult.capture；loop_line 不是迴圈標頭時退回 head 並附上 fallback_reason。
+
+    backend：settrace 或 monitoring（見 select_backend），兩者產生相同的 TraceResult。
+
+    heap：True 時變數不 repr，改記 heap 值（primitive 或 {"ref": oid}），每個 event 的
+    TraceEvent.heap 是當下的 oid → node view（見 heap_snapshot.HeapRecorder）。
+
+    full_profile：head 策略存滿後預設整個卸下 tracer（之後以原生速度跑完，profile 標
+    complete=False）；True 時改為繼續收 event 累計 profile，代價是截斷後的程式仍以
+    tracing 速度執行。其餘策略本來就要看完整段執行，不受影響。
+
     只能在 sandbox container 內呼叫（SANDBOX_CONTAINER=1）。
     直接從 Flask 進程呼叫會觸發 RuntimeError，防止意外暴露 exec 到 production 進程。
     """
-    import os
-    if os.environ.get("SANDBOX_CONTAINER") != "1":
-        raise RuntimeError(
-            "run_trace() 只能在 sandbox container 內呼叫。"
-            "請透過 sandbox_sidecar 執行用戶程式碼。"
-        )
-    trace_log: list[TraceEvent] = []
-    is_truncated = False
+    _require_sandbox()
+    capture = capture or CaptureSpec()
+    strategy = capture.strategy
+    max_steps = capture.max_steps
+    capture_report: dict = {"strategy": strategy}
+
+    loop_lines: range | None = None
+    if strategy == "loop":
+        loop_lines = _loop_line_range(user_code, capture.loop_line)
+        if loop_lines is None:
+            capture_report = {
+                "strategy": "head",
+                "requested": "loop",
+                "fallback_reason": f"no loop at line {capture.loop_line}",
+            }
+            strategy = "head"
+
+    # head / loop 只往後加：index 即時可知，可串流；其餘策略以全域 step 記錄，結束時再換算 index
+    append_only = strategy in ("head", "loop")
+    if not append_only:
+        on_batch = None
+
+    trace_log: list[TraceEvent] | deque[TraceEvent]
+    trace_log = deque(maxlen=max_steps) if strategy == "ring" else []
     stdout_events: list[dict] = []
 
     _stdin_queue = list(stdin_inputs or [])
     _input_call_count = [0]  # mutable container for closure
+    _input_wait = [0.0]  # 等 input_provider 的累計秒數，從 wall time 扣除
+
+    profile = ExecutionProfile()
+    line_hits = profile.line_hits
+    functions = profile.functions
+
+    def _stdout_step() -> int:
+        # 非 append-only 策略先記全域 step，結束時換算成保留下來的 trace index
+        return len(trace_log) if append_only else profile.total_steps
 
     def _traced_input(prompt=""):
         prompt_str = str(prompt) if prompt else ""
@@ -145,19 +665,20 @@ def run_trace(
                 # 暫停 tracing 再呼叫 input_provider：否則 runner 的 emit_event /
                 # json.dumps / stdin decoder 等內部 frame 會被 sys.settrace 當成使用者
                 # 程式記進 trace，污染結果、撐大 trace，複雜輸入下甚至拖垮 runner。
-                old_trace = sys.gettrace()
-                sys.settrace(None)
+                active_backend.pause()
+                wait_started = time.perf_counter()
                 try:
                     value = input_provider(prompt_str, _input_call_count[0], stdout_events)
                 finally:
-                    sys.settrace(old_trace)
+                    _input_wait[0] += time.perf_counter() - wait_started
+                    active_backend.resume()
                 _input_call_count[0] += 1
-                stdout_events.append({"step": len(trace_log), "text": prompt_str + value})
+                stdout_events.append({"step": _stdout_step(), "text": prompt_str + value})
                 return value
 
             # queue 用罄才彈窗，此時還沒拿到輸入值，先只記 prompt（若有）
             if prompt_str:
-                stdout_events.append({"step": len(trace_log), "text": prompt_str})
+                stdout_events.append({"step": _stdout_step(), "text": prompt_str})
             raise LegacyInputNeededError(
                 prompt=prompt_str,
                 input_index=_input_call_count[0],
@@ -167,141 +688,372 @@ def run_trace(
         _input_call_count[0] += 1
         # 模擬終端機：prompt 與使用者輸入值拼在同一行（像 `a: 2`），重現 REPL 體驗
         # 無 prompt 時輸入值單獨成一行（終端機仍會 echo 按鍵）
-        stdout_events.append({"step": len(trace_log), "text": prompt_str + value})
+        stdout_events.append({"step": _stdout_step(), "text": prompt_str + value})
         return value
 
     call_graph = CallGraph()
     call_stack: list[str] = []   # func_name stack
+    nodes_by_name: dict[str, CallNode] = {}
+    edges_by_pair: dict[tuple[str, str], CallEdge] = {}   # (caller, callee) func_name → edge
+    edge_steps = capture.edge_steps
+    recorder = HeapRecorder() if heap else None
+    _repr = recorder if heap else _ReprCache()
+    _flushed = [0]  # 已交給 on_batch 的 event 數
+
+    def _flush_batch() -> None:
+        start = _flushed[0]
+        _flushed[0] = len(trace_log)
+        on_batch(start, trace_log[start:])
 
     def _get_or_create_node(func_name: str) -> CallNode:
-        node_id = f"func_{func_name}"
-        for n in call_graph.nodes:
-            if n.id == node_id:
-                return n
-        node = CallNode(id=node_id, func_name=func_name)
-        call_graph.nodes.append(node)
+        node = nodes_by_name.get(func_name)
+        if node is None:
+            node = nodes_by_name[func_name] = CallNode(id=f"func_{func_name}", func_name=func_name)
+            call_graph.nodes.append(node)
         return node
 
-    def _get_or_create_edge(caller_id: str, callee_id: str) -> CallEdge:
-        for e in call_graph.edges:
-            if e.source == caller_id and e.target == callee_id:
-                return e
-        edge = CallEdge(source=caller_id, target=callee_id)
-        call_graph.edges.append(edge)
+    def _get_or_create_edge(caller: str, callee: str) -> CallEdge:
+        edge = edges_by_pair.get((caller, callee))
+        if edge is None:
+            edge = edges_by_pair[(caller, callee)] = CallEdge(
+                source=nodes_by_name[caller].id, target=nodes_by_name[callee].id,
+            )
+            call_graph.edges.append(edge)
         return edge
 
-    def tracer(frame, event, arg):
-        nonlocal is_truncated
+    def _enter(func_name: str, step: int | None) -> None:
+        # step 為 None：這一步沒進 trace，只累計次數
+        node = _get_or_create_node(func_name)
+        if func_name == "<module>" and not call_graph.root:
+            call_graph.root = node.id  # root 永遠是 <module>
+        if call_stack:
+            edge = _get_or_create_edge(call_stack[-1], func_name)
+            edge.calls += 1
+            if step is not None and len(edge.steps) < edge_steps:
+                edge.steps.append(step)
+        call_stack.append(func_name)
 
-        if len(trace_log) >= MAX_TRACE_STEPS:
-            is_truncated = True
-            # return None 停止此 frame 的 local tracing；
-            # sys.settrace(None) 在 local tracer 內是 no-op，全域清除由 finally 塊負責。
-            return None
+    def _leave(func_name: str, step: int | None) -> None:
+        # Defensive: ensure stack top matches current frame
+        if not call_stack or call_stack[-1] != func_name:
+            return
+        if len(call_stack) >= 2:
+            edge = _get_or_create_edge(call_stack[-2], func_name)
+            edge.returns += 1
+            if step is not None and len(edge.return_steps) < edge_steps:
+                edge.return_steps.append(step)
+        call_stack.pop()
+
+    def _prune_edge_steps(keep_step: Callable[[int], bool]) -> None:
+        # 非 append-only 策略：丟掉已不在 trace 裡的 step，edge 記錄量跟著 trace 有界
+        for e in call_graph.edges:
+            e.steps = array("I", filter(keep_step, e.steps))
+            e.return_steps = array("I", filter(keep_step, e.return_steps))
+
+    _active_depth: dict[str, int] = {}                # 函式名 → 目前在 stack 上的層數
+    _started: dict[str, tuple[float, float]] = {}     # 最外層呼叫開始時的 (wall, cpu)
+
+    def _profile_call(func_name: str) -> None:
+        fn = functions.get(func_name)
+        if fn is None:
+            fn = functions[func_name] = FunctionProfile()
+        fn.calls += 1
+        depth = _active_depth.get(func_name, 0)
+        if depth == 0:
+            _started[func_name] = (time.perf_counter() - _input_wait[0], time.process_time())
+        _active_depth[func_name] = depth + 1
+
+    def _profile_return(func_name: str) -> None:
+        depth = _active_depth.get(func_name, 0)
+        if depth == 0:
+            return
+        _active_depth[func_name] = depth - 1
+        if depth == 1:
+            wall, cpu = _started.pop(func_name)
+            fn = functions[func_name]
+            fn.wall_time += time.perf_counter() - _input_wait[0] - wall
+            fn.cpu_time += time.process_time() - cpu
+
+    def _close_open_calls() -> None:
+        # 卸下 tracer 時還在 stack 上的函式：時間算到卸下為止
+        now_wall, now_cpu = time.perf_counter() - _input_wait[0], time.process_time()
+        for func_name, (wall, cpu) in _started.items():
+            functions[func_name].wall_time += now_wall - wall
+            functions[func_name].cpu_time += now_cpu - cpu
+        _started.clear()
+        _active_depth.clear()
 
+    def _profile_event(code, event: str, lineno: int) -> None:
+        # head 存滿後只剩 profile 要累計：monitoring backend 改走這裡，不必取 frame
+        if event == "line":
+            line_hits[lineno] = line_hits.get(lineno, 0) + 1
+        elif event == "call":
+            _profile_call(code.co_name)
+        else:
+            _profile_return(code.co_name)
+        profile.total_steps += 1
+
+    # --- 各策略的取捨：回傳 True 表示這一步要保留 -------------------------------
+    window = range(capture.window_start, capture.window_start + capture.window_size)
+    sample_every = capture.every
+    _sampled = [0]       # stride / keyframe：目前保留的取樣 event 數（不含視窗內的）
+    _ring_stored = [0]
+    loop_state: dict = {"frame": None, "iteration": 0}
+    detach_when_full = strategy == "head" and not full_profile
+    _detached = [False]
+
+    def _keep_loop(frame, event: str) -> bool:
+        if len(trace_log) >= max_steps:
+            return False
+        loop_frame = loop_state["frame"]
+        if event == "line" and frame.f_lineno == loop_lines.start and (loop_frame is None or frame is loop_frame):
+            loop_state["frame"] = loop_frame = frame
+            loop_state["iteration"] += 1
+        if loop_frame is None:
+            return True
+        if frame is loop_frame and event == "return":
+            loop_state["frame"] = None
+            return True
+        # 迴圈內（含從迴圈裡呼叫的函式）只留第 1、1+every、1+2*every… 次迭代
+        if loop_frame.f_lineno not in loop_lines:
+            return True
+        return (loop_state["iteration"] - 1) % capture.every == 0
+
+    def _keep_sampled(step: int) -> bool:
+        nonlocal sample_every
+        if step in window:
+            return True
+        if sample_every == 0 or step % sample_every:
+            return False
+        if _sampled[0] >= max_steps:
+            # 存滿：間隔加倍，只留落在新間隔上的取樣（視窗內的 event 不動）
+            sample_every *= 2
+            trace_log[:] = [ev for ev in trace_log if ev.meta["step"] in window or ev.meta["step"] % sample_every == 0]
+            _sampled[0] = sum(1 for ev in trace_log if ev.meta["step"] not in window)
+            kept = {ev.meta["step"] for ev in trace_log}
+            _prune_edge_steps(kept.__contains__)
+            if step % sample_every:
+                return False
+        _sampled[0] += 1
+        return True
+
+    def _store(ev: TraceEvent) -> None:
+        trace_log.append(ev)
+        if strategy == "ring":
+            _ring_stored[0] += 1
+            if _ring_stored[0] % max_steps == 0:
+                oldest = trace_log[0].meta["step"]
+                _prune_edge_steps(lambda s: s >= oldest)
+
+    def _on_event(frame, event, arg) -> bool:
         func_name = frame.f_code.co_name
-        lineno = frame.f_lineno
 
         # 過濾內部 symbol（call 和 return 都需要過濾）
         if event in ("call", "return") and _is_internal_symbol(func_name):
-            return None
+            return False
+        if event not in ("line", "call", "return"):
+            return True
+
+        if detach_when_full and len(trace_log) >= max_steps:
+            # head 存滿後還有 event：標記截斷並卸下 tracer，之後的程式以原生速度跑完
+            _detached[0] = True
+            profile.complete = False
+            _close_open_calls()
+            active_backend.detach()
+            return False
+
+        # profile 累計（full_profile 或非 head 策略時涵蓋整段執行）
+        if event == "line":
+            lineno = frame.f_lineno
+            line_hits[lineno] = line_hits.get(lineno, 0) + 1
+        elif event == "call":
+            _profile_call(func_name)
+        else:
+            _profile_return(func_name)
+        step = profile.total_steps
+        profile.total_steps += 1
+
+        if strategy == "head":
+            if len(trace_log) >= max_steps:
+                # full_profile：trace 不再增長，但 profile 要看到之後的 line / call / return
+                return True
+            keep = True
+        elif strategy == "loop":
+            keep = _keep_loop(frame, event)
+        elif strategy == "ring":
+            keep = True
+        else:
+            keep = _keep_sampled(step)
+
+        if event != "line":
+            # len() before append = correct index
+            edge_step = (len(trace_log) if append_only else step) if keep else None
+            if event == "call":
+                _enter(func_name, edge_step)
+            else:
+                _leave(func_name, edge_step)
+
+        if not keep:
+            return True
+
+        lineno = frame.f_lineno
+        if recorder is not None:
+            recorder.begin()
 
         # local_vars：當前 frame 的局部變數
         # 對 <module> frame，f_locals 就是 sandboxed_globals，用過濾集排除內建 key
         local_vars = {
-            k: repr(v)
+            k: _repr(v)
             for k, v in frame.f_locals.items()
             if k not in _GLOBAL_FILTER
         }
 
         # global_vars：sandboxed_globals 中用戶定義的 key（排除內建 key 與函式物件）
         global_vars = {
-            k: repr(v)
+            k: _repr(v)
             for k, v in frame.f_globals.items()
             if k not in _GLOBAL_FILTER and not callable(v)
         }
 
+        meta = {"lineno": lineno, "func_name": func_name}
+        if strategy != "head":
+            meta["step"] = step
         if event == "call":
-            node = _get_or_create_node(func_name)
-
-            if func_name == "<module>" and not call_graph.root:
-                call_graph.root = node.id  # root 永遠是 <module>
-
-            if call_stack:
-                caller_id = f"func_{call_stack[-1]}"
-                edge = _get_or_create_edge(caller_id, node.id)
-                edge.steps.append(len(trace_log))
-
-            call_stack.append(func_name)
+            tag = "CALL"
+        elif event == "return":
+            tag = "RETURN"
+            meta["return_value"] = _repr(arg)
+        else:
+            tag = "LINE"
+        _store(TraceEvent(
+            tag=tag,
+            local_vars=local_vars,
+            global_vars=global_vars,
+            dataSnapshot=[],
+            meta=meta,
+            heap=recorder.end() if recorder is not None else None,
+        ))
 
-            trace_log.append(TraceEvent(
-                tag="CALL",
-                local_vars=local_vars,
-                global_vars=global_vars,
-                dataSnapshot=[],
-                meta={"lineno": lineno, "func_name": func_name},
-            ))
+        # trace function / monitoring callback 內部本身不會被追蹤，on_batch 的輸出不會混進 trace
+        if on_batch is not None and len(trace_log) - _flushed[0] >= batch_size:
+            _flush_batch()
+        if full_profile and strategy == "head" and len(trace_log) >= max_steps:
+            active_backend.lighten(_profile_event)
 
-        elif event == "return":
-            # Record return step to corresponding call edge
-            if (len(call_stack) >= 2
-                    and call_stack[-1] == func_name):  # Defensive: ensure stack top matches current frame
-                callee_id = f"func_{func_name}"
-                caller_id = f"func_{call_stack[-2]}"
-                edge = _get_or_create_edge(caller_id, callee_id)
-                edge.return_steps.append(len(trace_log))  # len() before append = correct index
-
-            trace_log.append(TraceEvent(
-                tag="RETURN",
-                local_vars=local_vars,
-                global_vars=global_vars,
-                dataSnapshot=[],
-                meta={"lineno": lineno, "func_name": func_name, "return_value": repr(arg)},
-            ))
-            if call_stack and call_stack[-1] == func_name:
-                call_stack.pop()
-
-        elif event == "line":
-            trace_log.append(TraceEvent(
-                tag="LINE",
-                local_vars=local_vars,
-                global_vars=global_vars,
-                dataSnapshot=[],
-                meta={"lineno": lineno, "func_name": func_name},
-            ))
-
-        return tracer
+        return True
 
     def _traced_print(*args, sep=" ", end="\n", **_kwargs):
         text = sep.join(str(a) for a in args)
-        stdout_events.append({"step": len(trace_log), "text": text})
+        stdout_events.append({"step": _stdout_step(), "text": text})
 
-    import builtins as _builtins_module
-    sandboxed_globals = {
-        "__builtins__": {
-            **{
-                k: getattr(_builtins_module, k)
-                for k in RESTRICTED_BUILTINS
-                if hasattr(_builtins_module, k)
-            },
-            "print": _traced_print,
-            "input": _traced_input,
-        },
-        "__name__": "__main__",
-    }
+    sandboxed_globals = _build_sandboxed_globals(_traced_print, _traced_input)
 
-    sys.settrace(tracer)
+    active_backend = _start_backend(backend, _on_event)
     try:
         exec(user_code, sandboxed_globals)  # noqa: S102
     except LegacyInputNeededError:
         raise  # 由 runner 層 catch 並轉為結構化 JSON 輸出，不要被泛用 except 吃掉
     finally:
-        sys.settrace(None)
+        active_backend.stop()
+
+    if on_batch is not None and len(trace_log) > _flushed[0]:
+        _flush_batch()
+
+    trace = list(trace_log)
+    if not append_only:
+        # 全域 step → 保留下來的 trace index
+        captured_steps = [ev.meta["step"] for ev in trace]
+        index_of = {s: i for i, s in enumerate(captured_steps)}
+        for e in call_graph.edges:
+            e.steps = array("I", [index_of[s] for s in e.steps if s in index_of])
+            e.return_steps = array("I", [index_of[s] for s in e.return_steps if s in index_of])
+        for out in stdout_events:
+            out["step"] = bisect_left(captured_steps, out["step"])
+
+    if strategy in ("stride", "keyframe"):
+        capture_report["every"] = sample_every
+    elif strategy == "loop":
+        capture_report.update(loop_line=capture.loop_line, every=capture.every,
+                              iterations=loop_state["iteration"])
+    if strategy == "keyframe" and capture.window_size:
+        capture_report["window"] = [capture.window_start, capture.window_start + capture.window_size]
+    capture_report["max_steps"] = max_steps
+    capture_report["captured"] = len(trace)
+    capture_report["total_steps"] = profile.total_steps
 
     return TraceResult(
-        trace=trace_log,
+        trace=trace,
         call_graph=call_graph,
-        is_truncated=is_truncated,
-        step_count=len(trace_log),
+        is_truncated=_detached[0] or len(trace) < profile.total_steps,
+        step_count=len(trace),
         stdout_events=stdout_events,
+        profile=profile,
+        capture=capture_report,
+    )
+
+
+def run_count_trace(
+    user_code: str,
+    stdin_inputs: list[str] | None = None,
+    max_steps: int = MAX_TRACE_STEPS,
+    backend: str = "settrace",
+) -> CountResult:
+    """
+    count-only 版 run_trace：big-O 測量只需要 step_count，不 repr 變數、不建 TraceEvent /
+    CallGraph、不收 stdout。步數語意與 run_trace 相同（LINE/CALL/RETURN，過濾內部 symbol，
+    max_steps 截斷），另外回傳每行 LINE 命中次數。stdin 用罄時同樣拋 LegacyInputNeededError。
+
+    截斷後不再需要任何 event：monitoring backend 下每個位置再觸發一次就被 DISABLE，
+    之後的迴圈以原生速度跑完（settrace 仍會對每個新 frame 呼叫一次 trace function）。
+    """
+    _require_sandbox()
+    line_hits: dict[int, int] = {}
+    step_count = 0
+    is_truncated = False
+    _stdin_queue = list(stdin_inputs or [])
+    _input_call_count = [0]
+
+    def _count_input(prompt=""):
+        if not _stdin_queue:
+            raise LegacyInputNeededError(
+                prompt=str(prompt) if prompt else "",
+                input_index=_input_call_count[0],
+            )
+        _input_call_count[0] += 1
+        return _stdin_queue.pop(0)
+
+    def _discard_print(*_args, **_kwargs):
+        pass
+
+    def _on_event(frame, event, arg) -> bool:
+        nonlocal step_count, is_truncated
+
+        if step_count >= max_steps:
+            is_truncated = True
+            return False
+
+        if event == "line":
+            lineno = frame.f_lineno
+            line_hits[lineno] = line_hits.get(lineno, 0) + 1
+        elif event in ("call", "return"):
+            if _is_internal_symbol(frame.f_code.co_name):
+                return False
+        else:
+            return True
+
+        step_count += 1
+        return True
+
+    sandboxed_globals = _build_sandboxed_globals(_discard_print, _count_input)
+
+    active_backend = _start_backend(backend, _on_event)
+    try:
+        exec(user_code, sandboxed_globals)  # noqa: S102
+    finally:
+        active_backend.stop()
+
+    return CountResult(
+        step_count=step_count,
+        is_truncated=is_truncated,
+        line_hits=line_hits,
     )
@@ -2,6 +2,12 @@
 import os
 os.environ.setdefault("SKIP_ML_WARMUP", "1")
 os.environ.setdefault("CELERY_TASK_ALWAYS_EAGER", "1")
+# 分析結果快取走 Redis；測試預設關閉，避免本機有 Redis 時不同測試互相命中快取
+os.environ.setdefault("ANALYSIS_CACHE_ENABLED", "0")
+# sidecar 測試以 mock 的 subprocess.Popen 驗證 docker exec 參數；zygote 路徑另有專屬測試
+os.environ.setdefault("SANDBOX_ZYGOTE", "0")
+# 互動 session 的 WebSocket 通道：測試一律走 HTTP（mock requests），通道另有專屬測試
+os.environ.setdefault("SANDBOX_CHANNEL", "0")
 import pytest
 
 # tracer.run_trace() 有 SANDBOX_CONTAINER guard，測試環境需要設此環境變數
@@ -0,0 +1,136 @@
+"""tests/test_admission.py — sandbox admission control 的等候佇列、放行與 probe 降載單元測試"""
+import pytest
+import redis as redis_lib
+
+from services import admission
+
+
+class FakeRedis:
+    """只實作 admission 用到的 sorted set 指令。"""
+
+    def __init__(self):
+        self.zset: dict[str, float] = {}
+
+    def _ordered(self):
+        return sorted(self.zset, key=lambda member: (self.zset[member], member))
+
+    def zadd(self, key, mapping, nx=False):
+        for member, score in mapping.items():
+            if nx and member in self.zset:
+                continue
+            self.zset[member] = score
+
+    def zrank(self, key, member):
+        return self._ordered().index(member) if member in self.zset else None
+
+    def zscore(self, key, member):
+        return self.zset.get(member)
+
+    def zrem(self, key, member):
+        self.zset.pop(member, None)
+
+    def zcard(self, key):
+        return len(self.zset)
+
+    def zremrangebyscore(self, key, low, high):
+        for member in [m for m, score in self.zset.items() if score <= high]:
+            del self.zset[member]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedis()
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "_redis", lambda: client)
+    return client
+
+
+def _capacity(monkeypatch, available):
+    monkeypatch.setattr(
+        admission, "sidecar_capacity",
+        lambda: None if available is None else {"available": available, "max_size": 4},
+    )
+
+
+def _deferred(monkeypatch, *task_ids):
+    """沒空位時依序 check：每個都被擋下、留在等候佇列（模擬等 retry 中的 task）。"""
+    _capacity(monkeypatch, 0)
+    for task_id in task_ids:
+        assert not admission.check(task_id).admitted
+
+
+def test_admits_within_available_slots_and_leaves_queue(fake_redis, monkeypatch):
+    _deferred(monkeypatch, "a", "b")
+    _capacity(monkeypatch, 1)
+    decision = admission.check("a")
+    assert decision.admitted and decision.capacity["available"] == 1
+    assert "a" not in fake_redis.zset and "b" in fake_redis.zset
+
+
+def test_first_check_admits_without_entering_queue(fake_redis, monkeypatch):
+    # cache hit / 還沒輪到 worker 的 task 不在佇列裡，不會擋住後來的
+    _capacity(monkeypatch, 1)
+    assert admission.check("a").admitted
+    assert fake_redis.zset == {}
+
+
+def test_full_pool_reports_position_in_arrival_order(fake_redis, monkeypatch):
+    _deferred(monkeypatch, "a", "b")
+    assert admission.check("c") == admission.Admission(
+        admitted=False, position=3, capacity={"available": 0, "max_size": 4},
+    )
+    # 前面的放行（或被取消）後位置往前
+    admission.release("a")
+    assert admission.check("c").position == 2
+
+
+def test_long_wait_is_admitted_anyway(fake_redis, monkeypatch):
+    _deferred(monkeypatch, "a")
+    fake_redis.zset["a"] -= admission.ADMISSION_MAX_WAIT
+    assert admission.check("a").admitted
+    assert fake_redis.zset == {}
+
+
+def test_stale_entries_are_pruned(fake_redis, monkeypatch):
+    _deferred(monkeypatch, "gone")
+    fake_redis.zset["gone"] -= admission.ADMISSION_MAX_WAIT + 120
+    assert admission.check("b").position == 1
+    assert "gone" not in fake_redis.zset
+
+
+def test_fails_open_without_capacity_or_redis(fake_redis, monkeypatch):
+    _deferred(monkeypatch, "a")
+    _capacity(monkeypatch, None)
+    assert admission.check("a").admitted
+    assert fake_redis.zset == {}
+
+    def broken():
+        raise redis_lib.ConnectionError("down")
+
+    _capacity(monkeypatch, 0)
+    monkeypatch.setattr(admission, "_redis", broken)
+    assert admission.check("b").admitted
+
+
+def test_should_shed_probes(fake_redis, monkeypatch):
+    _capacity(monkeypatch, 3)
+    assert not admission.should_shed_probes()
+    assert admission.should_shed_probes({"available": admission.PROBE_SHED_BELOW - 1})
+    _deferred(monkeypatch, "waiting")
+    _capacity(monkeypatch, 3)
+    assert admission.should_shed_probes()
+
+    _capacity(monkeypatch, None)
+    assert not admission.should_shed_probes()
+
+
+def test_sandbox_busy(fake_redis, monkeypatch):
+    _capacity(monkeypatch, 1)
+    assert not admission.sandbox_busy()
+    _deferred(monkeypatch, "waiting")
+    _capacity(monkeypatch, 1)
+    assert admission.sandbox_busy()
+    assert admission.sandbox_busy({"available": 0})
+
+    _capacity(monkeypatch, None)
+    assert not admission.sandbox_busy()
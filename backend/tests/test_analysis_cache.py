@@ -0,0 +1,263 @@
+"""tests/test_analysis_cache.py — 分析結果快取與 _run_analysis 快取路徑單元測試"""
+from unittest.mock import patch
+
+import pytest
+
+from services import admission, analysis_cache, analysis_runner
+from services.algo_identification import IdentifyResult
+from services.gemini_analysis.result import GeminiAnalysisResult, GeminiSummary
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data: dict[str, str] = {}
+        self.ttl: dict[str, int] = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttl[key] = ttl
+
+    def expire(self, key, ttl):
+        self.ttl[key] = ttl
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedis()
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(analysis_cache, "_redis", lambda: client)
+    return client
+
+
+def test_result_key_depends_on_stdin():
+    assert analysis_cache.result_key("x = input()", ["1"]) != analysis_cache.result_key("x = input()", ["2"])
+    assert analysis_cache.result_key("x = 1", None) == analysis_cache.result_key("x = 1", [])
+
+
+def test_fingerprint_ignores_comments(fake_redis):
+    a = analysis_cache.code_fingerprint("x = 1\n")
+    b = analysis_cache.code_fingerprint("# note\nx = 1  # trailing\n")
+    assert a is not None and a == b
+
+
+def test_result_roundtrip_refreshes_ttl(fake_redis):
+    analysis_cache.set_result("x = 1", [], {"time_complexity": "O(1)"})
+    key = analysis_cache.result_key("x = 1", [])
+    fake_redis.ttl[key] = 5
+    assert analysis_cache.get_result("x = 1", []) == {"time_complexity": "O(1)"}
+    assert fake_redis.ttl[key] == analysis_cache.RESULT_CACHE_TTL
+
+
+def test_oversized_result_not_cached(fake_redis, monkeypatch):
+    monkeypatch.setattr(analysis_cache, "MAX_CACHED_RESULT_BYTES", 10)
+    analysis_cache.set_result("x = 1", [], {"trace": ["a" * 100]})
+    assert fake_redis.data == {}
+
+
+def test_disabled_cache_is_noop(monkeypatch):
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    analysis_cache.set_stage(analysis_cache.STAGE_AST, "abc", "O(n)")
+    assert analysis_cache.get_stage(analysis_cache.STAGE_AST, "abc") is None
+
+
+def test_redis_error_is_swallowed(monkeypatch):
+    import redis as redis_lib
+
+    class Broken:
+        def get(self, _key):
+            raise redis_lib.ConnectionError("down")
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(analysis_cache, "_redis", lambda: Broken())
+    assert analysis_cache.get_result("x = 1", []) is None
+
+
+# ---------------------------------------------------------------------------
+# _run_analysis 整合
+# ---------------------------------------------------------------------------
+
+_CODE = "def f(arr):\n    return sorted(arr)\n\nf([3, 1, 2])\n"
+_SANDBOX_OK = {
+    "trace": [],
+    "call_graph": None,
+    "cfg_graph": {},
+    "is_truncated": False,
+    "stdout_events": [],
+}
+_GEMINI_OK = GeminiAnalysisResult(
+    detected_algorithm=None,
+    time_complexity=None,
+    summary=GeminiSummary(purpose="sort", feedback="ok"),
+    is_fallback=False,
+    fallback_reason=None,
+)
+
+
+def _analysis_patches(gemini_result=_GEMINI_OK, sandbox_result=_SANDBOX_OK):
+    return [
+        patch.object(analysis_runner.task_queue, "update_progress"),
+        patch.object(analysis_runner.task_queue, "publish_event"),
+        patch("services.analysis_runner.run_in_sandbox", return_value=sandbox_result),
+        patch("services.analysis_runner.analyze_complexity", return_value="O(n log n)"),
+        patch("services.analysis_runner.generate_bigo_wrapper", return_value="bigo"),
+        patch("services.analysis_runner.measure_step_counts", return_value="O(n log n)"),
+        patch("services.analysis_runner.algo_identify",
+              return_value=IdentifyResult(algo_name=None, score=0.1, top_raw="x", top3=[("x", 0.1)])),
+        patch("services.analysis_runner.gemini_analyze", return_value=gemini_result),
+        patch("services.analysis_runner.log_divergence"),
+    ]
+
+
+def _run(stdin_inputs=None, gemini_result=_GEMINI_OK, sandbox_result=_SANDBOX_OK, **kwargs):
+    patches = _analysis_patches(gemini_result, sandbox_result)
+    mocks = [p.start() for p in patches]
+    try:
+        result = analysis_runner._run_analysis("task-1", _CODE, _CODE, stdin_inputs=stdin_inputs, **kwargs)
+    finally:
+        for p in patches:
+            p.stop()
+    return result, dict(zip(
+        ["progress", "publish", "sandbox", "ast", "wrapper", "bigo", "identify", "gemini", "divergence"],
+        mocks,
+    ))
+
+
+def test_full_cache_hit_skips_pipeline(fake_redis):
+    first, _ = _run()
+    second, mocks = _run()
+
+    assert second == first
+    mocks["sandbox"].assert_not_called()
+    mocks["gemini"].assert_not_called()
+    mocks["progress"].assert_called_once_with("task-1", "done", "Done")
+
+
+def test_sandbox_usage_stored_per_task_not_cached(fake_redis, caplog):
+    sandbox_result = {
+        **_SANDBOX_OK,
+        "usage": {"user_ms": 12.5, "throttled_ms": 3.0, "memory_peak_bytes": 4096},
+        "sandbox_timings": {"acquire_ms": 40.0, "exec_start_ms": 2.0, "run_ms": 30.0},
+    }
+    with caplog.at_level("INFO", logger="services.analysis_runner"):
+        first, _ = _run(sandbox_result=sandbox_result)
+    assert first["sandbox_usage"] == {
+        "acquire_ms": 40.0, "exec_start_ms": 2.0, "run_ms": 30.0,
+        "user_ms": 12.5, "throttled_ms": 3.0, "memory_peak_bytes": 4096,
+    }
+    assert "acquire_ms=40.0" in caplog.text and "throttled_ms=3.0" in caplog.text
+
+    second, mocks = _run()
+    mocks["sandbox"].assert_not_called()
+    assert second["sandbox_usage"] == {}
+
+
+def test_different_stdin_reuses_deterministic_stages(fake_redis):
+    _run(stdin_inputs=["1"])
+    _, mocks = _run(stdin_inputs=["2"])
+
+    mocks["sandbox"].assert_called_once()
+    mocks["gemini"].assert_called_once()
+    mocks["ast"].assert_not_called()
+    mocks["bigo"].assert_not_called()
+    mocks["identify"].assert_not_called()
+
+
+def test_gemini_fallback_result_not_fully_cached(fake_redis):
+    fallback = GeminiAnalysisResult(
+        detected_algorithm=None, time_complexity=None, summary=None,
+        is_fallback=True, fallback_reason="rate_limited",
+    )
+    _run(gemini_result=fallback)
+
+    assert analysis_cache.get_result(_CODE, None) is None
+    assert analysis_cache.get_stage(analysis_cache.STAGE_AST, analysis_cache.code_fingerprint(_CODE)) == "O(n log n)"
+
+
+def test_cache_hit_still_saves_history_for_user(fake_redis):
+    _run()
+    with patch("services.analysis_runner._save_history") as mock_save:
+        _run(user_id=7)
+
+    mock_save.assert_called_once()
+    args, kwargs = mock_save.call_args
+    assert args[0] == 7
+    assert kwargs["raw_trace"] == {"encoding": "delta", "events": []}
+    assert kwargs["sandbox_usage"] == {}
+
+
+def test_sandbox_usage_saved_with_history(fake_redis):
+    sandbox_result = {**_SANDBOX_OK, "usage": {"user_ms": 12.5}, "sandbox_timings": {"acquire_ms": 40.0}}
+    with patch("services.analysis_runner._save_history") as mock_save:
+        _run(sandbox_result=sandbox_result, user_id=7)
+
+    assert mock_save.call_args.kwargs["sandbox_usage"] == {"acquire_ms": 40.0, "user_ms": 12.5}
+
+
+def test_admission_deferred_reports_queue_position(fake_redis, monkeypatch):
+    monkeypatch.setattr(admission, "check", lambda task_id: admission.Admission(admitted=False, position=3))
+    with pytest.raises(admission.AdmissionDeferred) as excinfo:
+        _run(admission=True)
+    assert excinfo.value.position == 3
+
+
+def test_admission_deferred_publishes_queued_event(fake_redis, monkeypatch):
+    monkeypatch.setattr(admission, "check", lambda task_id: admission.Admission(admitted=False, position=2))
+    patches = _analysis_patches()
+    mocks = [p.start() for p in patches]
+    try:
+        with pytest.raises(admission.AdmissionDeferred):
+            analysis_runner._run_analysis("task-1", _CODE, _CODE, admission=True)
+    finally:
+        for p in patches:
+            p.stop()
+    progress, publish, sandbox = mocks[:3]
+    publish.assert_called_once()
+    event = publish.call_args.args[1]
+    assert event["type"] == "queued" and event["position"] == 2 and event["status"] == "running"
+    sandbox.assert_not_called()
+    progress.assert_not_called()
+
+
+def test_busy_sandbox_sheds_bigo_probe_and_skips_full_cache(fake_redis, monkeypatch):
+    capacity = {"available": 1, "max_size": 4}
+    monkeypatch.setattr(admission, "check", lambda task_id: admission.Admission(admitted=True, capacity=capacity))
+    monkeypatch.setattr(admission, "should_shed_probes", lambda cap=None: cap is capacity)
+    result, mocks = _run(admission=True)
+
+    mocks["bigo"].assert_not_called()
+    assert result["analysis_source"] == "ast"
+    assert analysis_cache.get_result(_CODE, None) is None
+
+
+@pytest.mark.parametrize("outcome, released", [
+    ({"ok": True}, True),                                        # 含 cache hit：check 之前就結束
+    (RuntimeError("sandbox exploded"), True),
+    (admission.AdmissionDeferred(1), False),                     # 等 retry：保留排隊位置
+])
+def test_task_leaves_admission_queue_unless_requeued(monkeypatch, outcome, released):
+    task = analysis_runner.run_analysis_task
+    monkeypatch.setattr(analysis_runner.celery_app.conf, "task_always_eager", False)
+
+    def fake_run(*args, **kwargs):
+        assert kwargs["admission"] is True
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    task.push_request(id="task-9")
+    try:
+        with patch.object(analysis_runner, "_run_analysis", side_effect=fake_run), \
+             patch.object(task, "retry", return_value=RuntimeError("retry scheduled")), \
+             patch.object(admission, "release") as mock_release:
+            try:
+                task.run(_CODE, _CODE)
+            except RuntimeError:
+                pass
+    finally:
+        task.pop_request()
+    assert mock_release.called is released
+    if released:
+        mock_release.assert_called_once_with("task-9")
@@ -374,6 +374,42 @@ class TestHistoryQuota:
 
             assert ExploreHistory.query.filter_by(user_id=1).count() == 5
 
+    def test_save_history_persists_sandbox_usage(self, app):
+        from models.explorer import ExploreHistory
+        from services.algo_identification import IdentifyResult
+        from services.analysis_runner import _save_history
+        from database import db
+
+        usage = {"acquire_ms": 40.0, "run_ms": 30.0, "user_ms": 12.5, "memory_peak_bytes": 4096}
+        identify_result = IdentifyResult(algo_name="linear_search", score=0.9, top_raw="linear_search", top3=[])
+
+        # SQLite 的 BigInteger 主鍵不會自動遞增，測試裡手動給 explore_id
+        with app.app_context(), patch(
+            "services.analysis_runner.ExploreHistory",
+            side_effect=lambda **fields: ExploreHistory(explore_id=170, **fields),
+        ):
+            _save_history(
+                user_id=1,
+                code="usage_value = 3000\n",
+                identify_result=identify_result,
+                final_complexity="O(1)",
+                complexity_source="ast",
+                gemini_summary=None,
+                have_level1=False,
+                execution_trace=[],
+                is_truncated=False,
+                raw_trace=[],
+                raw_index_map=[],
+                call_graph=None,
+                cfg_graph={},
+                stdout_events=[],
+                sandbox_usage=usage,
+            )
+
+        with app.app_context():
+            db.session.expire_all()
+            assert db.session.get(ExploreHistory, 170).sandbox_usage == usage
+
     def test_save_history_skips_persistence_for_existing_normalized_code(self, app):
         from models.explorer import ExploreHistory, AnalysisSource
         from services.algo_identification import IdentifyResult
@@ -617,3 +653,98 @@ class TestAnalyzeInputApi:
 
         assert res.status_code == 202
         mock_cancel.assert_called_once_with("task-4")
+
+
+class TestTraceCapture:
+    def test_submit_forwards_capture(self, client, auth_headers):
+        capture = {"strategy": "ring", "max_steps": 500}
+        with patch("routes.analyze.task_queue.submit", return_value="tid-capture") as mock_submit:
+            res = _authed(
+                client, auth_headers, 'post', '/api/analyze/submit',
+                json={"code": "capture_forwarded = 1\n", "save_history": False, "capture": capture},
+            )
+        assert res.status_code == 202
+        assert mock_submit.call_args.kwargs["capture"] == capture
+        assert mock_submit.call_args.kwargs["stream_trace"] is False
+
+    def test_submit_forwards_stream_trace_opt_in(self, client, auth_headers):
+        with patch("routes.analyze.task_queue.submit", return_value="tid-stream") as mock_submit:
+            res = _authed(
+                client, auth_headers, 'post', '/api/analyze/submit',
+                json={"code": "stream_opt_in = 1\n", "save_history": False, "stream_trace": True},
+            )
+        assert res.status_code == 202
+        assert mock_submit.call_args.kwargs["stream_trace"] is True
+
+    def test_submit_rejects_invalid_capture(self, client, auth_headers):
+        res = _authed(
+            client, auth_headers, 'post', '/api/analyze/submit',
+            json={"code": "x = 1\n", "save_history": False, "capture": {"strategy": "loop"}},
+        )
+        assert res.status_code == 400
+        assert res.get_json()["error"] == "invalid_capture"
+
+    def test_window_reruns_with_window_capture_and_decodes(self, client, auth_headers):
+        sandbox_result = {
+            "trace": [{"tag": "LINE", "keyframe": True, "local_vars": {}, "global_vars": {"x": "1"},
+                       "dataSnapshot": [], "meta": {"lineno": 1, "step": 40}}],
+            "trace_encoding": "delta",
+            "capture": {"strategy": "keyframe", "window": [40, 60]},
+        }
+        with patch("routes.analyze.sandbox_admission.sandbox_busy", return_value=False), \
+             patch("routes.analyze.run_in_sandbox", return_value=sandbox_result) as mock_run:
+            res = _authed(
+                client, auth_headers, 'post', '/api/analyze/window',
+                json={"code": "x = 1\n", "stdin_inputs": ["a"], "start": 40, "count": 20},
+            )
+        assert res.status_code == 200
+        body = res.get_json()
+        assert body["events"][0]["global_vars"] == {"x": "1"}
+        assert body["events"][0]["meta"]["step"] == 40
+        assert mock_run.call_args.kwargs == {
+            "stdin_inputs": ["a"],
+            "capture": {"strategy": "keyframe", "every": 0, "window_start": 40, "window_size": 20},
+            "skip_cfg": True,
+            "tenant": "user:1",
+        }
+
+    def test_window_validates_range_and_reports_missing_input(self, client, auth_headers):
+        res = _authed(client, auth_headers, 'post', '/api/analyze/window', json={"code": "x = 1\n", "start": -1})
+        assert res.status_code == 400
+
+        # live sidecar 的回應：開了互動 session 在等輸入，視窗不會再餵值 → 關掉 session
+        needed = {"status": "input_needed", "session_id": "0:s1", "prompt": "", "input_index": 0}
+        with patch("routes.analyze.sandbox_admission.sandbox_busy", return_value=False), \
+             patch("routes.analyze.run_in_sandbox", return_value=needed), \
+             patch("routes.analyze.close_session") as mock_close:
+            res = _authed(
+                client, auth_headers, 'post', '/api/analyze/window',
+                json={"code": "x = input()\n", "start": 0, "count": 10},
+            )
+        assert res.status_code == 409
+        assert res.get_json()["error"] == "input_needed"
+        mock_close.assert_called_once_with("0:s1")
+
+    def test_window_defers_when_sandbox_busy(self, client, auth_headers):
+        with patch("routes.analyze.sandbox_admission.sandbox_busy", return_value=True), \
+             patch("routes.analyze.run_in_sandbox") as mock_run:
+            res = _authed(
+                client, auth_headers, 'post', '/api/analyze/window',
+                json={"code": "x = 1\n", "start": 0, "count": 10},
+            )
+        assert res.status_code == 503
+        assert res.headers["Retry-After"] == "1"
+        mock_run.assert_not_called()
+
+    def test_window_is_rate_limited_per_user(self, client, auth_headers):
+        with patch("routes.analyze.sandbox_admission.sandbox_busy", return_value=False), \
+             patch("routes.analyze.run_in_sandbox", return_value={"trace": []}):
+            codes = [
+                _authed(
+                    client, auth_headers, 'post', '/api/analyze/window',
+                    json={"code": "x = 1\n", "start": 0, "count": 10},
+                ).status_code
+                for _ in range(31)
+            ]
+        assert codes[:30] == [200] * 30
+        assert codes[30] == 429
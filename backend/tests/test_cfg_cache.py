@@ -0,0 +1,55 @@
+"""tests/test_cfg_cache.py — backend 端 CFG LRU 快取"""
+
+import pytest
+
+from services import cfg_cache
+from services.cfg_builder import build_cfg_graph_data
+
+CODE = """
+def f(x):
+    if x > 0:
+        return 1
+    return -1
+
+f(2)
+"""
+
+
+@pytest.fixture(autouse=True)
+def _clean_cache():
+    cfg_cache.clear_cache()
+    yield
+    cfg_cache.clear_cache()
+
+
+def test_matches_runner_format_and_serves_cached_dict():
+    first = cfg_cache.cfg_graph_for(CODE)
+    assert first == build_cfg_graph_data(CODE)
+    assert set(first) == {"f", "<global>"}
+    assert cfg_cache.cfg_graph_for(CODE) is first
+    assert cfg_cache.cache_stats()["hits"] == 1
+
+
+def test_line_shifted_code_is_a_different_entry():
+    shifted = cfg_cache.cfg_graph_for("\n" + CODE)
+    assert shifted != cfg_cache.cfg_graph_for(CODE)
+    assert cfg_cache.cache_stats()["misses"] == 2
+
+
+def test_lru_eviction(monkeypatch):
+    monkeypatch.setattr(cfg_cache, "CFG_CACHE_SIZE", 2)
+    codes = [f"x = {i}\n" for i in range(3)]
+    for code in codes:
+        cfg_cache.cfg_graph_for(code)
+    cfg_cache.cfg_graph_for(codes[1])   # 變成最近使用
+    cfg_cache.cfg_graph_for("y = 0\n")  # 淘汰 codes[2]
+    assert cfg_cache.cache_stats()["size"] == 2
+    hits = cfg_cache.cache_stats()["hits"]
+    cfg_cache.cfg_graph_for(codes[1])
+    assert cfg_cache.cache_stats()["hits"] == hits + 1
+    cfg_cache.cfg_graph_for(codes[2])
+    assert cfg_cache.cache_stats()["hits"] == hits + 1
+
+
+def test_unparsable_code_yields_empty_graph():
+    assert cfg_cache.cfg_graph_for("def broken(:\n") == {}
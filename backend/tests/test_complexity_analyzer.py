@@ -1,10 +1,11 @@
 """
 tests/test_complexity_analyzer.py — fit_complexity 單元測試
-（measure_step_counts 依賴 Docker，不在單元測試範圍）
+（measure_step_counts 以 mock run_batch_in_sandbox 測試，不碰 Docker）
 """
 import math
 import pytest
-from services.complexity_analyzer import fit_complexity
+from unittest.mock import patch
+from services.complexity_analyzer import fit_complexity, measure_step_counts, N_VALUES
 
 NS = [10, 50, 100, 200, 500]
 
@@ -114,3 +115,29 @@ def test_wrapper_unknown_param_returns_none():
 def test_wrapper_no_param_returns_none():
     code = "def run():\n    pass"
     assert generate_bigo_wrapper(code) is None
+
+
+def test_measure_step_counts_uses_single_batch_call():
+    results = [
+        {"n": n, "step_count": 3 * n + 5, "is_truncated": False, "timed_out": False}
+        for n in N_VALUES
+    ]
+    with patch("services.complexity_analyzer.run_batch_in_sandbox", return_value={"results": results}) as mock_batch:
+        assert measure_step_counts("code") == "O(n)"
+    mock_batch.assert_called_once()
+    assert mock_batch.call_args.args[1] == N_VALUES
+
+
+def test_measure_step_counts_skips_timed_out_and_errors():
+    results = [
+        {"n": 10, "step_count": 35, "is_truncated": False, "timed_out": False},
+        {"n": 50, "step_count": 0, "is_truncated": False, "timed_out": False, "error": "boom"},
+        {"n": 100, "step_count": 0, "is_truncated": False, "timed_out": True},
+    ]
+    with patch("services.complexity_analyzer.run_batch_in_sandbox", return_value={"results": results}):
+        assert measure_step_counts("code") == "unknown"
+
+
+def test_measure_step_counts_sidecar_error_returns_unknown():
+    with patch("services.complexity_analyzer.run_batch_in_sandbox", return_value={"error": "timeout", "results": []}):
+        assert measure_step_counts("code") == "unknown"
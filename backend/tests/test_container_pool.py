@@ -41,7 +41,7 @@ def test_init_cleans_up_zombie_containers(mock_subprocess):
     ]
     from sandbox_sidecar.container_pool import ContainerPool
 
-    ContainerPool(min_size=3, max_size=5)
+    ContainerPool(min_size=3, max_size=5).wait_spawns(timeout=5)
 
     rm_calls = [
         c for c in mock_subprocess.run.call_args_list
@@ -60,12 +60,37 @@ def test_init_spawns_min_size_containers(mock_subprocess):
     from sandbox_sidecar.container_pool import ContainerPool
 
     pool = ContainerPool(min_size=5, max_size=10)
+    assert pool.ready.is_set()
+    assert pool.wait_spawns(timeout=5)
 
     assert len(pool.containers) == 5
     assert {c.id for c in pool.containers} == {"id1", "id2", "id3", "id4", "id5"}
     assert all(not c.in_use for c in pool.containers)
 
 
+def test_on_spawn_called_for_each_new_container(mock_subprocess):
+    mock_subprocess.check_output.side_effect = ["", "id1", "id2"]
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    spawned = []
+    pool = ContainerPool(min_size=2, max_size=5, on_spawn=lambda c: spawned.append(c.id))
+    pool.wait_spawns(timeout=5)
+
+    assert sorted(spawned) == ["id1", "id2"]
+
+
+def test_on_spawn_failure_does_not_drop_container(mock_subprocess):
+    mock_subprocess.check_output.side_effect = ["", "id1"]
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    def boom(_container):
+        raise RuntimeError("zygote failed")
+
+    pool = ContainerPool(min_size=1, max_size=5, on_spawn=boom)
+
+    assert [c.id for c in pool.containers] == ["id1"]
+
+
 def test_spawn_uses_correct_docker_args(mock_subprocess):
     mock_subprocess.check_output.side_effect = ["", "id1"]
     from sandbox_sidecar.container_pool import ContainerPool
@@ -84,6 +109,17 @@ def test_spawn_uses_correct_docker_args(mock_subprocess):
     assert args[-3:] == ["codepulse-sandbox", "tail", "-f"] or "tail" in args
 
 
+def test_node_label_scopes_spawn_and_zombie_cleanup(mock_subprocess):
+    mock_subprocess.check_output.side_effect = ["", "id1"]
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    ContainerPool(min_size=1, max_size=5, label="codepulse-pool=b")
+
+    cleanup_args, spawn_args = (c.args[0] for c in mock_subprocess.check_output.call_args_list)
+    assert "label=codepulse-pool=b" in cleanup_args
+    assert "codepulse-pool=b" in spawn_args and "codepulse-pool=1" not in spawn_args
+
+
 def test_spawn_retries_on_failure(mock_subprocess):
     """spawn 失敗 retry 3 次，全失敗才拋。"""
     import subprocess as real_sp
@@ -125,6 +161,20 @@ def test_acquire_spawns_when_no_idle_and_under_max(mock_subprocess):
     assert c3.id == "id3"
 
 
+def test_capacity_counts_in_use_and_waiting(mock_subprocess):
+    mock_subprocess.check_output.side_effect = ["", "id1", "id2"]
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    pool = ContainerPool(min_size=2, max_size=3)
+    pool.acquire()
+    capacity = pool.capacity()
+    # 第二個容器可能還在背景 spawn
+    assert capacity["idle"] + capacity["spawning"] == 1
+    assert {k: capacity[k] for k in ("available", "in_use", "waiting", "max_size")} == {
+        "available": 2, "in_use": 1, "waiting": 0, "max_size": 3,
+    }
+
+
 def test_release_marks_idle(mock_subprocess):
     mock_subprocess.check_output.side_effect = ["", "id1"]
     from sandbox_sidecar.container_pool import ContainerPool
@@ -218,3 +268,404 @@ def test_destroy_calls_docker_rm_force(mock_subprocess):
         if call.args[0][:3] == ["docker", "rm", "-f"] and "id1" in call.args[0]
     ]
     assert len(rm_calls) >= 1
+
+
+def test_init_spawns_in_parallel(mock_subprocess):
+    """min_size 個 docker run 同時進行：全部到齊 barrier 才放行，序列 spawn 會卡住。"""
+    import threading
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    barrier = threading.Barrier(3, timeout=5)
+    ids = iter(["id1", "id2", "id3"])
+
+    def fake_check_output(args, *a, **kw):
+        if "ps" in args:
+            return ""
+        barrier.wait()
+        return next(ids)
+
+    mock_subprocess.check_output.side_effect = fake_check_output
+    pool = ContainerPool(min_size=3, max_size=5, spawn_workers=3)
+    pool.wait_spawns(timeout=5)
+
+    assert {c.id for c in pool.containers} == {"id1", "id2", "id3"}
+
+
+def test_init_returns_once_first_container_ready(mock_subprocess):
+    import threading
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    gate = threading.Event()
+    ids = iter(["fast", "slow"])
+
+    def fake_check_output(args, *a, **kw):
+        if "ps" in args:
+            return ""
+        cid = next(ids)
+        if cid == "slow":
+            gate.wait(5)
+        return cid
+
+    mock_subprocess.check_output.side_effect = fake_check_output
+    pool = ContainerPool(min_size=2, max_size=5, spawn_workers=2)
+
+    assert pool.ready.is_set()
+    assert pool.acquire(timeout=1).id == "fast"
+    assert pool.stats()["spawning"] == 1
+    gate.set()
+    assert pool.wait_spawns(timeout=5)
+    assert len(pool.containers) == 2
+
+
+def test_replenisher_coalesces_destroyed_containers(mock_subprocess):
+    """replenisher 忙著時陸續丟棄的容器合併成一次 docker rm -f，且只有一個 thread。"""
+    import threading
+    import time
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    ids = iter(f"id{i}" for i in range(100))
+    mock_subprocess.check_output.side_effect = lambda *a, **k: "" if "ps" in a[0] else next(ids)
+    first_rm = threading.Event()
+    unblock = threading.Event()
+
+    def fake_run(args, *a, **kw):
+        if args[:3] == ["docker", "rm", "-f"] and not first_rm.is_set():
+            first_rm.set()
+            unblock.wait(5)
+        return MagicMock(returncode=0)
+
+    mock_subprocess.run.side_effect = fake_run
+    pool = ContainerPool(min_size=3, max_size=5)
+    pool.wait_spawns(timeout=5)
+    a, b, c = (pool.acquire() for _ in range(3))
+
+    pool.mark_destroyed(a)
+    assert first_rm.wait(5)
+    replenisher = pool._replenisher
+    pool.mark_destroyed(b)
+    pool.mark_destroyed(c)
+    unblock.set()
+
+    for _ in range(100):
+        if len(pool.containers) == 3 and not pool._retired:
+            break
+        time.sleep(0.02)
+    pool.wait_spawns(timeout=5)
+
+    rm_calls = [
+        call.args[0] for call in mock_subprocess.run.call_args_list
+        if call.args[0][:3] == ["docker", "rm", "-f"]
+    ]
+    assert rm_calls[-1][3:] == [b.id, c.id]
+    assert pool._replenisher is replenisher
+    assert len(pool.containers) == 3
+
+
+def test_engine_backend_replaces_docker_cli(mock_subprocess):
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    engine = MagicMock()
+    engine.list_containers.return_value = ["zombie1"]
+    ids = iter(["id1", "id2"])
+    engine.run_container.side_effect = lambda config, name: next(ids)
+    pool = ContainerPool(min_size=2, max_size=5, engine=engine)
+    pool.wait_spawns(timeout=5)
+    c = pool.acquire()
+    pool.mark_destroyed(c)
+
+    import time
+    for _ in range(50):
+        if engine.remove_container.call_count >= 2:
+            break
+        time.sleep(0.02)
+
+    mock_subprocess.check_output.assert_not_called()
+    mock_subprocess.run.assert_not_called()
+    engine.list_containers.assert_called_once_with("codepulse-pool=1")
+    config, name = engine.run_container.call_args.args
+    assert config["Image"] == "codepulse-sandbox"
+    assert config["HostConfig"]["NetworkMode"] == "none"
+    assert config["HostConfig"]["ReadonlyRootfs"] is True
+    assert name.startswith("sandbox-")
+    removed = [call.args[0] for call in engine.remove_container.call_args_list]
+    assert removed[:2] == ["zombie1", c.id]
+
+
+def _engine_pool(size, **kwargs):
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    engine = MagicMock()
+    engine.list_containers.return_value = []
+    ids = iter(f"id{i}" for i in range(100))
+    engine.run_container.side_effect = lambda config, name: next(ids)
+    pool = ContainerPool(min_size=size, max_size=size + 2, engine=engine, **kwargs)
+    pool.wait_spawns(timeout=5)
+    return pool, engine
+
+
+def test_health_check_evicts_dead_idle_containers(mock_subprocess):
+    pool, engine = _engine_pool(3)
+    busy = pool.acquire()
+    healthy, dead = (c for c in pool.containers if not c.in_use)
+    engine.container_states.return_value = {busy.id: "exited", healthy.id: "running", dead.id: "exited"}
+
+    assert pool._health_tick() == 1
+    assert busy in pool.containers       # 使用中的不動，交給 exec 失敗時的 mark_destroyed
+    assert healthy in pool.containers and dead not in pool.containers
+    stats = pool.stats()
+    assert stats["health_evicted"] == 1 and stats["health_failures"] == 1
+
+
+def test_health_check_tolerates_transient_states(mock_subprocess):
+    from sandbox_sidecar.container_pool import HEALTH_MAX_FAILURES
+
+    pool, engine = _engine_pool(2)
+    engine.container_states.return_value = {"id0": "paused", "id1": "running"}
+    pool._health_tick()
+    flaky = next(c for c in pool.containers if c.id == "id0")
+    assert flaky.failure_rate == 1.0
+    assert pool.stats()["unhealthy_containers"] == {"id0": 1.0}
+    # 最近檢查正常的先被分出去
+    assert pool.acquire().id == "id1"
+
+    for _ in range(HEALTH_MAX_FAILURES - 1):
+        pool._health_tick()
+    assert flaky not in pool.containers
+
+
+def test_health_check_skips_round_when_docker_unavailable(mock_subprocess):
+    pool, engine = _engine_pool(2)
+    engine.container_states.side_effect = RuntimeError("daemon down")
+    assert pool._health_tick() == 0
+    assert len(pool.containers) == 2
+    assert pool.stats()["health_checks"] == 0
+
+
+def test_health_check_rewarms_stale_containers(mock_subprocess):
+    warmed = []
+    pool, engine = _engine_pool(1, on_spawn=warmed.append, warm_check=lambda c: len(warmed) > 1)
+    (container,) = pool.containers
+    engine.container_states.return_value = {container.id: "running"}
+
+    pool._health_tick()
+    assert warmed == [container, container]
+    assert container.in_use is False
+    pool._health_tick()
+    assert pool.stats()["health_rewarmed"] == 1
+
+
+def test_cli_health_check_reads_docker_ps(mock_subprocess):
+    mock_subprocess.check_output.side_effect = ["", "id1", "id2"]
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    pool = ContainerPool(min_size=2, max_size=5)
+    pool.wait_spawns(timeout=5)
+    mock_subprocess.check_output.side_effect = None
+    mock_subprocess.check_output.return_value = "id1 running\n"
+
+    assert pool._health_tick() == 1
+    assert "id2" not in {c.id for c in pool.containers}
+    health_calls = [c.args[0] for c in mock_subprocess.check_output.call_args_list if "--no-trunc" in c.args[0]]
+    assert health_calls == [[
+        "docker", "ps", "-a", "--no-trunc", "--filter", "label=codepulse-pool=1", "--format", "{{.ID}} {{.State}}",
+    ]]
+
+
+def _reset_proc(returncode=0, checksum=None):
+    import io
+    import json
+    from sandbox_sidecar.container_pool import BASE_PROCESSES, reset_state_checksum
+
+    proc = MagicMock()
+    proc.wait.return_value = returncode
+    report = {"checksum": checksum or reset_state_checksum(BASE_PROCESSES), "killed": 2, "removed": 1}
+    proc.stdout = io.StringIO(json.dumps(report) + "\n")
+    return proc
+
+
+def _wait_resets(pool):
+    import time
+
+    deadline = time.monotonic() + 5
+    while pool.stats()["resetting"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_release_skips_reset(mock_subprocess):
+    pool, engine = _engine_pool(1, reset=True)
+    c = pool.acquire()
+    pool.release(c)
+
+    engine.exec.assert_not_called()
+    assert c.in_use is False and c.reuse_count == 1
+    assert pool.stats()["resetting"] == 0 and pool.stats()["resets"] == 0
+
+
+def test_reset_returns_clean_container_to_pool(mock_subprocess):
+    pool, engine = _engine_pool(1, reset=True)
+    engine.exec.side_effect = lambda cid, cmd: _reset_proc()
+    c = pool.acquire()
+    pool.recycle(c)
+    _wait_resets(pool)
+
+    engine.exec.assert_called_once_with(c.id, ["python", "/sandbox/reset.py"])
+    assert c in pool.containers and c.in_use is False and c.reuse_count == 1
+    stats = pool.stats()
+    assert stats["resets"] == 1 and stats["reset_failures"] == 0
+
+
+def test_reset_evicts_container_on_checksum_mismatch_or_failure(mock_subprocess):
+    pool, engine = _engine_pool(2, reset=True)
+    procs = iter([_reset_proc(checksum="deadbeef"), _reset_proc(returncode=1)])
+    engine.exec.side_effect = lambda cid, cmd: next(procs)
+    a, b = pool.acquire(), pool.acquire()
+    pool.recycle(a)
+    pool.recycle(b)
+    _wait_resets(pool)
+
+    assert a not in pool.containers and b not in pool.containers
+    assert pool.stats()["reset_failures"] == 2
+
+
+def test_reset_keeps_zygote_only_while_warm(mock_subprocess):
+    from sandbox_sidecar.container_pool import BASE_PROCESSES, ZYGOTE_CMDLINE, reset_state_checksum
+
+    pool, engine = _engine_pool(1, reset=True, warm_check=lambda c: True)
+    engine.exec.side_effect = lambda cid, cmd: _reset_proc(
+        checksum=reset_state_checksum(BASE_PROCESSES + (ZYGOTE_CMDLINE,)),
+    )
+    c = pool.acquire()
+    pool.recycle(c)
+    _wait_resets(pool)
+
+    assert engine.exec.call_args.args[1] == ["python", "/sandbox/reset.py", "--keep-zygote"]
+    assert c in pool.containers and c.in_use is False
+
+
+def test_recycle_without_reset_destroys(mock_subprocess):
+    pool, engine = _engine_pool(1)
+    c = pool.acquire()
+    pool.recycle(c)
+    assert c not in pool.containers
+    engine.exec.assert_not_called()
+
+
+def test_replenisher_survives_unexpected_error(mock_subprocess):
+    import time
+
+    pool, engine = _engine_pool(1)
+    engine.remove_container.side_effect = [ValueError("boom"), None]
+    pool.mark_destroyed(pool.acquire())
+    pool.wait_spawns(timeout=5)
+    pool.mark_destroyed(pool.acquire())
+
+    deadline = time.monotonic() + 5
+    while engine.remove_container.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.wait_spawns(timeout=5)
+    assert engine.remove_container.call_count == 2
+    assert pool._replenisher.is_alive()
+
+
+def test_engine_spawn_error_is_retried(mock_subprocess):
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    engine = MagicMock()
+    engine.list_containers.return_value = []
+    engine.run_container.side_effect = [RuntimeError("docker api 500"), "id1"]
+    pool = ContainerPool(min_size=1, max_size=5, engine=engine)
+
+    assert [c.id for c in pool.containers] == ["id1"]
+
+
+# ---------------------------------------------------------------------------
+# autoscaler
+# ---------------------------------------------------------------------------
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def scaling_pool(mock_subprocess):
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    ids = iter(f"id{i}" for i in range(100))
+    mock_subprocess.check_output.side_effect = lambda *a, **k: "" if "ps" in a[0] else next(ids)
+    pool = ContainerPool(min_size=2, max_size=10)
+    pool.wait_spawns(timeout=5)
+    pool._clock = FakeClock()
+    return pool
+
+
+def test_autoscaler_keeps_headroom_when_idle(scaling_pool):
+    from sandbox_sidecar.container_pool import SCALE_UP_HEADROOM
+
+    scaling_pool._autoscale_tick()
+
+    assert len(scaling_pool.containers) == SCALE_UP_HEADROOM
+    assert scaling_pool.stats()["target"] == SCALE_UP_HEADROOM
+
+
+def test_autoscaler_prespawns_for_burst(scaling_pool):
+    # 一波 6 個請求同時拿走容器：使用中 + 到達率推估 + headroom → 擴張
+    for _ in range(6):
+        scaling_pool.acquire(timeout=0.1)
+    scaling_pool._autoscale_tick()
+
+    stats = scaling_pool.stats()
+    assert stats["in_use"] == 6
+    assert stats["size"] > 6
+    assert stats["size"] <= scaling_pool.max_size
+    assert stats["idle"] >= 2
+
+
+def test_autoscaler_never_exceeds_max_size(scaling_pool):
+    for _ in range(10):
+        scaling_pool.acquire(timeout=0.1)
+    scaling_pool._autoscale_tick()
+
+    assert len(scaling_pool.containers) == scaling_pool.max_size
+
+
+def test_autoscaler_shrinks_only_after_cooldown(scaling_pool):
+    from sandbox_sidecar.container_pool import AUTOSCALE_WINDOW, SCALE_DOWN_COOLDOWN
+
+    burst = [scaling_pool.acquire(timeout=0.1) for _ in range(8)]
+    scaling_pool._autoscale_tick()
+    for c in burst:
+        scaling_pool.release(c)
+    peak = len(scaling_pool.containers)
+
+    # 統計視窗過了但 cooldown 還沒到：不縮
+    scaling_pool._clock.now += AUTOSCALE_WINDOW + 1
+    scaling_pool._autoscale_tick()
+    assert len(scaling_pool.containers) == peak
+
+    # cooldown 過後每次 tick 只縮一個，最後停在 target 附近（hysteresis band 內）
+    scaling_pool._clock.now += SCALE_DOWN_COOLDOWN
+    scaling_pool._autoscale_tick()
+    assert len(scaling_pool.containers) == peak - 1
+    for _ in range(20):
+        scaling_pool._autoscale_tick()
+    assert len(scaling_pool.containers) >= scaling_pool.min_size
+    assert len(scaling_pool.containers) - scaling_pool.stats()["target"] < 2
+
+
+def test_exhausted_acquire_recorded_in_stats(mock_subprocess):
+    from sandbox_sidecar.container_pool import ContainerPool
+
+    mock_subprocess.check_output.side_effect = ["", "id1"]
+    pool = ContainerPool(min_size=1, max_size=1)
+    pool.acquire(timeout=0.1)
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire(timeout=0.05)
+
+    stats = pool.stats()
+    assert stats["exhausted_total"] == 1
+    assert stats["wait_p95"] >= 0.05
+    assert stats["in_use_ratio"] == 1.0
@@ -0,0 +1,236 @@
+"""
+test_docker_backend.py — sandbox_sidecar/docker_backend.py 測試
+
+用 unix socket 上的假 Engine API server 驗證：
+- container create / start / list / rm 的請求內容，以及持久連線重用（timeout / 壞回應後重建）
+- exec 的 hijacked stream：stdout / stderr 多工拆解、stdin 寫入、ExitCode
+- engine_from_env 的 CLI fallback
+"""
+
+import json
+import os
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "sandbox_sidecar"))
+
+from docker_backend import DOCKER_API_VERSION, DockerAPIError, DockerEngineClient, engine_from_env
+
+PREFIX = f"/{DOCKER_API_VERSION}"
+
+
+def _frame(stream: int, data: bytes) -> bytes:
+    return struct.pack(">BxxxI", stream, len(data)) + data
+
+
+class _FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.connections = 0
+        self.stalled = False
+        self.requests: list[tuple[str, str, dict | None]] = []
+        super().__init__(path, _Handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        body = self._body()
+        self.server.requests.append((method, self.path, body))
+        path = url.path
+        if path == "/_ping":
+            return self._reply(200)
+        assert path.startswith(PREFIX)
+        path = path[len(PREFIX):]
+        if method == "GET" and path == "/containers/json":
+            filters = json.loads(parse_qs(url.query)["filters"][0])
+            items = [{"Id": "z1", "State": "running"}, {"Id": "z2", "State": "exited"}]
+            return self._reply(200, items if filters == {"label": ["codepulse-pool=1"]} else [])
+        if method == "POST" and path == "/containers/create":
+            if body.get("Image") == "missing":
+                return self._reply(404, {"message": "No such image: missing"})
+            return self._reply(201, {"Id": "c1"})
+        if method == "POST" and path == "/containers/c1/start":
+            return self._reply(204)
+        if method == "DELETE" and path.endswith("/stall") and not self.server.stalled:
+            self.server.stalled = True
+            time.sleep(0.5)
+            return self._reply(204)
+        if method == "DELETE" and path.endswith("/garbage"):
+            self.wfile.write(b"garbage\r\n")
+            self.close_connection = True
+            return
+        if method == "DELETE" and path.startswith("/containers/"):
+            return self._reply(404 if path.endswith("/gone") else 204)
+        if method == "POST" and path == "/containers/c1/exec":
+            return self._reply(201, {"Id": "e1"})
+        if method == "POST" and path == "/exec/e1/start":
+            return self._exec_stream()
+        if method == "GET" and path == "/exec/e1/json":
+            return self._reply(200, {"ExitCode": 3, "Running": False})
+        return self._reply(404, {"message": "not found"})
+
+    def _exec_stream(self):
+        self.wfile.write(
+            b"HTTP/1.1 101 UPGRADED\r\n"
+            b"Content-Type: application/vnd.docker.raw-stream\r\n"
+            b"Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n"
+        )
+        # 一行拆成兩個 frame、中文跨 frame 切開
+        name = "測試".encode()
+        self.wfile.write(_frame(1, b"hello " + name[:2]) + _frame(1, name[2:] + b"\n"))
+        self.wfile.write(_frame(2, b"warn\n"))
+        self.wfile.flush()
+        value = self.rfile.readline()
+        self.wfile.write(_frame(1, b"got " + value + b"tail-without-newline"))
+        self.wfile.flush()
+        self.close_connection = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    path = str(tmp_path / "docker.sock")
+    server = _FakeEngine(path)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    client = DockerEngineClient(path, timeout=5)
+    client.server = server
+    yield client
+    server.shutdown()
+    server.server_close()
+
+
+class TestContainerLifecycle:
+    def test_ping(self, engine):
+        assert engine.ping() is True
+
+    def test_run_container_creates_and_starts(self, engine):
+        cid = engine.run_container({"Image": "codepulse-sandbox"}, "sandbox-abc")
+
+        assert cid == "c1"
+        methods = [(m, p) for m, p, _ in engine.server.requests]
+        assert methods == [
+            ("POST", f"{PREFIX}/containers/create?name=sandbox-abc"),
+            ("POST", f"{PREFIX}/containers/c1/start"),
+        ]
+
+    def test_requests_reuse_one_connection(self, engine):
+        engine.list_containers("codepulse-pool=1")
+        engine.run_container({"Image": "codepulse-sandbox"}, "a")
+        engine.remove_container("c1")
+
+        assert engine.server.connections == 1
+
+    def test_timeout_drops_connection(self, engine):
+        engine.timeout = 0.2
+        engine._local.conn = None
+        with pytest.raises(TimeoutError):
+            engine.remove_container("stall")
+        # 同 thread 之後的呼叫走新連線，不會卡在 CannotSendRequest
+        assert engine.list_containers("codepulse-pool=1") == ["z1", "z2"]
+        assert engine.server.connections == 2
+
+    def test_malformed_response_raises_connection_error(self, engine):
+        with pytest.raises(ConnectionError):
+            engine.remove_container("garbage")
+        assert engine.list_containers("codepulse-pool=1") == ["z1", "z2"]
+
+    def test_list_containers_filters_by_label(self, engine):
+        assert engine.list_containers("codepulse-pool=1") == ["z1", "z2"]
+        assert "all=1" in engine.server.requests[-1][1]
+
+    def test_container_states_by_label(self, engine):
+        assert engine.container_states("codepulse-pool=1") == {"z1": "running", "z2": "exited"}
+        assert engine.container_states("codepulse-pool=other") == {}
+
+    def test_remove_missing_container_is_ok(self, engine):
+        engine.remove_container("gone")
+        assert engine.server.requests[-1][1] == f"{PREFIX}/containers/gone?force=1"
+
+    def test_api_error_raises(self, engine):
+        with pytest.raises(DockerAPIError) as exc:
+            engine.run_container({"Image": "missing"}, "x")
+        assert exc.value.status == 404
+        assert "No such image" in str(exc.value)
+
+
+class TestExec:
+    def test_exec_demuxes_streams_and_returns_exit_code(self, engine):
+        proc = engine.exec("c1", ["python", "/sandbox/runner.py"], {"CODE": "eA=="})
+
+        assert proc.stdout.readline() == "hello 測試\n"
+        assert proc.stderr.readline() == "warn\n"
+        proc.stdin.write("Ada\n")
+        proc.stdin.flush()
+        assert proc.stdout.readline() == "got Ada\n"
+        assert proc.stdout.readline() == "tail-without-newline"
+        assert proc.stdout.readline() == ""
+        assert proc.wait(timeout=5) == 3
+        assert proc.poll() == 3
+
+        _, _, create_body = engine.server.requests[0]
+        assert create_body["Cmd"] == ["python", "/sandbox/runner.py"]
+        assert create_body["Env"] == ["CODE=eA=="]
+        assert create_body["AttachStdin"] is True
+
+    def test_kill_ends_stream(self, engine):
+        proc = engine.exec("c1", ["python"], {})
+        assert proc.stdout.readline() == "hello 測試\n"
+
+        proc.kill()
+
+        assert proc.wait(timeout=5) == -9
+        assert not any(p.endswith("/exec/e1/json") for _, p, _ in engine.server.requests)
+
+
+class TestEngineFromEnv:
+    def test_cli_mode_returns_none(self, engine):
+        with patch.dict(os.environ, {"DOCKER_BACKEND": "cli", "DOCKER_SOCKET": engine.socket_path}):
+            assert engine_from_env() is None
+
+    def test_auto_uses_available_socket(self, engine):
+        with patch.dict(os.environ, {"DOCKER_BACKEND": "auto", "DOCKER_SOCKET": engine.socket_path}):
+            client = engine_from_env()
+        assert isinstance(client, DockerEngineClient)
+
+    def test_missing_socket_falls_back(self, tmp_path):
+        with patch.dict(os.environ, {"DOCKER_BACKEND": "api", "DOCKER_SOCKET": str(tmp_path / "none.sock")}):
+            assert engine_from_env() is None
@@ -156,6 +156,38 @@ class TestTracer:
         ]
         assert len(self_edges) == 1
         assert len(self_edges[0].steps) == 3  # factorial(4) 遞迴 3 次
+        assert self_edges[0].calls == self_edges[0].returns == 3
+
+    def test_edge_counts_with_capped_steps(self):
+        from tracer import EDGE_STEPS_LIMIT, parse_capture
+        code = "def fib(n):\n    if n < 2:\n        return n\n    return fib(n - 1) + fib(n - 2)\n\nfib(18)\n"
+        result = run_trace(code)
+        edge = next(e for e in result.call_graph.edges if e.source == e.target == "func_fib")
+        assert result.is_truncated
+        # head：次數算到截斷為止，steps 只留前 EDGE_STEPS_LIMIT 個
+        traced_calls = sum(1 for ev in result.trace if ev.tag == "CALL" and ev.meta["func_name"] == "fib")
+        assert edge.calls == traced_calls - 1
+        assert len(edge.steps) == len(edge.return_steps) == EDGE_STEPS_LIMIT
+        assert all(result.trace[s].tag == "CALL" for s in edge.steps)
+        assert all(result.trace[s].tag == "RETURN" for s in edge.return_steps)
+
+        # ring 整段都在建 call graph：fib(18) 共 8361 次呼叫，扣掉最外層那次都走 fib → fib
+        ring = run_trace(code, capture=parse_capture({"strategy": "ring"}))
+        edge = next(e for e in ring.call_graph.edges if e.source == e.target == "func_fib")
+        assert edge.calls == edge.returns == 8360
+        assert len(edge.steps) <= EDGE_STEPS_LIMIT
+
+    def test_edge_steps_opt_in_and_off(self):
+        from tracer import parse_capture
+        code = "def fib(n):\n    if n < 2:\n        return n\n    return fib(n - 1) + fib(n - 2)\n\nfib(12)\n"
+        full = run_trace(code, capture=parse_capture({"edge_steps": MAX_TRACE_STEPS}))
+        edge = next(e for e in full.call_graph.edges if e.source == "func_fib")
+        assert len(edge.steps) == sum(1 for ev in full.trace if ev.tag == "CALL" and ev.meta["func_name"] == "fib") - 1
+
+        counts_only = run_trace(code, capture=parse_capture({"edge_steps": 0}))
+        edge = next(e for e in counts_only.call_graph.edges if e.source == "func_fib")
+        assert len(edge.steps) == 0
+        assert edge.calls == 464
 
     def test_truncation(self):
         # 製造超過 MAX_TRACE_STEPS 的迴圈
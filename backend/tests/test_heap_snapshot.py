@@ -0,0 +1,128 @@
+"""tests/test_heap_snapshot.py — heap 快照的擷取、object table 與還原單元測試"""
+
+import json
+
+from services.heap_snapshot import (
+    HeapReader,
+    HeapRecorder,
+    HeapTable,
+    OpaqueValue,
+    heap_local_values,
+    resolve_heap,
+)
+from services.trace_codec import TRACE_ENCODING_DELTA, decode_trace, encode_trace, pack_trace, unpack_trace
+
+
+def _record(recorder: HeapRecorder, **variables) -> tuple[dict, dict]:
+    recorder.begin()
+    values = {k: recorder(v) for k, v in variables.items()}
+    return values, recorder.end()
+
+
+def _wire(steps: list[tuple[dict, dict]]) -> tuple[list[dict], list]:
+    """(values, view) 序列 → runner 輸出格式（經過一次 JSON）。"""
+    table = HeapTable()
+    events = [
+        {"tag": "LINE", "local_vars": values, "global_vars": {}, "dataSnapshot": [], "meta": {}, "heap": table.delta(view)}
+        for values, view in steps
+    ]
+    return json.loads(json.dumps([events, table.objects]))
+
+
+def test_primitives_are_inline_and_containers_are_refs():
+    values, _ = _record(HeapRecorder(), n=3, s="x", ok=True, none=None, f=1.5, arr=[1, 2])
+    assert values["n"] == 3 and values["s"] == "x" and values["f"] == 1.5
+    assert values["arr"] == {"ref": 1}
+
+
+def test_aliases_share_one_object():
+    recorder = HeapRecorder()
+    arr = [1, 2]
+    values, view = _record(recorder, a=arr, b=arr, pair=(arr, arr))
+    assert values["a"] is values["b"]
+    assert view[values["pair"]["ref"]] == ["tuple", [values["a"], values["a"]]]
+    assert len(view) == 2
+
+
+def test_unchanged_objects_keep_the_same_view():
+    recorder = HeapRecorder()
+    arr = [3, 1, 2]
+    _, first = _record(recorder, arr=arr, i=0)
+    _, second = _record(recorder, arr=arr, i=1)
+    assert second is first
+    arr[0] = 9
+    _, third = _record(recorder, arr=arr, i=1)
+    assert third is not second
+    assert third[1] == ["list", [9, 1, 2]]
+
+
+def test_nested_change_only_replaces_the_inner_object():
+    recorder = HeapRecorder()
+    grid = [[0, 0], [0, 0]]
+    values, before = _record(recorder, grid=grid)
+    grid[1][0] = 5
+    _, after = _record(recorder, grid=grid)
+    outer = values["grid"]["ref"]
+    assert after[outer] is before[outer]
+    changed = [oid for oid in after if after[oid] is not before[oid]]
+    assert len(changed) == 1 and after[changed[0]] == ["list", [5, 0]]
+
+
+def test_bool_and_int_are_distinct_versions():
+    recorder = HeapRecorder()
+    arr = [1]
+    _, first = _record(recorder, arr=arr)
+    arr[0] = True
+    _, second = _record(recorder, arr=arr)
+    assert second[1] == ["list", [True]]
+    assert second is not first
+
+
+def test_table_emits_each_version_once_and_patches_small_list_changes():
+    recorder = HeapRecorder()
+    arr = list(range(10))
+    steps = [_record(recorder, arr=arr)]
+    steps.append(_record(recorder, arr=arr))
+    arr[0], arr[1] = arr[1], arr[0]
+    steps.append(_record(recorder, arr=arr))
+    events, objects = _wire(steps)
+    assert [ev["heap"] for ev in events] == [[[1, 0]], [], [[1, 1]]]
+    assert objects[1] == ["patch", 0, 10, [[0, 1], [1, 0]]]
+    assert heap_local_values(events, objects)[-1]["arr"] == [1, 0, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_render_matches_repr():
+    recorder = HeapRecorder()
+    cyclic = [1]
+    cyclic.append(cyclic)
+    nested = {"k": (1,), "s": {2}, "e": set(), "t": (), "inf": float("inf"), "f": len}
+    values, view = _record(recorder, cyclic=cyclic, nested=nested, pair=(cyclic, "x"))
+    reader = HeapReader()
+    for name, value in (("cyclic", cyclic), ("nested", nested), ("pair", (cyclic, "x"))):
+        assert reader.render(values[name], view) == repr(value)
+
+
+def test_materialize_restores_values_and_aliasing():
+    recorder = HeapRecorder()
+    arr = [3, 1, 2]
+    values, view = _record(recorder, arr=arr, grid=[arr, arr], fn=len)
+    reader = HeapReader()
+    grid = reader.materialize(values["grid"], view)
+    assert grid == [[3, 1, 2], [3, 1, 2]]
+    assert grid[0] is grid[1]
+    fn = reader.materialize(values["fn"], view)
+    assert isinstance(fn, OpaqueValue) and repr(fn) == repr(len)
+
+
+def test_resolve_heap_through_trace_codec():
+    recorder = HeapRecorder()
+    arr = [2, 1]
+    steps = [_record(recorder, arr=arr, i=0)]
+    arr.reverse()
+    steps.append(_record(recorder, arr=arr, i=1))
+    events, objects = _wire(steps)
+    encoded = encode_trace(events)
+    resolved = decode_trace(encoded, TRACE_ENCODING_DELTA, objects)
+    assert [ev["local_vars"] for ev in resolved] == [{"arr": "[2, 1]", "i": "0"}, {"arr": "[1, 2]", "i": "1"}]
+    assert resolved == resolve_heap(events, objects)
+    assert unpack_trace(pack_trace(encoded, TRACE_ENCODING_DELTA, objects)) == resolved
@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 
@@ -34,9 +34,24 @@ def test_resolve_interactive_sandbox_publishes_input_and_sends_value():
         "prompt": "Name: ",
         "input_index": 0,
     })
-    mock_wait.assert_called_once_with("task-1", "session-1")
+    mock_wait.assert_called_once_with("task-1", "session-1", None)
     mock_send.assert_called_once_with("session-1", "Ada")
-    mock_cleanup.assert_called_once_with("task-1", "session-1")
+    mock_cleanup.assert_called_once_with("task-1", "session-1", None)
+
+
+def test_completed_result_keeps_sandbox_timings():
+    first = {"status": "input_needed", "session_id": "session-1", "prompt": "", "input_index": 0}
+    timings = {"acquire_ms": 5.0, "exec_start_ms": 1.0, "run_ms": 900.0}
+    completed = {"status": "completed", "result": {"trace": [], "usage": {"user_ms": 3.0}}, "sandbox_timings": timings}
+
+    with patch.object(analysis_runner.task_queue, "mark_waiting_for_input"), \
+         patch.object(analysis_runner.task_queue, "publish_event"), \
+         patch("services.analysis_runner._wait_for_user_input", return_value="Ada"), \
+         patch("services.analysis_runner.send_input", return_value=completed), \
+         patch("services.analysis_runner._cleanup_interactive_session"):
+        result = analysis_runner._resolve_interactive_sandbox("task-1", first)
+
+    assert analysis_runner._sandbox_usage(result) == {**timings, "user_ms": 3.0}
 
 
 def test_wait_for_user_input_heartbeats_sidecar_when_no_input(monkeypatch):
@@ -117,3 +132,103 @@ def test_resolve_interactive_sandbox_returns_cancelled_result():
 
     assert result["error"] == "cancelled"
     assert result["is_truncated"] is False
+
+
+def test_run_analysis_publishes_streamed_trace_batches():
+    def fake_run_in_sandbox(_code, stdin_inputs=None, on_trace_batch=None, capture=None, skip_cfg=False,
+                            priority=None, tenant=None):
+        on_trace_batch(0, [{"tag": "LINE"}])
+        return {"error": "boom"}
+
+    with patch.object(analysis_runner.task_queue, "update_progress"), \
+         patch.object(analysis_runner.task_queue, "publish_event") as mock_publish, \
+         patch("services.analysis_runner.run_in_sandbox", side_effect=fake_run_in_sandbox):
+        with pytest.raises(RuntimeError):
+            analysis_runner._run_analysis("task-1", "x = 1", "x = 1", stream_trace=True)
+
+    mock_publish.assert_called_once_with("task-1", {
+        "stage": "sandbox",
+        "status": "running",
+        "type": "trace_batch",
+        "start": 0,
+        "events": [{"tag": "LINE"}],
+    })
+
+
+@pytest.mark.parametrize("code, expected", [
+    ('name = input("Name: ")\n', True),
+    ("read = input\nx = read()\n", True),
+    ('# no input here\nprint("input")\n', False),
+    ("user_input = 3\ninputs = [user_input]\n", False),
+    ("def f(:\n    input()\n", True),
+])
+def test_reads_input_matches_builtin_references_only(code, expected):
+    assert analysis_runner._reads_input(code) is expected
+
+
+@pytest.mark.parametrize("code, uses_channel", [("x = input()", True), ("# input\nx = 1", False)])
+def test_run_analysis_opens_channel_only_for_input_calls(code, uses_channel):
+    with patch.object(analysis_runner.task_queue, "update_progress"), \
+         patch("services.analysis_runner.open_channel", return_value=None) as mock_open, \
+         patch("services.analysis_runner.run_in_sandbox", return_value={"error": "boom"}) as mock_run:
+        with pytest.raises(RuntimeError):
+            analysis_runner._run_analysis("task-1", code, code)
+    assert mock_open.called is uses_channel
+    assert mock_run.call_args.kwargs["priority"] == (
+        analysis_runner.PRIORITY_INTERACTIVE if uses_channel else analysis_runner.PRIORITY_PRIMARY
+    )
+
+
+def test_run_analysis_does_not_stream_unless_requested():
+    with patch.object(analysis_runner.task_queue, "update_progress"), \
+         patch("services.analysis_runner.run_in_sandbox", return_value={"error": "boom"}) as mock_run:
+        with pytest.raises(RuntimeError):
+            analysis_runner._run_analysis("task-1", "x = 1", "x = 1")
+
+    assert mock_run.call_args.kwargs["on_trace_batch"] is None
+
+
+def test_resolve_interactive_sandbox_uses_channel_instead_of_http():
+    first = {"status": "input_needed", "session_id": "session-1", "prompt": "> ", "input_index": 0}
+    channel = MagicMock()
+    channel.send_input.return_value = {"status": "completed", "result": {"trace": []}}
+
+    with patch.object(analysis_runner.task_queue, "mark_waiting_for_input"), \
+         patch.object(analysis_runner.task_queue, "publish_event"), \
+         patch("services.analysis_runner._wait_for_user_input", return_value="Ada") as mock_wait, \
+         patch("services.analysis_runner.send_input") as mock_http_send, \
+         patch("services.analysis_runner.close_session") as mock_http_close, \
+         patch("services.analysis_runner._redis_client"):
+        result = analysis_runner._resolve_interactive_sandbox("task-1", first, channel)
+
+    assert result == {"trace": []}
+    mock_wait.assert_called_once_with("task-1", "session-1", channel.is_alive)
+    channel.send_input.assert_called_once_with("Ada")
+    channel.close.assert_called_once()
+    mock_http_send.assert_not_called()
+    mock_http_close.assert_not_called()
+
+
+def test_run_analysis_opens_channel_only_for_input_programs():
+    channel = MagicMock()
+    channel.run.return_value = {"error": "boom"}
+
+    with patch.object(analysis_runner.task_queue, "update_progress"), \
+         patch("services.analysis_runner.open_channel", return_value=channel) as mock_open, \
+         patch("services.analysis_runner.run_in_sandbox", return_value={"error": "boom"}) as mock_http_run:
+        with pytest.raises(RuntimeError):
+            analysis_runner._run_analysis("task-1", "x = 1", "x = 1")
+        mock_open.assert_not_called()
+        mock_http_run.assert_called_once()
+
+        with pytest.raises(RuntimeError):
+            analysis_runner._run_analysis("task-2", "x = input()", "x = input()")
+
+    mock_open.assert_called_once()
+    channel.run.assert_called_once()
+    channel.close.assert_called_once()
+    mock_http_run.assert_called_once()
+    # 互動程式排在主 trace 前面；匿名使用者以 task 為 tenant
+    assert mock_http_run.call_args.kwargs["priority"] == "primary"
+    assert channel.run.call_args.kwargs["priority"] == "interactive"
+    assert channel.run.call_args.kwargs["tenant"] == "task:task-2"
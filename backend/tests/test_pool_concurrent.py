@@ -7,7 +7,13 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
-from sandbox_sidecar.container_pool import ContainerPool, PoolExhaustedError
+from sandbox_sidecar.container_pool import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PRIMARY,
+    PRIORITY_PROBE,
+    ContainerPool,
+    PoolExhaustedError,
+)
 
 
 @pytest.fixture
@@ -36,6 +42,7 @@ def test_concurrent_acquire_within_max_all_succeed(mock_subprocess):
     with ThreadPoolExecutor(max_workers=5) as ex:
         futures = [ex.submit(_hold_and_release, pool, 0.1) for _ in range(5)]
         ids = [f.result(timeout=5) for f in futures]
+    pool.wait_spawns(timeout=5)
     assert len(ids) == 5
     assert len(pool.containers) <= 5
 
@@ -78,3 +85,75 @@ def test_release_wakes_waiter(mock_subprocess):
     t.join(timeout=2)
 
     assert len(waiter_result) == 1
+
+
+def _queue_waiters(pool, specs, order):
+    """依序讓 specs [(name, priority, tenant)] 排進 acquire，每個都確定在排隊後才送下一個。"""
+    threads = []
+    for name, priority, tenant in specs:
+        def take(name=name, priority=priority, tenant=tenant):
+            c = pool.acquire(timeout=5, priority=priority, tenant=tenant)
+            order.append(name)
+            pool.release(c)
+
+        expected = pool.stats()["waiting"] + 1
+        t = threading.Thread(target=take)
+        t.start()
+        threads.append(t)
+        deadline = time.monotonic() + 2
+        while pool.stats()["waiting"] < expected and time.monotonic() < deadline:
+            time.sleep(0.005)
+    return threads
+
+
+def test_freed_container_goes_to_highest_priority_class(mock_subprocess):
+    pool = ContainerPool(min_size=1, max_size=1, starvation_bound=60)
+    held = pool.acquire()
+    order: list[str] = []
+    threads = _queue_waiters(pool, [
+        ("probe", PRIORITY_PROBE, "a"),
+        ("primary", PRIORITY_PRIMARY, "b"),
+        ("interactive", PRIORITY_INTERACTIVE, "c"),
+    ], order)
+    assert pool.stats()["waiting_by_priority"] == {"interactive": 1, "primary": 1, "probe": 1}
+
+    pool.release(held)
+    for t in threads:
+        t.join(timeout=5)
+    assert order == ["interactive", "primary", "probe"]
+
+
+def test_same_class_prefers_tenant_holding_fewer_containers(mock_subprocess):
+    """a 已佔一個容器又排了兩個 probe；b 後到，仍先於 a 的第二個 probe 拿到容器。"""
+    pool = ContainerPool(min_size=2, max_size=2, starvation_bound=60)
+    pool.wait_spawns(timeout=5)
+    held_a = pool.acquire(priority=PRIORITY_PROBE, tenant="a")
+    held_other = pool.acquire(priority=PRIORITY_PROBE, tenant="other")
+    order: list[str] = []
+    threads = _queue_waiters(pool, [
+        ("a-1", PRIORITY_PROBE, "a"),
+        ("a-2", PRIORITY_PROBE, "a"),
+        ("b-1", PRIORITY_PROBE, "b"),
+    ], order)
+
+    pool.release(held_other)
+    for t in threads:
+        t.join(timeout=5)
+    pool.release(held_a)
+    assert order[0] == "b-1"
+    assert sorted(order[1:]) == ["a-1", "a-2"]
+
+
+def test_starved_probe_is_not_overtaken(mock_subprocess):
+    pool = ContainerPool(min_size=1, max_size=1, starvation_bound=0.2)
+    held = pool.acquire()
+    order: list[str] = []
+    threads = _queue_waiters(pool, [("probe", PRIORITY_PROBE, "a")], order)
+    time.sleep(0.3)
+    threads += _queue_waiters(pool, [("interactive", PRIORITY_INTERACTIVE, "b")], order)
+
+    pool.release(held)
+    for t in threads:
+        t.join(timeout=5)
+    assert order == ["probe", "interactive"]
+    assert pool.stats()["wait_p95_by_priority"]["probe"] >= 0.3
@@ -0,0 +1,100 @@
+"""
+test_reset.py — docker/reset.py（容器重用前的狀態重置）測試
+
+process 表與 os.kill 以假資料取代（不會真的殺本機 process），驗證：
+- 只保留 PID 1、自己與 sidecar 的 zygote，其餘（含 zygote fork 出的 child）都被 SIGKILL
+- /tmp 清空
+- 回報的 checksum 與 sidecar 端 container_pool.reset_state_checksum 對預期乾淨狀態算出的一致
+"""
+
+import importlib.util
+import json
+import os
+import signal
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "sandbox_sidecar"))
+
+from container_pool import BASE_PROCESSES, ZYGOTE_CMDLINE, reset_state_checksum
+
+RESET_PATH = os.path.join(os.path.dirname(__file__), "..", "docker", "reset.py")
+
+_spec = importlib.util.spec_from_file_location("sandbox_reset", RESET_PATH)
+reset = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(reset)
+
+
+@pytest.fixture
+def fake_container(monkeypatch, tmp_path):
+    me = os.getpid()
+    procs = {
+        1: (0, "tail -f /dev/null"),
+        me: (0, "python /sandbox/reset.py"),
+        40: (0, "python /sandbox/zygote.py"),
+        41: (40, "python /sandbox/zygote.py"),       # zygote fork 的 child（卡住的 user code）
+        50: (0, "python /sandbox/runner.py"),        # timeout 後留下的 runner
+        51: (50, "sleep 100"),
+    }
+    killed = []
+
+    def fake_kill(pid, sig):
+        assert sig == signal.SIGKILL
+        killed.append(pid)
+        procs.pop(pid, None)
+
+    monkeypatch.setattr(reset, "_processes", lambda: dict(procs))
+    monkeypatch.setattr(reset.os, "kill", fake_kill)
+    monkeypatch.setattr(reset, "TMP_DIR", str(tmp_path))
+    (tmp_path / "out.txt").write_text("x")
+    (tmp_path / ".hidden").write_text("x")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "f").write_text("x")
+    return killed, tmp_path
+
+
+def _run_main(monkeypatch, capsys, *args) -> dict:
+    monkeypatch.setattr(sys, "argv", ["reset.py", *args])
+    reset.main()
+    return json.loads(capsys.readouterr().out)
+
+
+def test_checksum_format_matches_sidecar():
+    processes, tmp = ["tail -f /dev/null", "python /sandbox/zygote.py"], ["b", "a"]
+    assert reset.state_checksum(processes, tmp) == reset_state_checksum(processes, tmp)
+    assert reset.state_checksum(processes[::-1], tmp[::-1]) == reset_state_checksum(processes, tmp)
+    assert reset.ZYGOTE_CMDLINE == ZYGOTE_CMDLINE
+
+
+def test_reset_keeps_zygote_and_kills_strays(fake_container, monkeypatch, capsys):
+    killed, tmp_path = fake_container
+    report = _run_main(monkeypatch, capsys, "--keep-zygote")
+
+    assert sorted(killed) == [41, 50, 51]
+    assert report["killed"] == 3 and report["removed"] == 3
+    assert list(tmp_path.iterdir()) == []
+    assert report["checksum"] == reset_state_checksum(BASE_PROCESSES + (ZYGOTE_CMDLINE,))
+
+
+def test_reset_without_zygote_kills_it_too(fake_container, monkeypatch, capsys):
+    killed, _ = fake_container
+    report = _run_main(monkeypatch, capsys)
+
+    assert sorted(killed) == [40, 41, 50, 51]
+    assert report["checksum"] == reset_state_checksum(BASE_PROCESSES)
+
+
+def test_surviving_process_changes_checksum(fake_container, monkeypatch, capsys):
+    monkeypatch.setattr(reset.os, "kill", lambda pid, sig: None)   # 殺不掉（例如其他 uid）
+    monkeypatch.setattr(reset, "KILL_WAIT_SECONDS", 0.05)
+    report = _run_main(monkeypatch, capsys, "--keep-zygote")
+    assert report["checksum"] != reset_state_checksum(BASE_PROCESSES + (ZYGOTE_CMDLINE,))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="needs procfs")
+def test_processes_reads_procfs():
+    procs = reset._processes()
+    ppid, cmdline = procs[os.getpid()]
+    assert ppid == os.getppid()
+    assert "python" in cmdline or "pytest" in cmdline
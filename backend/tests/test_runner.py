@@ -20,6 +20,7 @@ import json
 import os
 import subprocess
 import sys
+import zlib
 
 import pytest
 
@@ -354,6 +355,16 @@ x = [i**2 for i in range(5)]
         assert "trace" in data
         assert "cfg_graph" in data  # 即使是空 {}
 
+    def test_skip_cfg_leaves_cfg_to_backend(self):
+        """SKIP_CFG=1 時 runner 不建 CFG；backend 的 cfg_cache 產生相同內容"""
+        from cfg_builder import build_cfg_graph_data
+        full, _ = run_runner(SIMPLE_CODE)
+        skipped, rc = run_runner(SIMPLE_CODE, extra_env={"SKIP_CFG": "1"})
+        assert rc == 0
+        assert skipped["cfg_graph"] == {}
+        assert skipped["step_count"] == full["step_count"]
+        assert full["cfg_graph"] == build_cfg_graph_data(SIMPLE_CODE) != {}
+
 
 # ---------------------------------------------------------------------------
 # 6. 輸出格式完整性
@@ -411,6 +422,29 @@ class TestOutputFormat:
         assert rc == 0
         assert data["step_count"] == len(data["trace"])
 
+    def test_trace_is_delta_encoded(self):
+        """trace 以 keyframe + delta 編碼，decode 後每個 event 都有完整變數"""
+        from trace_codec import decode_trace
+        data, rc = run_runner(SIMPLE_CODE)
+        assert rc == 0
+        assert data["trace_encoding"] == "delta"
+        assert data["trace"][0]["keyframe"] is True
+        decoded = decode_trace(data["trace"], data["trace_encoding"], data["heap_objects"])
+        assert decoded[-1]["global_vars"]["result"] == "3"
+
+    def test_variables_use_heap_snapshot(self):
+        """變數以 heap 值輸出：alias 指向同一個 oid，decode 後與 repr 字串相同"""
+        from trace_codec import decode_trace
+        code = "a = [3, 1, 2]\nb = a\nb.append(4)\npair = (a, 'x')\n"
+        data, rc = run_runner(code)
+        assert rc == 0
+        assert data["value_encoding"] == "heap"
+        heap_values = decode_trace(data["trace"], data["trace_encoding"])[-1]["global_vars"]
+        assert heap_values["a"] == heap_values["b"] == {"ref": heap_values["a"]["ref"]}
+        decoded = decode_trace(data["trace"], data["trace_encoding"], data["heap_objects"])
+        assert decoded[-1]["global_vars"]["pair"] == "([3, 1, 2, 4], 'x')"
+        assert "heap" not in decoded[-1]
+
 
 # ---------------------------------------------------------------------------
 # 7. Interactice input() — run_trace 直接單元測試
@@ -443,6 +477,20 @@ class TestRunTraceWithStdinInputs:
         )
         assert assigned
 
+    def test_list_mutation_visible_despite_repr_cache(self, _mark_sandbox):
+        from tracer import run_trace
+        code = "arr = [3, 1]\narr[0], arr[1] = arr[1], arr[0]\narr.append(5)\nx = 0\n"
+        result = run_trace(code)
+        seen = [ev.local_vars.get("arr") for ev in result.trace if ev.tag == "LINE"]
+        assert seen[-1] == "[1, 3, 5]"
+        assert "[1, 3]" in seen
+
+    def test_nested_list_mutation_visible_despite_repr_cache(self, _mark_sandbox):
+        from tracer import run_trace
+        code = "grid = [[0], [0]]\ngrid[1][0] = 7\nx = 0\n"
+        result = run_trace(code)
+        assert result.trace[-1].local_vars["grid"] == "[[0], [7]]"
+
     def test_input_needed_when_queue_empty(self, _mark_sandbox):
         from tracer import run_trace, LegacyInputNeededError
         code = 'a = input("name: ")\nb = input("age: ")'
@@ -509,3 +557,439 @@ class TestRunTraceWithStdinInputs:
 
     # NOTE: random seed determinism test 已移除 — 隨 D4/D5 拆出至獨立 plan
     # 該測試需要 sandbox 允許 `import random`，但本 plan 不碰 __import__ allowlist
+
+
+class TestRunTraceOnBatch:
+    def test_batches_cover_whole_trace_in_order(self, _mark_sandbox):
+        from tracer import run_trace
+        batches = []
+        result = run_trace(
+            "for i in range(30):\n    x = i\n",
+            on_batch=lambda start, events: batches.append((start, list(events))),
+            batch_size=10,
+        )
+        assert [start for start, _ in batches] == list(range(0, result.step_count, 10))
+        assert all(len(events) == 10 for _, events in batches[:-1])
+        assert [e for _, events in batches for e in events] == result.trace
+
+
+class TestExecutionProfile:
+    def test_full_profile_keeps_counting_after_truncation(self, _mark_sandbox):
+        from tracer import MAX_TRACE_STEPS, run_trace
+        result = run_trace("total = 0\nfor i in range(5000):\n    total += i\n", full_profile=True)
+        assert result.is_truncated is True
+        assert result.step_count == MAX_TRACE_STEPS
+        assert result.profile.line_hits[3] == 5000
+        assert result.profile.total_steps > MAX_TRACE_STEPS
+        assert result.profile.complete is True
+
+    def test_truncation_detaches_tracer_by_default(self, _mark_sandbox):
+        from tracer import MAX_TRACE_STEPS, run_trace
+        code = "total = 0\nfor i in range(5000):\n    total += i\nprint(total)\n"
+        result = run_trace(code)
+        assert result.is_truncated is True
+        assert result.step_count == MAX_TRACE_STEPS
+        # 卸下後不再累計，但程式照常跑完
+        assert result.profile.complete is False
+        assert result.profile.total_steps == MAX_TRACE_STEPS
+        assert result.profile.line_hits[3] < 5000
+        assert result.stdout_events[-1]["text"] == str(sum(range(5000)))
+        assert result.profile.functions["<module>"].wall_time > 0
+
+    def test_truncation_at_exact_cap_is_not_reported(self, _mark_sandbox):
+        from tracer import parse_capture, run_trace
+        steps = run_trace("x = 1\ny = 2\n").step_count
+        result = run_trace("x = 1\ny = 2\n", capture=parse_capture({"strategy": "head", "max_steps": steps}))
+        assert result.is_truncated is False
+        assert result.profile.complete is True
+
+    def test_total_steps_equals_step_count_when_not_truncated(self, _mark_sandbox):
+        from tracer import run_trace
+        result = run_trace(LOOP_CODE)
+        assert result.is_truncated is False
+        assert result.profile.total_steps == result.step_count
+
+    def test_function_calls_count_recursion_once_for_time(self, _mark_sandbox):
+        from tracer import run_trace
+        code = "def fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)\n\nfib(10)\n"
+        profile = run_trace(code).profile
+        assert profile.functions["fib"].calls == 177
+        assert profile.functions["<module>"].calls == 1
+        # 遞迴只計最外層，所以 fib 的累計時間不會超過整段程式
+        assert 0 < profile.functions["fib"].wall_time <= profile.functions["<module>"].wall_time
+
+    def test_input_wait_excluded_from_wall_time(self, _mark_sandbox):
+        import time
+        from tracer import run_trace
+
+        def slow_provider(_prompt, _index, _events):
+            time.sleep(0.3)
+            return "x"
+
+        profile = run_trace("name = input()\n", input_provider=slow_provider).profile
+        assert profile.functions["<module>"].wall_time < 0.3
+
+    def test_runner_result_includes_profile(self):
+        data, rc = run_runner(LOOP_CODE)
+        assert rc == 0
+        profile = data["profile"]
+        assert profile["total_steps"] == data["step_count"]
+        assert profile["line_hits"]["5"] == 5
+        assert profile["functions"]["count_up"]["calls"] == 1
+        assert set(profile["functions"]["count_up"]) == {"calls", "wall_ms", "cpu_ms"}
+        assert profile["complete"] is True
+
+    def test_runner_full_profile_env(self):
+        code = "total = 0\nfor i in range(5000):\n    total += i\n"
+        data, rc = run_runner(code)
+        assert rc == 0 and data["profile"]["complete"] is False
+        data, rc = run_runner(code, extra_env={"TRACE_PROFILE": "1"})
+        assert rc == 0
+        assert data["profile"]["complete"] is True
+        assert data["profile"]["line_hits"]["3"] == 5000
+
+
+LONG_LOOP = "total = 0\nfor i in range(3000):\n    total += i\nprint(total)\n"
+
+
+class TestCaptureStrategies:
+    def _run(self, code, **spec):
+        from tracer import parse_capture, run_trace
+        return run_trace(code, capture=parse_capture(spec))
+
+    def test_ring_keeps_last_steps(self, _mark_sandbox):
+        result = self._run(LONG_LOOP, strategy="ring", max_steps=100)
+        steps = [ev.meta["step"] for ev in result.trace]
+        total = result.profile.total_steps
+        assert steps == list(range(total - 100, total))
+        assert result.is_truncated is True
+        assert result.capture == {
+            "strategy": "ring", "max_steps": 100, "captured": 100, "total_steps": total,
+        }
+        # print 發生在 <module> RETURN（最後一個 event）之前，step 換算成保留 trace 的 index
+        assert result.stdout_events == [{"step": 99, "text": "4498500"}]
+
+    def test_stride_doubles_interval_and_stays_bounded(self, _mark_sandbox):
+        result = self._run(LONG_LOOP, strategy="stride", max_steps=100)
+        steps = [ev.meta["step"] for ev in result.trace]
+        every = result.capture["every"]
+        assert len(steps) <= 100
+        assert every > 1
+        assert steps == list(range(0, result.profile.total_steps, every))
+        # 取樣涵蓋整段執行，不是只有開頭
+        assert steps[-1] >= result.profile.total_steps - every
+
+    def test_loop_keeps_every_kth_iteration(self, _mark_sandbox):
+        code = "for i in range(10):\n    x = i\ndone = True\n"
+        result = self._run(code, strategy="loop", loop_line=1, every=3)
+        body = [ev.local_vars["i"] for ev in result.trace if ev.meta["lineno"] == 2]
+        assert body == ["0", "3", "6", "9"]
+        # 迴圈之後的 step 照常保留
+        assert result.trace[-1].meta["lineno"] == 3
+        assert result.capture["iterations"] == 11  # 標頭在迴圈結束時多判斷一次
+
+    def test_loop_on_non_loop_line_falls_back_to_head(self, _mark_sandbox):
+        result = self._run("x = 1\ny = 2\n", strategy="loop", loop_line=2)
+        assert result.capture["strategy"] == "head"
+        assert result.capture["fallback_reason"] == "no loop at line 2"
+        assert result.step_count == result.profile.total_steps
+
+    def test_keyframe_window_matches_full_trace(self, _mark_sandbox):
+        from tracer import run_trace
+        code = "total = 0\nfor i in range(50):\n    total += i * 2\n"
+        full = run_trace(code).trace
+        window = self._run(code, strategy="keyframe", every=0, window_start=40, window_size=20)
+        assert [ev.meta.pop("step") for ev in window.trace] == list(range(40, 60))
+        assert window.trace == full[40:60]
+        assert window.capture["window"] == [40, 60]
+
+    def test_sampled_call_graph_steps_index_captured_trace(self, _mark_sandbox):
+        code = "def f(n):\n    return n\n\nfor i in range(500):\n    f(i)\n"
+        result = self._run(code, strategy="ring", max_steps=50)
+        edge = next(e for e in result.call_graph.edges if e.target == "func_f")
+        assert edge.steps
+        assert all(result.trace[s].tag == "CALL" for s in edge.steps)
+        assert all(result.trace[s].tag == "RETURN" for s in edge.return_steps)
+
+    def test_parse_capture_rejects_invalid_specs(self):
+        from tracer import MAX_TRACE_STEPS, parse_capture
+        for spec in (
+            "ring",
+            {"strategy": "nope"},
+            {"strategy": "ring", "max_steps": MAX_TRACE_STEPS + 1},
+            {"strategy": "loop"},
+            {"strategy": "stride", "every": 0},
+            {"strategy": "keyframe", "every": 0},
+        ):
+            with pytest.raises(ValueError):
+                parse_capture(spec)
+
+    def test_runner_reports_capture(self):
+        data, rc = run_runner(LONG_LOOP, extra_env={"TRACE_CAPTURE": json.dumps({"strategy": "ring", "max_steps": 10})})
+        assert rc == 0
+        assert data["step_count"] == 10
+        assert data["capture"]["strategy"] == "ring"
+        assert data["capture"]["total_steps"] == data["profile"]["total_steps"]
+
+    def test_runner_default_capture_is_head(self):
+        data, rc = run_runner(SIMPLE_CODE)
+        assert rc == 0
+        assert data["capture"]["strategy"] == "head"
+
+    def test_runner_rejects_invalid_capture(self):
+        data, rc = run_runner(SIMPLE_CODE, extra_env={"TRACE_CAPTURE": json.dumps({"strategy": "nope"})})
+        assert rc == 1
+        assert data["error"].startswith("invalid capture")
+
+
+# ---------------------------------------------------------------------------
+# 8. Count-only 模式（COUNT_ONLY=1）
+# ---------------------------------------------------------------------------
+
+LOOP_CODE = """
+def count_up(n):
+    total = 0
+    for i in range(n):
+        total += i
+    return total
+
+count_up(5)
+"""
+
+
+class TestCompressedResult:
+    def test_result_event_carries_zlib_payload(self):
+        lines, rc = run_runner_interactive(
+            SIMPLE_CODE, [], extra_env={"CODEPULSE_INTERACTIVE": "1", "RESULT_ENCODING": "zlib"}
+        )
+        assert rc == 0
+        event = json.loads(lines[-1][len("__CODEPULSE_EVENT__"):])
+        assert event["type"] == "result"
+        assert "payload" not in event
+        data = json.loads(zlib.decompress(base64.b64decode(event["payload_z"])))
+        assert data["step_count"] > 0
+        assert data["trace_encoding"] == "delta"
+
+
+class TestUsage:
+    def test_every_result_mode_reports_usage(self):
+        full, _ = run_runner(LOOP_CODE)
+        counted, _ = run_runner(LOOP_CODE, extra_env={"COUNT_ONLY": "1"})
+        lines, _ = run_runner_interactive(
+            LOOP_CODE, [], extra_env={"CODEPULSE_INTERACTIVE": "1", "RESULT_ENCODING": "zlib"}
+        )
+        event = json.loads(lines[-1][len("__CODEPULSE_EVENT__"):])
+        compressed = json.loads(zlib.decompress(base64.b64decode(event["payload_z"])))
+        for data in (full, counted, compressed):
+            usage = data["usage"]
+            assert usage["wall_ms"] >= usage["trace_ms"] > 0
+            assert usage["serialize_ms"] >= 0
+            assert usage["user_ms"] >= 0 and usage["max_rss_kb"] > 0
+        assert compressed["step_count"] == full["step_count"]
+
+    def test_reads_cgroup_v2_and_v1_stats(self, tmp_path, monkeypatch):
+        sys.path.insert(0, os.path.dirname(RUNNER_PATH))
+        import runner
+
+        monkeypatch.setattr(runner, "CGROUP_ROOT", str(tmp_path))
+        assert runner._cgroup_throttled() is None
+        assert runner._cgroup_memory_peak() is None
+
+        (tmp_path / "memory").mkdir()
+        (tmp_path / "cpu").mkdir()
+        (tmp_path / "memory" / "memory.max_usage_in_bytes").write_text("2048\n")
+        (tmp_path / "cpu" / "cpu.stat").write_text("nr_periods 10\nnr_throttled 2\nthrottled_time 5000000\n")
+        assert runner._cgroup_throttled() == (2, 5.0)
+        assert runner._cgroup_memory_peak() == 2048
+
+        (tmp_path / "memory.peak").write_text("4096\n")
+        (tmp_path / "cpu.stat").write_text("usage_usec 900\nnr_throttled 3\nthrottled_usec 1500\n")
+        assert runner._cgroup_throttled() == (3, 1.5)
+        assert runner._cgroup_memory_peak() == 4096
+
+        started = runner._usage_snapshot()
+        (tmp_path / "cpu.stat").write_text("usage_usec 900\nnr_throttled 5\nthrottled_usec 4000\n")
+        usage = runner._usage_payload(started, started["wall"])
+        assert (usage["nr_throttled"], usage["throttled_ms"]) == (2, 2.5)
+        assert usage["memory_peak_bytes"] == 4096
+
+
+class TestCountOnlyMode:
+    def test_step_count_matches_full_trace(self):
+        full, _ = run_runner(LOOP_CODE)
+        counted, rc = run_runner(LOOP_CODE, extra_env={"COUNT_ONLY": "1"})
+        assert rc == 0
+        assert counted["step_count"] == full["step_count"]
+        assert counted["is_truncated"] is False
+
+    def test_returns_line_hits_without_trace(self):
+        data, rc = run_runner(LOOP_CODE, extra_env={"COUNT_ONLY": "1"})
+        assert rc == 0
+        assert "trace" not in data
+        assert "cfg_graph" not in data
+        # for 迴圈 body（total += i）跑 5 次
+        assert data["line_hits"]["5"] == 5
+
+    def test_truncation_reported(self):
+        code = "for i in range(5000):\n    pass\n"
+        data, rc = run_runner(code, extra_env={"COUNT_ONLY": "1"})
+        assert rc == 0
+        assert data["is_truncated"] is True
+        assert data["step_count"] == 2000
+
+
+# ---------------------------------------------------------------------------
+# 9. Batch 模式（BATCH_N_VALUES）— big-O 測量
+# ---------------------------------------------------------------------------
+
+BATCH_CODE = """
+def count_up(n):
+    total = 0
+    for i in range(n):
+        total += i
+    return total
+
+def explore_wrapper(n):
+    count_up(n)
+"""
+
+
+class TestBatchMode:
+    def test_returns_step_count_per_n(self):
+        data, rc = run_runner(BATCH_CODE, extra_env={"BATCH_N_VALUES": "5,10,20"})
+        assert rc == 0
+        assert [r["n"] for r in data["results"]] == [5, 10, 20]
+        counts = [r["step_count"] for r in data["results"]]
+        assert counts[0] < counts[1] < counts[2]
+        assert not any(r["timed_out"] for r in data["results"])
+        assert all("line_hits" in r for r in data["results"])
+        assert "trace" not in data
+
+    def test_timeout_marks_remaining_n_as_timed_out(self):
+        code = "def explore_wrapper(n):\n    while n > 0:\n        n = n\n"
+        data, rc = run_runner(code, extra_env={"BATCH_N_VALUES": "1,2", "PER_N_TIMEOUT": "0.2"})
+        assert rc == 0
+        assert [r["timed_out"] for r in data["results"]] == [True, True]
+
+    def test_user_exception_reported_per_n(self):
+        code = "def explore_wrapper(n):\n    1 / (n - 2)\n"
+        data, rc = run_runner(code, extra_env={"BATCH_N_VALUES": "1,2,3"})
+        assert rc == 0
+        errors = [r.get("error") for r in data["results"]]
+        assert errors[0] is None and errors[2] is None
+        assert errors[1].startswith("ZeroDivisionError")
+
+    def test_invalid_batch_n_values_returns_error(self):
+        data, rc = run_runner(BATCH_CODE, extra_env={"BATCH_N_VALUES": "ten"})
+        assert "error" in data
+        assert rc == 1
+
+
+# ---------------------------------------------------------------------------
+# 10. Tracing backend（settrace / sys.monitoring）
+# ---------------------------------------------------------------------------
+
+needs_monitoring = pytest.mark.skipif(sys.version_info < (3, 12), reason="sys.monitoring 需要 Python 3.12+")
+TRACE_BACKENDS_UNDER_TEST = ["settrace", pytest.param("monitoring", marks=needs_monitoring)]
+
+BACKEND_PROGRAMS = [
+    LOOP_CODE,
+    "def fib(n):\n    if n < 2:\n        return n\n    return fib(n - 1) + fib(n - 2)\nprint(fib(8))\n",
+    "def gen(n):\n    for i in range(n):\n        yield i * 2\ntotal = 0\nfor v in gen(4):\n    total += v\n",
+    "def f(x):\n    return 1 / x\nok = []\nfor i in range(3):\n    try:\n        ok.append(f(i))\n    except:\n        ok.append(0)\n",
+    "def _helper(x):\n    return x + 1\ndef outer(n):\n    return [_helper(i) for i in range(n)]\nr = outer(3)\nwhile r: r.pop()\n",
+    "name = input('name: ')\nprint('hi', name)\n",
+]
+
+
+def _comparable(result) -> str:
+    """TraceResult → 可比較的字串：去掉函式 repr 的位址與 profile 的計時。"""
+    import dataclasses
+    import re
+    data = dataclasses.asdict(result)
+    for fn in data["profile"]["functions"].values():
+        fn["wall_time"] = fn["cpu_time"] = 0
+    return re.sub(r"0x[0-9a-f]+", "0x", json.dumps(data, sort_keys=True, default=str))
+
+
+class TestTraceBackends:
+    def test_select_backend(self):
+        from tracer import select_backend
+        expected = "monitoring" if sys.version_info >= (3, 12) else "settrace"
+        assert select_backend() == expected
+        assert select_backend("monitoring") == expected
+        assert select_backend("settrace") == "settrace"
+        with pytest.raises(ValueError):
+            select_backend("ptrace")
+
+    @needs_monitoring
+    @pytest.mark.parametrize("code", BACKEND_PROGRAMS)
+    @pytest.mark.parametrize("capture", [None, {"strategy": "ring", "max_steps": 20}, {"strategy": "head", "max_steps": 15}])
+    def test_monitoring_matches_settrace(self, _mark_sandbox, code, capture):
+        from tracer import parse_capture, run_trace
+        results = [
+            _comparable(run_trace(code, stdin_inputs=["Ada"], capture=parse_capture(capture), backend=backend))
+            for backend in ("settrace", "monitoring")
+        ]
+        assert results[0] == results[1]
+
+    @needs_monitoring
+    @pytest.mark.parametrize("code", BACKEND_PROGRAMS)
+    def test_count_trace_matches_settrace(self, _mark_sandbox, code):
+        from tracer import run_count_trace
+        for max_steps in (10**6, 12):
+            expected = run_count_trace(code, ["Ada"], max_steps=max_steps, backend="settrace")
+            assert run_count_trace(code, ["Ada"], max_steps=max_steps, backend="monitoring") == expected
+
+    @needs_monitoring
+    def test_monitoring_releases_tool_and_resets_disabled_events(self, _mark_sandbox):
+        from tracer import run_count_trace
+        code = "total = 0\nfor i in range(100):\n    total += i\n"
+        first = run_count_trace(code, max_steps=50, backend="monitoring")
+        # 前一次截斷時 DISABLE 的位置不能影響下一次 run
+        second = run_count_trace(code, max_steps=10**6, backend="monitoring")
+        assert first.is_truncated is True
+        assert second.line_hits[3] == 100
+        assert sys.monitoring.get_tool(sys.monitoring.PROFILER_ID) is None
+
+    @needs_monitoring
+    def test_falls_back_to_settrace_when_tool_id_taken(self, _mark_sandbox):
+        from tracer import run_trace
+        sys.monitoring.use_tool_id(sys.monitoring.PROFILER_ID, "other-profiler")
+        try:
+            result = run_trace(LOOP_CODE, backend="monitoring")
+        finally:
+            sys.monitoring.free_tool_id(sys.monitoring.PROFILER_ID)
+        assert result.profile.line_hits[5] == 5
+
+    def test_input_provider_not_traced(self, _mark_sandbox):
+        from tracer import run_trace, select_backend
+
+        def provider(_prompt, _index, _events):
+            internal = [n * 2 for n in range(50)]
+            return str(len(internal))
+
+        result = run_trace("a = input()\nb = a\n", input_provider=provider, backend=select_backend())
+        assert {ev.meta["func_name"] for ev in result.trace} == {"<module>"}
+        assert result.step_count == 4
+
+    @pytest.mark.parametrize("backend", TRACE_BACKENDS_UNDER_TEST)
+    def test_detached_tracer_stays_off_after_input(self, _mark_sandbox, backend):
+        from tracer import parse_capture, run_trace
+        code = "x = 0\nfor i in range(50):\n    x += i\nname = input()\nfor i in range(50):\n    x += i\nprint(x)\n"
+        result = run_trace(code, input_provider=lambda *_: "Ada", backend=backend,
+                           capture=parse_capture({"strategy": "head", "max_steps": 20}))
+        # input 後 resume 不能把卸下的 tracer 掛回去
+        assert result.is_truncated is True
+        assert result.profile.total_steps == result.step_count == 20
+        assert 6 not in result.profile.line_hits
+        assert result.stdout_events[-1]["text"] == str(2 * sum(range(50)))
+
+    def test_runner_backend_env(self):
+        for backend in ("settrace", "auto"):
+            data, rc = run_runner(LOOP_CODE, extra_env={"TRACE_BACKEND": backend})
+            assert rc == 0
+            assert data["profile"]["line_hits"]["5"] == 5
+        data, rc = run_runner(LOOP_CODE, extra_env={"TRACE_BACKEND": "ptrace"})
+        assert rc == 1
+        assert data["error"].startswith("invalid TRACE_BACKEND")
@@ -46,7 +46,7 @@ def run_runner_interactive(code: str, inputs: list[str]) -> tuple[list[str], int
     return lines, proc.returncode
 
 
-def run_runner_interactive_no_input(code: str) -> tuple[list[dict], int]:
+def run_runner_interactive_no_input(code: str, extra_env: dict | None = None) -> tuple[list[dict], int]:
     """互動模式下執行無 input() 的 code，回傳 (parsed_events, returncode)。
 
     重點：直接驗證真實 runner 在互動模式下的輸出協定。所有行都必須帶
@@ -57,6 +57,8 @@ def run_runner_interactive_no_input(code: str) -> tuple[list[dict], int]:
     env["CODE"] = base64.b64encode(code.encode()).decode()
     env["SANDBOX_CONTAINER"] = "1"
     env["CODEPULSE_INTERACTIVE"] = "1"
+    if extra_env:
+        env.update(extra_env)
 
     proc = subprocess.run(
         [sys.executable, RUNNER_PATH],
@@ -144,6 +146,31 @@ def test_syntax_error_emits_error_event():
     assert "SyntaxError" in error_events[0]["message"]
 
 
+def test_stream_trace_emits_batches_before_result():
+    """STREAM_TRACE=1 時 trace_batch 先於 result 送出，且接起來等於完整 trace。"""
+    from services.trace_codec import decode_trace
+
+    code = "total = 0\nnums = []\nfor i in range(80):\n    total += i\n    nums.append(i)\n"
+    events, rc = run_runner_interactive_no_input(code, extra_env={"STREAM_TRACE": "1"})
+
+    assert rc == 0
+    assert events[-1]["type"] == "result"
+    batches = [ev for ev in events if ev["type"] == "trace_batch"]
+    assert len(batches) >= 2
+    assert batches[0]["start"] == 0
+
+    streamed = [e for batch in batches for e in batch["events"]]
+    payload = events[-1]["payload"]
+    assert streamed == decode_trace(payload["trace"], payload["trace_encoding"], payload["heap_objects"])
+
+
+def test_no_trace_batches_without_stream_flag():
+    events, rc = run_runner_interactive_no_input("x = 1\n")
+
+    assert rc == 0
+    assert [ev["type"] for ev in events] == ["result"]
+
+
 def test_runner_interactive_protocol_reuses_process_for_multiple_inputs():
     code = (
         'name = input("Name: ")\n'
@@ -2,22 +2,30 @@
 test_sandbox.py — sandbox.run_in_sandbox() 單元測試
 
 測試策略：
-- sandbox.py 是 HTTP 薄層，用 unittest.mock.patch 模擬 requests.post
+- sandbox.py 是 HTTP 薄層，用 unittest.mock.patch 模擬 requests.Session.post
+- 共用 Session 的連線重用 / 重試以本機 HTTP server 驗證
 - 真實 sidecar 整合測試標記 @pytest.mark.integration
 """
 
+import base64
+import json
+import socket
 import sys
 import os
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 from unittest.mock import patch, MagicMock
 import requests
+from urllib3.connectionpool import HTTPConnectionPool
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
 
 import services.sandbox as sandbox_client
-from services.sandbox import run_in_sandbox, CONTAINER_TIMEOUT
+from services.sandbox import run_in_sandbox, CONNECT_TIMEOUT, CONTAINER_TIMEOUT, COMPRESSED_RESULT_MIMETYPE
 
 
 SIMPLE_CODE = """
@@ -47,13 +55,22 @@ VALID_RESULT = {
 def _make_response(payload=None, status=200):
     resp = MagicMock()
     resp.status_code = status
+    resp.headers = {"Content-Type": "application/json"}
     resp.json.return_value = payload if payload is not None else VALID_RESULT
     return resp
 
 
+def _make_compressed_response(payload=None):
+    resp = MagicMock()
+    resp.status_code = 200
+    resp.headers = {"Content-Type": COMPRESSED_RESULT_MIMETYPE}
+    resp.content = zlib.compress(json.dumps(payload if payload is not None else VALID_RESULT).encode())
+    return resp
+
+
 class TestRunInSandboxSuccess:
     def test_returns_dict_on_valid_response(self):
-        with patch("services.sandbox.requests.post", return_value=_make_response()):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()):
             result = run_in_sandbox(SIMPLE_CODE)
         assert isinstance(result, dict)
         assert "trace" in result
@@ -61,76 +78,169 @@ class TestRunInSandboxSuccess:
         assert "is_truncated" in result
 
     def test_posts_code_in_json_body(self):
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             run_in_sandbox(SIMPLE_CODE)
         kwargs = mock_post.call_args.kwargs
         assert kwargs["json"]["code"] == SIMPLE_CODE
 
     def test_posts_to_sidecar_run_endpoint(self):
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             run_in_sandbox(SIMPLE_CODE)
         url = mock_post.call_args.args[0]
         assert url.endswith("/run")
 
     def test_default_timeout_passed(self):
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             run_in_sandbox(SIMPLE_CODE)
-        assert mock_post.call_args.kwargs["timeout"] == CONTAINER_TIMEOUT + 5
+        assert mock_post.call_args.kwargs["timeout"] == (CONNECT_TIMEOUT, CONTAINER_TIMEOUT + 5)
+
+    def test_requests_compressed_result(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE)
+        assert mock_post.call_args.kwargs["json"]["compress"] is True
+
+    def test_decodes_compressed_response(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_compressed_response()):
+            result = run_in_sandbox(SIMPLE_CODE)
+        assert result == VALID_RESULT
+
+    def test_timings_header_merged_into_result(self):
+        resp = _make_compressed_response()
+        resp.headers["X-Sandbox-Timings"] = '{"acquire_ms": 12.5, "exec_start_ms": 1.0, "run_ms": 30.0}'
+        with patch("services.sandbox.requests.Session.post", return_value=resp):
+            result = run_in_sandbox(SIMPLE_CODE)
+        assert result["sandbox_timings"] == {"acquire_ms": 12.5, "exec_start_ms": 1.0, "run_ms": 30.0}
+        assert result["trace"] == VALID_RESULT["trace"]
 
 
 class TestRunInSandboxNInjection:
     """Task 4 新行為：n / per_n_timeout 參數轉發至 sidecar"""
 
     def test_n_param_forwarded_in_body(self):
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             run_in_sandbox(SIMPLE_CODE, n=100)
         body = mock_post.call_args.kwargs["json"]
         assert body["n"] == 100
 
     def test_per_n_timeout_overrides_default(self):
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             run_in_sandbox(SIMPLE_CODE, n=50, per_n_timeout=7)
-        assert mock_post.call_args.kwargs["timeout"] == 7 + 5
+        assert mock_post.call_args.kwargs["timeout"] == (CONNECT_TIMEOUT, 7 + 5)
 
     def test_no_n_does_not_include_n_field(self):
         """n=None 時不應污染 body（保持與原本 sidecar 呼叫的相容性）"""
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             run_in_sandbox(SIMPLE_CODE)
         body = mock_post.call_args.kwargs["json"]
         assert "n" not in body or body["n"] is None
 
+    def test_count_only_forwarded_in_body(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE, count_only=True)
+        assert mock_post.call_args.kwargs["json"]["count_only"] is True
+
+    def test_skip_cfg_forwarded_in_body(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE, skip_cfg=True)
+            run_in_sandbox(SIMPLE_CODE)
+        assert mock_post.call_args_list[0].kwargs["json"]["skip_cfg"] is True
+        assert "skip_cfg" not in mock_post.call_args_list[1].kwargs["json"]
+
+    def test_full_profile_forwarded_in_body(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE, full_profile=True)
+            run_in_sandbox(SIMPLE_CODE)
+        assert mock_post.call_args_list[0].kwargs["json"]["profile"] is True
+        assert "profile" not in mock_post.call_args_list[1].kwargs["json"]
+
+    def test_priority_class_defaults_and_tenant(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE)
+            run_in_sandbox(SIMPLE_CODE, n=50)
+            run_in_sandbox(SIMPLE_CODE, priority="interactive", tenant="user:7")
+        bodies = [c.kwargs["json"] for c in mock_post.call_args_list]
+        assert [b["priority"] for b in bodies] == ["primary", "probe", "interactive"]
+        assert "tenant" not in bodies[0]
+        assert bodies[2]["tenant"] == "user:7"
+
     def test_backwards_compatible_single_arg_call(self):
         """原有 run_in_sandbox(code) 呼叫完全不變"""
-        with patch("services.sandbox.requests.post", return_value=_make_response()) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
             result = run_in_sandbox(SIMPLE_CODE)
         assert isinstance(result, dict)
         assert mock_post.call_count == 1
 
 
+def _make_stream_response(lines: list[dict]):
+    resp = MagicMock()
+    resp.status_code = 200
+    resp.headers = {"Content-Type": "application/x-ndjson"}
+    resp.iter_lines.return_value = [json.dumps(line) for line in lines]
+    return resp
+
+
+class TestRunInSandboxStream:
+    def test_batches_forwarded_and_final_line_returned(self):
+        batch = {"type": "trace_batch", "start": 0, "events": [{"tag": "LINE"}]}
+        received = []
+        resp = _make_stream_response([batch, VALID_RESULT])
+        with patch("services.sandbox.requests.Session.post", return_value=resp) as mock_post:
+            result = run_in_sandbox(SIMPLE_CODE, on_trace_batch=lambda s, e: received.append((s, e)))
+        assert result == VALID_RESULT
+        assert received == [(0, [{"tag": "LINE"}])]
+        assert mock_post.call_args.kwargs["json"]["stream"] is True
+        assert mock_post.call_args.kwargs["stream"] is True
+
+    def test_compressed_final_line_is_decoded(self):
+        payload = base64.b64encode(zlib.compress(json.dumps(VALID_RESULT).encode())).decode()
+        timings = {"acquire_ms": 1.0, "exec_start_ms": 2.0, "run_ms": 3.0}
+        resp = _make_stream_response([
+            {"type": "trace_batch", "start": 0, "events": []},
+            {"type": "result_z", "payload_z": payload, "sandbox_timings": timings},
+        ])
+        with patch("services.sandbox.requests.Session.post", return_value=resp):
+            result = run_in_sandbox(SIMPLE_CODE, on_trace_batch=lambda s, e: None)
+        assert result == {**VALID_RESULT, "sandbox_timings": timings}
+
+    def test_callback_error_does_not_break_result(self):
+        def boom(_start, _events):
+            raise RuntimeError("redis down")
+
+        resp = _make_stream_response([{"type": "trace_batch", "start": 0, "events": []}, VALID_RESULT])
+        with patch("services.sandbox.requests.Session.post", return_value=resp):
+            result = run_in_sandbox(SIMPLE_CODE, on_trace_batch=boom)
+        assert result == VALID_RESULT
+
+    def test_old_sidecar_plain_json_response(self):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()):
+            result = run_in_sandbox(SIMPLE_CODE, on_trace_batch=lambda s, e: None)
+        assert result == VALID_RESULT
+
+
 class TestRunInSandboxTimeout:
     def test_timeout_returns_truncated_result(self):
-        with patch("services.sandbox.requests.post", side_effect=requests.Timeout()):
+        with patch("services.sandbox.requests.Session.post", side_effect=requests.Timeout()):
             result = run_in_sandbox(SIMPLE_CODE)
         assert result["is_truncated"] is True
         assert result["trace"] == []
         assert "error" in result
 
     def test_timeout_does_not_raise(self):
-        with patch("services.sandbox.requests.post", side_effect=requests.Timeout()):
+        with patch("services.sandbox.requests.Session.post", side_effect=requests.Timeout()):
             result = run_in_sandbox(SIMPLE_CODE)
         assert isinstance(result, dict)
 
 
 class TestRunInSandboxErrors:
     def test_connection_error_returns_error_dict(self):
-        with patch("services.sandbox.requests.post", side_effect=requests.ConnectionError("sidecar down")):
+        with patch("services.sandbox.requests.Session.post", side_effect=requests.ConnectionError("sidecar down")):
             result = run_in_sandbox(SIMPLE_CODE)
         assert "error" in result
 
     def test_runner_error_key_propagated(self):
         """sidecar 回傳 {"error": "..."} → 原樣回傳"""
         error_payload = {"error": "ZeroDivisionError: division by zero", "is_truncated": False, "trace": []}
-        with patch("services.sandbox.requests.post", return_value=_make_response(payload=error_payload)):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response(payload=error_payload)):
             result = run_in_sandbox(SIMPLE_CODE)
         assert "error" in result
         assert "ZeroDivisionError" in result["error"]
@@ -144,14 +254,14 @@ class TestInteractiveSandboxClient:
             "prompt": "Name: ",
             "input_index": 0,
         }
-        with patch("services.sandbox.requests.post", return_value=_make_response(payload=payload)):
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response(payload=payload)):
             result = run_in_sandbox('name = input("Name: ")')
 
-        assert result == payload
+        assert result == {**payload, "session_id": "0:session-1"}
 
     def test_send_input_posts_value_to_session_endpoint(self):
         payload = {"status": "completed", "result": {"trace": []}}
-        with patch("services.sandbox.requests.post", return_value=_make_response(payload=payload)) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response(payload=payload)) as mock_post:
             result = sandbox_client.send_input("session-1", "Ada")
 
         assert result == payload
@@ -160,7 +270,7 @@ class TestInteractiveSandboxClient:
 
     def test_check_session_alive_gets_alive_endpoint(self):
         payload = {"status": "alive", "alive": True}
-        with patch("services.sandbox.requests.get", return_value=_make_response(payload=payload)) as mock_get:
+        with patch("services.sandbox.requests.Session.get", return_value=_make_response(payload=payload)) as mock_get:
             result = sandbox_client.check_session_alive("session-1")
 
         assert result is True
@@ -168,13 +278,218 @@ class TestInteractiveSandboxClient:
 
     def test_close_session_posts_close_endpoint(self):
         payload = {"status": "closed"}
-        with patch("services.sandbox.requests.post", return_value=_make_response(payload=payload)) as mock_post:
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response(payload=payload)) as mock_post:
             result = sandbox_client.close_session("session-1")
 
         assert result == payload
         assert mock_post.call_args.args[0].endswith("/session/session-1/close")
 
 
+class TestRunBatchInSandbox:
+    def test_posts_n_values_to_run_batch_endpoint(self):
+        payload = {"results": [{"n": 10, "step_count": 5, "is_truncated": False, "timed_out": False}]}
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response(payload=payload)) as mock_post:
+            result = sandbox_client.run_batch_in_sandbox(SIMPLE_CODE, [10, 50], per_n_timeout=5)
+
+        assert result == payload
+        assert mock_post.call_args.args[0].endswith("/run_batch")
+        assert mock_post.call_args.kwargs["json"] == {
+            "code": SIMPLE_CODE, "n_values": [10, 50], "per_n_timeout": 5, "priority": "probe",
+        }
+        assert mock_post.call_args.kwargs["timeout"] == (CONNECT_TIMEOUT, 5 * 2 + 5)
+
+    def test_timeout_returns_error_dict(self):
+        with patch("services.sandbox.requests.Session.post", side_effect=requests.Timeout()):
+            result = sandbox_client.run_batch_in_sandbox(SIMPLE_CODE, [10], per_n_timeout=5)
+        assert result["error"] == "timeout"
+        assert result["results"] == []
+
+
+class TestSidecarCapacity:
+    def test_reads_capacity_endpoint(self):
+        body = {"initialized": True, "available": 2, "max_size": 4}
+        with patch("services.sandbox.requests.Session.get", return_value=_make_response(payload=body)) as mock_get:
+            assert sandbox_client.sidecar_capacity() == body
+        assert mock_get.call_args.args[0].endswith("/capacity")
+
+    def test_unreachable_or_old_sidecar_returns_none(self):
+        with patch("services.sandbox.requests.Session.get", side_effect=requests.ConnectionError()):
+            assert sandbox_client.sidecar_capacity() is None
+        with patch("services.sandbox.requests.Session.get", return_value=_make_response(payload={}, status=404)):
+            assert sandbox_client.sidecar_capacity() is None
+        with patch("services.sandbox.requests.Session.get", return_value=_make_response(payload={"size": 3})):
+            assert sandbox_client.sidecar_capacity() is None
+
+
+@pytest.fixture
+def two_sidecars():
+    with patch.object(sandbox_client, "SIDECAR_URLS", ["http://node-a:8080", "http://node-b:8080/"]), \
+         patch.object(sandbox_client, "_nodes", []), \
+         patch.object(sandbox_client, "_nodes_key", ()):
+        yield sandbox_client._sidecar_nodes()
+
+
+class TestMultipleSidecars:
+    def test_least_outstanding_node_is_chosen(self, two_sidecars):
+        node_a, node_b = two_sidecars
+        held = sandbox_client.acquire_node()
+        assert held is node_a
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE)
+        assert mock_post.call_args.args[0] == "http://node-b:8080/run"
+        sandbox_client.release_node(held)
+        assert [n["outstanding"] for n in sandbox_client.node_stats()] == [0, 0]
+
+    def test_unreachable_node_fails_over_and_is_paused(self, two_sidecars):
+        responses = [requests.ConnectionError("refused"), _make_response()]
+        with patch("services.sandbox.requests.Session.post", side_effect=responses) as mock_post:
+            result = run_in_sandbox(SIMPLE_CODE)
+        assert "error" not in result
+        assert [c.args[0] for c in mock_post.call_args_list] == ["http://node-a:8080/run", "http://node-b:8080/run"]
+        assert [n["down"] for n in sandbox_client.node_stats()] == [True, False]
+
+        # 暫停中的節點不再分到請求
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response()) as mock_post:
+            run_in_sandbox(SIMPLE_CODE)
+        assert mock_post.call_args.args[0] == "http://node-b:8080/run"
+
+    def test_paused_node_returns_after_health_probe(self, two_sidecars):
+        node_a, _ = two_sidecars
+        sandbox_client.release_node(sandbox_client.acquire_node(), failed=True)
+        node_a.down_until = 0.0
+        with patch("services.sandbox.requests.Session.get", return_value=_make_response(payload={"available": 1})) as mock_get:
+            sandbox_client.acquire_node()
+        assert mock_get.call_args.args[0] == "http://node-a:8080/capacity"
+        assert node_a.down is False
+
+    def test_exhausted_pool_fails_over(self, two_sidecars):
+        busy = _make_response(payload={"error": "pool exhausted"}, status=503)
+        with patch("services.sandbox.requests.Session.post", side_effect=[busy, _make_response()]) as mock_post:
+            result = sandbox_client.run_batch_in_sandbox(SIMPLE_CODE, [10], per_n_timeout=5)
+        assert mock_post.call_count == 2
+        assert result == VALID_RESULT
+        assert [n["down"] for n in sandbox_client.node_stats()] == [False, False]
+
+    def test_session_calls_go_to_the_owning_node(self, two_sidecars):
+        node_a, node_b = two_sidecars
+        held = sandbox_client.acquire_node()
+        payload = {"status": "input_needed", "session_id": "abc", "prompt": "", "input_index": 0}
+        with patch("services.sandbox.requests.Session.post", return_value=_make_response(payload=payload)):
+            first = run_in_sandbox("x = input()")
+        sandbox_client.release_node(held)
+        assert first["session_id"] == "1:abc"
+
+        # 即使 node-b 較忙也不 failover：session 只存在於建立它的節點
+        sandbox_client.acquire_node(exclude=(node_a,))
+        with patch("services.sandbox.requests.Session.post",
+                   return_value=_make_response(payload={**payload, "input_index": 1})) as mock_post:
+            second = sandbox_client.send_input(first["session_id"], "1")
+        assert mock_post.call_args.args[0] == "http://node-b:8080/input/abc"
+        assert second["session_id"] == "1:abc"
+        with patch("services.sandbox.requests.Session.get", return_value=_make_response(payload={"alive": True})) as mock_get:
+            assert sandbox_client.check_session_alive("1:abc") is True
+        assert mock_get.call_args.args[0] == "http://node-b:8080/session/abc/alive"
+
+    def test_capacity_is_summed_over_nodes(self, two_sidecars):
+        reports = [
+            _make_response(payload={"available": 2, "max_size": 4}),
+            _make_response(payload={"available": 1, "max_size": 4}),
+        ]
+        with patch("services.sandbox.requests.Session.get", side_effect=reports):
+            assert sandbox_client.sidecar_capacity() == {"available": 3, "max_size": 8, "nodes": 2}
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/run":
+            self._reply(VALID_RESULT)
+        else:
+            self._reply({"status": "closed"})
+
+    def do_GET(self):
+        self._reply({"status": "alive", "alive": True})
+
+
+@pytest.fixture
+def local_sidecar():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    with patch.object(sandbox_client, "SIDECAR_URL", url), \
+         patch.object(sandbox_client, "_session", None), \
+         patch.object(sandbox_client, "_session_pid", None):
+        yield url
+    server.shutdown()
+    server.server_close()
+
+
+class TestSharedSession:
+    def test_calls_reuse_keep_alive_connection(self, local_sidecar):
+        for _ in range(3):
+            assert run_in_sandbox(SIMPLE_CODE)["step_count"] == 3
+        assert sandbox_client.check_session_alive("s1") is True
+        assert sandbox_client.close_session("s1") == {"status": "closed"}
+
+        stats = sandbox_client.connection_stats()
+        assert stats["requests"] == 5
+        assert stats["connections_opened"] == 1
+        assert stats["reuse_ratio"] == pytest.approx(0.8)
+
+    def test_parallel_calls_share_pool(self, local_sidecar):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=5) as ex:
+            results = list(ex.map(lambda _: run_in_sandbox(SIMPLE_CODE), range(20)))
+
+        assert all(r["step_count"] == 3 for r in results)
+        stats = sandbox_client.connection_stats()
+        assert stats["requests"] == 20
+        assert stats["connections_opened"] <= 5
+
+    def test_session_is_rebuilt_after_fork(self, local_sidecar):
+        first = sandbox_client._http()
+        with patch.object(sandbox_client.os, "getpid", return_value=-1):
+            assert sandbox_client._http() is not first
+
+    def test_one_connection_pool_per_sidecar_node(self):
+        urls = ["http://node-a:8080", "http://node-b:8080", "http://node-c:8080"]
+        with patch.object(sandbox_client, "SIDECAR_URLS", urls), \
+             patch.object(sandbox_client, "_session", None):
+            adapter = sandbox_client._http().get_adapter("http://node-a:8080")
+        # 節點輪流時各自的連線都留著，不會被 LRU 擠掉
+        assert adapter.poolmanager.pools._maxsize == len(urls)
+        assert adapter._pool_maxsize == sandbox_client.HTTP_POOL_SIZE
+
+    def test_connect_failure_is_retried_then_reported(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()  # 沒人 listen 的 port：連線被拒
+
+        original_new_conn = HTTPConnectionPool._new_conn
+        with patch.object(sandbox_client, "SIDECAR_URL", f"http://127.0.0.1:{port}"), \
+             patch.object(sandbox_client, "_session", None), \
+             patch.object(HTTPConnectionPool, "_new_conn", autospec=True, side_effect=original_new_conn) as new_conn:
+            result = run_in_sandbox(SIMPLE_CODE)
+
+        assert "sandbox sidecar unavailable" in result["error"]
+        assert new_conn.call_count == sandbox_client.CONNECT_RETRIES + 1
+
+
 @pytest.mark.integration
 class TestRunInSandboxIntegration:
     """需要真實 sidecar + Docker 環境才能執行，CI 中跳過"""
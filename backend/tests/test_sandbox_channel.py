@@ -0,0 +1,125 @@
+"""
+test_sandbox_channel.py — services/sandbox_channel.py 測試
+
+以本機 websockets server 扮演 sidecar 的 /ws/run，驗證：
+- run → input_needed → input → completed 全在同一條連線上往返
+- trace_batch 轉給 callback、close 通知 sidecar 回收
+- sidecar 不支援 WebSocket（握手被拒）時回 None 並暫停重試
+"""
+
+import json
+import threading
+from http import HTTPStatus
+from unittest.mock import MagicMock
+
+import pytest
+from websockets.sync.server import serve
+
+from services import sandbox as sandbox_client
+from services import sandbox_channel
+
+
+class _FakeSidecar:
+    def __init__(self, *, reject: bool = False):
+        self.connections = 0
+        self.messages: list[dict] = []
+        self.closed = threading.Event()
+        process_request = self._reject if reject else None
+        self.server = serve(self._handler, "127.0.0.1", 0, process_request=process_request)
+        self.port = self.server.socket.getsockname()[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def _reject(connection, _request):
+        return connection.respond(HTTPStatus.NOT_FOUND, "not found\n")
+
+    def _handler(self, ws):
+        self.connections += 1
+        inputs = []
+        for raw in ws:
+            message = json.loads(raw)
+            self.messages.append(message)
+            if message["type"] == "close":
+                break
+            if message["type"] == "run" and message["body"].get("stream"):
+                ws.send(json.dumps({"type": "trace_batch", "start": 0, "events": [{"tag": "LINE"}]}))
+            if message["type"] == "input":
+                inputs.append(message["value"])
+            if len(inputs) < 2:
+                body = {"status": "input_needed", "session_id": "s1", "prompt": "> ", "input_index": len(inputs)}
+            else:
+                body = {"status": "completed", "result": {"stdout_events": [{"text": "+".join(inputs)}]}}
+            ws.send(json.dumps({"type": "response", "status": 200, "body": body}))
+        self.closed.set()
+
+
+@pytest.fixture
+def sidecar(monkeypatch):
+    servers = []
+
+    def start(**kwargs):
+        server = _FakeSidecar(**kwargs)
+        servers.append(server)
+        monkeypatch.setattr(sandbox_client, "SIDECAR_URL", f"http://127.0.0.1:{server.port}")
+        return server
+
+    monkeypatch.setattr(sandbox_channel, "CHANNEL_MODE", "auto")
+    monkeypatch.setattr(sandbox_channel, "_unavailable_until", 0.0)
+    yield start
+    for server in servers:
+        server.server.shutdown()
+
+
+def test_session_round_trips_on_one_connection(sidecar):
+    server = sidecar()
+    on_batch = MagicMock()
+
+    channel = sandbox_channel.open_channel()
+    first = channel.run("x = input()", stdin_inputs=[], on_trace_batch=on_batch)
+    assert first["status"] == "input_needed"
+    assert first["session_id"] == "0:s1"
+    assert sandbox_client.node_stats()[0]["outstanding"] == 1
+    assert channel.is_alive() is True
+    assert channel.send_input("1")["input_index"] == 1
+    done = channel.send_input("2")
+    channel.close()
+
+    assert done["result"]["stdout_events"] == [{"text": "1+2"}]
+    on_batch.assert_called_once_with(0, [{"tag": "LINE"}])
+    assert server.connections == 1
+    assert sandbox_client.node_stats()[0]["outstanding"] == 0
+    assert server.closed.wait(5)
+    run = server.messages[0]
+    assert run["type"] == "run"
+    assert run["body"] == {"code": "x = input()", "stdin_inputs": [], "stream": True, "priority": "primary"}
+    assert [m["type"] for m in server.messages[1:]] == ["input", "input", "close"]
+
+
+def test_closed_connection_reports_failure(sidecar):
+    server = sidecar()
+    channel = sandbox_channel.open_channel()
+    channel.run("x = input()")
+    server.server.shutdown()
+    channel._ws.close()
+
+    assert channel.is_alive() is False
+    result = channel.send_input("1")
+    assert result["status"] == "failed"
+    assert "sandbox channel closed" in result["error"]
+
+
+def test_rejected_handshake_falls_back_and_backs_off(sidecar, monkeypatch):
+    sidecar(reject=True)
+    connect = MagicMock(wraps=sandbox_channel.ws_connect)
+    monkeypatch.setattr(sandbox_channel, "ws_connect", connect)
+
+    assert sandbox_channel.open_channel() is None
+    assert sandbox_channel.open_channel() is None
+    assert connect.call_count == 1
+
+
+def test_disabled_by_env(sidecar, monkeypatch):
+    sidecar()
+    monkeypatch.setattr(sandbox_channel, "CHANNEL_MODE", "0")
+
+    assert sandbox_channel.open_channel() is None
@@ -13,13 +13,14 @@ import os
 import subprocess
 import io
 import threading
+import zlib
 
 import pytest
 from unittest.mock import patch, MagicMock
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "sandbox_sidecar"))
 
-from sandbox_sidecar.app import app, CONTAINER_TIMEOUT
+from sandbox_sidecar.app import app, CONTAINER_TIMEOUT, COMPRESSED_RESULT_MIMETYPE
 
 
 SIMPLE_CODE = "def add(a, b):\n    return a + b\n"
@@ -164,6 +165,190 @@ class TestRunEndpointNInjection:
         assert mock_wait.call_args.args[1] == CONTAINER_TIMEOUT
 
 
+class TestRunEndpointEngineApi:
+    def test_uses_engine_exec_instead_of_cli(self, client):
+        engine = MagicMock()
+        engine.exec.return_value = _make_result_popen()
+        with patch("sandbox_sidecar.app._engine", engine), \
+             patch("sandbox_sidecar.app.subprocess.Popen") as mock_popen:
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "count_only": True})
+
+        mock_popen.assert_not_called()
+        assert "trace" in resp.get_json()
+        container_id, cmd, env = engine.exec.call_args.args
+        assert container_id == "test-container-abc"
+        assert cmd == ["python", "/sandbox/runner.py"]
+        assert base64.b64decode(env["CODE"]).decode() == SIMPLE_CODE
+        assert env["COUNT_ONLY"] == "1"
+        assert env["CODEPULSE_INTERACTIVE"] == "1"
+
+    def test_engine_failure_falls_back_to_cli(self, client):
+        engine = MagicMock()
+        engine.exec.side_effect = ConnectionRefusedError("docker.sock")
+        with patch("sandbox_sidecar.app._engine", engine), \
+             patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen()) as mock_popen:
+            resp = client.post("/run", json={"code": SIMPLE_CODE})
+
+        assert mock_popen.call_args.args[0][:2] == ["docker", "exec"]
+        assert "trace" in resp.get_json()
+
+
+class TestRunEndpointCountOnly:
+    def test_count_only_sets_runner_env(self, client):
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen()) as mock_popen:
+            client.post("/run", json={"code": SIMPLE_CODE, "count_only": True})
+        assert "COUNT_ONLY=1" in mock_popen.call_args.args[0]
+
+    def test_default_run_does_not_set_count_only(self, client):
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen()) as mock_popen:
+            client.post("/run", json={"code": SIMPLE_CODE})
+        assert "COUNT_ONLY=1" not in mock_popen.call_args.args[0]
+
+
+class TestRunEndpointCompressed:
+    def test_compress_sets_runner_env(self, client):
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen()) as mock_popen:
+            client.post("/run", json={"code": SIMPLE_CODE, "compress": True})
+        assert "RESULT_ENCODING=zlib" in mock_popen.call_args.args[0]
+
+    def test_compressed_payload_passed_through_as_bytes(self, client):
+        compressed = zlib.compress(VALID_STDOUT.encode())
+        popen = FakePopen([
+            {"type": "result", "payload_z": base64.b64encode(compressed).decode()}
+        ])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "compress": True})
+        assert resp.mimetype == COMPRESSED_RESULT_MIMETYPE
+        assert resp.data == compressed
+
+    def test_timings_header_on_every_run_response(self, client):
+        compressed = zlib.compress(VALID_STDOUT.encode())
+        popen = FakePopen([{"type": "result", "payload_z": base64.b64encode(compressed).decode()}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "compress": True})
+        timings = json.loads(resp.headers["X-Sandbox-Timings"])
+        assert set(timings) == {"acquire_ms", "exec_start_ms", "run_ms"}
+        assert all(v >= 0 for v in timings.values())
+        # 壓縮位元組原封不動，計時只在 header
+        assert resp.data == compressed
+
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen()):
+            resp = client.post("/run", json={"code": SIMPLE_CODE})
+        assert "X-Sandbox-Timings" in resp.headers
+        assert resp.get_json() == json.loads(VALID_STDOUT)
+
+    def test_invalid_compressed_payload_returns_error(self, client):
+        popen = FakePopen([{"type": "result", "payload_z": "not base64!"}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "compress": True})
+        assert "error" in resp.get_json()
+
+
+class TestRunEndpointStream:
+    def test_stream_yields_batches_then_result(self, client):
+        batch = {"type": "trace_batch", "start": 0, "events": [{"tag": "LINE"}]}
+        popen = FakePopen([batch, {"type": "result", "payload": json.loads(VALID_STDOUT)}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen) as mock_popen:
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "stream": True, "compress": True})
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        assert resp.mimetype == "application/x-ndjson"
+        # header 在第一個 batch 前就送出了，sidecar 計時放進最後一行
+        timings = lines[-1].pop("sandbox_timings")
+        assert set(timings) == {"acquire_ms", "exec_start_ms", "run_ms"}
+        assert lines == [batch, json.loads(VALID_STDOUT)]
+        cmd = mock_popen.call_args.args[0]
+        assert "STREAM_TRACE=1" in cmd
+        # 最後的完整結果照樣壓縮（trace_batch 已是明文，不再送一份明文的完整 trace）
+        assert "RESULT_ENCODING=zlib" in cmd
+
+    def test_stream_compressed_result_is_last_line(self, client):
+        batch = {"type": "trace_batch", "start": 0, "events": [{"tag": "LINE"}]}
+        compressed = zlib.compress(VALID_STDOUT.encode())
+        popen = FakePopen([batch, {"type": "result", "payload_z": base64.b64encode(compressed).decode()}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "stream": True, "compress": True})
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        assert lines[0] == batch
+        assert lines[-1]["type"] == "result_z"
+        assert base64.b64decode(lines[-1]["payload_z"]) == compressed
+        assert set(lines[-1]["sandbox_timings"]) == {"acquire_ms", "exec_start_ms", "run_ms"}
+
+    def test_stream_disconnect_recycles_session(self, client, mock_pool):
+        batch = {"type": "trace_batch", "start": 0, "events": [{"tag": "LINE"}]}
+        popen = FakePopen([batch, batch])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "stream": True}, buffered=False)
+            assert json.loads(next(iter(resp.response))) == batch
+            resp.close()  # worker 斷線：generator 收到 GeneratorExit
+        assert popen.killed is True
+        mock_pool.recycle.assert_called_once_with(mock_pool.acquire.return_value)
+        mock_pool.release.assert_not_called()
+
+    def test_stream_input_needed_keeps_session_parked(self, client, mock_pool):
+        popen = FakePopen([{"type": "input_needed", "prompt": "> ", "input_index": 0}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "stream": True, "interactive": True})
+        last = json.loads(resp.get_data(as_text=True).splitlines()[-1])
+        assert last["status"] == "input_needed"
+        assert popen.killed is False
+        mock_pool.recycle.assert_not_called()
+        client.post(f"/session/{last['session_id']}/close")
+
+    def test_capture_forwarded_to_runner(self, client):
+        popen = FakePopen([{"type": "result", "payload": json.loads(VALID_STDOUT)}])
+        capture = {"strategy": "ring", "max_steps": 100}
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen) as mock_popen:
+            client.post("/run", json={"code": SIMPLE_CODE, "capture": capture})
+        env_args = [a for a in mock_popen.call_args.args[0] if a.startswith("TRACE_CAPTURE=")]
+        assert [json.loads(a.split("=", 1)[1]) for a in env_args] == [capture]
+
+    def test_skip_cfg_forwarded_to_runner(self, client):
+        popen = FakePopen([{"type": "result", "payload": json.loads(VALID_STDOUT)}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen) as mock_popen:
+            client.post("/run", json={"code": SIMPLE_CODE, "skip_cfg": True})
+        assert "SKIP_CFG=1" in mock_popen.call_args.args[0]
+
+    def test_full_profile_forwarded_to_runner(self, client):
+        popen = FakePopen([{"type": "result", "payload": json.loads(VALID_STDOUT)}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen) as mock_popen:
+            client.post("/run", json={"code": SIMPLE_CODE, "profile": True})
+        assert "TRACE_PROFILE=1" in mock_popen.call_args.args[0]
+
+    def test_priority_and_tenant_passed_to_acquire(self, client, mock_pool):
+        with patch("sandbox_sidecar.app.subprocess.Popen", side_effect=lambda *a, **k: _make_result_popen()):
+            client.post("/run", json={"code": SIMPLE_CODE, "priority": "interactive", "tenant": "user:1"})
+            client.post("/run", json={"code": SIMPLE_CODE})
+            client.post("/run_batch", json={"code": SIMPLE_CODE, "n_values": [10]})
+        calls = [c.kwargs for c in mock_pool.acquire.call_args_list]
+        assert [(c["priority"], c["tenant"]) for c in calls] == [(0, "user:1"), (1, None), (2, None)]
+
+    def test_unknown_priority_returns_400(self, client, mock_pool):
+        resp = client.post("/run", json={"code": SIMPLE_CODE, "priority": "urgent"})
+        assert resp.status_code == 400
+        mock_pool.acquire.assert_not_called()
+
+    def test_capture_must_be_object(self, client):
+        resp = client.post("/run", json={"code": SIMPLE_CODE, "capture": "ring"})
+        assert resp.status_code == 400
+
+    def test_stream_error_is_last_line(self, client):
+        popen = FakePopen([{"type": "error", "message": "ZeroDivisionError: division by zero", "lineno": 2}])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE, "stream": True})
+        last = json.loads(resp.get_data(as_text=True).splitlines()[-1])
+        assert last["error"].startswith("ZeroDivisionError")
+        assert last["lineno"] == 2
+
+    def test_non_stream_run_skips_trace_batches(self, client):
+        popen = FakePopen([
+            {"type": "trace_batch", "start": 0, "events": []},
+            {"type": "result", "payload": json.loads(VALID_STDOUT)},
+        ])
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=popen):
+            resp = client.post("/run", json={"code": SIMPLE_CODE})
+        assert resp.get_json() == json.loads(VALID_STDOUT)
+
+
 class TestRunEndpointErrors:
     def test_timeout_returns_error_payload(self, client, mock_pool):
         with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen()):
@@ -171,7 +356,22 @@ class TestRunEndpointErrors:
                 resp = client.post("/run", json={"code": SIMPLE_CODE})
         body = resp.get_json()
         assert body["error"] == "timeout"
-        mock_pool.mark_destroyed.assert_called_once()
+        mock_pool.recycle.assert_called_once()
+
+    def test_runner_crash_recycles_but_user_error_releases(self, client, mock_pool):
+        crashed = FakePopen([])
+        crashed.returncode = 137
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=crashed):
+            resp = client.post("/run", json={"code": SIMPLE_CODE})
+        assert resp.get_json()["error"] == "runner exited without result"
+        mock_pool.recycle.assert_called_once()
+
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=FakePopen([
+            {"type": "error", "message": "ZeroDivisionError: division by zero", "lineno": 1},
+        ])):
+            client.post("/run", json={"code": SIMPLE_CODE})
+        mock_pool.release.assert_called_once()
+        mock_pool.recycle.assert_called_once()
 
     def test_nonzero_returncode_returns_error(self, client):
         with patch("sandbox_sidecar.app.subprocess.Popen", return_value=FakePopen([
@@ -286,3 +486,64 @@ class TestInteractiveSessions:
 
         assert resp.status_code == 404
         assert resp.get_json()["status"] == "failed"
+
+
+class TestRunBatchEndpoint:
+    def test_missing_code_returns_400(self, client):
+        resp = client.post("/run_batch", json={"n_values": [10]})
+        assert resp.status_code == 400
+
+    def test_invalid_n_values_returns_400(self, client):
+        resp = client.post("/run_batch", json={"code": SIMPLE_CODE, "n_values": ["10"]})
+        assert resp.status_code == 400
+
+    def test_single_exec_with_batch_env(self, client, mock_pool):
+        payload = {"results": [
+            {"n": 10, "step_count": 30, "is_truncated": False, "timed_out": False},
+            {"n": 50, "step_count": 150, "is_truncated": False, "timed_out": False},
+        ]}
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen(payload)) as mock_popen:
+            resp = client.post("/run_batch", json={"code": SIMPLE_CODE, "n_values": [10, 50], "per_n_timeout": 5})
+
+        assert resp.get_json() == payload
+        assert mock_popen.call_count == 1
+        assert mock_pool.acquire.call_count == 1
+        cmd = mock_popen.call_args.args[0]
+        assert "BATCH_N_VALUES=10,50" in cmd
+        assert "PER_N_TIMEOUT=5" in cmd
+        decoded = base64.b64decode(cmd[cmd.index("-e") + 1][len("CODE="):]).decode()
+        assert decoded == SIMPLE_CODE
+        mock_pool.release.assert_called_once()
+
+    def test_overall_timeout_scales_with_n_values(self, client):
+        with patch("sandbox_sidecar.app.subprocess.Popen", return_value=_make_result_popen({"results": []})):
+            with patch("sandbox_sidecar.app._wait_for_control_event", return_value={"type": "result", "payload": {"results": []}}) as mock_wait:
+                client.post("/run_batch", json={"code": SIMPLE_CODE, "n_values": [10, 50, 100], "per_n_timeout": 4})
+        assert mock_wait.call_args.args[1] == 12
+
+
+class TestPoolStats:
+    def test_not_initialized_does_not_create_pool(self, client):
+        with patch("sandbox_sidecar.app._pool", None):
+            resp = client.get("/pool/stats")
+        assert resp.get_json() == {"initialized": False}
+
+    def test_returns_pool_stats(self, client):
+        pool = MagicMock()
+        pool.stats.return_value = {"size": 3, "in_use": 1}
+        with patch("sandbox_sidecar.app._pool", pool):
+            resp = client.get("/pool/stats")
+        assert resp.get_json() == {"initialized": True, "size": 3, "in_use": 1}
+
+    def test_capacity_before_init_reports_full_pool(self, client):
+        with patch("sandbox_sidecar.app._pool", None):
+            resp = client.get("/capacity")
+        body = resp.get_json()
+        assert body["initialized"] is False and body["available"] == body["max_size"]
+
+    def test_capacity_from_pool(self, client):
+        pool = MagicMock()
+        pool.capacity.return_value = {"available": 2, "max_size": 4}
+        with patch("sandbox_sidecar.app._pool", pool):
+            resp = client.get("/capacity")
+        assert resp.get_json() == {"initialized": True, "available": 2, "max_size": 4}
@@ -0,0 +1,377 @@
+"""
+test_sidecar_asgi.py — sandbox_sidecar/asgi_app.py（asyncio 版 sidecar）測試
+
+直接呼叫 ASGI app（不需 uvicorn / httpx）；docker exec 換成本機直接跑 docker/runner.py，
+驗證與 Flask 版相同的 HTTP 介面：/run（含串流與互動 input）、/input、/session、timeout 回收，
+以及 WebSocket 通道 /ws/run。
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "sandbox_sidecar"))
+
+from sandbox_sidecar import asgi_app
+from container_pool import PoolExhaustedError
+
+RUNNER_PATH = os.path.join(os.path.dirname(__file__), "..", "docker", "runner.py")
+SERVICES_PATH = os.path.join(os.path.dirname(__file__), "..", "services")
+INPUT_CODE = 'name = input("Name: ")\nprint("hi", name)\n'
+
+
+async def _local_runner(container, env):
+    run_env = os.environ.copy()
+    run_env.update(env)
+    run_env.update({"PYTHONPATH": SERVICES_PATH, "SANDBOX_CONTAINER": "1", "CODEPULSE_INTERACTIVE": "1"})
+    return await asyncio.create_subprocess_exec(
+        sys.executable, RUNNER_PATH,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=run_env,
+        limit=asgi_app.STREAM_LINE_LIMIT,
+    )
+
+
+async def _call(method: str, path: str, body: dict | None = None):
+    messages = [{"type": "http.request", "body": json.dumps(body).encode() if body is not None else b""}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app.app({"type": "http", "method": method, "path": path}, receive, send)
+    headers = dict(sent[0]["headers"])
+    data = b"".join(m.get("body", b"") for m in sent[1:])
+    return sent[0]["status"], headers[b"content-type"].decode(), data
+
+
+class _WebSocketClient:
+    """以兩個 asyncio.Queue 模擬 ASGI websocket 連線的 client 端。"""
+
+    def __init__(self, path: str = "/ws/run"):
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(
+            asgi_app.app({"type": "websocket", "path": path}, self.inbox.get, self.outbox.put)
+        )
+
+    def send(self, message: dict) -> None:
+        self.inbox.put_nowait({"type": "websocket.receive", "text": json.dumps(message)})
+
+    def disconnect(self) -> None:
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1006})
+
+    async def receive(self) -> dict:
+        """下一則 sidecar 訊息（ASGI event）；websocket.send 解成 JSON。"""
+        message = await asyncio.wait_for(self.outbox.get(), 10)
+        if message["type"] == "websocket.send":
+            return json.loads(message["text"])
+        return message
+
+
+def _run(scenario):
+    pool = MagicMock()
+    pool.acquire.return_value = MagicMock(id="asgi-container")
+
+    async def main():
+        try:
+            await scenario(pool)
+        finally:
+            for session in list(asgi_app._sessions.values()):
+                await asgi_app._finish_session(session, recycle=True)
+            await asyncio.gather(*asgi_app._reapers)
+
+    with patch.object(asgi_app, "_get_pool", return_value=pool), \
+         patch.object(asgi_app, "_exec_runner", side_effect=_local_runner):
+        asyncio.run(main())
+
+
+class TestRun:
+    def test_run_returns_result_and_releases_container(self):
+        async def scenario(pool):
+            status, mimetype, data = await _call("POST", "/run", {"code": "x = 1\ny = x + 1\n"})
+            assert status == 200
+            assert mimetype == "application/json"
+            assert json.loads(data)["step_count"] > 0
+            pool.release.assert_called_once()
+            pool.recycle.assert_not_called()
+
+        _run(scenario)
+
+    def test_compressed_result_passed_through(self):
+        async def scenario(pool):
+            status, mimetype, data = await _call("POST", "/run", {"code": "x = 1\n", "compress": True})
+            import zlib
+            assert mimetype == asgi_app.COMPRESSED_RESULT_MIMETYPE
+            assert json.loads(zlib.decompress(data))["step_count"] > 0
+
+        _run(scenario)
+
+    def test_timings_header_and_runner_usage(self):
+        async def scenario(pool):
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": json.dumps({"code": "x = 1\n", "compress": True}).encode()}
+
+            async def send(message):
+                sent.append(message)
+
+            await asgi_app.app({"type": "http", "method": "POST", "path": "/run"}, receive, send)
+            import zlib
+            timings = json.loads(dict(sent[0]["headers"])[b"x-sandbox-timings"])
+            assert set(timings) == {"acquire_ms", "exec_start_ms", "run_ms"}
+            assert json.loads(zlib.decompress(sent[1]["body"]))["usage"]["wall_ms"] > 0
+
+        _run(scenario)
+
+    def test_stream_sends_batches_then_result(self):
+        async def scenario(pool):
+            code = "total = 0\nfor i in range(80):\n    total += i\n"
+            status, mimetype, data = await _call("POST", "/run", {"code": code, "stream": True})
+            lines = [json.loads(line) for line in data.decode().splitlines()]
+            assert mimetype == asgi_app.STREAM_MIMETYPE
+            assert lines[0]["type"] == "trace_batch"
+            assert "trace" in lines[-1] and "acquire_ms" in lines[-1]["sandbox_timings"]
+
+        _run(scenario)
+
+    def test_stream_with_compress_sends_compressed_result_line(self):
+        async def scenario(pool):
+            import base64
+            import zlib
+            code = "total = 0\nfor i in range(80):\n    total += i\n"
+            _, _, data = await _call("POST", "/run", {"code": code, "stream": True, "compress": True})
+            lines = [json.loads(line) for line in data.decode().splitlines()]
+            assert lines[0]["type"] == "trace_batch"
+            assert lines[-1]["type"] == "result_z" and "acquire_ms" in lines[-1]["sandbox_timings"]
+            result = json.loads(zlib.decompress(base64.b64decode(lines[-1]["payload_z"])))
+            assert len(result["trace"]) > 0
+
+        _run(scenario)
+
+    def test_stream_client_disconnect_recycles_session(self):
+        async def scenario(pool):
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": json.dumps({"code": "while True:\n    pass\n", "stream": True}).encode()}
+
+            async def send(message):
+                if message.get("more_body"):
+                    raise OSError("client disconnected")
+                sent.append(message)
+
+            try:
+                await asgi_app.app({"type": "http", "method": "POST", "path": "/run"}, receive, send)
+            except OSError:
+                pass
+            pool.recycle.assert_called_once()
+            pool.release.assert_not_called()
+            assert asgi_app._sessions == {}
+
+        _run(scenario)
+
+    def test_timeout_recycles_container(self):
+        async def scenario(pool):
+            status, _, data = await _call("POST", "/run", {"code": "while True:\n    pass\n", "per_n_timeout": 0.5})
+            assert json.loads(data)["error"] == "timeout"
+            pool.recycle.assert_called_once()
+
+        _run(scenario)
+
+    def test_syntax_error_reported(self):
+        async def scenario(pool):
+            _, _, data = await _call("POST", "/run", {"code": "def f(:\n"})
+            assert "SyntaxError" in json.loads(data)["error"]
+
+        _run(scenario)
+
+    def test_validation_errors(self):
+        async def scenario(pool):
+            assert (await _call("POST", "/run", {}))[0] == 400
+            assert (await _call("POST", "/run", {"code": "x", "stdin_inputs": "a"}))[0] == 400
+            assert (await _call("POST", "/run_batch", {"code": "x", "n_values": []}))[0] == 400
+            assert (await _call("GET", "/nope"))[0] == 404
+            pool.acquire.assert_not_called()
+
+        _run(scenario)
+
+    def test_pool_exhausted_returns_503(self):
+        async def scenario(pool):
+            pool.acquire.side_effect = PoolExhaustedError("busy")
+            status, _, data = await _call("POST", "/run", {"code": "x = 1\n"})
+            assert status == 503
+            assert json.loads(data)["error"].startswith("pool_exhausted")
+
+        _run(scenario)
+
+
+class TestInteractiveSession:
+    def test_input_round_trip(self):
+        async def scenario(pool):
+            _, _, data = await _call("POST", "/run", {"code": INPUT_CODE})
+            first = json.loads(data)
+            assert first["status"] == "input_needed"
+            assert first["prompt"] == "Name: "
+            sid = first["session_id"]
+
+            status, _, data = await _call("GET", f"/session/{sid}/alive")
+            assert json.loads(data)["alive"] is True
+
+            _, _, data = await _call("POST", f"/input/{sid}", {"value": "Ada"})
+            done = json.loads(data)
+            assert done["status"] == "completed"
+            assert [ev["text"] for ev in done["result"]["stdout_events"]] == ["Name: Ada", "hi Ada"]
+            pool.recycle.assert_called_once()
+            assert (await _call("POST", f"/input/{sid}", {"value": "x"}))[0] == 404
+
+        _run(scenario)
+
+    def test_close_session(self):
+        async def scenario(pool):
+            _, _, data = await _call("POST", "/run", {"code": INPUT_CODE})
+            sid = json.loads(data)["session_id"]
+            assert json.loads((await _call("DELETE", f"/session/{sid}/close"))[2]) == {"status": "closed"}
+            assert (await _call("GET", f"/session/{sid}/alive"))[0] == 404
+            pool.recycle.assert_called_once()
+
+        _run(scenario)
+
+    def test_idle_sessions_do_not_hold_threads(self):
+        async def scenario(pool):
+            before = set(threading.enumerate())
+            results = await asyncio.gather(*(_call("POST", "/run", {"code": INPUT_CODE}) for _ in range(8)))
+            sids = [json.loads(data)["session_id"] for _, _, data in results]
+            assert len(set(sids)) == 8
+            # 等 input 的 session 不佔 reader thread（Flask 版每個 session 兩個）；
+            # 只允許 asyncio 自己的 to_thread executor / child watcher thread
+            new_threads = [t for t in threading.enumerate() if t not in before and not t.name.startswith("asyncio")]
+            assert new_threads == []
+            for sid in sids:
+                await _call("POST", f"/session/{sid}/close")
+
+        _run(scenario)
+
+
+class TestWebSocketChannel:
+    def test_input_round_trip_on_one_connection(self):
+        async def scenario(pool):
+            ws = _WebSocketClient()
+            assert (await ws.receive())["type"] == "websocket.accept"
+            ws.send({"type": "run", "body": {"code": 'a = input("A: ")\nb = input("B: ")\nprint(a + b)\n'}})
+
+            first = await ws.receive()
+            assert first["type"] == "response"
+            assert first["body"]["status"] == "input_needed"
+            assert first["body"]["prompt"] == "A: "
+            ws.send({"type": "input", "value": "1"})
+            second = await ws.receive()
+            assert second["body"]["status"] == "input_needed"
+            assert second["body"]["input_index"] == 1
+            ws.send({"type": "input", "value": "2"})
+
+            done = await ws.receive()
+            assert done["body"]["status"] == "completed"
+            assert done["body"]["result"]["stdout_events"][-1]["text"] == "12"
+            assert (await ws.receive())["type"] == "websocket.close"
+            await ws.task
+            pool.recycle.assert_called_once()
+            pool.acquire.assert_called_once()
+
+        _run(scenario)
+
+    def test_stream_forwards_trace_batches_then_result(self):
+        async def scenario(pool):
+            ws = _WebSocketClient()
+            await ws.receive()
+            code = "total = 0\nfor i in range(80):\n    total += i\n"
+            ws.send({"type": "run", "body": {"code": code, "stream": True, "compress": True}})
+
+            messages = []
+            while not messages or messages[-1]["type"] == "trace_batch":
+                messages.append(await ws.receive())
+            assert messages[0]["type"] == "trace_batch"
+            # compress 在通道上被忽略：結果直接是 JSON；沒有 header，計時放在 body
+            assert "trace" in messages[-1]["body"]
+            assert set(messages[-1]["body"]["sandbox_timings"]) == {"acquire_ms", "exec_start_ms", "run_ms"}
+            await ws.task
+            pool.release.assert_called_once()
+
+        _run(scenario)
+
+    def test_runner_exit_reported_while_waiting_for_input(self):
+        async def scenario(pool):
+            ws = _WebSocketClient()
+            await ws.receive()
+            ws.send({"type": "run", "body": {"code": INPUT_CODE}})
+            sid = (await ws.receive())["body"]["session_id"]
+
+            asgi_app._sessions[sid].process.kill()
+
+            failed = await ws.receive()
+            assert failed["body"]["status"] == "failed"
+            assert (await ws.receive())["type"] == "websocket.close"
+            await ws.task
+            pool.recycle.assert_called_once()
+
+        _run(scenario)
+
+    def test_disconnect_recycles_session(self):
+        async def scenario(pool):
+            ws = _WebSocketClient()
+            await ws.receive()
+            ws.send({"type": "run", "body": {"code": INPUT_CODE}})
+            assert (await ws.receive())["body"]["status"] == "input_needed"
+
+            ws.disconnect()
+            await asyncio.wait_for(ws.task, 10)
+
+            assert asgi_app._sessions == {}
+            pool.recycle.assert_called_once()
+
+        _run(scenario)
+
+    def test_invalid_run_and_unknown_path(self):
+        async def scenario(pool):
+            ws = _WebSocketClient()
+            await ws.receive()
+            ws.send({"type": "input", "value": "x"})
+            assert (await ws.receive())["status"] == 400
+            await ws.task
+
+            other = _WebSocketClient("/ws/other")
+            assert (await other.receive())["type"] == "websocket.close"
+            pool.acquire.assert_not_called()
+
+        _run(scenario)
+
+
+def test_pool_stats_before_init():
+    async def scenario():
+        return await _call("GET", "/pool/stats")
+
+    with patch.object(asgi_app, "_pool", None):
+        status, _, data = asyncio.run(scenario())
+    assert json.loads(data) == {"initialized": False}
+
+
+def test_capacity_from_pool():
+    async def scenario():
+        return await _call("GET", "/capacity")
+
+    pool = MagicMock()
+    pool.capacity.return_value = {"available": 1, "max_size": 4}
+    with patch.object(asgi_app, "_pool", pool):
+        status, _, data = asyncio.run(scenario())
+    assert status == 200
+    assert json.loads(data) == {"initialized": True, "available": 1, "max_size": 4}
@@ -63,6 +63,17 @@ def test_owns_task_reads_owner_from_redis():
         assert q.owns_task("test-task-id-owner", 8) is False
 
 
+def test_cancel_task_wakes_input_wait_and_leaves_admission_queue():
+    q = make_queue()
+    with patch.object(q._redis, "rpush") as mock_rpush, \
+         patch.object(q._redis, "expire"), \
+         patch("services.task_queue_celery.admission.release") as mock_release:
+        q.cancel_task("test-task-id-cancel")
+
+    assert mock_rpush.call_args.args[0] == "analyze:input:test-task-id-cancel"
+    mock_release.assert_called_once_with("test-task-id-cancel")
+
+
 def test_update_progress_writes_to_redis():
     import json
     q = make_queue()
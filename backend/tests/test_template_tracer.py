@@ -153,9 +153,9 @@ class TestAlignSnapshots:
         return [TagEvent(tag=f"TAG_{i}", dataSnapshot=[99, 99]) for i in range(n_tags)]
 
     def _make_user_raw(self, snapshots: list) -> list:
-        """建構 user raw trace，local_vars 的 value 為 repr 字串（符合 tracer.py 格式）。"""
+        """建構 user raw trace，local_vars 的 value 為 heap 還原的 Python 值（符合 analysis_runner 格式）。"""
         return [
-            TraceEvent(tag="LINE", local_vars={"arr": repr(snap)}, global_vars={}, dataSnapshot=[], meta={})
+            TraceEvent(tag="LINE", local_vars={"arr": list(snap)}, global_vars={}, dataSnapshot=[], meta={})
             for snap in snapshots
         ]
 
@@ -194,7 +194,7 @@ class TestAlignSnapshots:
         """用戶 trace 完全沒有 list 快照 → None。"""
         ref_trace = self._make_ref_trace(5)
         user_raw = [
-            TraceEvent(tag="LINE", local_vars={"x": "1"}, global_vars={}, dataSnapshot=[], meta={})
+            TraceEvent(tag="LINE", local_vars={"x": 1, "s": "[1, 2]"}, global_vars={}, dataSnapshot=[], meta={})
         ]
         result = align_snapshots(ref_trace, user_raw)
         assert result is None
@@ -210,8 +210,23 @@ class TestAlignSnapshots:
         assert result is None
 
 
+import json
+
+from heap_snapshot import HeapTable, heap_local_values
 from template_tracer import build_level1_trace
 
+
+def _user_raw_trace(code: str) -> list:
+    """模擬 runner → backend：heap 值經 JSON 傳輸後還原成 Python 值（analysis_runner 的做法）。"""
+    result = run_trace(code, heap=True)
+    table = HeapTable()
+    events = [{"tag": ev.tag, "local_vars": ev.local_vars, "heap": table.delta(ev.heap)} for ev in result.trace]
+    events, objects = json.loads(json.dumps([events, table.objects]))
+    return [
+        TraceEvent(tag=ev.tag, local_vars=values, global_vars={}, dataSnapshot=[], meta=ev.meta)
+        for ev, values in zip(result.trace, heap_local_values(events, objects))
+    ]
+
 BUBBLE_SORT_USER_CODE = """
 def bubble_sort(arr):
     n = len(arr)
@@ -237,8 +252,8 @@ result = linear_search([1, 2, 3], 2)
 
 class TestBuildLevel1Trace:
     def test_returns_trace_event_list(self):
-        raw = run_trace(BUBBLE_SORT_USER_CODE)
-        result = build_level1_trace("bubble_sort", raw.trace, [3, 1, 2])
+        raw = _user_raw_trace(BUBBLE_SORT_USER_CODE)
+        result = build_level1_trace("bubble_sort", raw, [3, 1, 2])
         assert result is not None
         events, raw_index_map = result
         assert isinstance(events, list)
@@ -246,8 +261,8 @@ class TestBuildLevel1Trace:
         assert isinstance(raw_index_map, list)
 
     def test_trace_events_have_semantic_tags(self):
-        raw = run_trace(BUBBLE_SORT_USER_CODE)
-        result = build_level1_trace("bubble_sort", raw.trace, [3, 1, 2])
+        raw = _user_raw_trace(BUBBLE_SORT_USER_CODE)
+        result = build_level1_trace("bubble_sort", raw, [3, 1, 2])
         assert result is not None
         events, _ = result
         tags = {e.tag for e in events}
@@ -256,8 +271,8 @@ class TestBuildLevel1Trace:
 
     def test_trace_event_matches_frontend_contract(self):
         """每個 TraceEvent 必須有 tag, local_vars, global_vars, dataSnapshot。"""
-        raw = run_trace(BUBBLE_SORT_USER_CODE)
-        result = build_level1_trace("bubble_sort", raw.trace, [3, 1, 2])
+        raw = _user_raw_trace(BUBBLE_SORT_USER_CODE)
+        result = build_level1_trace("bubble_sort", raw, [3, 1, 2])
         assert result is not None
         events, _ = result
         for event in events:
@@ -267,15 +282,20 @@ class TestBuildLevel1Trace:
             assert hasattr(event, "dataSnapshot")
 
     def test_returns_none_for_unsupported_algo(self):
-        raw = run_trace(BUBBLE_SORT_USER_CODE)
-        result = build_level1_trace("unknown_algo", raw.trace, [3, 1, 2])
+        raw = _user_raw_trace(BUBBLE_SORT_USER_CODE)
+        result = build_level1_trace("unknown_algo", raw, [3, 1, 2])
         assert result is None
 
     def test_returns_none_for_empty_input_data(self):
-        raw = run_trace(BUBBLE_SORT_USER_CODE)
-        result = build_level1_trace("bubble_sort", raw.trace, [])
+        raw = _user_raw_trace(BUBBLE_SORT_USER_CODE)
+        result = build_level1_trace("bubble_sort", raw, [])
         assert result is None
 
+    def test_aligns_with_user_list_states(self):
+        raw = _user_raw_trace(BUBBLE_SORT_USER_CODE)
+        _, raw_index_map = build_level1_trace("bubble_sort", raw, [3, 1, 2])
+        assert raw[raw_index_map[-1]].local_vars["arr"] == [1, 2, 3]
+
     def test_never_raises(self):
         """build_level1_trace 永遠不 raise，即使輸入是垃圾。"""
         try:
@@ -285,8 +305,8 @@ class TestBuildLevel1Trace:
             assert False, f"build_level1_trace raised: {exc}"
 
     def test_linear_search_level1(self):
-        raw = run_trace(LINEAR_SEARCH_USER_CODE)
-        result = build_level1_trace("linear_search", raw.trace, [1, 2, 3], target=2)
+        raw = _user_raw_trace(LINEAR_SEARCH_USER_CODE)
+        result = build_level1_trace("linear_search", raw, [1, 2, 3], target=2)
         assert result is not None
         events, _ = result
         tags = {e.tag for e in events}
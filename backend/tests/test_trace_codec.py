@@ -0,0 +1,72 @@
+"""tests/test_trace_codec.py — trace 差量編碼 encode/decode 單元測試"""
+
+from services.trace_codec import (
+    TRACE_ENCODING_DELTA,
+    decode_trace,
+    encode_trace,
+    pack_trace,
+    unpack_trace,
+)
+
+
+def _event(tag, local_vars, global_vars=None, lineno=1):
+    return {
+        "tag": tag,
+        "local_vars": local_vars,
+        "global_vars": global_vars or {},
+        "dataSnapshot": [],
+        "meta": {"lineno": lineno, "func_name": "f"},
+    }
+
+
+TRACE = [
+    _event("CALL", {"arr": "[3, 1, 2]"}, {"g": "1"}, 1),
+    _event("LINE", {"arr": "[3, 1, 2]", "i": "0"}, {"g": "1"}, 2),
+    _event("LINE", {"arr": "[1, 3, 2]", "i": "0"}, {"g": "1"}, 3),
+    _event("LINE", {"arr": "[1, 3, 2]", "i": "1"}, {"g": "2"}, 2),
+    _event("RETURN", {"arr": "[1, 2, 3]"}, {}, 4),
+]
+
+
+def test_roundtrip_restores_full_trace():
+    encoded = encode_trace(TRACE)
+    assert decode_trace(encoded, TRACE_ENCODING_DELTA) == TRACE
+
+
+def test_delta_events_only_carry_changed_keys():
+    encoded = encode_trace(TRACE)
+    assert encoded[0]["keyframe"] is True
+    assert encoded[1]["local_vars"] == {"i": "0"}
+    assert encoded[1]["global_vars"] == {}
+    assert encoded[2]["local_vars"] == {"arr": "[1, 3, 2]"}
+
+
+def test_removed_keys_are_recorded():
+    encoded = encode_trace(TRACE)
+    assert encoded[4]["local_del"] == ["i"]
+    assert encoded[4]["global_del"] == ["g"]
+
+
+def test_keyframe_interval():
+    trace = [_event("LINE", {"i": str(i)}) for i in range(7)]
+    encoded = encode_trace(trace, keyframe_interval=3)
+    assert [bool(ev.get("keyframe")) for ev in encoded] == [True, False, False, True, False, False, True]
+    assert decode_trace(encoded, TRACE_ENCODING_DELTA) == trace
+
+
+def test_decode_without_encoding_is_passthrough():
+    assert decode_trace(TRACE, None) is TRACE
+
+
+def test_decoded_events_do_not_share_var_dicts():
+    decoded = decode_trace(encode_trace(TRACE), TRACE_ENCODING_DELTA)
+    decoded[1]["local_vars"]["x"] = "mutated"
+    assert "x" not in decoded[2]["local_vars"]
+
+
+def test_pack_unpack_roundtrip_and_legacy_list():
+    packed = pack_trace(encode_trace(TRACE), TRACE_ENCODING_DELTA)
+    assert unpack_trace(packed) == TRACE
+    assert pack_trace(TRACE, None) is TRACE
+    assert unpack_trace(TRACE) == TRACE
+    assert unpack_trace(None) == []
@@ -0,0 +1,148 @@
+"""
+test_zygote.py — docker/zygote.py（容器內 supervisor）與 sandbox_sidecar/zygote_client.py 測試
+
+zygote 直接以本機 subprocess 執行（不經 docker exec），驗證：
+- 同一個 zygote 依序跑多個 job，env 不互相汙染
+- 互動 input 由 child 從 zygote 的 stdin 讀取
+- ZygoteJob 的 Popen 相容介面，以及 sidecar /run 走 zygote 的完整路徑
+"""
+
+import base64
+import json
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "sandbox_sidecar"))
+
+from sandbox_sidecar import app as sidecar_app
+from zygote_client import ZYGOTE_PREFIX, ZygoteProcess, ZygoteUnavailableError
+
+ZYGOTE_PATH = os.path.join(os.path.dirname(__file__), "..", "docker", "zygote.py")
+SERVICES_PATH = os.path.join(os.path.dirname(__file__), "..", "services")
+EVENT_PREFIX = "__CODEPULSE_EVENT__"
+
+
+def _local_zygote() -> ZygoteProcess:
+    env = os.environ.copy()
+    env["PYTHONPATH"] = SERVICES_PATH
+    env["SANDBOX_CONTAINER"] = "1"
+    return ZygoteProcess([sys.executable, ZYGOTE_PATH], env=env)
+
+
+def _job_env(code: str, **extra) -> dict:
+    return {
+        "CODE": base64.b64encode(code.encode()).decode(),
+        "CODEPULSE_INTERACTIVE": "1",
+        **extra,
+    }
+
+
+def _read_events(job) -> list[dict]:
+    events = []
+    for line in iter(job.stdout.readline, ""):
+        assert line.startswith(EVENT_PREFIX), f"unexpected line: {line!r}"
+        assert not line.startswith(ZYGOTE_PREFIX)
+        events.append(json.loads(line[len(EVENT_PREFIX):]))
+    return events
+
+
+@pytest.fixture
+def zygote():
+    z = _local_zygote()
+    yield z
+    z.kill()
+
+
+class TestZygoteSupervisor:
+    def test_runs_sequential_jobs_in_one_process(self, zygote):
+        first = zygote.submit(_job_env("x = 1\n", COUNT_ONLY="1"))
+        first_events = _read_events(first)
+        assert first.wait(timeout=10) == 0
+
+        second = zygote.submit(_job_env("y = 2\n"))
+        second_events = _read_events(second)
+        assert second.wait(timeout=10) == 0
+
+        assert "line_hits" in first_events[-1]["payload"]
+        # COUNT_ONLY 只套在第一個 child，第二個 job 是完整 trace
+        assert "trace" in second_events[-1]["payload"]
+        assert zygote.is_alive()
+
+    def test_interactive_input_goes_to_child(self, zygote):
+        job = zygote.submit(_job_env('name = input("Name: ")\nprint(name)\n'))
+        first = json.loads(job.stdout.readline()[len(EVENT_PREFIX):])
+        assert first["type"] == "input_needed"
+
+        job.stdin.write("Ada\n")
+        job.stdin.flush()
+        events = _read_events(job)
+        assert events[-1]["type"] == "result"
+        assert [ev["text"] for ev in events[-1]["payload"]["stdout_events"]] == ["Name: Ada", "Ada"]
+
+    def test_runner_exit_code_propagates(self, zygote):
+        job = zygote.submit(_job_env("def f(:\n"))
+        events = _read_events(job)
+        assert job.wait(timeout=10) == 1
+        assert events[-1]["type"] == "error"
+        assert "SyntaxError" in events[-1]["message"]
+
+    def test_kill_stuck_job_kills_zygote(self, zygote):
+        job = zygote.submit(_job_env("while True:\n    pass\n"))
+        assert job.poll() is None
+        job.kill()
+        assert job.wait(timeout=10) != 0
+        assert not zygote.is_alive()
+        with pytest.raises(ZygoteUnavailableError):
+            zygote.submit(_job_env("x = 1\n"))
+
+    def test_rejects_concurrent_job(self, zygote):
+        job = zygote.submit(_job_env("x = 1\n"))
+        with pytest.raises(ZygoteUnavailableError):
+            zygote.submit(_job_env("y = 1\n"))
+        _read_events(job)
+
+
+class TestSidecarZygotePath:
+    @pytest.fixture
+    def container(self, zygote):
+        container = MagicMock()
+        container.id = "zygote-container"
+        container.zygote = zygote
+        return container
+
+    @pytest.fixture
+    def client(self, container):
+        pool = MagicMock()
+        pool.acquire.return_value = container
+        sidecar_app.app.config["TESTING"] = True
+        with patch.object(sidecar_app, "ZYGOTE_ENABLED", True), \
+             patch("sandbox_sidecar.app._get_pool", return_value=pool), \
+             sidecar_app.app.test_client() as c:
+            c.pool = pool
+            yield c
+
+    def test_run_uses_zygote_without_docker_exec(self, client, container):
+        with patch("sandbox_sidecar.app.subprocess.Popen") as mock_popen:
+            first = client.post("/run", json={"code": "x = 1\n"})
+            second = client.post("/run", json={"code": "y = 2\n"})
+
+        mock_popen.assert_not_called()
+        assert first.get_json()["step_count"] > 0
+        assert second.get_json()["step_count"] > 0
+        assert client.pool.release.call_count == 2
+        assert container.zygote.is_alive()
+
+    def test_dead_zygote_is_restarted(self, client, container):
+        container.zygote.kill()
+        container.zygote.process.wait(timeout=10)
+        replacement = _local_zygote()
+        try:
+            with patch("sandbox_sidecar.app.ZygoteProcess.for_container", return_value=replacement) as mock_start:
+                resp = client.post("/run", json={"code": "x = 1\n"})
+            mock_start.assert_called_once_with("zygote-container")
+            assert resp.get_json()["step_count"] > 0
+        finally:
+            replacement.kill()
@@ -184,17 +184,20 @@ export function buildCallGraphElements(
   });
 
   // call edges（實線，active 時高亮）
-  const callEdges = callGraph.edges.map((e) => ({
-    data: {
-      id: `${e.source}->${e.target}`,
-      source: e.source,
-      target: e.target,
-      steps: e.steps,
-      label: e.steps.length > 1 ? `×${e.steps.length}` : "",
-      edgeType: "call",
-    },
-    classes: e.steps.includes(currentStep) ? "active" : "",
-  }));
+  const callEdges = callGraph.edges.map((e) => {
+    const calls = e.calls ?? e.steps.length;
+    return {
+      data: {
+        id: `${e.source}->${e.target}`,
+        source: e.source,
+        target: e.target,
+        steps: e.steps,
+        label: calls > 1 ? `×${calls}` : "",
+        edgeType: "call",
+      },
+      classes: e.steps.includes(currentStep) ? "active" : "",
+    };
+  });
 
   // return edges（虛線，RETURN event 時 active-return class 顯示）
   const returnEdges = callGraph.edges
@@ -159,6 +159,8 @@ export function usePlaygroundRun({
               target: e.target,
               steps: e.steps ?? [],
               returnSteps: e.return_steps ?? e.returnSteps ?? [],
+              calls: e.calls,
+              returns: e.returns,
             })),
             root: record.call_graph.root,
           }
@@ -158,6 +158,49 @@ describe("AnalyzeService.run", () => {
     expect(submitCalls).toHaveLength(1);
   });
 
+  it("forwards streamed trace batches without treating them as stage changes", async () => {
+    vi.stubGlobal(
+      "fetch",
+      vi.fn(async () => {
+        return new Response(JSON.stringify({ task_id: "task-1" }), {
+          status: 202,
+          headers: { "Content-Type": "application/json" },
+        });
+      }),
+    );
+    vi.stubGlobal("EventSource", MockEventSource);
+
+    const controller = new AbortController();
+    const onProgress = vi.fn();
+    const onTraceBatch = vi.fn();
+    const promise = run("x = 1", onProgress, controller.signal, { onTraceBatch });
+    const settled = promise.catch((e) => e);
+    await vi.waitFor(() => expect(MockEventSource.instances).toHaveLength(1));
+    const [, init] = vi.mocked(fetch).mock.calls.find(([url]) =>
+      String(url).endsWith("/api/analyze/submit"),
+    ) as [string, RequestInit];
+    expect(JSON.parse(init.body as string).stream_trace).toBe(true);
+
+    const events = [{ tag: "LINE", local_vars: {}, global_vars: {}, dataSnapshot: [], meta: {} }];
+    MockEventSource.instances[0].onmessage?.(
+      new MessageEvent("message", {
+        data: JSON.stringify({
+          stage: "sandbox",
+          status: "running",
+          type: "trace_batch",
+          start: 0,
+          events,
+        }),
+      }),
+    );
+
+    expect(onTraceBatch).toHaveBeenCalledWith(0, events);
+    expect(onProgress).not.toHaveBeenCalled();
+
+    controller.abort();
+    await settled;
+  });
+
   it("cancels the backend task when the user dismisses the input dialog", async () => {
     const fetchMock = vi.fn(async (url: string) => {
       if (url.endsWith("/api/analyze/submit")) {
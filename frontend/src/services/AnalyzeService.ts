@@ -73,6 +73,11 @@ export type AnalyzeRunOptions = {
   stdinInputs?: string[];
   isRetry?: boolean;
   onInputNeeded?: (prompt: string, inputIndex: number) => Promise<string | null>;
+  /**
+   * 執行中陸續收到的 trace 片段（start 為第一個 event 的 index），可在結果回來前先播放。
+   * 有給才會請後端串流（submit 帶 stream_trace）。
+   */
+  onTraceBatch?: (start: number, events: TraceEvent[]) => void;
 };
 
 /**
@@ -105,6 +110,8 @@ export async function run(
       save_history: options.saveHistory ?? true,
       stdin_inputs: options.stdinInputs ?? [],
       is_retry: options.isRetry ?? false,
+      // 有 onTraceBatch 才請後端串流 trace 片段；沒人接就不必經 Redis / SSE 轉送每一批
+      stream_trace: options.onTraceBatch !== undefined,
     }, undefined, signal);
   } catch (err: any) {
     const body = err?.response?.data;
@@ -137,7 +144,13 @@ export async function run(
   const taskId = submitRes.data.task_id!;
 
   // 2. Stream progress via SSE
-  return streamProgress(taskId, onProgress, signal, options.onInputNeeded);
+  return streamProgress(
+    taskId,
+    onProgress,
+    signal,
+    options.onInputNeeded,
+    options.onTraceBatch,
+  );
 }
 
 // Internal helpers
@@ -147,6 +160,7 @@ function streamProgress(
   onProgress: (stage: RunStage) => void,
   signal?: AbortSignal,
   onInputNeeded?: (prompt: string, inputIndex: number) => Promise<string | null>,
+  onTraceBatch?: (start: number, events: TraceEvent[]) => void,
 ): Promise<AnalyzeResult> {
   return new Promise((resolve, reject) => {
     if (signal?.aborted) {
@@ -191,6 +205,11 @@ function streamProgress(
         return;
       }
 
+      if (event.type === "trace_batch") {
+        onTraceBatch?.(event.start ?? 0, event.events ?? []);
+        return;
+      }
+
       if (event.status === "running" && event.stage) {
         onProgress(event.stage as RunStage);
         return;
@@ -296,11 +315,15 @@ async function fetchResult(
             target: string;
             steps: number[];
             return_steps: number[];
+            calls?: number;
+            returns?: number;
           }) => ({
             source: e.source,
             target: e.target,
             steps: e.steps ?? [],
             returnSteps: e.return_steps ?? [],
+            calls: e.calls,
+            returns: e.returns,
           }),
         ),
       }
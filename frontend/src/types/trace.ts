@@ -39,8 +39,11 @@ export interface CallNode {
 export interface CallEdge {
   source: string;
   target: string;
+  /** trace 中的 CALL / RETURN index；後端每條 edge 有上限，完整次數見 calls / returns */
   steps: number[];
   returnSteps: number[];
+  calls?: number;
+  returns?: number;
 }
 
 export interface CallGraph {